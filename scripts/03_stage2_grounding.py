@@ -1,29 +1,23 @@
 
 import os
 import sys
-from PIL import Image
 
 # 将utils目录添加到Python路径，导入其中的模块
 # 在项目中组织代码的常用方法
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from utils.model_loader import load_model_and_processor
-from utils.grounding_utils import inference, plot_bounding_boxes
+from utils.model_loader import MODEL_ID, get_model_and_processor
+from utils.grounding_utils import inference, inference_batch, inference_tiled, plot_bounding_boxes
+from utils import telemetry
+from utils.frames import as_frame
+from utils.query_fusion import fused_grounding
+from utils.render import AnnotationRenderer
+from utils.result_cache import GroundingCache, make_cache_key
 
-def run_visual_grounding(image_path, user_instruction, output_filename):
-    """
-    执行一次完整的视觉定位任务：从指令到可视化结果。
-    """
-    print("--- 开始视觉定位任务 ---")
-    
-    # 1. 加载模型和处理器 (如果已加载，会从缓存中快速返回)
-    model, processor = load_model_and_processor()
-
-    # 2. 设计"one-shot" 的Prompt，引导模型输出JSON
+# 设计"one-shot" 的Prompt，引导模型输出JSON
+SYSTEM_PROMPT = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
 
-    system_prompt = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
-    
-    prompt_template = """
+PROMPT_TEMPLATE = """
 User instruction: "{instruction}"
 Please provide a JSON list containing the bounding box for the requested element. The format should be:
 [
@@ -31,59 +25,216 @@ Please provide a JSON list containing the bounding box for the requested element
 ]
 The coordinates must be normalized between 0 and 1000.
 """
-    
-    prompt = prompt_template.format(instruction=user_instruction)
-
-    # 3. 调用推理函数
-    #    它会返回模型的文本输出，以及模型处理时内部使用的图像尺寸
-    json_response, input_height, input_width = inference(
-        model, 
-        processor, 
-        image_path=image_path, 
-        prompt=prompt,
-        system_prompt=system_prompt
-    )
 
-    # 4. 可视化结果
+# 约束解码：按边界框 JSON 的语法限制每一步可选的 token，输出总能直接解析、坐标均为整数（见 utils.decoding_utils）。
+# 约束下模型至少输出一个框，因此只用于目标确定存在的查询；分块推理中的图块可能不含目标，不启用。
+CONSTRAINED_DECODING = True
+
+# 定位结果图在后台线程中绘制与保存，不阻塞后续的推理；脚本结束前统一等待写入完成
+RENDERER = AnnotationRenderer(max_workers=2)
+
+
+def _save_grounding_result(image_path, json_response, input_height, input_width, output_filename):
+    """
+    将一次定位结果绘制到原图上，交给后台渲染器保存到 output 目录。
+    """
     #    确保输出目录存在
     output_dir = os.path.join(os.path.dirname(__file__), '..', 'output')
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, output_filename)
 
-    # 加载原始图像用于绘制
-    image = Image.open(image_path)
-    
+    # 传入的帧已解码时直接复用，不再重新打开原图
     plot_bounding_boxes(
-        im=image,
+        im=as_frame(image_path),
         json_str=json_response,
         input_width=input_width,
         input_height=input_height,
-        output_path=output_path
+        output_path=output_path,
+        renderer=RENDERER
     )
+
+
+def _result_cache_key(image_path, user_instruction, variant=""):
+    """
+    根据图像内容、指令、Prompt 模板和模型 ID 生成结果缓存键。
+    `variant` 用于区分同一 Prompt 的不同推理方式（例如分块推理及其参数）。
+    """
+    return make_cache_key(
+        as_frame(image_path).digest, user_instruction, variant + PROMPT_TEMPLATE, MODEL_ID, SYSTEM_PROMPT
+    )
+
+
+def run_visual_grounding(image_path, user_instruction, output_filename, prefix_cache=None, result_cache=None,
+                         expected_boxes=None):
+    """
+    执行一次完整的视觉定位任务：从指令到可视化结果。
+
+    已知目标数量时传入 `expected_boxes`，模型输出该数量的完整边界框后即停止解码。
+
+    多次对同一张图像调用时，可传入共享的 `prefix_cache` 以复用图像前缀的预填充结果。
+    传入 `result_cache` 时，命中缓存则直接使用缓存的模型输出，不会加载或调用模型。
+    """
+    print("--- 开始视觉定位任务 ---")
+    # 截图只解码一次，缓存键、推理与可视化共用同一个帧
+    frame = as_frame(image_path)
+
+    # 1. 使用模块级的 one-shot Prompt
+    prompt = PROMPT_TEMPLATE.format(instruction=user_instruction)
+
+    def compute():
+        # 2. 加载模型和处理器 (如果已加载，会从缓存中快速返回)
+        model, processor = get_model_and_processor()
+
+        # 3. 调用推理函数
+        #    它会返回模型的文本输出，以及模型处理时内部使用的图像尺寸
+        json_response, input_height, input_width = inference(
+            model, 
+            processor, 
+            image_path=frame,
+            prompt=prompt,
+            system_prompt=SYSTEM_PROMPT,
+            prefix_cache=prefix_cache,
+            expected_boxes=expected_boxes,
+            constrained=CONSTRAINED_DECODING
+        )
+        return {"response": json_response, "input_height": input_height, "input_width": input_width}
+
+    if result_cache is not None:
+        result = result_cache.get_or_compute(_result_cache_key(frame, user_instruction), compute)
+    else:
+        result = compute()
+    json_response, input_height, input_width = result["response"], result["input_height"], result["input_width"]
+
+    # 4. 可视化结果
+    _save_grounding_result(frame, json_response, input_height, input_width, output_filename)
     
     print("--- 任务完成 ---")
 
+
+def run_visual_grounding_batch(tasks, result_cache=None, fuse=True):
+    """
+    批量执行多个视觉定位任务：所有指令合并到一次 `generate` 调用中完成。
+
+    `fuse` 为 True 时启用查询融合（见 `utils.query_fusion`）：同一张截图上的多条指令合并为一个多目标提示，
+    图像只预填充一次；回答中缺失的目标再单独查询。为 False 时每条指令作为批中的一个独立任务。
+
+    Args:
+        tasks (list): 每个元素为 (image_path, user_instruction, output_filename)。
+        result_cache (GroundingCache, optional): 结果缓存。只有未命中的任务才会进入批量推理。
+        fuse (bool): 是否启用查询融合。
+    """
+    print(f"--- 开始批量视觉定位任务 (共 {len(tasks)} 个) ---")
+
+    # 同一张截图上的多条指令共用一个帧，只解码一次
+    frames = {}
+    tasks = [(frames.setdefault(image_path, as_frame(image_path)), instruction, output_filename)
+             for image_path, instruction, output_filename in tasks]
+
+    # 1. 先查询结果缓存，收集未命中的任务
+    results = [None] * len(tasks)
+    keys = [None] * len(tasks)
+    if result_cache is not None:
+        # 融合查询的回答与单独查询不同，缓存键中加以区分
+        variant = "fused:" if fuse else ""
+        for i, (image_path, instruction, _) in enumerate(tasks):
+            keys[i] = _result_cache_key(image_path, instruction, variant=variant)
+            results[i] = result_cache.get(keys[i])
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    # 2. 只为未命中的任务加载模型并批量推理
+    if pending:
+        model, processor = get_model_and_processor()
+        if fuse:
+            fusion_stats = {}
+            batch_results = fused_grounding(
+                model, processor, [(tasks[i][0], tasks[i][1]) for i in pending], PROMPT_TEMPLATE, SYSTEM_PROMPT,
+                stats=fusion_stats, constrained=CONSTRAINED_DECODING
+            )
+            print(f"[查询融合] {fusion_stats['requests']} 条指令: {fusion_stats['fused_targets']} 条由 "
+                  f"{fusion_stats['fused_calls']} 次融合查询完成, {fusion_stats['fallbacks']} 条单独查询")
+        else:
+            jobs = [
+                (tasks[i][0], PROMPT_TEMPLATE.format(instruction=tasks[i][1]), SYSTEM_PROMPT)
+                for i in pending
+            ]
+            # 每条指令只定位一个元素，输出一个完整的 bbox_2d 对象后即可停止
+            batch_results = inference_batch(model, processor, jobs, expected_boxes=1, constrained=CONSTRAINED_DECODING)
+        for i, (json_response, input_height, input_width) in zip(pending, batch_results):
+            results[i] = {"response": json_response, "input_height": input_height, "input_width": input_width}
+            if result_cache is not None:
+                result_cache.put(keys[i], results[i])
+
+    for (image_path, _, output_filename), result in zip(tasks, results):
+        _save_grounding_result(
+            image_path, result["response"], result["input_height"], result["input_width"], output_filename
+        )
+
+    print("--- 批量任务完成 ---")
+
+
+def run_visual_grounding_tiled(image_path, user_instruction, output_filename, tile_size=896, overlap=128,
+                               result_cache=None):
+    """
+    在高分辨率截图上执行分块视觉定位：截图被切分为重叠图块批量推理，结果合并到原图坐标系。
+    适用于整图缩放后小图标难以辨认的大尺寸桌面。
+    """
+    print("--- 开始分块视觉定位任务 ---")
+    frame = as_frame(image_path)
+    prompt = PROMPT_TEMPLATE.format(instruction=user_instruction)
+
+    def compute():
+        model, processor = get_model_and_processor()
+        boxes = inference_tiled(
+            model, processor, frame, prompt, SYSTEM_PROMPT, tile_size=tile_size, overlap=overlap
+        )
+        # 合并后的坐标已位于原图像素坐标系，以原图尺寸作为输入尺寸，绘制时即为恒等映射
+        width, height = frame.size
+        return {"response": boxes.to_json(), "input_height": height, "input_width": width}
+
+    if result_cache is not None:
+        key = _result_cache_key(frame, user_instruction, variant=f"tiled:{tile_size}:{overlap}:")
+        result = result_cache.get_or_compute(key, compute)
+    else:
+        result = compute()
+
+    _save_grounding_result(
+        frame, result["response"], result["input_height"], result["input_width"], output_filename
+    )
+    print("--- 任务完成 ---")
+
+
 if __name__ == '__main__':
-    # --- 测试案例 1: 定位登录按钮 ---
-    image_file = "data/login_page.png"
-    instruction_1 = "定位登录按钮"
-    output_file_1 = "grounding_login_button.png"
-    run_visual_grounding(image_file, instruction_1, output_file_1)
+    telemetry.configure()
 
-    # --- 测试案例 2: 定位用户名输入框 ---
-    instruction_2 = "定位用户名输入框"
-    output_file_2 = "grounding_username_field.png"
-    run_visual_grounding(image_file, instruction_2, output_file_2)
+    # 结果缓存：重复运行本脚本时，所有定位结果直接从缓存读取，无需加载模型
+    result_cache = GroundingCache()
 
-    # --- 测试案例 3: 定位关闭按钮 ---
-    instruction_3 = "定位关闭按钮"
-    output_file_3 = "grounding_close_button.png"
-    run_visual_grounding(image_file, instruction_3, output_file_3)
+    # --- 测试案例 1~3: 同一张登录页上的三条指令，融合为一个多目标提示，只需一次预填充与解码 ---
+    image_file = "data/login_page.png"
+    run_visual_grounding_batch([
+        (image_file, "定位登录按钮", "grounding_login_button.png"),
+        (image_file, "定位用户名输入框", "grounding_username_field.png"),
+        (image_file, "定位关闭按钮", "grounding_close_button.png"),
+    ], result_cache=result_cache)
 
     # --- 测试案例 4: 定位多个元素 ---
     file_explorer_img = "data/file_explorer.png" 
     instruction_4 = "分别定位面板中名为 Linux, Program, Github, Codefield 的文件夹。"
     output_file_4 = "grounding_all_folders.png"
     if os.path.exists(file_explorer_img):
-        run_visual_grounding(file_explorer_img, instruction_4, output_file_4)
+        run_visual_grounding(file_explorer_img, instruction_4, output_file_4, result_cache=result_cache, expected_boxes=4)
+
+    # --- 测试案例 5: 高分辨率桌面上的小图标，分块推理 ---
+    desktop_img = "data/desktop_clean.png"
+    if os.path.exists(desktop_img):
+        run_visual_grounding_tiled(desktop_img, "定位桌面上所有的应用图标", "grounding_desktop_icons_tiled.png",
+                                   result_cache=result_cache)
+
+    stats = result_cache.stats()
+    print(f"\n缓存统计: 命中 {stats['memory_hits'] + stats['disk_hits']} 次, 模型调用 {stats['misses']} 次")
+
+    RENDERER.close()
+    render_stats = RENDERER.stats()
+    print(f"可视化: 保存 {render_stats['completed']} 张, 失败 {render_stats['failed']} 张, "
+          f"平均每张 {render_stats['mean_render_ms']:.1f} ms（后台完成）")
 
@@ -1,116 +1,463 @@
+import argparse
+import contextlib
 import os
 import sys
-import re
-from PIL import Image
+import threading
 
 # 确保可以导入你的工具函数
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils.model_loader import load_model_and_processor
-from utils.grounding_utils import inference, draw_click_on_image  # 我们只需要推理和坐标解析
+from utils.model_client import is_remote_model
+from utils.model_loader import MODEL_ID, get_model_and_processor, preload_model_and_processor
+from utils.grounding_utils import (  # 我们只需要推理和坐标解析
+    POINT_JSON_PROMPT_TEMPLATE, POINT_PROMPT_TEMPLATE, POINT_SYSTEM_PROMPT, inference, draw_click_on_image,
+    parse_points
+)
+from utils import telemetry
+from utils.agent_pipeline import FramePrefetcher, StepTimeline
+from utils.boxes import BoxSet, PointSet
+from utils.element_index import ENUMERATE_PROMPT, ENUMERATE_SYSTEM_PROMPT, ElementIndex, enumerate_elements
+from utils.frame_diff import FrameDiffTracker
+from utils.frames import Frame, as_frame
+from utils.prefix_cache import PrefixCache
+from utils.render import AnnotationRenderer
+from utils.result_cache import GroundingCache, make_cache_key
+from utils.workflow import StepJournal, WorkflowEngine, load_workflow
+from utils.zoom_grounding import zoom_grounding
 # 注意：你可能需要把你的坐标解析逻辑也抽成一个独立的函数
 
-def parse_box_from_json(json_str):
+def parse_box_from_json(json_str, input_height, input_width):
     """
-    一个简化的解析器，从你阶段二的JSON输出中提取第一个bbox。
-    你需要根据你自己的json_str格式来完善它。
+    从阶段二格式的模型输出中提取第一个bbox，返回只含一个框的 `BoxSet`（模型输入坐标系）。
+    使用增量流式解析器，兼容代码块包裹、说明文字、单引号以及被截断的输出。
     """
-    try:
-        # 使用正则表达式从可能不完整的JSON中提取第一个bbox
-        match = re.search(r'\[\s*\{\s*"bbox_2d":\s*\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\].*?\}\s*\]', json_str, re.DOTALL)
-        if match:
-            coords = [int(c) for c in match.groups()]
-            # 你的格式是 [y1, x1, y2, x2]，我们统一一下
-            return {'x1': coords[0], 'y1': coords[1], 'x2': coords[2], 'y2': coords[3]}
-    except Exception as e:
-        print(f"解析坐标失败: {e}")
-    return None
-
-def get_click_coordinates(model, processor, image_path, instruction):
+    boxes = BoxSet.from_response(json_str, input_height, input_width)
+    if not len(boxes):
+        print("解析坐标失败: 模型输出中没有完整的 bbox_2d。")
+        return None
+    return boxes[0]
+
+SYSTEM_PROMPT = "You are a helpful assistant. Locate the object in the image based on the instruction and provide its bounding box in JSON format."
+PROMPT_TEMPLATE = "Instruction: \"{instruction}\". Provide the JSON for the bounding box: [{{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"element\"}}]"
+
+# 默认的任务定义与步骤日志
+DEFAULT_WORKFLOW = os.path.join(os.path.dirname(__file__), "workflows", "calculator.yaml")
+OUTPUT_DIR = "output/calculator_task"
+
+# 本进程内加载的模型不能被多个线程同时调用 generate，并发步骤的推理在此排队；
+# 推理服务客户端的请求由服务端调度，不需要加锁。
+_model_lock = threading.Lock()
+
+def _model_guard(model):
+    return contextlib.nullcontext() if is_remote_model(model) else _model_lock
+
+def _prompts_for_mode(mode, constrained=False):
+    """
+    返回定位模式对应的 (系统提示, Prompt 模板)。
+    启用约束解码时，点定位模式改为要求 JSON 坐标点，与约束解码的语法一致。
+    """
+    if mode == "point":
+        return POINT_SYSTEM_PROMPT, POINT_JSON_PROMPT_TEMPLATE if constrained else POINT_PROMPT_TEMPLATE
+    if mode in ("box", "zoom"):
+        return SYSTEM_PROMPT, PROMPT_TEMPLATE
+    raise ValueError(f"未知的定位模式: {mode}")
+
+def _result_cache_key(frame, instruction, mode, constrained=False):
+    """单步定位结果的缓存键。"""
+    system_prompt, prompt_template = _prompts_for_mode(mode, constrained)
+    # 缩放定位的结果与单次定位不同，模式名也参与缓存键
+    template_key = prompt_template if mode != "zoom" else f"zoom:{prompt_template}"
+    return make_cache_key(frame.digest, instruction, template_key, MODEL_ID, system_prompt)
+
+def _element_index_key(frame):
+    """全屏元素枚举结果的缓存键。"""
+    return make_cache_key(frame.digest, "", ENUMERATE_PROMPT, MODEL_ID, ENUMERATE_SYSTEM_PROMPT)
+
+def build_element_index(model, processor, image_path, result_cache=None):
+    """
+    对截图做一次全屏元素枚举并建立元素索引（见 `utils.element_index`）。
+    传入 `result_cache` 时枚举结果会被缓存，重复运行时不需要加载模型；`model` 可以为 None。
+    """
+    frame = as_frame(image_path)
+
+    def compute():
+        nonlocal model, processor
+        if model is None:
+            model, processor = get_model_and_processor()
+        with _model_guard(model):
+            response, input_height, input_width = enumerate_elements(model, processor, frame)
+        return {"response": response, "input_height": input_height, "input_width": input_width}
+
+    if result_cache is not None:
+        result = result_cache.get_or_compute(_element_index_key(frame), compute)
+    else:
+        result = compute()
+    return ElementIndex.from_response(result["response"], result["input_height"], result["input_width"], frame)
+
+def _click_region(click, frame, margin=16):
+    """点击坐标（模型输入坐标系）附近的区域，换算到原图像素坐标系，用于判断结果是否仍然有效。"""
+    point, input_size = click
+    x, y = PointSet([point], input_size=input_size).to_pixels(frame.size).coords[0].tolist()
+    return (max(0, x - margin), max(0, y - margin), min(frame.width, x + margin), min(frame.height, y + margin))
+
+def get_click_coordinates(model, processor, image_path, instruction, prefix_cache=None, result_cache=None,
+                          mode="box", element_index=None, frame_tracker=None, preprocess_cache=None,
+                          constrained=False):
     """
     封装的单步定位功能：给定图片和指令，返回点击坐标。
     这是你阶段二代码的核心提炼。
+
+    `mode` 决定让模型输出什么：
+    - "box": 输出边界框，再取其中心点作为点击坐标。
+    - "point": 直接输出一个坐标点（`<points>` 标记，约束解码时为 `point_2d` JSON），生成的 token 更少，单步延迟更低。
+    - "zoom": 先以低分辨率在整张截图上粗定位，再以高分辨率在裁剪区域上精定位（见 `zoom_grounding`），
+      大尺寸截图上的预填充开销更低，小目标的定位更准。
+
+    传入 `prefix_cache` 时，对同一截图的重复查询会复用已缓存的图像前缀，只预填充指令文本。
+    传入 `result_cache` 时，内容相同的截图 + 指令直接返回缓存结果；`model` 可以为 None，
+    此时只在缓存未命中时才加载模型。
+
+    `image_path` 也可以是 `Frame`：缓存键、推理与后续的可视化共用同一次解码。
+    传入 `preprocess_cache`（例如 `FramePrefetcher.wait` 的返回值）时，"box"/"point" 模式的推理直接使用
+    其中已完成的图像预处理结果。
+
+    传入 `element_index` 时先按指令中的标签在索引中查找，命中且元素所在区域未变化时直接返回其中心点，
+    不调用模型，也不查询结果缓存；查找失败时再走上面的流程。
+
+    `constrained` 为 True 时，"box" / "point" 模式的推理启用边界框 / 坐标点 JSON 的约束解码，
+    输出总能直接解析（见 `inference`）。
+
+    传入 `frame_tracker`（`FrameDiffTracker`，调用方已对本帧调用过 `observe`）时：
+    - 本帧在同一指令之前的结果所在区域与得到该结果的帧相同时，直接复用该结果；
+    - 元素索引查找失败且有变化区域待更新时，只对变化区域重新枚举元素，而不是整张截图；
+    - 每一步的定位来源与模型处理的像素比例记录在 `frame_tracker` 中。
     """
-    system_prompt = "You are a helpful assistant. Locate the object in the image based on the instruction and provide its bounding box in JSON format."
-    prompt_template = "Instruction: \"{instruction}\". Provide the JSON for the bounding box: [{{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"element\"}}]"
+    frame = as_frame(image_path)
+
+    def note(source, model_fraction):
+        if frame_tracker is not None:
+            frame_tracker.note(source, model_fraction)
+
+    if frame_tracker is not None:
+        reused = frame_tracker.recall((instruction, mode), frame)
+        if reused is not None:
+            note("reused", 0.0)
+            return reused
+
+    if element_index is not None:
+        refreshed = 0.0
+        if element_index.pending_regions and element_index.match(frame, instruction) is None:
+            if model is None:
+                model, processor = get_model_and_processor()
+
+            def enumerate_crop(crop):
+                with _model_guard(model):
+                    return enumerate_elements(model, processor, crop)
+
+            refreshed = element_index.refresh(frame, enumerate_crop)
+        element = element_index.locate(frame, instruction)
+        if element is not None:
+            note("regions" if refreshed else "index", refreshed)
+            return (element.center, (element_index.input_height, element_index.input_width))
+
+    system_prompt, prompt_template = _prompts_for_mode(mode, constrained)
     prompt = prompt_template.format(instruction=instruction)
+    called_model = False
 
-    json_response, input_height, input_width = inference(model, processor, image_path, prompt, system_prompt)
-    
-    box = parse_box_from_json(json_response)
-    if box:
-        # 计算边界框的中心点作为点击坐标
-        click_x = (box['x1'] + box['x2']) / 2
-        click_y = (box['y1'] + box['y2']) / 2
-        return ((click_x, click_y), (input_height, input_width))
-    return None
-
-def run_calculator_task(model, processor):
+    def compute():
+        nonlocal model, processor, called_model
+        called_model = True
+        if model is None:
+            model, processor = get_model_and_processor()
+        with _model_guard(model):
+            if mode == "zoom":
+                # 两阶段定位直接给出原图像素坐标，缓存时以原图尺寸作为"输入尺寸"，坐标映射即为恒等变换
+                result = zoom_grounding(model, processor, frame.image, prompt, system_prompt)
+                found = [result["bbox"]] if result["bbox"] else []
+                return {"response": BoxSet(found, [result["label"]] * len(found)).to_json(),
+                        "input_height": frame.height, "input_width": frame.width}
+            # 只需要一个边界框/坐标点：输出第一个完整元素后即停止解码
+            response, input_height, input_width = inference(
+                model, processor, frame, prompt, system_prompt,
+                prefix_cache=prefix_cache, expected_boxes=1, preprocess_cache=preprocess_cache,
+                # 约束解码的语法随定位模式切换为边界框或坐标点 JSON
+                constrained=mode if constrained else False
+            )
+        return {"response": response, "input_height": input_height, "input_width": input_width}
+
+    if result_cache is not None:
+        result = result_cache.get_or_compute(_result_cache_key(frame, instruction, mode, constrained), compute)
+    else:
+        result = compute()
+    response, input_height, input_width = result["response"], result["input_height"], result["input_width"]
+    note("model" if called_model else "cache", 1.0 if called_model else 0.0)
+
+    click = None
+    if mode == "point":
+        points = PointSet.from_elements(parse_points(response), (input_height, input_width))
+        if len(points):
+            click = (tuple(points.coords[0].tolist()), (input_height, input_width))
+        else:
+            print("解析坐标失败: 模型输出中没有坐标点。")
+    else:
+        box = parse_box_from_json(response, input_height, input_width)
+        if box is not None:
+            # 计算边界框的中心点作为点击坐标
+            click = (tuple(box.centers[0].tolist()), (input_height, input_width))
+
+    if click is not None and frame_tracker is not None:
+        frame_tracker.remember((instruction, mode), _click_region(click, frame), click, frame)
+    return click
+
+def run_calculator_task(model, processor, result_cache=None, mode=None, use_element_index=False,
+                        frame_tracker=None, workflow_path=DEFAULT_WORKFLOW, resume=True, max_workers=4,
+                        renderer=None, lookahead=2, timeline_path=None, constrained=False):
     """
     主Agent循环，执行计算器任务，并对每一步进行可视化。
+
+    任务步骤从 `workflow_path`（YAML 或 JSON，见 `utils.workflow`）加载，由工作流引擎按依赖关系执行：
+    - 每一步的输入哈希、输出与耗时追加写入 `output/calculator_task/journal.jsonl`；
+    - `resume` 为 True 时，输入未变化且已成功完成的步骤直接跳过，失败后重新运行只需执行剩余的步骤；
+    - 失败的步骤按工作流文件中的 `retries`/`retry_delay` 重试；
+    - 互不依赖的步骤（`depends_on: []`）最多以 `max_workers` 个线程并发执行。
+
+    `mode` 为 None 时使用各步骤在工作流文件中声明的定位模式（未声明时为 "box"），否则覆盖所有步骤；
+    "point" 为点定位模式（见 `get_click_coordinates`）。`constrained` 为 True 时 "box" / "point" 模式启用约束解码。
+
+    `model`/`processor` 可以为 None：配合 `result_cache` 使用时，模型只在缓存未命中时才会被加载。
+    此时先解码所有截图并检查缓存，只要有一步未命中，就在后台线程中提前加载模型，
+    与截图解码、缓存查询和前几步的可视化重叠进行。
+
+    `use_element_index` 为 True 时启用"解析一次"模式：先在第一张截图上枚举所有元素建立索引，
+    计算器的按钮布局不变，之后各步骤的按钮直接在索引中查找，只有查找失败的步骤才调用模型。
+
+    传入 `frame_tracker`（`FrameDiffTracker`）时，每一步先与上一帧做差分：变化区域中的索引元素失效，
+    未受影响区域上的结果直接复用（见 `get_click_coordinates`），并打印每一步跳过模型的情况。
+
+    每一步的可视化交给后台渲染器 `renderer`（`AnnotationRenderer`，为 None 时自动创建一个）：
+    步骤在提交绘制任务后立即结束，图片的合成、编码与保存不占用智能体循环的时间；函数返回前等待所有图片写入完成。
+
+    观察 -> 思考 -> 行动以流水线方式执行（见 `utils.agent_pipeline`）：后台线程最多提前 `lookahead` 帧解码后续截图
+    并完成图像预处理，与当前步骤的生成重叠；步骤日志在后台线程中落盘。传入 `timeline_path` 时，
+    各线程的 span 写成 Chrome 追踪格式的时间线，并打印每一步的墙钟时间与其中的模型时间。
+
+    Returns:
+        dict[str, StepResult]: 各步骤的执行结果。
     """
-    output_dir = "output/calculator_task" # 为本次任务创建一个专门的输出文件夹
-
-    # 1. 定义任务分解
-    task_steps = [
-        {"instruction": "定位按钮 '1'", "screenshot": "data/calc_01_initial.png"},
-        {"instruction": "定位按钮 '2'", "screenshot": "data/calc_02_after_1.png"},
-        {"instruction": "点击按钮 '3'", "screenshot": "data/calc_03_after_12.png"},
-        {"instruction": "点击加号按钮 '+'", "screenshot": "data/calc_04_after_123.png"},
-        {"instruction": "点击按钮 '4'", "screenshot": "data/calc_05_after_plus.png"},
-        {"instruction": "点击按钮 '5'", "screenshot": "data/calc_06_after_4.png"},
-        {"instruction": "点击按钮 '6'", "screenshot": "data/calc_07_after_45.png"},
-        {"instruction": "点击等号按钮 '='", "screenshot": "data/calc_08_after_456.png"},
-    ]
-
-    # 2. Agent主循环
-    for i, step in enumerate(task_steps):
-        step_number = i + 1
-        print(f"\n--- 步骤 {step_number}/{len(task_steps)} ---")
-        
-        current_screenshot = step["screenshot"]
-        if not os.path.exists(current_screenshot):
-            print(f"[错误] 截图文件不存在: {current_screenshot}。任务中断。")
-            break
+    output_dir = OUTPUT_DIR # 为本次任务创建一个专门的输出文件夹
+    owns_renderer = renderer is None
+    if owns_renderer:
+        # 渲染跟不上时最多排队 8 帧，之后的步骤等待（背压）
+        renderer = AnnotationRenderer(max_workers=2, max_pending=8)
+    # 同一截图上的重复查询复用图像前缀；每步截图不同，只需保留最近的少量条目
+    prefix_cache = PrefixCache(max_entries=2)
+
+    # 1. 加载任务定义
+    workflow_name, task_steps = load_workflow(workflow_path)
+    print(f"📋 工作流: {workflow_name} ({len(task_steps)} 步)")
+
+    step_numbers = {step.id: i + 1 for i, step in enumerate(task_steps)}
+
+    def step_mode(step):
+        return mode or step.params.get("mode", "box")
+
+    # 每步的截图只解码一次：缓存键、推理和可视化共用同一个帧
+    frames = {}
+    for step in task_steps:
+        screenshot = step.params["screenshot"]
+        if screenshot not in frames and os.path.exists(screenshot):
+            frames[screenshot] = Frame(screenshot)
+
+    def fingerprint(step):
+        # 截图内容（不是路径）与模型共同决定步骤的结果；只哈希文件字节，无需解码
+        frame = frames.get(step.params["screenshot"])
+        return f"{frame.source_digest if frame is not None else None}:{MODEL_ID}"
+
+    journal = StepJournal(os.path.join(output_dir, "journal.jsonl"), background=True)
+    engine = WorkflowEngine(
+        workflow_name, task_steps, None, journal=journal, fingerprint=fingerprint,
+        max_workers=max_workers, resume=resume
+    )
+    resumed = engine.resumable()
+    to_run = [step for step in task_steps if step.id not in resumed]
+    if resumed:
+        print(f"⏩ 续跑: {len(resumed)} 步已在之前的运行中完成，将直接跳过")
+
+    element_index = None
+    first_frame = frames.get(to_run[0].params["screenshot"]) if to_run else None
+    if use_element_index and first_frame is not None:
+        if model is None and (result_cache is None or not result_cache.contains(_element_index_key(first_frame))):
+            preload_model_and_processor()
+        element_index = build_element_index(model, processor, first_frame, result_cache)
+        print(f"🗂️ 元素索引: 在首张截图上识别到 {len(element_index)} 个元素")
+        if frame_tracker is not None:
+            # 之后每一帧都与建立索引的帧比较，变化区域中的元素随即失效
+            frame_tracker.prime(first_frame)
+
+    def needs_model(step):
+        frame = frames.get(step.params["screenshot"])
+        if frame is None:
+            return False
+        if element_index is not None and element_index.match(frame, step.params["instruction"]) is not None:
+            return False
+        return result_cache is None or not result_cache.contains(
+            _result_cache_key(frame, step.params["instruction"], step_mode(step), constrained))
+
+    timeline = None
+    if timeline_path:
+        trace = telemetry.ChromeTraceExporter(timeline_path)
+        timeline = StepTimeline()
+        telemetry.add_exporter(trace)
+        telemetry.add_exporter(timeline)
+
+    # 观察阶段：按步骤顺序在后台提前解码截图；需要调用模型的步骤还提前完成图像预处理
+    prefetcher = FramePrefetcher(
+        [(step.id, frames[step.params["screenshot"]], needs_model(step))
+         for step in to_run if step.params["screenshot"] in frames],
+        processor=processor, lookahead=lookahead
+    )
+
+    # 有索引查不到、缓存也未命中的步骤时，在后台提前加载模型；第一次推理时直接取用加载结果，
+    # 加载完成后预取线程随即开始为后续的帧做图像预处理
+    if model is None and any(needs_model(step) for step in to_run):
+        preload_model_and_processor().add_done_callback(
+            lambda future: future.exception() is None and prefetcher.set_processor(future.result()[1])
+        )
+
+    # 2. 单步执行：观察 -> 思考 -> 行动。抛出异常表示本次尝试失败，由引擎按重试策略处理。
+    def run_step(step):
+        instruction, current_screenshot = step.params["instruction"], step.params["screenshot"]
+        print(f"\n--- 步骤 {step.id} ---")
+        if current_screenshot not in frames:
+            raise FileNotFoundError(f"截图文件不存在: {current_screenshot}")
         print(f"👀 观察: {current_screenshot}")
+        frame = frames[current_screenshot]
+        with telemetry.span("observe", step=step.id):
+            # 通常已由预取线程解码并预处理完毕
+            preprocess_cache = prefetcher.wait(frame)
+            if frame_tracker is not None:
+                # 与依赖步骤观察到的帧比较：并发执行的分支各自维护"上一帧"
+                dirty = frame_tracker.observe(frame, step=step.id, after=step.depends_on)
+                if element_index is not None:
+                    element_index.invalidate(dirty)
 
-        instruction = step["instruction"]
         print(f"🤔 思考: 我的下一步指令是 '{instruction}'。正在定位...")
-        normalized_coords, input_coords = get_click_coordinates(model, processor, current_screenshot, instruction)
-        
-        if normalized_coords:
-            print(f"✅ 行动: 生成指令 CLICK(x={normalized_coords[0]:.0f}, y={normalized_coords[1]:.0f})")
-            
-            # --- 新增的可视化步骤 ---
-            output_filename = f"step_{step_number:02d}_action_on_{os.path.basename(current_screenshot)}"
-            output_path = os.path.join(output_dir, output_filename)
-            
+        with telemetry.span("think", step=step.id):
+            click = get_click_coordinates(
+                model, processor, frame, instruction,
+                prefix_cache=prefix_cache, result_cache=result_cache, mode=step_mode(step),
+                element_index=element_index, frame_tracker=frame_tracker, preprocess_cache=preprocess_cache,
+                constrained=constrained
+            )
+        if frame_tracker is not None:
+            record = frame_tracker.current()
+            print(f"🔍 差分: {len(record['dirty_regions'])} 个变化区域, 占画面 {record['dirty_fraction']:.1%}; "
+                  f"定位来源 {record['source']}, 模型处理像素 {record['model_fraction'] or 0:.0%}")
+        if not click:
+            raise RuntimeError(f"无法定位 '{instruction}'")
+        # 定位成功后不再需要该帧的预处理结果（失败时保留给重试），预取线程可以继续准备后面的帧
+        prefetcher.release(frame, step.id)
+
+        normalized_coords, input_coords = click
+        print(f"✅ 行动: 生成指令 CLICK(x={normalized_coords[0]:.0f}, y={normalized_coords[1]:.0f})")
+
+        # --- 可视化步骤 ---
+        output_filename = f"step_{step_numbers[step.id]:02d}_action_on_{os.path.basename(current_screenshot)}"
+        output_path = os.path.join(output_dir, output_filename)
+        with telemetry.span("act", step=step.id):
             draw_click_on_image(
-                image_path=current_screenshot,
+                image_path=frame,
                 normalized_coords=normalized_coords,
                 input_width=input_coords[1],
                 input_height=input_coords[0],
-                output_path=output_path
+                output_path=output_path,
+                renderer=renderer
             )
-            # --------------------------
-            
+        return {"click": list(normalized_coords), "input_size": list(input_coords), "visualization": output_path}
+
+    # 3. 按依赖关系执行所有步骤
+    engine.run_step = run_step
+    try:
+        results = engine.run()
+    finally:
+        prefetcher.close()
+        journal.close()
+        # 所有可视化图片写入完成后再汇报结果
+        if owns_renderer:
+            renderer.close()
         else:
-            print(f"❌ 行动失败: 无法定位 '{instruction}'。")
+            renderer.wait()
+        if timeline is not None:
+            telemetry.remove_exporter(timeline)
+            telemetry.remove_exporter(trace)
+
+    print("\n--- 步骤结果 ---")
+    for step_id, result in results.items():
+        detail = f"CLICK{tuple(round(c) for c in result.output['click'])}" if result.output else result.error
+        print(f"  {step_id:14s} {result.status:9s} 尝试 {result.attempts} 次, {result.elapsed_ms:7.1f} ms  {detail}")
 
+    render_stats = renderer.stats()
+    print(f"\n可视化: 保存 {render_stats['completed']} 张, 失败 {render_stats['failed']} 张, "
+          f"平均每张 {render_stats['mean_render_ms']:.1f} ms（后台完成，不计入步骤耗时）")
+    if element_index is not None:
+        stats = element_index.stats()
+        print(f"\n元素索引统计: 命中 {stats['hits']} 次, 未找到 {stats['misses']} 次, 区域已变化 {stats['stale']} 次")
+    if frame_tracker is not None:
+        report = frame_tracker.report()
+        print(f"差分统计: {report['skipped_steps']}/{report['steps']} 步完全跳过模型, "
+              f"模型处理的像素为逐帧整图推理的 {report['model_pixel_fraction']:.1%}, "
+              f"平均变化区域占画面 {report['mean_dirty_fraction']:.1%}")
+    if timeline is not None:
+        print("\n--- 步骤时间线 (ms) ---")
+        print(f"  {'步骤':14s} {'墙钟':>9s} {'模型':>9s} {'观察等待':>9s} {'其他':>9s}")
+        for row in timeline.steps():
+            print(f"  {row['step']:14s} {row['wall_ms']:9.1f} {row['model_ms']:9.1f} "
+                  f"{row['observe_ms']:9.1f} {row['other_ms']:9.1f}")
+        summary = timeline.summary()
+        print(f"模型时间占步骤墙钟时间的 {summary['model_fraction']:.1%}; 时间线已写入 {timeline_path}"
+              f"（用 https://ui.perfetto.dev 或 chrome://tracing 打开）")
     print("\n--- 任务流程模拟完成 ---")
+    return results
 
 def main():
     """
     程序主入口，执行计算器自动化任务。
     """
+    parser = argparse.ArgumentParser(description="阶段三：自动化工作流模拟")
+    parser.add_argument("workflow", nargs="?", default=DEFAULT_WORKFLOW, help="任务定义文件（YAML 或 JSON）")
+    parser.add_argument("--fresh", action="store_true", help="忽略步骤日志，重新执行所有步骤")
+    parser.add_argument("--workers", type=int, default=4, help="并发执行互不依赖的步骤时的最大线程数")
+    parser.add_argument("--lookahead", type=int, default=2, help="后台最多提前解码、预处理的截图数")
+    parser.add_argument("--timeline", default=os.path.join(OUTPUT_DIR, "timeline.json"),
+                        help="步骤时间线（Chrome 追踪格式）的输出路径，空字符串表示不记录")
+    parser.add_argument("--unconstrained", action="store_true",
+                        help="关闭边界框 / 坐标点 JSON 的约束解码（默认开启，输出总能直接解析）")
+    args = parser.parse_args()
+
+    telemetry.configure()
     print("--- 启动桌面智能体，任务：使用计算器计算 123 + 456 ---")
     
-    # 步骤1: 加载模型 (采用单例模式，高效)
-    model, processor = load_model_and_processor()
+    # 步骤1: 准备结果缓存。模型延迟到第一次缓存未命中时才加载 (采用单例模式，高效)，
+    #        重复运行时所有步骤都命中缓存，完全不需要加载模型。
+    result_cache = GroundingCache()
+
+    # 步骤2: 加载任务定义并执行。定位模式等参数在工作流文件中声明；
+    #        按钮布局不变，先枚举一次所有元素，之后的步骤直接查找索引，只有查找失败时才调用模型；
+    #        相邻截图只有显示区域不同，差分检测只让变化区域中的元素失效。阈值可在 FrameDiffTracker 中调整。
+    frame_tracker = FrameDiffTracker(threshold=24, block_size=16, min_changed_pixels=8)
+    results = run_calculator_task(None, None, result_cache=result_cache, use_element_index=True,
+                                  frame_tracker=frame_tracker, workflow_path=args.workflow,
+                                  resume=not args.fresh, max_workers=args.workers,
+                                  lookahead=args.lookahead, timeline_path=args.timeline or None,
+                                  constrained=not args.unconstrained)
 
-    # 步骤2: 定义任务并执行
-    run_calculator_task(model, processor)
+    stats = result_cache.stats()
+    print(f"\n缓存统计: 命中 {stats['memory_hits'] + stats['disk_hits']} 次, 模型调用 {stats['misses']} 次")
 
+    failed = [step_id for step_id, result in results.items() if result.status in ("failed", "blocked")]
+    if failed:
+        print(f"\n--- 有 {len(failed)} 个步骤未完成: {', '.join(failed)}。修复后重新运行即可从中断处继续 ---")
+        sys.exit(1)
     print("\n--- 所有任务流程已成功模拟 ---")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
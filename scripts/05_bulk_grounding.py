@@ -0,0 +1,156 @@
+"""
+离线批量定位：对截图目录（或清单）中的每张截图执行定位指令，结果以 JSONL 流式写出。
+
+解码与图像预处理在后台线程中提前完成，模型每次 `generate` 处理一批记录；中断后重新运行同一命令会从断点继续。
+
+用法（在项目根目录下执行）：
+    # 清单为 JSONL（每行 {"image": ..., "instruction": ...}）或带表头的 CSV / TSV
+    python scripts/05_bulk_grounding.py --manifest data/manifest.jsonl --output output/bulk/results.jsonl
+
+    # 目录中的每张截图 x 指令文件中的每条指令（每行一条）
+    python scripts/05_bulk_grounding.py --images data/ --instructions data/instructions.txt --output output/bulk/results.jsonl
+
+    # 手动分片：在两台机器（或两张卡）上分别处理一半，各自写入 results.shard00-of-02.jsonl / results.shard01-of-02.jsonl
+    python scripts/05_bulk_grounding.py --manifest ... --output ... --num-shards 2 --shard-index 0
+
+    # 本机多卡：每张卡一个子进程，全部完成后合并为 --output
+    python scripts/05_bulk_grounding.py --manifest ... --output ... --devices 0,1,2,3
+
+推理服务 (`serve_model.py`) 运行时默认使用它；`--local` 或 `--devices` 会在本进程内加载模型。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import telemetry
+from utils.bulk_grounding import (
+    completed_ids, load_manifest, manifest_from_directory, run_bulk_grounding, shard_output_path, shard_records
+)
+from utils.model_loader import get_model_and_processor, load_model_and_processor
+
+SYSTEM_PROMPT = "You are a helpful assistant. Locate the object in the image based on the instruction and provide its bounding box in JSON format."
+PROMPT_TEMPLATE = "Instruction: \"{instruction}\". Provide the JSON for the bounding box: [{{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"element\"}}]"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="对截图目录批量执行视觉定位，结果写入 JSONL")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="(截图, 指令) 清单：JSONL、CSV 或 TSV")
+    source.add_argument("--images", help="截图目录（递归查找 png/jpg/bmp/webp），需配合 --instructions")
+    parser.add_argument("--instructions", help="指令文件，每行一条；与 --images 一起使用")
+    parser.add_argument("--image-root", help="清单中相对图像路径的根目录")
+    parser.add_argument("--output", required=True, help="输出 JSONL 路径")
+    parser.add_argument("--fresh", action="store_true", help="清空已有输出，不从断点继续")
+    parser.add_argument("--batch-size", type=int, default=8, help="每次 generate 处理的记录数")
+    parser.add_argument("--workers", type=int, default=4, help="解码与预处理的后台线程数")
+    parser.add_argument("--prefetch-batches", type=int, default=2, help="最多提前准备多少批记录")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--expected-boxes", type=int, default=1,
+                        help="每条指令期望的边界框数（启用早停，0 表示不早停）；清单中的 expected_boxes 优先")
+    parser.add_argument("--max-pixels", type=int, default=None, help="图像像素预算上限（降低预填充开销）")
+    parser.add_argument("--min-pixels", type=int, default=None, help="图像像素预算下限")
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--devices", help="逗号分隔的 GPU 编号：每张卡启动一个子进程处理一个分片")
+    parser.add_argument("--device", default=None, help="在本进程内加载模型到指定设备，如 cuda:0（隐含 --local）")
+    parser.add_argument("--local", action="store_true", help="不使用推理服务，在本进程内加载模型")
+    parser.add_argument("--progress-every", type=int, default=100, help="每处理多少条记录输出一次进度")
+    args = parser.parse_args(argv)
+    if args.images and not args.instructions:
+        parser.error("--images 需要配合 --instructions 使用")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard-index 应在 [0, {args.num_shards}) 之间")
+    return args
+
+
+def load_records(args):
+    if args.manifest:
+        return load_manifest(args.manifest, args.image_root)
+    with open(args.instructions, "r", encoding="utf-8") as f:
+        instructions = [line.strip() for line in f if line.strip()]
+    return manifest_from_directory(args.images, instructions)
+
+
+def merge_shards(shard_paths: list, output_path: str):
+    """把各分片的输出合并为一个文件；同一 id 只保留最后一次成功的结果（失败的记录保留最后一次错误）。"""
+    latest = {}
+    for path in shard_paths:
+        completed_ids(path)  # 截掉可能残留的不完整行
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                result = json.loads(line)
+                if not result.get("error") or "error" in latest.get(result["id"], {"error": True}):
+                    latest[result["id"]] = result
+    with open(output_path, "w", encoding="utf-8") as f:
+        for result in latest.values():
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return len(latest)
+
+
+def spawn_shards(args, argv):
+    """每张 GPU 启动一个子进程处理一个分片，全部成功后合并输出。"""
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()]
+    num_shards = len(devices)
+    # 子进程沿用父进程的参数，去掉 --devices 并指定分片；可见设备只有一张卡，统一加载到 cuda:0
+    child_argv, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--devices":
+            skip = True
+        elif not arg.startswith("--devices="):
+            child_argv.append(arg)
+
+    procs = []
+    for index, device in enumerate(devices):
+        env = dict(os.environ, CUDA_VISIBLE_DEVICES=device)
+        cmd = [sys.executable, os.path.abspath(__file__), *child_argv,
+               "--shard-index", str(index), "--num-shards", str(num_shards), "--device", "cuda:0"]
+        print(f"[分片 {index}/{num_shards}] GPU {device}: {shard_output_path(args.output, index, num_shards)}")
+        procs.append(subprocess.Popen(cmd, env=env))
+
+    failed = [index for index, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        sys.exit(f"[错误] 分片 {failed} 未正常结束；重新运行同一命令会从断点继续。")
+    total = merge_shards([shard_output_path(args.output, i, num_shards) for i in range(num_shards)], args.output)
+    print(f"全部分片已完成，合并 {total} 条结果至: {args.output}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    telemetry.configure()
+    if args.devices:
+        spawn_shards(args, argv)
+        return
+
+    records = shard_records(load_records(args), args.shard_index, args.num_shards)
+    output_path = shard_output_path(args.output, args.shard_index, args.num_shards)
+    print(f"分片 {args.shard_index}/{args.num_shards}: {len(records)} 条记录 -> {output_path}")
+    if not records:
+        return
+
+    if args.device:
+        model, processor = load_model_and_processor(device=args.device)
+    else:
+        model, processor = get_model_and_processor(use_server=not args.local)
+
+    stats = run_bulk_grounding(
+        model, processor, records, output_path, PROMPT_TEMPLATE, SYSTEM_PROMPT,
+        batch_size=args.batch_size, workers=args.workers, prefetch_batches=args.prefetch_batches,
+        max_new_tokens=args.max_new_tokens, expected_boxes=args.expected_boxes or None,
+        min_pixels=args.min_pixels, max_pixels=args.max_pixels, resume=not args.fresh,
+        progress_every=args.progress_every,
+    )
+    print(f"完成 {stats['completed']} 条, 失败 {stats['failed']} 条, 跳过（已完成）{stats['skipped']} 条; "
+          f"{stats['records_per_s']:.2f} 条/秒")
+    print(f"模型等待预取 {stats['prefetch_wait_s']:.1f}s, 推理 {stats['inference_s']:.1f}s, 总计 {stats['elapsed_s']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+入口脚本与工具模块的启动时间测试。
+
+每个场景在独立的子进程中以 `python -X importtime` 运行，报告：
+1. 子进程的总耗时（解释器启动 + 导入 + 场景本身的工作）。
+2. 是否导入了 torch / transformers / numpy 等重量级依赖。
+3. 累计导入耗时最高的若干个模块（来自 `-X importtime` 的输出）。
+
+后处理场景（只解析、只可视化）不应导入 torch，且应在一秒以内完成；`--check` 时不满足则以非零状态退出。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_import_time.py
+    python scripts/benchmarks/bench_import_time.py --repeat 5 --top 10 --check
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), '..')
+PROJECT_ROOT = os.path.join(SCRIPTS_DIR, '..')
+OUTPUTS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'grounding_outputs.jsonl')
+
+HEAVY_MODULES = ("torch", "transformers", "numpy", "modelscope")
+
+# 场景名 -> (子进程中执行的代码, 是否为后处理场景)
+_PRELUDE = f"import sys; sys.path.insert(0, {os.path.abspath(SCRIPTS_DIR)!r})\n"
+SCENARIOS = {
+    "import_stream_parser": ("import utils.stream_parser", True),
+    "import_frames": ("import utils.frames", True),
+    "import_grounding_utils": ("import utils.grounding_utils", True),
+    "import_model_loader": ("import utils.model_loader", True),
+    "parse_only": (
+        "from utils.stream_parser import parse_grounding_output\n"
+        "import json\n"
+        f"for line in open({os.path.abspath(OUTPUTS_FILE)!r}, encoding='utf-8'):\n"
+        "    parse_grounding_output(json.loads(line)['output'])\n",
+        True,
+    ),
+    "visualize_only": (
+        "import json, tempfile, os\n"
+        "from utils.grounding_utils import plot_bounding_boxes\n"
+        "from utils.frames import Frame\n"
+        f"record = json.loads(open({os.path.abspath(OUTPUTS_FILE)!r}, encoding='utf-8').readline())\n"
+        f"frame = Frame({os.path.abspath(os.path.join(PROJECT_ROOT, 'data', 'login_page.png'))!r})\n"
+        "out = os.path.join(tempfile.mkdtemp(), 'plot.png')\n"
+        "plot_bounding_boxes(frame, record['output'], frame.width, frame.height, output_path=out)\n",
+        True,
+    ),
+    # 对照组：实际推理路径需要的依赖
+    "import_torch_transformers": ("import torch, transformers", False),
+}
+
+
+def _heavy_probe() -> str:
+    return "\nimport sys as _s; print('__HEAVY__' + ','.join(m for m in %r if m in _s.modules))\n" % (HEAVY_MODULES,)
+
+
+def parse_importtime(stderr: str):
+    """解析 `-X importtime` 的输出，返回 [(模块名, 自身耗时 us, 累计耗时 us)]。"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        rows.append((fields[2].strip(), self_us, cumulative_us))
+    return rows
+
+
+def run_scenario(code: str):
+    """在子进程中运行一个场景，返回 (耗时 ms, 已导入的重量级模块, importtime 行, 错误信息)。"""
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PRELUDE + code + _heavy_probe()],
+        capture_output=True, text=True, cwd=PROJECT_ROOT,
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+        return elapsed_ms, [], [], error
+    heavy = []
+    for line in proc.stdout.splitlines():
+        if line.startswith("__HEAVY__"):
+            heavy = [m for m in line[len("__HEAVY__"):].split(",") if m]
+    return elapsed_ms, heavy, parse_importtime(proc.stderr), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本与工具模块的启动时间测试")
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景运行的次数，报告中位数")
+    parser.add_argument("--top", type=int, default=5, help="每个场景列出累计导入耗时最高的模块数")
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="后处理场景的耗时上限（毫秒）")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    parser.add_argument("--check", action="store_true", help="后处理场景导入了 torch 或超出耗时上限时以非零状态退出")
+    args = parser.parse_args()
+
+    report = {}
+    failures = []
+    for name in args.scenarios:
+        code, post_processing = SCENARIOS[name]
+        timings, heavy, rows, error = [], [], [], None
+        for _ in range(args.repeat):
+            elapsed_ms, heavy, rows, error = run_scenario(code)
+            if error:
+                break
+            timings.append(elapsed_ms)
+
+        if error:
+            print(f"{name:28s} 失败: {error}")
+            report[name] = {"error": error}
+            if post_processing:
+                failures.append(f"{name}: {error}")
+            continue
+
+        median_ms = statistics.median(timings)
+        top = sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]
+        report[name] = {
+            "median_ms": round(median_ms, 1),
+            "heavy_modules": heavy,
+            "top_imports": [{"module": m, "self_us": s, "cumulative_us": c} for m, s, c in top],
+        }
+        print(f"{name:28s} {median_ms:8.1f} ms  重量级依赖: {', '.join(heavy) or '无'}")
+        for module, _, cumulative_us in top:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {module}")
+
+        if post_processing:
+            if "torch" in heavy:
+                failures.append(f"{name}: 导入了 torch")
+            if median_ms > args.budget_ms:
+                failures.append(f"{name}: {median_ms:.0f} ms 超出上限 {args.budget_ms:.0f} ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {args.output}")
+
+    if failures:
+        print("\n后处理场景未达标:")
+        for failure in failures:
+            print(f"  - {failure}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+批量推理吞吐量基准测试。
+
+对比两种方式在同一组定位任务上的耗时与吞吐量：
+1. 串行循环：逐个调用 `inference`，每次都重新加载、预处理并预填充(prefill)图像。
+2. 批量推理：调用 `inference_batch`，将所有任务填充到一次 `generate` 调用中。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_inference_batch.py --repeats 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.model_loader import load_model_and_processor
+from utils.grounding_utils import inference, inference_batch
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+SYSTEM_PROMPT = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
+PROMPT_TEMPLATE = 'User instruction: "{instruction}". Provide the JSON for the bounding box: [{{"bbox_2d": [x1, y1, x2, y2], "label": "element"}}]'
+
+# 与阶段二测试案例 1~3 相同：同一张登录页上的三条指令
+INSTRUCTIONS = ["定位登录按钮", "定位用户名输入框", "定位关闭按钮"]
+
+
+def _time_it(fn, repeats):
+    """执行 `fn` 若干次，返回每次的耗时（秒）。"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比串行推理与批量推理的吞吐量")
+    parser.add_argument("--image", default=os.path.join(PROJECT_ROOT, "data", "login_page.png"))
+    parser.add_argument("--repeats", type=int, default=3, help="每种方式的重复次数")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    model, processor = load_model_and_processor()
+    jobs = [(args.image, PROMPT_TEMPLATE.format(instruction=ins), SYSTEM_PROMPT) for ins in INSTRUCTIONS]
+
+    def run_serial():
+        return [inference(model, processor, *job, max_new_tokens=args.max_new_tokens) for job in jobs]
+
+    def run_batched():
+        return inference_batch(model, processor, jobs, max_new_tokens=args.max_new_tokens)
+
+    # 预热一次，排除 CUDA kernel 初始化等一次性开销
+    run_batched()
+
+    serial = _time_it(run_serial, args.repeats)
+    batched = _time_it(run_batched, args.repeats)
+
+    print("\n" + "=" * 50)
+    print(f"任务数: {len(jobs)}    重复次数: {args.repeats}")
+    for name, timings in (("串行循环", serial), ("批量推理", batched)):
+        best = min(timings)
+        print(f"{name}: 最佳 {best:.3f}s / 平均 {sum(timings) / len(timings):.3f}s, "
+              f"吞吐量 {len(jobs) / best:.2f} 任务/秒")
+    print(f"加速比: {min(serial) / min(batched):.2f}x")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+前缀 KV 缓存的首 token 延迟(TTFT)基准测试。
+
+在同一张截图上依次执行多条定位指令，以 `max_new_tokens=1` 近似测量 TTFT：
+1. 不使用缓存：每条指令都重新编码图像并预填充完整序列。
+2. 使用 `PrefixCache`：首条指令建立前缀缓存，之后只预填充指令文本后缀。
+
+理论上，缓存命中时 TTFT 的降幅约等于图像 token 在整个序列中所占的比例。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_prefix_cache.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.model_loader import load_model_and_processor
+from utils.grounding_utils import inference
+from utils.prefix_cache import PrefixCache
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+SYSTEM_PROMPT = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
+PROMPT_TEMPLATE = 'User instruction: "{instruction}". Provide the JSON for the bounding box: [{{"bbox_2d": [x1, y1, x2, y2], "label": "element"}}]'
+INSTRUCTIONS = ["定位登录按钮", "定位用户名输入框", "定位关闭按钮", "定位密码输入框"]
+
+
+def _measure_ttft(model, processor, image_path, prefix_cache):
+    """对每条指令测量一次只生成 1 个 token 的耗时。"""
+    timings = []
+    for instruction in INSTRUCTIONS:
+        start = time.perf_counter()
+        inference(
+            model, processor, image_path,
+            PROMPT_TEMPLATE.format(instruction=instruction),
+            SYSTEM_PROMPT,
+            max_new_tokens=1,
+            prefix_cache=prefix_cache
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量前缀缓存对 TTFT 的影响")
+    parser.add_argument("--image", default=os.path.join(PROJECT_ROOT, "data", "login_page.png"))
+    args = parser.parse_args()
+
+    model, processor = load_model_and_processor()
+
+    # 预热
+    _measure_ttft(model, processor, args.image, prefix_cache=None)
+
+    baseline = _measure_ttft(model, processor, args.image, prefix_cache=None)
+    cache = PrefixCache(max_entries=2)
+    cached = _measure_ttft(model, processor, args.image, prefix_cache=cache)
+
+    print("\n" + "=" * 50)
+    print(f"{'指令':<16}{'无缓存(s)':>12}{'前缀缓存(s)':>14}")
+    for instruction, t0, t1 in zip(INSTRUCTIONS, baseline, cached):
+        print(f"{instruction:<16}{t0:>12.3f}{t1:>14.3f}")
+    hit_timings = cached[1:]
+    hit_baseline = baseline[1:]
+    print(f"命中时平均 TTFT: {sum(hit_timings) / len(hit_timings):.3f}s "
+          f"(无缓存 {sum(hit_baseline) / len(hit_baseline):.3f}s)")
+    print(f"缓存统计: {cache.stats()}")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
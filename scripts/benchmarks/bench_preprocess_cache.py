@@ -0,0 +1,99 @@
+"""
+图像预处理缓存的基准测试。
+
+只测量预处理阶段（从图像文件到模型输入张量），不运行模型。对 `data/` 下的每张截图比较：
+1. 无缓存：`Image.open` 解码 PNG -> 聊天模板 -> `processor(...)` 缩放/归一化/切分 patch。
+2. 冷缓存：缓存目录为空，执行完整预处理并把 `pixel_values` 写入磁盘。
+3. 热缓存：从磁盘以内存映射方式加载 `pixel_values`，不解码 PNG。
+
+同时校验缓存路径产生的 `input_ids`、`pixel_values`、`image_grid_thw` 与直接调用处理器完全一致。
+只下载处理器的配置文件，不需要模型权重和 GPU。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_preprocess_cache.py --repeats 5
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import torch
+from transformers import AutoProcessor
+from modelscope import snapshot_download
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.grounding_utils import _build_messages, _cached_processor_inputs, _load_image
+from utils.model_loader import MODEL_ID
+from utils.preprocess_cache import PreprocessCache
+from utils.tiny_model import _CONFIG_PATTERNS
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+PROMPT = 'Instruction: "定位登录按钮". Provide the JSON for the bounding box: [{"bbox_2d": [x1, y1, x2, y2], "label": "element"}]'
+
+
+def _prompt_text(processor, image):
+    messages = _build_messages(image, PROMPT, SYSTEM_PROMPT)
+    return processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def preprocess_uncached(processor, image_path):
+    image = _load_image(image_path)
+    return processor(text=[_prompt_text(processor, image)], images=[image], padding=True, return_tensors="pt")
+
+
+def preprocess_cached(processor, image_path, cache):
+    return _cached_processor_inputs(processor, [image_path], [_prompt_text(processor, image_path)], None, None, cache)
+
+
+def _time_ms(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比无缓存、冷缓存、热缓存下的图像预处理耗时")
+    parser.add_argument("--repeats", type=int, default=5, help="无缓存与热缓存的重复次数")
+    args = parser.parse_args()
+
+    model_dir = snapshot_download(MODEL_ID, allow_patterns=_CONFIG_PATTERNS)
+    processor = AutoProcessor.from_pretrained(model_dir, trust_remote_code=True)
+    images = sorted(glob.glob(os.path.join(PROJECT_ROOT, "data", "*.png")))
+
+    print(f"{'截图':<26}{'视觉token':>10}{'无缓存(ms)':>12}{'冷缓存(ms)':>12}{'热缓存(ms)':>12}{'加速比':>8}")
+    totals = [0.0, 0.0, 0.0]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PreprocessCache(cache_dir)
+        for image_path in images:
+            uncached = min(_time_ms(lambda: preprocess_uncached(processor, image_path))[0] for _ in range(args.repeats))
+            cold, _ = _time_ms(lambda: preprocess_cached(processor, image_path, cache))
+            warm_runs = [_time_ms(lambda: preprocess_cached(processor, image_path, cache)) for _ in range(args.repeats)]
+            warm = min(ms for ms, _ in warm_runs)
+
+            # 校验：缓存路径的模型输入与直接调用处理器完全一致
+            reference = preprocess_uncached(processor, image_path)
+            cached_inputs = warm_runs[-1][1]
+            for name in ("input_ids", "attention_mask", "pixel_values", "image_grid_thw"):
+                assert torch.equal(reference[name], cached_inputs[name]), f"{os.path.basename(image_path)}: {name} 不一致"
+
+            grid = reference["image_grid_thw"][0]
+            tokens = int(grid.prod()) // processor.image_processor.merge_size ** 2
+            print(f"{os.path.basename(image_path):<26}{tokens:>10}{uncached:>12.1f}{cold:>12.1f}{warm:>12.1f}"
+                  f"{uncached / warm:>7.1f}x")
+            for i, ms in enumerate((uncached, cold, warm)):
+                totals[i] += ms
+
+        stats = cache.stats()
+    print(f"\n合计: 无缓存 {totals[0]:.0f}ms, 冷缓存 {totals[1]:.0f}ms, 热缓存 {totals[2]:.0f}ms "
+          f"({totals[0] / totals[2]:.1f}x), 缓存占用 {stats['disk_bytes'] / 1024 / 1024:.1f} MB")
+    print("所有截图的缓存输入与直接预处理结果一致。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+阶段三每一步可视化的开销对比（不含模型推理）。
+
+对每张截图在中心位置绘制一个点击标记并保存，比较：
+1. 整帧合成（旧方式）：整张截图转换为 RGBA、分配整帧叠加层、整帧 alpha 合成后转回 RGB，按 PNG 默认级别保存。
+2. 区域合成：只在点击标记的外接矩形内合成（`render.compose`），不保存。
+3. 区域合成 + 保存：同步执行 `render.render`，PNG 压缩级别为 `--compress-level`。
+4. 后台渲染：`AnnotationRenderer.submit` 在调用方所花的时间（智能体循环实际被占用的时间），以及全部写完的总耗时。
+
+同时校验区域合成与整帧合成的结果逐像素一致。
+
+用法（在项目根目录下执行，无需 GPU）：
+    python scripts/benchmarks/bench_render.py --repeats 5
+    python scripts/benchmarks/bench_render.py --images "data/desktop*.png" --format JPEG
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageChops, ImageDraw
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.frames import Frame
+from utils.render import AnnotationRenderer, ClickMarker, compose, render
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+def full_frame_composite(image: Image.Image, x: float, y: float) -> Image.Image:
+    """旧版 `draw_click_on_image` 的绘制方式：整帧 RGBA 叠加层与整帧合成。"""
+    rgba = image.convert('RGBA')
+    overlay = Image.new('RGBA', rgba.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    radius = min(rgba.size) * 0.02
+    draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill=(255, 0, 0, 128))
+    center_radius = radius * 0.2
+    draw.ellipse([(x - center_radius, y - center_radius), (x + center_radius, y + center_radius)],
+                 fill=(0, 255, 0, 255))
+    return Image.alpha_composite(rgba, overlay).convert('RGB')
+
+
+def _mean_ms(fn, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比整帧合成与区域合成 + 后台保存的可视化开销")
+    parser.add_argument("--images", default=os.path.join(PROJECT_ROOT, "data", "calc_*.png"),
+                        help="截图的 glob 模式")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--format", default=None, help="后台渲染的输出格式 (PNG / JPEG / WEBP)")
+    parser.add_argument("--compress-level", type=int, default=1, help="PNG 压缩级别 (0-9)")
+    parser.add_argument("--workers", type=int, default=2, help="后台渲染线程数")
+    args = parser.parse_args()
+
+    screenshots = sorted(glob.glob(args.images))
+    if not screenshots:
+        sys.exit(f"没有找到截图: {args.images}")
+    # 截图预先解码：只比较绘制与保存本身
+    frames = [Frame(path) for path in screenshots]
+    for frame in frames:
+        frame.image
+
+    results = {}
+    mismatched = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        def out(i, tag):
+            return os.path.join(output_dir, f"{tag}_{i}.png")
+
+        def legacy():
+            for i, frame in enumerate(frames):
+                full_frame_composite(frame.image, frame.width / 2, frame.height / 2).save(out(i, "legacy"))
+
+        def region_only():
+            for frame in frames:
+                compose(frame, [ClickMarker(frame.width / 2, frame.height / 2)])
+
+        def region_save():
+            for i, frame in enumerate(frames):
+                render(frame, [ClickMarker(frame.width / 2, frame.height / 2)], out(i, "region"),
+                       compress_level=args.compress_level)
+
+        results["整帧合成 + 保存"] = _mean_ms(legacy, args.repeats)
+        results["区域合成"] = _mean_ms(region_only, args.repeats)
+        results["区域合成 + 保存"] = _mean_ms(region_save, args.repeats)
+
+        with AnnotationRenderer(max_workers=args.workers, format=args.format,
+                                compress_level=args.compress_level) as renderer:
+            submit_ms, started = 0.0, time.perf_counter()
+            for _ in range(args.repeats):
+                for i, frame in enumerate(frames):
+                    t0 = time.perf_counter()
+                    renderer.submit(frame, [ClickMarker(frame.width / 2, frame.height / 2)], out(i, "async"))
+                    submit_ms += (time.perf_counter() - t0) * 1000
+            renderer.wait()
+            drain_ms = (time.perf_counter() - started) * 1000
+        results["后台渲染（调用方）"] = submit_ms / args.repeats
+        results["后台渲染（全部写完）"] = drain_ms / args.repeats
+
+        for frame in frames:
+            # 包括贴近画面边缘的位置
+            for x, y in ((frame.width / 2, frame.height / 2), (3.3, 5.7), (frame.width - 2.5, frame.height - 1.2)):
+                expected = full_frame_composite(frame.image, x, y)
+                actual = compose(frame, [ClickMarker(x, y)])
+                if ImageChops.difference(expected, actual).getbbox() is not None:
+                    mismatched += 1
+
+    steps = len(frames)
+    print(f"截图: {steps} 张, 每种方式重复 {args.repeats} 轮, 数值为每步平均\n")
+    baseline = results["整帧合成 + 保存"] / steps
+    for name, total_ms in results.items():
+        per_step = total_ms / steps
+        print(f"{name:<20}{per_step:>10.2f} ms  ({per_step / baseline:>6.1%})")
+    print(f"\n区域合成与整帧合成结果不一致的样本: {mismatched}")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+动态微批调度器的负载测试。
+
+模拟若干个并发的桌面智能体，每个智能体按泊松过程（指数分布的到达间隔）提交定位与视觉问答请求，
+对比两种服务方式的延迟与吞吐量：
+1. 直接调用：每个请求在一把锁内单独调用 `inference` / `chat`（即各智能体直接调用模型时的情形）。
+2. 微批调度：请求提交给 `BatchScheduler`，在最长等待时间内合并为微批。
+
+报告每种方式的完成数、吞吐量、端到端延迟的 p50/p99，以及调度器的平均批大小和 padding 浪费。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_scheduler.py --agents 8 --rate 0.5 --duration 60
+    python scripts/benchmarks/bench_scheduler.py --tiny          # 随机初始化的迷你模型，CPU 上即可运行
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.grounding_utils import chat, inference
+from utils.scheduler import BatchScheduler, _percentile
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+SYSTEM_PROMPT = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
+PROMPT_TEMPLATE = 'User instruction: "{instruction}". Provide the JSON for the bounding box: [{{"bbox_2d": [x1, y1, x2, y2], "label": "element"}}]'
+
+# 不同尺寸的截图混合在一起，检验视觉 token 分桶的效果
+WORKLOAD = [
+    ("login_page.png", "grounding", "定位登录按钮"),
+    ("login_page.png", "grounding", "定位用户名输入框"),
+    ("file_explorer.png", "grounding", "定位名为 Github 的文件夹"),
+    ("calc_01_initial.png", "grounding", "定位按钮 '1'"),
+    ("calc_04_after_123.png", "grounding", "定位加号按钮 '+'"),
+    ("desktop_clean.png", "grounding", "定位回收站图标"),
+    ("login_page.png", "chat", "这张截图中的用户可以通过什么方式登录？"),
+    ("calc_05_after_plus.png", "chat", "计算器当前显示的数字是多少？"),
+]
+
+
+def _generate_load(agents, rate, duration, seed, handle):
+    """
+    启动 `agents` 个线程，每个线程以每秒 `rate` 个请求的泊松过程调用 `handle(image, kind, instruction)`。
+
+    Returns:
+        tuple: (每个请求的端到端延迟列表, 实际耗时)
+    """
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def agent(index):
+        rng = random.Random(seed + index)
+        while True:
+            time.sleep(rng.expovariate(rate))
+            if time.perf_counter() >= stop_at:
+                return
+            image, kind, instruction = rng.choice(WORKLOAD)
+            start = time.perf_counter()
+            handle(os.path.join(PROJECT_ROOT, "data", image), kind, instruction)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=agent, args=(i,)) for i in range(agents)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def _report(name, latencies, elapsed):
+    print(f"{name}: 完成 {len(latencies)} 个请求, 吞吐量 {len(latencies) / elapsed:.2f} 请求/秒, "
+          f"p50 {_percentile(latencies, 50) * 1000:.0f}ms, p99 {_percentile(latencies, 99) * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比直接调用与动态微批调度在并发负载下的延迟和吞吐量")
+    parser.add_argument("--agents", type=int, default=8, help="并发智能体数量")
+    parser.add_argument("--rate", type=float, default=0.5, help="每个智能体每秒提交的请求数")
+    parser.add_argument("--duration", type=float, default=60.0, help="每种方式的压测时长（秒）")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-queue-delay", type=float, default=0.02, help="最长凑批等待时间（秒）")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tiny", action="store_true", help="使用随机初始化的迷你模型（CPU）")
+    args = parser.parse_args()
+
+    if args.tiny:
+        from utils.tiny_model import load_tiny_model_and_processor
+        model, processor = load_tiny_model_and_processor()
+    else:
+        from utils.model_loader import load_model_and_processor
+        model, processor = load_model_and_processor()
+
+    # 1. 直接调用：各智能体共享一把锁，请求逐个进入 generate
+    model_lock = threading.Lock()
+
+    def handle_direct(image, kind, instruction):
+        with model_lock:
+            if kind == "chat":
+                return chat(model, processor, image, instruction, max_new_tokens=args.max_new_tokens)
+            return inference(model, processor, image, PROMPT_TEMPLATE.format(instruction=instruction), SYSTEM_PROMPT,
+                             max_new_tokens=args.max_new_tokens, expected_boxes=1)
+
+    # 预热一次，排除 CUDA kernel 初始化等一次性开销
+    handle_direct(os.path.join(PROJECT_ROOT, "data", WORKLOAD[0][0]), "grounding", WORKLOAD[0][2])
+
+    direct = _generate_load(args.agents, args.rate, args.duration, args.seed, handle_direct)
+
+    # 2. 微批调度
+    scheduler = BatchScheduler(
+        model, processor, max_batch_size=args.max_batch_size, max_queue_delay=args.max_queue_delay
+    )
+
+    def handle_scheduled(image, kind, instruction):
+        if kind == "chat":
+            future = scheduler.submit_chat(image, instruction, max_new_tokens=args.max_new_tokens)
+        else:
+            future = scheduler.submit_grounding(
+                image, PROMPT_TEMPLATE.format(instruction=instruction), SYSTEM_PROMPT,
+                max_new_tokens=args.max_new_tokens, expected_boxes=1
+            )
+        return future.result()
+
+    scheduled = _generate_load(args.agents, args.rate, args.duration, args.seed, handle_scheduled)
+    scheduler.close()
+    stats = scheduler.stats()
+
+    print("\n" + "=" * 60)
+    print(f"智能体: {args.agents}    到达率: {args.rate}/s/智能体    时长: {args.duration}s")
+    _report("直接调用", *direct)
+    _report("微批调度", *scheduled)
+    print(f"调度器: 平均批大小 {stats['avg_batch_size']:.2f}, 排队 p50 {stats['queue_p50_ms']:.0f}ms / "
+          f"p99 {stats['queue_p99_ms']:.0f}ms, 视觉 token padding 浪费 {stats['padding_waste']:.1%}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+"""
+推理流水线的分阶段基准测试。
+
+在阶段二（登录页三条指令 + 文件管理器多目标）与阶段三（计算器八步）两个场景上，
+把一次定位请求拆成以下阶段分别计时：
+1. load: 解码截图 (`Frame.image`)。
+2. template: 构建消息并套用聊天模板。
+3. preprocess: 处理器的分词与图像缩放/归一化/切分 patch。
+4. prefill: 预填充，以 `generate(max_new_tokens=1)` 的耗时计（即首 token 延迟）。
+5. decode: 完整 `generate` 的耗时减去预填充耗时。
+6. parse: 用流式解析器解析模型输出。
+7. transform: 把模型坐标映射回原图像素坐标。
+8. render: 阶段二绘制边界框 (`plot_bounding_boxes`)，阶段三绘制点击位置 (`draw_click_on_image`)。
+
+同时记录视觉 token 数、提示 token 数、生成 token 数以及预填充/解码的 token 吞吐量，
+结果写成 JSON 报告；指定 `--baseline` 时与已保存的基线逐阶段比较，出现回归时以非零状态码退出，
+可直接用作 CI 的性能门禁。
+
+模型后端（`--backend`）：
+- full: 真实模型，需要 GPU。
+- tiny: 随机初始化的迷你 Qwen2.5-VL（见 `utils/tiny_model.py`），CPU 上即可运行，覆盖真实的预填充/解码路径。
+- mock: 不运行任何网络，`generate` 直接返回按输入尺寸合成的边界框输出，只测量模型以外的开销。
+tiny/mock 只需下载处理器配置文件（几 MB），不需要模型权重。随机模型的输出没有意义，
+这两个后端的 parse/transform/render 阶段改用合成的参考输出，使这些阶段的工作量与真实模型一致。
+
+用法（在项目根目录下执行）：
+    python scripts/benchmarks/bench_stages.py --backend tiny --save-baseline output/benchmarks/baseline.json
+    python scripts/benchmarks/bench_stages.py --backend tiny --baseline output/benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.frames import Frame
+from utils.grounding_utils import _build_messages, draw_click_on_image, plot_bounding_boxes
+from utils.stream_parser import parse_grounding_output
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+DEFAULT_REPORT = os.path.join(PROJECT_ROOT, "output", "benchmarks", "stage_report.json")
+
+STAGES = ["load", "template", "preprocess", "prefill", "decode", "parse", "transform", "render"]
+
+STAGE2_SYSTEM_PROMPT = "You are a helpful assistant that can accurately locate objects in an image based on user instructions and provide their coordinates in a JSON format."
+STAGE2_PROMPT_TEMPLATE = 'User instruction: "{instruction}". Provide the JSON for the bounding box: [{{"bbox_2d": [x1, y1, x2, y2], "label": "element"}}]'
+STAGE3_SYSTEM_PROMPT = "You are a helpful assistant. Locate the object in the image based on the instruction and provide its bounding box in JSON format."
+STAGE3_PROMPT_TEMPLATE = "Instruction: \"{instruction}\". Provide the JSON for the bounding box: [{{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"element\"}}]"
+
+# 每个场景: (截图, 指令, 期望的边界框数量)
+SCENARIOS = {
+    "stage2": {
+        "system_prompt": STAGE2_SYSTEM_PROMPT,
+        "prompt_template": STAGE2_PROMPT_TEMPLATE,
+        "render": "boxes",
+        "jobs": [
+            ("login_page.png", "定位登录按钮", 1),
+            ("login_page.png", "定位用户名输入框", 1),
+            ("login_page.png", "定位关闭按钮", 1),
+            ("file_explorer.png", "分别定位面板中名为 Linux, Program, Github, Codefield 的文件夹。", 4),
+        ],
+    },
+    "stage3": {
+        "system_prompt": STAGE3_SYSTEM_PROMPT,
+        "prompt_template": STAGE3_PROMPT_TEMPLATE,
+        "render": "click",
+        "jobs": [
+            ("calc_01_initial.png", "定位按钮 '1'", 1),
+            ("calc_02_after_1.png", "定位按钮 '2'", 1),
+            ("calc_03_after_12.png", "点击按钮 '3'", 1),
+            ("calc_04_after_123.png", "点击加号按钮 '+'", 1),
+            ("calc_05_after_plus.png", "点击按钮 '4'", 1),
+            ("calc_06_after_4.png", "点击按钮 '5'", 1),
+            ("calc_07_after_45.png", "点击按钮 '6'", 1),
+            ("calc_08_after_456.png", "点击等号按钮 '='", 1),
+        ],
+    },
+}
+
+
+def reference_output(input_height: int, input_width: int, count: int = 1) -> str:
+    """按模型输入尺寸合成一段与真实模型格式相同的定位输出（Markdown 代码块包裹的 JSON 数组）。"""
+    boxes = []
+    for i in range(count):
+        x1 = int(input_width * (0.1 + 0.8 * i / max(count, 1)))
+        y1 = int(input_height * 0.4)
+        x2 = x1 + max(1, int(input_width * 0.6 / max(count, 1)))
+        y2 = int(input_height * 0.6)
+        boxes.append(f'\t{{"bbox_2d": [{x1}, {y1}, {x2}, {y2}], "label": "element {i}"}}')
+    return "```json\n[\n" + ",\n".join(boxes) + "\n]\n```"
+
+
+class MockGroundingModel:
+    """
+    替代模型的桩对象：`generate` 不做任何计算，直接返回 `reference_output` 的 token，
+    用于只测量模型以外各阶段的开销。
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.device = torch.device("cpu")
+        tokenizer = processor.tokenizer
+        self.eos_token_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else self.eos_token_id
+        self._patch_size = processor.image_processor.patch_size
+
+    def generate(self, input_ids, image_grid_thw, max_new_tokens, **kwargs):
+        rows = []
+        for grid in image_grid_thw:
+            text = reference_output(int(grid[1]) * self._patch_size, int(grid[2]) * self._patch_size)
+            ids = self.processor.tokenizer(text, add_special_tokens=False)["input_ids"] + [self.eos_token_id]
+            rows.append(ids[:max_new_tokens])
+        width = max(len(ids) for ids in rows)
+        generated = torch.full((len(rows), width), self.pad_token_id, dtype=input_ids.dtype)
+        for i, ids in enumerate(rows):
+            generated[i, :len(ids)] = torch.tensor(ids, dtype=input_ids.dtype)
+        return torch.cat([input_ids, generated], dim=1)
+
+
+def load_backend(name: str):
+    """按名称加载模型后端，返回 (model, processor)。"""
+    if name == "full":
+        from utils.model_loader import load_model_and_processor
+        return load_model_and_processor()
+    if name == "tiny":
+        from utils.tiny_model import load_tiny_model_and_processor
+        return load_tiny_model_and_processor()
+    if name == "mock":
+        from modelscope import snapshot_download
+        from transformers import AutoProcessor
+        from utils.model_loader import MODEL_ID
+        from utils.tiny_model import _CONFIG_PATTERNS
+        processor = AutoProcessor.from_pretrained(
+            snapshot_download(MODEL_ID, allow_patterns=_CONFIG_PATTERNS), trust_remote_code=True
+        )
+        return MockGroundingModel(processor), processor
+    raise ValueError(f"未知的模型后端: {name}")
+
+
+def _timed(timings: dict, stage: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    timings[stage] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def run_job(model, processor, scenario: dict, job: tuple, max_new_tokens: int, output_path: str,
+            use_model_output: bool) -> tuple[dict, dict]:
+    """
+    执行一次分阶段计时的定位请求。
+
+    Returns:
+        tuple[dict, dict]: (各阶段耗时(ms), token 计数 {"visual", "prompt", "generated"})
+    """
+    image_name, instruction, expected_boxes = job
+    prompt = scenario["prompt_template"].format(instruction=instruction)
+    timings = {}
+
+    frame = Frame(os.path.join(PROJECT_ROOT, "data", image_name))
+    image = _timed(timings, "load", lambda: frame.image)
+
+    messages = _build_messages(image, prompt, scenario["system_prompt"])
+    text = _timed(timings, "template", lambda: processor.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    ))
+    inputs = _timed(timings, "preprocess", lambda: processor(
+        text=[text], images=[image], padding=True, return_tensors="pt"
+    ).to(model.device))
+
+    with torch.inference_mode():
+        _timed(timings, "prefill", lambda: model.generate(**inputs, max_new_tokens=1, do_sample=False))
+        output_ids = _timed(timings, "decode", lambda: model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False
+        ))
+    # 完整生成包含一次预填充，扣除后即为逐 token 解码的耗时
+    timings["decode"] = max(timings["decode"] - timings["prefill"], 0.0)
+
+    image_processor = processor.image_processor
+    grid = inputs["image_grid_thw"][0]
+    input_height = int(grid[1]) * image_processor.patch_size
+    input_width = int(grid[2]) * image_processor.patch_size
+    generated = output_ids[0][inputs["input_ids"].shape[1]:]
+    pad_token_id = processor.tokenizer.pad_token_id
+    counts = {
+        "visual": int(grid.prod()) // image_processor.merge_size ** 2,
+        "prompt": int(inputs["input_ids"].shape[1]),
+        "generated": int((generated != pad_token_id).sum()) if pad_token_id is not None else len(generated),
+    }
+
+    if use_model_output:
+        response = processor.batch_decode([generated], skip_special_tokens=True)[0]
+    else:
+        response = reference_output(input_height, input_width, expected_boxes)
+
+    boxes = _timed(timings, "parse", lambda: [
+        element["bbox_2d"] for element in parse_grounding_output(response)
+        if isinstance(element.get("bbox_2d"), list) and len(element["bbox_2d"]) == 4
+    ])
+
+    def transform():
+        scale_x, scale_y = frame.width / input_width, frame.height / input_height
+        if scenario["render"] == "click":
+            return [((x1 + x2) / 2 * scale_x, (y1 + y2) / 2 * scale_y) for x1, y1, x2, y2 in boxes[:1]]
+        return [(x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y) for x1, y1, x2, y2 in boxes]
+    _timed(timings, "transform", transform)
+
+    def render():
+        # 屏蔽绘制函数的提示输出，保持报告整洁
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if scenario["render"] == "click":
+                if boxes:
+                    x1, y1, x2, y2 = boxes[0]
+                    draw_click_on_image(frame, ((x1 + x2) / 2, (y1 + y2) / 2), input_width, input_height, output_path)
+            else:
+                plot_bounding_boxes(frame, response, input_width, input_height, output_path)
+    _timed(timings, "render", render)
+
+    return timings, counts
+
+
+def run_scenario(model, processor, name: str, repeats: int, max_new_tokens: int, use_model_output: bool) -> dict:
+    """运行一个场景：预热一轮后重复 `repeats` 轮，汇总每个阶段每个请求的耗时。"""
+    scenario = SCENARIOS[name]
+    samples = {stage: [] for stage in STAGES}
+    totals = {"visual": 0, "prompt": 0, "generated": 0}
+    visual_tokens = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for round_index in range(repeats + 1):
+            for i, job in enumerate(scenario["jobs"]):
+                output_path = os.path.join(output_dir, f"{i}.png")
+                timings, counts = run_job(model, processor, scenario, job, max_new_tokens, output_path,
+                                          use_model_output)
+                if round_index == 0:
+                    continue  # 预热轮：排除首次调用的初始化开销
+                for stage in STAGES:
+                    samples[stage].append(timings[stage])
+                for key in totals:
+                    totals[key] += counts[key]
+                visual_tokens[job[0]] = counts["visual"]
+
+    requests = repeats * len(scenario["jobs"])
+    prefill_s = sum(samples["prefill"]) / 1000
+    decode_s = sum(samples["decode"]) / 1000
+    # 第一个生成 token 计入预填充
+    decoded_tokens = totals["generated"] - requests
+    stages = {
+        stage: {
+            "median_ms": statistics.median(values),
+            "mean_ms": statistics.fmean(values),
+            "min_ms": min(values),
+        }
+        for stage, values in samples.items()
+    }
+    return {
+        "requests": requests,
+        "stages": stages,
+        "total_median_ms": sum(s["median_ms"] for s in stages.values()),
+        "visual_tokens": visual_tokens,
+        "avg_prompt_tokens": totals["prompt"] / requests,
+        "avg_generated_tokens": totals["generated"] / requests,
+        "prefill_tokens_per_s": totals["prompt"] / prefill_s if prefill_s > 0 else 0.0,
+        "decode_tokens_per_s": decoded_tokens / decode_s if decode_s > 0 and decoded_tokens > 0 else 0.0,
+    }
+
+
+def compare_with_baseline(report: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list[str]:
+    """
+    逐场景、逐阶段比较中位数耗时，返回回归描述列表。
+
+    某阶段比基线慢超过 `threshold`（相对比例）且绝对差值超过 `min_delta_ms` 时视为回归；
+    视觉 token 数与基线不一致（预处理行为发生变化）也视为回归。
+    """
+    regressions = []
+    print(f"\n与基线比较 (后端 {baseline['meta'].get('backend')}, 阈值 +{threshold:.0%}):")
+    print(f"{'场景':<8}{'阶段':<12}{'基线(ms)':>12}{'当前(ms)':>12}{'变化':>10}")
+    for name, current in report["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:<8}(基线中没有该场景)")
+            continue
+        for stage in STAGES + ["total"]:
+            if stage == "total":
+                before, after = base["total_median_ms"], current["total_median_ms"]
+            else:
+                before, after = base["stages"][stage]["median_ms"], current["stages"][stage]["median_ms"]
+            change = after / before - 1 if before > 0 else 0.0
+            regressed = change > threshold and after - before > min_delta_ms
+            marker = "  <- 回归" if regressed else ""
+            print(f"{name:<8}{stage:<12}{before:>12.2f}{after:>12.2f}{change:>+10.1%}{marker}")
+            if regressed:
+                regressions.append(f"{name}/{stage}: {before:.2f}ms -> {after:.2f}ms ({change:+.1%})")
+        if current["visual_tokens"] != base["visual_tokens"]:
+            regressions.append(f"{name}: 视觉 token 数与基线不一致 {base['visual_tokens']} -> {current['visual_tokens']}")
+    return regressions
+
+
+def _print_report(report: dict):
+    for name, result in report["scenarios"].items():
+        print(f"\n[{name}] {result['requests']} 个请求, 每请求中位数合计 {result['total_median_ms']:.1f}ms")
+        print(f"{'阶段':<12}{'中位数(ms)':>12}{'平均(ms)':>12}{'最小(ms)':>12}")
+        for stage in STAGES:
+            s = result["stages"][stage]
+            print(f"{stage:<12}{s['median_ms']:>12.2f}{s['mean_ms']:>12.2f}{s['min_ms']:>12.2f}")
+        print(f"视觉 token: {result['visual_tokens']}")
+        print(f"平均提示 token {result['avg_prompt_tokens']:.0f}, 平均生成 token {result['avg_generated_tokens']:.1f}, "
+              f"预填充 {result['prefill_tokens_per_s']:.0f} token/s, 解码 {result['decode_tokens_per_s']:.1f} token/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分阶段测量阶段二/阶段三定位流水线的耗时")
+    parser.add_argument("--backend", choices=["full", "tiny", "mock"], default="tiny")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeats", type=int, default=3, help="每个场景的重复轮数（另有一轮预热）")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--output", default=DEFAULT_REPORT, help="JSON 报告的输出路径")
+    parser.add_argument("--baseline", help="与之比较的基线报告；出现回归时以状态码 1 退出")
+    parser.add_argument("--save-baseline", help="把本次报告另存为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定回归的相对变慢比例")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="判定回归的最小绝对差值，过滤计时噪声")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model, processor = load_backend(args.backend)
+    use_model_output = args.backend == "full"
+
+    report = {
+        "meta": {
+            "backend": args.backend,
+            "repeats": args.repeats,
+            "max_new_tokens": args.max_new_tokens,
+            "device": str(model.device),
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "scenarios": {
+            name: run_scenario(model, processor, name, args.repeats, args.max_new_tokens, use_model_output)
+            for name in args.scenarios
+        },
+    }
+    _print_report(report)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已保存至: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print("\n检测到性能回归:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n未检测到性能回归。")
+
+
+if __name__ == '__main__':
+    main()
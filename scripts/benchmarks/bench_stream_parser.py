@@ -0,0 +1,107 @@
+"""
+定位结果解析的微基准测试。
+
+在一组录制的模型原始输出（`data/grounding_outputs.jsonl`，包含代码块包裹、说明文字、
+单引号、截断、XML 坐标点等情况）上，对比：
+1. 旧解析链：`parse_json_from_string` 按行切分重组 -> `ast.literal_eval` -> 失败时截断修复后重试。
+2. 新解析器：`GroundingStreamParser` 单遍增量解析（分别按整段输入和逐 token 大小的片段输入测量）。
+
+报告每种方式的单次解析耗时以及成功解析出的元素数。
+
+用法（在项目根目录下执行，无需 GPU）：
+    python scripts/benchmarks/bench_stream_parser.py --iterations 2000
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.stream_parser import GroundingStreamParser, parse_grounding_output
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "grounding_outputs.jsonl")
+
+
+def parse_json_from_string(text: str) -> str:
+    """与 `grounding_utils.parse_json_from_string` 相同的旧实现（避免为基准测试引入 PIL 等依赖）。"""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if line.strip() == "```json":
+            json_content = "\n".join(lines[i+1:])
+            json_content = json_content.split("```")[0]
+            return json_content.strip()
+    return text
+
+
+def legacy_parse(text: str) -> list:
+    """旧版 `plot_bounding_boxes` 中的解析链。"""
+    clean = parse_json_from_string(text)
+    try:
+        return ast.literal_eval(clean)
+    except Exception:
+        try:
+            end_idx = clean.rfind('"}') + len('"}')
+            return ast.literal_eval(clean[:end_idx] + "]")
+        except Exception:
+            return []
+
+
+def stream_parse_chunked(text: str, chunk_size: int = 4) -> list:
+    """模拟 `TextIteratorStreamer`：按小片段逐块喂给解析器。"""
+    parser = GroundingStreamParser()
+    elements = []
+    for start in range(0, len(text), chunk_size):
+        elements.extend(parser.feed(text[start:start + chunk_size]))
+    elements.extend(parser.close())
+    return elements
+
+
+def _count_elements(result) -> int:
+    if not isinstance(result, list):
+        return 0
+    return sum(1 for item in result if isinstance(item, dict) and ("bbox_2d" in item or "point_2d" in item))
+
+
+def _bench(fn, corpus, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in corpus:
+            fn(text)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比旧解析链与流式解析器")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    corpus = [record["output"] for record in records]
+
+    methods = {
+        "旧解析链": legacy_parse,
+        "流式解析(整段)": parse_grounding_output,
+        "流式解析(分片)": stream_parse_chunked,
+    }
+
+    print(f"语料: {len(corpus)} 条录制输出, 每种方式重复 {args.iterations} 轮\n")
+    print(f"{'样本':<26}" + "".join(f"{name:>14}" for name in methods))
+    for record in records:
+        counts = [_count_elements(fn(record["output"])) for fn in methods.values()]
+        print(f"{record['name']:<26}" + "".join(f"{count:>14}" for count in counts))
+
+    print()
+    for name, fn in methods.items():
+        per_call = _bench(fn, corpus, args.iterations)
+        total = sum(_count_elements(fn(text)) for text in corpus)
+        print(f"{name:<16} 平均 {per_call * 1e6:8.1f} µs/条, 共解析出 {total} 个元素")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+在 CPU 上用随机初始化的迷你模型验证约束解码。
+
+迷你模型的输出本身毫无意义，正因如此它很适合检验约束：
+- 不加约束时，输出是随机 token，几乎不可能解析为 JSON，且会一直生成到 `max_new_tokens`。
+- 加上约束后，无论模型权重如何，输出都必须是可以被 `json.loads` 解析的规范边界框 JSON，
+  坐标均为整数，并且在输出完整后立即结束。
+
+用法（在项目根目录下执行，无需 GPU）：
+    python scripts/benchmarks/check_constrained_decoding.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.tiny_model import load_tiny_model_and_processor
+from utils.grounding_utils import inference
+
+PROMPT = 'Instruction: "定位按钮 \'1\'". Provide the JSON for the bounding box: [{"bbox_2d": [x1, y1, x2, y2], "label": "element"}]'
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def _run(model, processor, image_path, constrained, expected_boxes):
+    stats = []
+    output, _, _ = inference(
+        model, processor, image_path, PROMPT, SYSTEM_PROMPT,
+        max_new_tokens=96,
+        expected_boxes=expected_boxes,
+        stats=stats,
+        constrained=constrained
+    )
+    try:
+        boxes = json.loads(output)
+    except json.JSONDecodeError:
+        boxes = None
+    return output, boxes, stats[0]["generated_tokens"]
+
+
+def main():
+    model, processor = load_tiny_model_and_processor()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, "tiny.png")
+        Image.new("RGB", (224, 224), (40, 120, 200)).save(image_path)
+
+        _, free_boxes, free_tokens = _run(model, processor, image_path, constrained=False, expected_boxes=None)
+        for expected in (1, 3):
+            output, boxes, tokens = _run(model, processor, image_path, constrained=True, expected_boxes=expected)
+
+            assert boxes is not None, f"约束解码的输出无法解析为 JSON: {output!r}"
+            assert 1 <= len(boxes) <= expected, f"边界框数量不符合约束: {len(boxes)}"
+            for box in boxes:
+                assert set(box) == {"bbox_2d", "label"}
+                assert len(box["bbox_2d"]) == 4 and all(isinstance(v, int) for v in box["bbox_2d"])
+            print(f"[+] 约束解码 (最多 {expected} 个框): {tokens} 个 token, 输出合法: {output}")
+
+    print(f"[+] 无约束解码: {free_tokens} 个 token, 可解析为 JSON: {free_boxes is not None}")
+    print("约束解码检查通过。")
+
+
+if __name__ == '__main__':
+    main()
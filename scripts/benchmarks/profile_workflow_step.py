@@ -0,0 +1,132 @@
+"""
+阶段三单步的图像处理开销剖析（不含模型推理）。
+
+每一步智能体都要：用截图内容计算结果缓存键 -> 把截图交给推理 -> 在截图上绘制点击位置。
+对比两种方式：
+1. 按路径传递（旧方式）：每个环节各自 `Image.open` 并解码 PNG。
+2. 共享帧：每步构造一个 `Frame`，三个环节共用同一次解码和同一个内容哈希。
+
+对每种方式报告每步的耗时（按环节拆分）、PNG 解码次数与解码产生的像素缓冲区大小。
+解码次数通过包装 `ImageFile.load` 统计：只有真正执行解码的调用才计数。
+
+用法（在项目根目录下执行，无需 GPU）：
+    python scripts/benchmarks/profile_workflow_step.py --repeats 5
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw, ImageFile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.frames import Frame, image_digest
+from utils.grounding_utils import _load_image, draw_click_on_image
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+# 解码统计
+_decodes = {"count": 0, "bytes": 0}
+_original_load = ImageFile.ImageFile.load
+
+
+def _counting_load(self):
+    if getattr(self, "tile", None):
+        _decodes["count"] += 1
+        _decodes["bytes"] += self.size[0] * self.size[1] * len(self.getbands())
+    return _original_load(self)
+
+
+def legacy_draw_click(image_path, normalized_coords, input_width, input_height, output_path):
+    """旧版 `draw_click_on_image`：按路径重新打开并解码截图。"""
+    image = Image.open(image_path).convert('RGBA')
+    abs_x = normalized_coords[0] / input_width * image.width
+    abs_y = normalized_coords[1] / input_height * image.height
+    overlay = Image.new('RGBA', image.size, (255, 255, 255, 0))
+    radius = min(image.size) * 0.02
+    ImageDraw.Draw(overlay).ellipse(
+        [(abs_x - radius, abs_y - radius), (abs_x + radius, abs_y + radius)], fill=(255, 0, 0, 128)
+    )
+    Image.alpha_composite(image, overlay).convert('RGB').save(output_path)
+
+
+def step_by_path(image_path, output_path):
+    """旧方式：缓存键、推理输入、可视化各自打开截图。"""
+    timings = {}
+    start = time.perf_counter()
+    image_digest(Image.open(image_path))
+    timings["缓存键"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = Image.open(image_path)
+    image.convert("RGB")  # 处理器内部的第一步
+    timings["推理输入"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_draw_click(image_path, (image.width / 2, image.height / 2), image.width, image.height, output_path)
+    timings["可视化"] = time.perf_counter() - start
+    return timings
+
+
+def step_with_frame(image_path, output_path):
+    """共享帧：三个环节共用一次解码。"""
+    timings = {}
+    start = time.perf_counter()
+    frame = Frame(image_path)
+    frame.digest
+    timings["缓存键"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _load_image(frame).convert("RGB")
+    timings["推理输入"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    draw_click_on_image(frame, (frame.width / 2, frame.height / 2), frame.width, frame.height, output_path)
+    timings["可视化"] = time.perf_counter() - start
+    return timings
+
+
+def _profile(step_fn, screenshots, output_dir, repeats):
+    stages = {}
+    _decodes["count"] = _decodes["bytes"] = 0
+    for _ in range(repeats):
+        for image_path in screenshots:
+            output_path = os.path.join(output_dir, os.path.basename(image_path))
+            for stage, seconds in step_fn(image_path, output_path).items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+    steps = repeats * len(screenshots)
+    return {stage: seconds / steps * 1000 for stage, seconds in stages.items()}, _decodes["count"] / steps, \
+        _decodes["bytes"] / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剖析阶段三每一步的截图解码与可视化开销")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    screenshots = sorted(glob.glob(os.path.join(PROJECT_ROOT, "data", "calc_*.png")))
+    ImageFile.ImageFile.load = _counting_load
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # 预热文件系统缓存
+        _profile(step_by_path, screenshots, output_dir, 1)
+        results = {
+            "按路径传递": _profile(step_by_path, screenshots, output_dir, args.repeats),
+            "共享帧": _profile(step_with_frame, screenshots, output_dir, args.repeats),
+        }
+
+    print(f"截图: {len(screenshots)} 张 (计算器任务), 每种方式重复 {args.repeats} 轮, 数值为每步平均\n")
+    stage_names = list(next(iter(results.values()))[0])
+    print(f"{'方式':<12}" + "".join(f"{name + '(ms)':>14}" for name in stage_names)
+          + f"{'合计(ms)':>12}{'解码次数':>10}{'解码缓冲(MB)':>14}")
+    for name, (stages, decodes, decoded_bytes) in results.items():
+        print(f"{name:<12}" + "".join(f"{stages[stage]:>14.2f}" for stage in stage_names)
+              + f"{sum(stages.values()):>12.2f}{decodes:>10.1f}{decoded_bytes / 1024 / 1024:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
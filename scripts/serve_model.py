@@ -0,0 +1,36 @@
+"""
+启动常驻推理服务：模型只加载一次，之后各阶段脚本通过本机 HTTP 接口推理，启动时间从模型加载的数十秒降到毫秒级。
+
+用法（在项目根目录下执行）：
+    python scripts/serve_model.py                 # 监听 127.0.0.1:8765
+    python scripts/serve_model.py --port 9000     # 自定义端口，客户端需设置 VLM_SERVER_URL=http://127.0.0.1:9000
+
+服务运行期间，`02_stage1_basics.py`、`03_stage2_grounding.py`、`04_stage3_workflow.py` 会自动探测并使用它；
+设置环境变量 `VLM_SERVER_URL=` (空字符串) 可强制在脚本进程内加载模型。
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import telemetry
+from utils.model_client import DEFAULT_HOST, DEFAULT_PORT
+from utils.model_server import serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的本地 Qwen2.5-VL 推理服务")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址（默认只监听本机）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--prefix-cache-entries", type=int, default=4, help="服务端前缀 KV 缓存的条目数上限")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="并发请求合并为微批的最大请求数")
+    parser.add_argument("--max-queue-delay", type=float, default=0.02, help="请求凑批的最长等待时间（秒）")
+    args = parser.parse_args()
+    telemetry.configure()
+    serve(args.host, args.port, args.prefix_cache_entries, args.max_batch_size, args.max_queue_delay)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+本模块把阶段三的智能体循环组织为流水线：观察 -> 思考 -> 行动三个阶段在不同线程中重叠执行。
+
+过去每一步都严格串行：检查文件、解码截图、预处理、生成、解析、绘制并保存，然后下一步才开始。
+模型生成期间 CPU 空闲，而解码、预处理、编码与日志落盘又都在关键路径上。流水线中：
+1. 观察：`FramePrefetcher` 在后台线程中按步骤顺序提前解码后续截图、计算内容哈希，并完成图像预处理
+   （结果放在 `PrefetchBuffer` 中，作为 `preprocess_cache` 交给推理）。当前步骤生成时，下一帧已在准备。
+2. 思考：步骤线程只做定位（生成与解析）。
+3. 行动：可视化交给 `AnnotationRenderer`，步骤日志交给 `StepJournal` 的后台写入线程。
+
+阶段之间都是有界队列：预取最多领先 `lookahead` 帧，渲染与日志的排队数也有上限，下游跟不上时上游等待（背压），
+内存占用不会随步骤数增长。
+
+`StepTimeline` 汇总每一步的墙钟时间与其中的模型时间；配合 `telemetry.ChromeTraceExporter` 写出的时间线，
+可以直接看到各线程的重叠情况，以及每一步的耗时是否已接近纯模型时间。
+"""
+
+import logging
+import threading
+
+from . import telemetry
+from .preprocess_cache import PrefetchBuffer
+
+logger = logging.getLogger(__name__)
+
+# 计入"模型时间"的 span：本地生成（含前缀预填充）与推理服务请求
+MODEL_SPANS = ("generate", "remote_inference")
+
+
+class _Slot:
+    """一帧在预取流水线中的状态。"""
+
+    __slots__ = ("frame", "preprocess", "consumers", "started", "ready", "key", "holds_slot")
+
+    def __init__(self, frame, preprocess: bool):
+        self.frame = frame
+        self.preprocess = preprocess
+        self.consumers = set()
+        self.started = False
+        self.ready = threading.Event()
+        self.key = None
+        self.holds_slot = False
+
+
+class FramePrefetcher:
+    """
+    观察阶段：按步骤顺序在后台线程中提前准备截图。
+
+    每一帧的准备包括解码与内容哈希；需要调用模型的帧还会完成图像预处理。后台线程最多领先 `lookahead` 帧，
+    一帧的所有步骤都 `release` 之后才腾出位置。步骤用到的帧尚未轮到后台线程时，步骤线程直接就地准备，
+    因此步骤的执行顺序与预取顺序不一致（并发步骤、续跑、失败的依赖）时不会互相等待。
+
+    Args:
+        schedule (list): 按执行顺序排列的 (step_id, frame, preprocess) 三元组；同一帧可出现多次。
+            `preprocess` 为 False 的帧只解码（例如结果已在缓存或元素索引中的步骤）。
+        processor: 处理器；为 None 时只解码（使用推理服务，或模型尚未加载，见 `set_processor`）。
+        lookahead (int): 最多提前准备的帧数。
+        min_pixels, max_pixels (int, optional): 图像像素预算，需与推理时使用的一致。
+    """
+
+    def __init__(self, schedule: list, processor=None, lookahead: int = 2, min_pixels: int = None,
+                 max_pixels: int = None):
+        self.processor = processor
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.buffer = PrefetchBuffer()
+        self._slots = {}
+        self._order = []
+        for step_id, frame, preprocess in schedule:
+            slot = self._slots.get(id(frame))
+            if slot is None:
+                slot = self._slots[id(frame)] = _Slot(frame, preprocess)
+                self._order.append(slot)
+            slot.preprocess = slot.preprocess or preprocess
+            slot.consumers.add(step_id)
+        self._lock = threading.Lock()
+        self._capacity = threading.Semaphore(max(1, lookahead))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="observe-prefetch", daemon=True)
+        self._thread.start()
+
+    def set_processor(self, processor):
+        """模型在后台加载完成后设置处理器：之后准备的帧会完成图像预处理。"""
+        self.processor = processor
+
+    def _run(self):
+        for slot in self._order:
+            self._capacity.acquire()
+            if self._closed:
+                return
+            if not self._prepare(slot, holds_slot=True):
+                # 该帧已由步骤线程就地准备，不占用预取位置
+                self._capacity.release()
+
+    def _prepare(self, slot: _Slot, holds_slot: bool = False) -> bool:
+        """准备一帧；该帧已在（或已被）其他线程准备时返回 False。`holds_slot` 表示由预取线程准备、占用一个位置。"""
+        with self._lock:
+            if slot.started:
+                return False
+            slot.started = True
+            slot.holds_slot = holds_slot
+        try:
+            with telemetry.span("observe_prefetch", frame=slot.frame.path):
+                slot.frame.image
+                slot.frame.digest
+                processor = self.processor
+                if slot.preprocess and processor is not None:
+                    slot.key = self.buffer.prepare(
+                        slot.frame, processor.image_processor, self.min_pixels, self.max_pixels
+                    )
+        except Exception as e:
+            # 交给步骤自己处理：步骤中的同一操作会再次抛出，并按重试策略处理
+            logger.debug("预取截图失败 %s: %s", slot.frame.path, e)
+        finally:
+            slot.ready.set()
+        return True
+
+    def wait(self, frame):
+        """
+        取得已准备好的帧：已就绪时立即返回；正在准备时等待；尚未轮到时就地准备。
+
+        Returns:
+            PrefetchBuffer | None: 该帧的图像预处理结果所在的缓存，可直接作为 `preprocess_cache` 传给推理；
+                没有预处理结果时为 None。
+        """
+        slot = self._slots.get(id(frame))
+        if slot is None:
+            return None
+        if not self._prepare(slot):
+            slot.ready.wait()
+        return self.buffer if slot.key is not None else None
+
+    def release(self, frame, step_id: str):
+        """步骤 `step_id` 不再需要该帧：所有步骤都释放后，丢弃其预处理结果并腾出预取位置。"""
+        slot = self._slots.get(id(frame))
+        if slot is None:
+            return
+        with self._lock:
+            if step_id not in slot.consumers:
+                return
+            slot.consumers.discard(step_id)
+            if slot.consumers:
+                return
+            key, holds_slot = slot.key, slot.holds_slot
+            slot.key, slot.holds_slot = None, False
+        if key is not None:
+            self.buffer.release([key])
+        if holds_slot:
+            self._capacity.release()
+
+    def close(self):
+        """停止预取线程并丢弃所有预处理结果。"""
+        self._closed = True
+        self._capacity.release()
+        self._thread.join()
+        for slot in self._order:
+            with self._lock:
+                slot.consumers.clear()
+                key, slot.key = slot.key, None
+            if key is not None:
+                self.buffer.release([key])
+
+
+class StepTimeline:
+    """
+    遥测导出器：按工作流步骤汇总墙钟时间与模型时间。
+
+    每次尝试（`workflow_step` span）的模型时间为其内部所有 `MODEL_SPANS` 的耗时之和，
+    观察等待为其中 `observe` span 的耗时。用 `telemetry.add_exporter` 注册。
+    """
+
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        if record["type"] == "span":
+            with self._lock:
+                self._spans[record["span_id"]] = record
+
+    def steps(self) -> list[dict]:
+        """
+        Returns:
+            list[dict]: 按开始时间排列的每次尝试：{"step", "attempt", "wall_ms", "model_ms", "observe_ms", "other_ms"}。
+        """
+        with self._lock:
+            spans = dict(self._spans)
+        rows = {
+            span_id: {"step": s["attributes"].get("step"), "attempt": s["attributes"].get("attempt"),
+                      "start_time": s["start_time"], "wall_ms": s["duration_ms"], "model_ms": 0.0, "observe_ms": 0.0}
+            for span_id, s in spans.items() if s["name"] == "workflow_step"
+        }
+        for s in spans.values():
+            if s["name"] not in MODEL_SPANS and s["name"] != "observe":
+                continue
+            # 向上找到所属的步骤；嵌套在另一个模型 span 中的不重复计入
+            parent, nested = s["parent_id"], False
+            while parent is not None and parent not in rows:
+                ancestor = spans.get(parent)
+                if ancestor is None:
+                    break
+                nested = nested or ancestor["name"] in MODEL_SPANS
+                parent = ancestor["parent_id"]
+            if parent in rows and not nested:
+                rows[parent]["observe_ms" if s["name"] == "observe" else "model_ms"] += s["duration_ms"]
+        result = sorted(rows.values(), key=lambda row: row["start_time"])
+        for row in result:
+            del row["start_time"]
+            row["other_ms"] = row["wall_ms"] - row["model_ms"] - row["observe_ms"]
+        return result
+
+    def summary(self) -> dict:
+        """全部步骤的合计：{"steps", "wall_ms", "model_ms", "observe_ms", "other_ms", "model_fraction"}。"""
+        rows = self.steps()
+        totals = {name: sum(row[name] for row in rows) for name in ("wall_ms", "model_ms", "observe_ms", "other_ms")}
+        totals["steps"] = len(rows)
+        totals["model_fraction"] = totals["model_ms"] / totals["wall_ms"] if totals["wall_ms"] else 0.0
+        return totals
@@ -0,0 +1,304 @@
+"""
+本模块定义定位结果的数组表示 `BoxSet` / `PointSet`。
+
+过去定位结果以 dict 列表在各模块之间流转：`plot_bounding_boxes` 逐个框做坐标换算与交换，
+阶段三把结果转换成 `{'x1': ...}` 再转回来，分块推理、区域放大、元素索引各自手写一遍"输入坐标 -> 原图坐标"的换算。
+`BoxSet` 把一组边界框存放在一个 (N, 4) 的 NumPy 数组中，同时携带标签、得分与来源帧：
+1. 坐标系：`input_size` 不为 None 时坐标位于模型输入坐标系（与模型输出一致），为 None 时位于原图像素坐标系。
+   `to_pixels` / `to_input` 对整组坐标做一次向量化的缩放与平移。
+2. 模型输入尺寸由 `image_grid_thw` 与处理器实际的 patch_size 算出（见 `input_sizes`），不再硬编码 14。
+3. IoU、NMS、包含关系与中心点查询都是整组数组运算，全屏枚举出几百个元素时依然很快。
+
+与 JSON 之间的转换（`from_response` / `to_elements` / `to_json`）保持模型输出的格式，
+因此结果缓存、推理服务等以文本传递结果的地方无需改动。
+"""
+
+import json
+
+import numpy as np
+
+from .frames import as_frame
+from .stream_parser import parse_grounding_output
+
+# Qwen2.5-VL 图像处理器的默认值（处理器未提供时使用）
+DEFAULT_PATCH_SIZE = 14
+DEFAULT_MERGE_SIZE = 2
+
+
+def patch_size(processor=None) -> int:
+    """处理器实际使用的 patch 边长（像素）。"""
+    return getattr(getattr(processor, "image_processor", None), "patch_size", None) or DEFAULT_PATCH_SIZE
+
+
+def merge_size(processor=None) -> int:
+    """处理器把多少 x 多少个相邻 patch 合并为一个视觉 token。"""
+    return getattr(getattr(processor, "image_processor", None), "merge_size", None) or DEFAULT_MERGE_SIZE
+
+
+def input_sizes(image_grid_thw, processor=None) -> np.ndarray:
+    """
+    由 `image_grid_thw` 计算每张图像的模型输入尺寸。
+
+    Args:
+        image_grid_thw: 形如 (N, 3) 或 (3,) 的 [T, H, W] 网格（torch 张量、NumPy 数组或列表）。
+        processor: 处理器，用于读取 patch_size；为 None 时使用默认值。
+
+    Returns:
+        np.ndarray: 形如 (N, 2) 的 [输入高度, 输入宽度]（整数）。
+    """
+    grid = image_grid_thw.tolist() if hasattr(image_grid_thw, "tolist") else image_grid_thw
+    grid = np.asarray(grid, dtype=np.int64).reshape(-1, 3)
+    return grid[:, 1:] * patch_size(processor)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def box_iou(a, b) -> np.ndarray:
+    """两组 [x1, y1, x2, y2] 框两两之间的 IoU，返回形如 (N, M) 的矩阵。"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    inter_w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area_b = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def nms(boxes, scores, iou_threshold: float = 0.5) -> list[int]:
+    """
+    向量化的非极大值抑制 (NMS)。
+
+    每轮保留得分最高的框，并用 numpy 一次性计算它与其余所有框的 IoU，剔除重叠超过阈值的框。
+
+    Args:
+        boxes: 形如 (N, 4) 的 [x1, y1, x2, y2] 坐标。
+        scores: 长度为 N 的得分，得分高者优先保留。
+        iou_threshold (float, optional): IoU 超过该值的框视为重复。
+
+    Returns:
+        list[int]: 保留下来的框的下标，按得分从高到低排列。
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(int(best))
+        order = rest[box_iou(boxes[best], boxes[rest])[0] <= iou_threshold]
+    return keep
+
+
+class _CoordinateSet:
+    """`BoxSet` 与 `PointSet` 的公共部分：坐标数组 (N, D)、标签、得分、坐标系与来源帧。"""
+
+    __slots__ = ("coords", "labels", "scores", "input_size", "frame")
+    _WIDTH = None   # 每个元素的坐标个数
+    _KEY = None     # 模型输出 JSON 中的坐标字段名
+
+    def __init__(self, coords, labels=None, scores=None, input_size=None, frame=None):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, self._WIDTH)
+        count = len(coords)
+        self.coords = coords
+        self.labels = list(labels) if labels is not None else [""] * count
+        self.scores = np.asarray(scores, dtype=np.float64) if scores is not None else np.ones(count)
+        if len(self.labels) != count or self.scores.shape != (count,):
+            raise ValueError(f"坐标、标签与得分的数量不一致: {count}, {len(self.labels)}, {self.scores.shape}")
+        self.input_size = tuple(int(v) for v in input_size) if input_size is not None else None
+        self.frame = as_frame(frame) if frame is not None else None
+
+    @classmethod
+    def from_elements(cls, elements, input_size=None, frame=None):
+        """
+        由元素列表（模型输出解析后的 dict）构造，坐标不完整或不是数字的元素被跳过。
+
+        Args:
+            elements (Iterable[dict]): 每项包含坐标字段（"bbox_2d" 或 "point_2d"）与可选的 "label"、"score"。
+            input_size (tuple, optional): (输入高度, 输入宽度)；坐标已经位于原图像素坐标系时为 None。
+            frame (Frame | str | Image.Image, optional): 来源帧。
+        """
+        coords, labels, scores = [], [], []
+        for element in elements:
+            values = element.get(cls._KEY)
+            if not isinstance(values, (list, tuple)) or len(values) != cls._WIDTH:
+                continue
+            values = [_float(v) for v in values]
+            if None in values:
+                continue
+            coords.append(values)
+            labels.append(str(element.get("label", "")))
+            scores.append(_float(element.get("score", 1.0)) or 0.0)
+        return cls(coords, labels, scores, input_size, frame)
+
+    @classmethod
+    def from_response(cls, response: str, input_height: int, input_width: int, frame=None):
+        """由模型输出文本（及其模型输入尺寸）构造，坐标位于模型输入坐标系。"""
+        return cls.from_elements(parse_grounding_output(response), (input_height, input_width), frame)
+
+    def _with(self, coords, index=None, input_size=None):
+        """以新的坐标（以及可选的子集下标）构造同类型的对象，其余属性沿用。"""
+        labels = self.labels if index is None else [self.labels[i] for i in index]
+        scores = self.scores if index is None else self.scores[index]
+        return type(self)(coords, labels, scores, input_size, self.frame)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, index):
+        """按下标、切片、下标数组或布尔掩码取子集，结果仍是同类型的对象。"""
+        index = np.arange(len(self))[index]
+        index = np.atleast_1d(index)
+        return self._with(self.coords[index], index.tolist(), self.input_size)
+
+    def __repr__(self):
+        space = f"input {self.input_size[1]}x{self.input_size[0]}" if self.input_size else "pixels"
+        return f"{type(self).__name__}({len(self)} items, {space})"
+
+    def _frame_size(self, size):
+        if size is not None:
+            return size
+        if self.frame is None:
+            raise ValueError("没有来源帧，必须指定原图尺寸")
+        return self.frame.size
+
+    def _scale(self, scale_x: float, scale_y: float) -> np.ndarray:
+        return np.tile([scale_x, scale_y], self._WIDTH // 2)
+
+    def to_pixels(self, size=None, offset=(0, 0)):
+        """
+        模型输入坐标系 -> 原图像素坐标系（反归一化）。
+
+        Args:
+            size (tuple, optional): 模型输入所对应的图像区域的 (宽, 高)；默认为来源帧的尺寸。
+                结果来自裁剪区域（分块、放大、局部重新枚举）时传入裁剪区域的尺寸。
+            offset (tuple, optional): 该区域在原图中的左上角，坐标平移到整张原图。
+        """
+        if self.input_size is None:
+            return self
+        width, height = self._frame_size(size)
+        input_height, input_width = self.input_size
+        coords = self.coords * self._scale(width / input_width, height / input_height) + np.tile(offset, self._WIDTH // 2)
+        return self._with(coords)
+
+    def to_input(self, input_height: int, input_width: int, size=None):
+        """原图像素坐标系 -> 模型输入坐标系（归一化）。已位于模型输入坐标系时先换算回原图。"""
+        width, height = self._frame_size(size)
+        pixels = self.to_pixels(size)
+        coords = pixels.coords * self._scale(input_width / width, input_height / height)
+        return self._with(coords, input_size=(input_height, input_width))
+
+    def to_elements(self) -> list[dict]:
+        """转换为模型输出格式的元素列表，坐标取整。"""
+        rounded = np.rint(self.coords).astype(np.int64).tolist()
+        return [{self._KEY: coords, "label": label} for coords, label in zip(rounded, self.labels)]
+
+    def to_json(self) -> str:
+        """与模型输出格式相同的 JSON 文本，可写入结果缓存或交给 `plot_bounding_boxes`。"""
+        return json.dumps(self.to_elements(), ensure_ascii=False)
+
+
+class BoxSet(_CoordinateSet):
+    """
+    一组边界框，坐标存放在形如 (N, 4) 的 [x1, y1, x2, y2] 数组中（构造时统一为左上、右下）。
+
+    Args:
+        coords: (N, 4) 坐标。
+        labels (list[str], optional): 标签。
+        scores (optional): 长度为 N 的得分，默认全为 1。
+        input_size (tuple, optional): (输入高度, 输入宽度)；为 None 表示坐标位于原图像素坐标系。
+        frame (Frame | str | Image.Image, optional): 来源帧，`to_pixels` 默认换算到它的尺寸。
+    """
+
+    __slots__ = ()
+    _WIDTH = 4
+    _KEY = "bbox_2d"
+
+    def __init__(self, coords, labels=None, scores=None, input_size=None, frame=None):
+        super().__init__(coords, labels, scores, input_size, frame)
+        # 模型偶尔输出 x2 < x1，统一为左上、右下
+        xy = self.coords.reshape(-1, 2, 2)
+        self.coords = np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1)
+
+    @classmethod
+    def concat(cls, sets, input_size=None, frame=None) -> "BoxSet":
+        """拼接多组位于同一坐标系的边界框。"""
+        sets = list(sets)
+        if not sets:
+            return cls([], input_size=input_size, frame=frame)
+        return cls(
+            np.concatenate([s.coords for s in sets]),
+            [label for s in sets for label in s.labels],
+            np.concatenate([s.scores for s in sets]),
+            input_size if input_size is not None else sets[0].input_size,
+            frame if frame is not None else sets[0].frame,
+        )
+
+    @property
+    def centers(self) -> np.ndarray:
+        """形如 (N, 2) 的中心点坐标。"""
+        return (self.coords[:, :2] + self.coords[:, 2:]) / 2
+
+    @property
+    def areas(self) -> np.ndarray:
+        return (self.coords[:, 2] - self.coords[:, 0]) * (self.coords[:, 3] - self.coords[:, 1])
+
+    def center_points(self) -> "PointSet":
+        """各框的中心点，作为同一坐标系下的 `PointSet`。"""
+        return PointSet(self.centers, self.labels, self.scores, self.input_size, self.frame)
+
+    def iou(self, other: "BoxSet" = None) -> np.ndarray:
+        """与 `other`（默认为自身）两两之间的 IoU 矩阵。"""
+        return box_iou(self.coords, (other if other is not None else self).coords)
+
+    def nms(self, iou_threshold: float = 0.5) -> "BoxSet":
+        """按得分做非极大值抑制，返回保留下来的框（按得分从高到低）。"""
+        return self[nms(self.coords, self.scores, iou_threshold)]
+
+    def contains(self, points) -> np.ndarray:
+        """
+        包含关系矩阵：结果的 [i, j] 表示第 i 个框是否包含第 j 个点（含边界）。
+
+        Args:
+            points (PointSet | array-like): 同一坐标系下的点，形如 (M, 2)。
+        """
+        xy = points.coords if isinstance(points, PointSet) else np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = xy[None, :, 0], xy[None, :, 1]
+        c = self.coords
+        return (c[:, 0:1] <= x) & (x <= c[:, 2:3]) & (c[:, 1:2] <= y) & (y <= c[:, 3:4])
+
+    def containing(self, x: float, y: float) -> "BoxSet":
+        """包含点 (x, y) 的所有框。"""
+        return self[self.contains([[x, y]])[:, 0]]
+
+    def intersecting(self, region) -> "BoxSet":
+        """与区域 [x1, y1, x2, y2] 相交（含边界接触）的所有框。"""
+        x1, y1, x2, y2 = region
+        c = self.coords
+        return self[(c[:, 0] <= x2) & (x1 <= c[:, 2]) & (c[:, 1] <= y2) & (y1 <= c[:, 3])]
+
+    def centered_in(self, region) -> "BoxSet":
+        """中心点落在区域 [x1, y1, x2, y2] 内的所有框。"""
+        x1, y1, x2, y2 = region
+        cx, cy = self.centers.T
+        return self[(x1 <= cx) & (cx <= x2) & (y1 <= cy) & (cy <= y2)]
+
+
+class PointSet(_CoordinateSet):
+    """
+    一组坐标点，坐标存放在形如 (N, 2) 的 [x, y] 数组中。参数与 `BoxSet` 相同。
+    """
+
+    __slots__ = ()
+    _WIDTH = 2
+    _KEY = "point_2d"
+
+    def inside(self, boxes: BoxSet) -> np.ndarray:
+        """结果的 [j] 表示第 j 个点是否落在任一框内。"""
+        return boxes.contains(self).any(axis=0)
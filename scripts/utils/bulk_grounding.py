@@ -0,0 +1,317 @@
+"""
+本模块实现离线批量定位：对成千上万张截图 x 指令列表执行定位，结果以 JSONL 流式写出。
+
+流水线分为三段，彼此重叠执行：
+1. 预取：`workers` 个线程按清单顺序提前解码截图，并运行处理器的图像预处理（缩放、归一化、切分 patch），
+   结果暂存在 `PrefetchBuffer`（见 `preprocess_cache`）中。它实现了 `PreprocessCache` 的 `get`/`put` 接口，
+   `inference_batch` 通过 `preprocess_cache` 参数直接取用，模型线程不再解码或预处理任何图像。
+2. 推理：按 `batch_size` 把记录合并到一次 `inference_batch` 调用中。
+3. 写出：每批完成后立即追加到输出 JSONL 并落盘；一批结束后其预处理结果即被释放，内存占用只与预取窗口有关。
+
+分片与续跑：
+- 记录按 id 的 CRC32 分配到 `num_shards` 个分片，各进程（或各 GPU）只处理自己的分片，写入各自的输出文件。
+- 输出文件中已有成功结果的 id 会被跳过；写到一半被中断的最后一行会被截掉。失败的记录（带 "error" 字段）在下次运行时重试。
+
+预取耗时（模型等待图像的时间）与推理耗时分别统计：前者接近 0 说明瓶颈已在模型上，增加预取线程不再有收益。
+"""
+
+import csv
+import glob
+import json
+import logging
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from . import telemetry
+from .frames import Frame
+from .grounding_utils import inference_batch
+from .model_client import is_remote_model
+from .preprocess_cache import PrefetchBuffer
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.bmp", "*.webp")
+
+
+class BulkRecord(NamedTuple):
+    """清单中的一条定位任务。"""
+    id: str
+    image: str
+    instruction: str
+    expected_boxes: int = None
+
+
+def _record(image: str, instruction: str, record_id: str = None, expected_boxes=None) -> BulkRecord:
+    expected = int(expected_boxes) if expected_boxes not in (None, "") else None
+    return BulkRecord(record_id or f"{image}\t{instruction}", image, instruction, expected)
+
+
+def load_manifest(path: str, image_root: str = None) -> list[BulkRecord]:
+    """
+    读取 (截图, 指令) 清单。
+
+    支持两种格式：
+    - JSONL：每行 {"image": ..., "instruction": ..., "id": 可选, "expected_boxes": 可选}。
+    - CSV / TSV：表头包含 image、instruction 列，可选 id、expected_boxes 列。
+
+    Args:
+        path (str): 清单文件路径。
+        image_root (str, optional): 相对图像路径的根目录；为 None 时相对于当前工作目录。
+
+    Returns:
+        list[BulkRecord]: 按清单顺序排列的记录。id 缺省为 "清单中的图像路径\\t指令"。
+    """
+    def resolve(image):
+        return os.path.join(image_root, image) if image_root and not os.path.isabs(image) else image
+
+    records = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith((".csv", ".tsv")):
+            rows = csv.DictReader(f, delimiter="\t" if path.endswith(".tsv") else ",")
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for n, row in enumerate(rows, 1):
+            if not row.get("image") or not row.get("instruction"):
+                raise ValueError(f"清单第 {n} 条记录缺少 image 或 instruction: {row}")
+            # 缺省 id 使用清单中的原始路径：更换 image_root 后续跑与分片结果不变
+            record_id = row.get("id") or f"{row['image']}\t{row['instruction']}"
+            records.append(_record(resolve(row["image"]), row["instruction"], record_id, row.get("expected_boxes")))
+    return records
+
+
+def manifest_from_directory(directory: str, instructions: list, patterns=IMAGE_PATTERNS) -> list[BulkRecord]:
+    """目录中的每张截图与每条指令组成一条记录（截图按文件名排序）。"""
+    images = sorted({path for pattern in patterns for path in glob.glob(os.path.join(directory, "**", pattern),
+                                                                          recursive=True)})
+    return [_record(image, instruction) for image in images for instruction in instructions]
+
+
+def shard_records(records: list, shard_index: int = 0, num_shards: int = 1) -> list:
+    """按 id 的 CRC32 取模分片：与记录顺序、进程无关，同一条记录总是落在同一个分片中。"""
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"分片下标越界: {shard_index} / {num_shards}")
+    if num_shards == 1:
+        return list(records)
+    return [r for r in records if zlib.crc32(r.id.encode("utf-8")) % num_shards == shard_index]
+
+
+def shard_output_path(path: str, shard_index: int = 0, num_shards: int = 1) -> str:
+    """多分片时每个分片写入各自的文件，例如 results.jsonl -> results.shard01-of-04.jsonl。"""
+    if num_shards == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard_index:02d}-of-{num_shards:02d}{ext or '.jsonl'}"
+
+
+def completed_ids(path: str) -> set:
+    """
+    读取已有的输出文件，返回已成功完成的记录 id。
+
+    上次运行在写某一行时被中断的话，文件末尾会留下不完整的一行：该行被截掉，之后的追加从完整的行边界开始。
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning("[续跑] 输出文件末尾有不完整的一行 (%d 字节)，已截掉。", len(data) - end)
+            f.truncate(end)
+
+    done = set()
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            result = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        # 同一 id 可能出现多次（失败后重试成功），以最后一次为准
+        if result.get("error"):
+            done.discard(result.get("id"))
+        else:
+            done.add(result.get("id"))
+    return done
+
+
+def _prefetch(record: BulkRecord, processor, buffer: PrefetchBuffer, min_pixels, max_pixels):
+    """
+    预取线程中执行：解码截图并完成图像预处理。
+
+    Returns:
+        tuple[Frame, str | None]: (截图帧, 预处理结果在 buffer 中的键)；使用推理服务时不在本地预处理，键为 None。
+    """
+    frame = Frame(record.image)
+    if processor is None:
+        # 推理服务按路径读取截图；这里只读取文件头，提前发现不存在或无法识别的文件
+        frame.size
+        return frame, None
+    return frame, buffer.prepare(frame, processor.image_processor, min_pixels, max_pixels)
+
+
+class _ResultWriter:
+    """以追加方式写出 JSONL，每批结束后落盘。"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, results: list):
+        for result in results:
+            self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _result(record: BulkRecord, frame, output=None, error=None) -> dict:
+    from .boxes import BoxSet
+
+    result = {"id": record.id, "image": record.image, "instruction": record.instruction}
+    if error is not None:
+        result["error"] = error
+        return result
+    response, input_height, input_width = output
+    boxes = BoxSet.from_response(response, input_height, input_width).to_pixels(frame.size)
+    result.update(
+        response=response, input_height=input_height, input_width=input_width,
+        boxes=boxes.to_elements(), image_size=list(frame.size),
+    )
+    return result
+
+
+@telemetry.traced("bulk_grounding")
+def run_bulk_grounding(
+    model,
+    processor,
+    records: list,
+    output_path: str,
+    prompt_template: str,
+    system_prompt: str,
+    batch_size: int = 8,
+    workers: int = 4,
+    prefetch_batches: int = 2,
+    max_new_tokens: int = 256,
+    expected_boxes: int = None,
+    min_pixels: int = None,
+    max_pixels: int = None,
+    resume: bool = True,
+    progress_every: int = 100,
+) -> dict:
+    """
+    批量执行定位，结果按完成顺序追加写入 `output_path`。
+
+    Args:
+        model: 已加载的VLLM模型（或推理服务客户端）。
+        processor: 对应的处理器（使用推理服务时为 None，此时预取线程只校验截图）。
+        records (list[BulkRecord]): 本进程要处理的记录（已分片）。
+        output_path (str): 输出 JSONL 路径。
+        prompt_template (str): 定位提示模板（含 `{instruction}`）。
+        system_prompt (str): 系统提示。
+        batch_size (int): 每次 `generate` 调用处理的记录数。
+        workers (int): 预取线程数。
+        prefetch_batches (int): 预取窗口：最多提前准备多少批的记录。
+        max_new_tokens (int): 每条记录生成的最大 token 数。
+        expected_boxes (int, optional): 默认的期望边界框数（启用早停）；记录中的 `expected_boxes` 优先。
+        min_pixels, max_pixels (int, optional): 图像像素预算，见 `resize_to_pixel_budget`。
+        resume (bool): 是否跳过输出文件中已成功完成的记录。
+        progress_every (int): 每处理多少条记录输出一次进度。
+
+    Returns:
+        dict: {"total", "skipped", "completed", "failed", "elapsed_s", "records_per_s",
+               "prefetch_wait_s", "inference_s"}。
+    """
+    done = completed_ids(output_path) if resume else set()
+    todo = [r for r in records if r.id not in done]
+    if not resume and os.path.exists(output_path):
+        open(output_path, "w").close()
+    skipped = len(records) - len(todo)
+    if skipped:
+        logger.info("[续跑] %d 条记录已在之前的运行中完成，跳过。", skipped)
+
+    local_processor = None if is_remote_model(model) else processor
+    buffer = PrefetchBuffer()
+    writer = _ResultWriter(output_path)
+    stats = {"total": len(records), "skipped": skipped, "completed": 0, "failed": 0,
+             "prefetch_wait_s": 0.0, "inference_s": 0.0}
+    started = time.perf_counter()
+
+    window = deque()
+    pending = iter(todo)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bulk-prefetch") as pool:
+            def fill():
+                # 预取窗口：保持最多 prefetch_batches + 1 批的记录在准备中或已准备好
+                while len(window) < batch_size * (prefetch_batches + 1):
+                    record = next(pending, None)
+                    if record is None:
+                        return
+                    window.append((record, pool.submit(
+                        _prefetch, record, local_processor, buffer, min_pixels, max_pixels
+                    )))
+
+            fill()
+            while window:
+                batch = [window.popleft() for _ in range(min(batch_size, len(window)))]
+                fill()
+
+                # 1. 取出本批的预取结果；模型在这里等待的时间即为预取不足的开销
+                wait_started = time.perf_counter()
+                ready, results, keys = [], [], []
+                for record, future in batch:
+                    try:
+                        frame, key = future.result()
+                    except Exception as e:
+                        results.append(_result(record, None, error=f"{type(e).__name__}: {e}"))
+                        continue
+                    ready.append((record, frame))
+                    if key is not None:
+                        keys.append(key)
+                stats["prefetch_wait_s"] += time.perf_counter() - wait_started
+
+                # 2. 一次 generate 完成整批推理
+                if ready:
+                    jobs = [(frame, prompt_template.format(instruction=record.instruction), system_prompt)
+                            for record, frame in ready]
+                    expected = [record.expected_boxes or expected_boxes for record, _ in ready]
+                    infer_started = time.perf_counter()
+                    try:
+                        outputs = inference_batch(
+                            model, processor, jobs, max_new_tokens=max_new_tokens,
+                            expected_boxes=expected if any(e is not None for e in expected) else None,
+                            min_pixels=min_pixels, max_pixels=max_pixels,
+                            preprocess_cache=buffer if local_processor is not None else None,
+                        )
+                        results.extend(_result(record, frame, output) for (record, frame), output in zip(ready, outputs))
+                    except Exception as e:
+                        logger.exception("[批量定位] 一批 %d 条记录推理失败", len(ready))
+                        results.extend(_result(record, frame, error=f"{type(e).__name__}: {e}") for record, frame in ready)
+                    stats["inference_s"] += time.perf_counter() - infer_started
+                    buffer.release(keys)
+
+                # 3. 立即写出
+                writer.write(results)
+                failed = sum(1 for r in results if "error" in r)
+                stats["failed"] += failed
+                stats["completed"] += len(results) - failed
+                telemetry.count("bulk_grounding_records", value=len(results) - failed, result="ok")
+                telemetry.count("bulk_grounding_records", value=failed, result="error")
+
+                processed = stats["completed"] + stats["failed"]
+                if progress_every and (processed // progress_every) != ((processed - len(results)) // progress_every):
+                    elapsed = time.perf_counter() - started
+                    logger.info("[批量定位] %d/%d 条, %.2f 条/秒, 预取等待 %.1fs, 推理 %.1fs",
+                                processed, len(todo), processed / elapsed, stats["prefetch_wait_s"], stats["inference_s"])
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    processed = stats["completed"] + stats["failed"]
+    stats.update(elapsed_s=elapsed, records_per_s=processed / elapsed if elapsed > 0 else 0.0)
+    return stats
@@ -0,0 +1,517 @@
+"""
+本模块提供控制 `model.generate` 解码过程的工具。
+
+定位任务的答案（如 `[{"bbox_2d": [...], "label": "..."}]`）在几十个 token 后就已完整，
+但默认的生成会一直持续到 EOS 或 `max_new_tokens`。`JsonCompletionStoppingCriteria`
+在生成过程中跟踪 JSON 的括号与字符串状态，一旦产生了期望数量的完整 `bbox_2d` 对象就停止解码，
+并统计每个请求最多节省的 token 数（相对于解码到 `max_new_tokens` 的上界，模型本身也可能很快输出 EOS）。
+
+`BboxJsonLogitsProcessor` 则更进一步：按边界框（或坐标点）JSON 的语法约束每一步可选的 token，
+保证输出总是可以直接解析的规范 JSON，且坐标均为整数。
+
+`FirstTokenTimer` 不改变解码结果，只记录首 token 延迟，供遥测使用（见 `telemetry.py`）。
+"""
+
+import time
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+# 括号配对表
+_CLOSERS = {"[": "]", "{": "}"}
+# 点定位模式下一个坐标点元素的结束标记
+_POINTS_CLOSE = "</points>"
+# 标记一个对象为定位结果的键
+_LOCATION_KEYS = ("bbox_2d", "point_2d")
+
+
+class JsonStateTracker:
+    """
+    增量跟踪模型输出中 JSON 的结构状态。
+
+    逐字符消费生成的文本，记录括号栈、是否位于字符串内部，以及已经闭合的 `bbox_2d`（或 `point_2d`）对象数量。
+    在遇到第一个 `[` 或 `{` 之前的文本（如 Markdown 代码块标记、前导说明文字）会被忽略。
+    最外层结构闭合时，只有其中出现过定位对象才视为结束；说明文字中的 `[...]` 等结构被丢弃，继续向后查找。
+    """
+
+    def __init__(self):
+        self.stack = []            # 尚未闭合的括号
+        self.bbox_flags = []       # 与 stack 中每个 '{' 对应：该对象是否包含 bbox_2d / point_2d 键
+        self.in_string = None      # 当前所在字符串的引号字符；不在字符串内时为 None
+        self.escape = False
+        self.string_buffer = []
+        self.started = False
+        self.finished = False      # 最外层的 JSON 结构是否已闭合
+        self.completed_boxes = 0
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.finished:
+                return
+            self._feed_char(ch)
+
+    def _feed_char(self, ch: str):
+        if self.in_string is not None:
+            if self.escape:
+                self.escape = False
+                self.string_buffer.append(ch)
+            elif ch == "\\":
+                self.escape = True
+            elif ch == self.in_string:
+                # 字符串结束：若这是对象中的 "bbox_2d" / "point_2d" 键，则标记当前对象
+                if "".join(self.string_buffer) in _LOCATION_KEYS and self.stack and self.stack[-1] == "{":
+                    self.bbox_flags[-1] = True
+                self.in_string = None
+            else:
+                self.string_buffer.append(ch)
+            return
+
+        if not self.started:
+            if ch in _CLOSERS:
+                self.started = True
+            else:
+                return
+
+        if ch in ('"', "'"):
+            self.in_string = ch
+            self.string_buffer = []
+        elif ch in _CLOSERS:
+            self.stack.append(ch)
+            if ch == "{":
+                self.bbox_flags.append(False)
+        elif ch in ("]", "}"):
+            if not self.stack or _CLOSERS[self.stack[-1]] != ch:
+                # 括号不匹配，说明并非合法 JSON，不再据此做判断
+                return
+            opener = self.stack.pop()
+            if opener == "{" and self.bbox_flags.pop():
+                self.completed_boxes += 1
+            if not self.stack:
+                if self.completed_boxes:
+                    self.finished = True
+                else:
+                    # 不含定位对象的结构（如说明文字中的 [1]）：丢弃，等待下一个结构
+                    self.started = False
+
+    def closing_suffix(self) -> str:
+        """返回补全当前未闭合结构所需的括号（不在字符串内时有效）。"""
+        if self.in_string is not None:
+            return ""
+        return "".join(_CLOSERS[opener] for opener in reversed(self.stack))
+
+
+class JsonCompletionStoppingCriteria(StoppingCriteria):
+    """
+    当输出中出现期望数量的完整 `bbox_2d` 对象（或点定位模式下的 `<points>` 元素），
+    或最外层 JSON 结构闭合时停止生成。
+
+    Args:
+        tokenizer: 用于把新生成的 token 解码为文本的分词器。
+        expected_boxes (int | list[int]): 期望的边界框/坐标点元素数量；按批次中的每一行分别指定时传入列表。
+            为 None 的行只在最外层 JSON 闭合时停止。
+        max_new_tokens (int): 本次生成的 `max_new_tokens`，用于计算最多节省的 token 数。
+    """
+
+    def __init__(self, tokenizer, expected_boxes, max_new_tokens: int):
+        self.tokenizer = tokenizer
+        self.expected_boxes = expected_boxes
+        self.max_new_tokens = max_new_tokens
+        self.prompt_length = None
+        self.trackers = []
+        self.stopped_at = []       # 每一行被本准则停止时已生成的 token 数；未被停止为 None
+        self._consumed = []
+        self._points_closed = []   # 每一行已闭合的 <points> 元素数量
+        self._tails = []           # 每一行上一段文本的末尾，用于识别跨 token 的 </points>
+
+    def _expected_for(self, row: int):
+        if isinstance(self.expected_boxes, (list, tuple)):
+            return self.expected_boxes[row]
+        return self.expected_boxes
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        batch_size, cur_len = input_ids.shape
+        if self.prompt_length is None:
+            # 第一次调用发生在第一个新 token 追加之后
+            self.prompt_length = cur_len - 1
+            self.trackers = [JsonStateTracker() for _ in range(batch_size)]
+            self.stopped_at = [None] * batch_size
+            self._consumed = [self.prompt_length] * batch_size
+            self._points_closed = [0] * batch_size
+            self._tails = [""] * batch_size
+
+        done = torch.zeros(batch_size, dtype=torch.bool, device=input_ids.device)
+        for row in range(batch_size):
+            if self.stopped_at[row] is not None:
+                done[row] = True
+                continue
+
+            # 只解码上次调用之后新增的 token；结构字符均为 ASCII，逐段解码不会破坏判断
+            new_ids = input_ids[row, self._consumed[row]:cur_len]
+            self._consumed[row] = cur_len
+            tracker = self.trackers[row]
+            text = self.tokenizer.decode(new_ids, skip_special_tokens=True)
+            tracker.feed(text)
+
+            window = self._tails[row] + text
+            self._points_closed[row] += window.count(_POINTS_CLOSE)
+            self._tails[row] = window[-(len(_POINTS_CLOSE) - 1):]
+
+            expected = self._expected_for(row)
+            completed = tracker.completed_boxes + self._points_closed[row]
+            if tracker.finished or (expected is not None and completed >= expected):
+                self.stopped_at[row] = cur_len - self.prompt_length
+                done[row] = True
+        return done
+
+    def closing_suffix(self, row: int) -> str:
+        """被提前停止的行需要补全的括号，使输出保持为完整的 JSON。"""
+        if row >= len(self.stopped_at) or self.stopped_at[row] is None:
+            return ""
+        return self.trackers[row].closing_suffix()
+
+    def early_stopped(self, row: int) -> bool:
+        """该行是否在达到 `max_new_tokens` 之前被本准则停止。"""
+        return row < len(self.stopped_at) and self.stopped_at[row] is not None and \
+            self.stopped_at[row] < self.max_new_tokens
+
+    def max_tokens_saved(self, row: int) -> int:
+        """
+        该行最多节省的 token 数：相对于解码到 `max_new_tokens` 的上界；未被提前停止时为 0。
+        不早停时模型通常会在补全 JSON 后很快输出 EOS，实际节省的只是闭合括号与 EOS 之间的少量 token，
+        准确的数值需要与同一请求不早停时的 `generated_tokens` 对比。
+        """
+        if not self.early_stopped(row):
+            return 0
+        return self.max_new_tokens - self.stopped_at[row]
+
+
+# --- 约束解码 ---
+
+# 约束解码支持的几何类型：名称 -> (坐标字段名, 坐标个数)
+GEOMETRIES = {"box": ("bbox_2d", 4), "point": ("point_2d", 2)}
+
+
+def _literals(key: str) -> dict:
+    """
+    规范化的定位 JSON 由以下固定片段拼接而成（以边界框为例）：
+        [{"bbox_2d": [x1, y1, x2, y2], "label": "..."}, {"bbox_2d": [...], "label": "..."}]
+    """
+    return {
+        "open": '[{"%s": [' % key,
+        "next": ', {"%s": [' % key,
+        "sep": ", ",
+        "label": '], "label": "',
+        "obj_end": '"}',
+    }
+
+
+# 语法状态的阶段。状态统一表示为 (阶段, 字面量名, 计数, 坐标序号, 已完成框数)
+_PHASE_LITERAL = 0   # 正在输出固定片段，计数为片段内偏移
+_PHASE_INT = 1       # 正在输出整数坐标，计数为已输出的位数
+_PHASE_STRING = 2    # 正在输出 label 字符串，计数为已输出的字符数
+_PHASE_CHOICE = 3    # 一个对象刚结束：继续下一个对象，或结束数组
+_PHASE_DONE = 4      # 数组已闭合，只允许 EOS
+
+_DIGITS = "0123456789"
+
+
+class BboxJsonGrammar:
+    """
+    边界框（或坐标点）JSON 的字符级语法自动机。
+
+    只接受规范格式 `[{"bbox_2d": [x1, y1, x2, y2], "label": "..."}, ...]`
+    （`geometry="point"` 时为 `[{"point_2d": [x, y], "label": "..."}, ...]`）：
+    坐标必须是整数，label 不允许转义字符和控制字符，不允许 Markdown 代码块或多余的说明文字。
+
+    Args:
+        max_boxes (int, optional): 最多允许输出的元素数量；达到后只能闭合数组。
+        max_digits (int): 每个坐标最多的位数。
+        max_label_chars (int): label 的最大字符数；达到后只能闭合字符串。
+        geometry (str): "box"（边界框）或 "point"（坐标点），见 `GEOMETRIES`。
+    """
+
+    def __init__(self, max_boxes: int = None, max_digits: int = 5, max_label_chars: int = 48,
+                 geometry: str = "box"):
+        if geometry not in GEOMETRIES:
+            raise ValueError(f"未知的几何类型: {geometry}")
+        key, size = GEOMETRIES[geometry]
+        self.max_boxes = max_boxes
+        self.max_digits = max_digits
+        self.max_label_chars = max_label_chars
+        self.geometry = geometry
+        self._literals = _literals(key)
+        self._last_coord = size - 1
+
+    def initial_state(self):
+        return (_PHASE_LITERAL, "open", 0, 0, 0)
+
+    def advance(self, state, ch: str):
+        """消费一个字符，返回新状态；字符不合法时返回 None。"""
+        phase, literal, count, coord, boxes = state
+
+        if phase == _PHASE_LITERAL:
+            text = self._literals[literal]
+            if ch != text[count]:
+                return None
+            if count + 1 < len(text):
+                return (phase, literal, count + 1, coord, boxes)
+            return self._after_literal(literal, coord, boxes)
+
+        if phase == _PHASE_INT:
+            if ch in _DIGITS and count < self.max_digits:
+                return (phase, None, count + 1, coord, boxes)
+            if count > 0 and coord < self._last_coord and ch == ",":
+                return (_PHASE_LITERAL, "sep", 1, coord, boxes)
+            if count > 0 and coord == self._last_coord and ch == "]":
+                return (_PHASE_LITERAL, "label", 1, coord, boxes)
+            return None
+
+        if phase == _PHASE_STRING:
+            if ch == '"':
+                return (_PHASE_LITERAL, "obj_end", 1, 0, boxes)
+            if ch == "\\" or ord(ch) < 0x20 or count >= self.max_label_chars:
+                return None
+            return (phase, None, count + 1, 0, boxes)
+
+        if phase == _PHASE_CHOICE:
+            if ch == "," and (self.max_boxes is None or boxes < self.max_boxes):
+                return (_PHASE_LITERAL, "next", 1, 0, boxes)
+            if ch == "]":
+                return (_PHASE_DONE, None, 0, 0, boxes)
+            return None
+
+        return None
+
+    def _after_literal(self, literal, coord, boxes):
+        if literal in ("open", "next"):
+            return (_PHASE_INT, None, 0, 0, boxes)
+        if literal == "sep":
+            return (_PHASE_INT, None, 0, coord + 1, boxes)
+        if literal == "label":
+            return (_PHASE_STRING, None, 0, 0, boxes)
+        # obj_end
+        return (_PHASE_CHOICE, None, 0, 0, boxes + 1)
+
+    def consume(self, state, text: str):
+        """消费一段文本，任意字符不合法时返回 None。"""
+        for ch in text:
+            state = self.advance(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def continuations(self, state) -> list:
+        """
+        列出当前状态下合法的"下一段文本"的开头，用于从词表中快速筛选候选 token。
+        `_DIGITS` 表示任意一位数字。
+        """
+        phase, literal, count, coord, boxes = state
+        if phase == _PHASE_LITERAL:
+            return [self._literals[literal][count:]]
+        if phase == _PHASE_INT:
+            options = [_DIGITS] if count < self.max_digits else []
+            if count > 0:
+                options.append(self._literals["sep"] if coord < self._last_coord else self._literals["label"])
+            return options
+        if phase == _PHASE_CHOICE:
+            options = ["]"]
+            if self.max_boxes is None or boxes < self.max_boxes:
+                options.append(self._literals["next"])
+            return options
+        return []
+
+    def memo_key(self, state):
+        """
+        只保留影响合法 token 集合的状态分量，使不同对象中的相同位置共享缓存。
+        未限制框数时，已完成框数不影响合法性（一个 token 可能跨越对象边界，限制框数时则必须保留）。
+        """
+        phase, literal, count, coord, boxes = state
+        if self.max_boxes is not None:
+            return (phase, literal, count, coord, min(boxes, self.max_boxes))
+        return (phase, literal, count, coord, 0)
+
+
+class _TokenVocabulary:
+    """
+    词表的文本索引：每个 token 解码后的字符串、按字符串排序的前缀查找表，以及 label 字符串内可直接放行的 token 掩码。
+    构建一次约需数秒，按分词器缓存复用。
+    """
+
+    def __init__(self, tokenizer):
+        import bisect
+        self._bisect = bisect
+
+        vocab_size = len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}).keys())
+        texts = tokenizer.batch_decode([[i] for i in range(vocab_size)], clean_up_tokenization_spaces=False)
+
+        self.vocab_size = vocab_size
+        self.texts = [None if i in special_ids or not text else text for i, text in enumerate(texts)]
+
+        pairs = sorted((text, i) for i, text in enumerate(self.texts) if text is not None)
+        self._sorted_texts = [text for text, _ in pairs]
+        self._sorted_ids = [i for _, i in pairs]
+        self._exact = {}
+        for text, i in pairs:
+            self._exact.setdefault(text, []).append(i)
+
+        # label 字符串内部：不含引号、反斜杠和控制字符的 token 总是合法（只受长度限制）
+        self.plain_string_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        self.lengths = torch.full((vocab_size,), 1 << 30, dtype=torch.long)
+        self.quote_ids = []
+        for i, text in enumerate(self.texts):
+            if text is None or "\\" in text or any(ord(ch) < 0x20 for ch in text):
+                continue
+            if '"' in text:
+                self.quote_ids.append(i)
+            else:
+                self.plain_string_mask[i] = True
+                self.lengths[i] = len(text)
+
+    def starting_with(self, prefix: str) -> list:
+        """返回文本以 `prefix` 开头的所有 token。"""
+        start = self._bisect.bisect_left(self._sorted_texts, prefix)
+        ids = []
+        for j in range(start, len(self._sorted_texts)):
+            if not self._sorted_texts[j].startswith(prefix):
+                break
+            ids.append(self._sorted_ids[j])
+        return ids
+
+    def prefixes_of(self, text: str) -> list:
+        """返回文本恰好是 `text` 某个前缀的所有 token。"""
+        ids = []
+        for k in range(1, len(text) + 1):
+            ids.extend(self._exact.get(text[:k], ()))
+        return ids
+
+
+_VOCABULARY_CACHE = {}
+
+
+def _get_vocabulary(tokenizer) -> _TokenVocabulary:
+    key = id(tokenizer)
+    if key not in _VOCABULARY_CACHE:
+        _VOCABULARY_CACHE[key] = _TokenVocabulary(tokenizer)
+    return _VOCABULARY_CACHE[key]
+
+
+class BboxJsonLogitsProcessor(LogitsProcessor):
+    """
+    由边界框（或坐标点）JSON 语法驱动的 logits 处理器：每一步只保留能使输出继续合法的 token。
+
+    生成结果必然是可以被 `json.loads` 直接解析的规范 JSON，坐标均为整数，
+    模型不会再输出 Markdown 代码块或说明文字，因此也不再需要容错解析和重试。
+
+    Args:
+        tokenizer: 模型的分词器。
+        eos_token_ids (int | list[int]): 数组闭合后允许输出的结束 token。
+        max_boxes (int | list, optional): 最多输出的元素数量；按批次中的每一行分别指定时传入列表。
+        max_label_chars (int): label 的最大字符数。
+        geometry (str): "box" 约束为边界框 JSON，"point" 约束为坐标点 JSON（见 `BboxJsonGrammar`）。
+    """
+
+    def __init__(self, tokenizer, eos_token_ids, max_boxes=None, max_label_chars: int = 48,
+                 geometry: str = "box"):
+        self.vocabulary = _get_vocabulary(tokenizer)
+        if isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        self.eos_token_ids = list(eos_token_ids)
+        self.max_boxes = max_boxes
+        self.max_label_chars = max_label_chars
+        self.geometry = geometry
+
+        self._grammars = {}
+        self._masks = {}
+        self.states = None
+        self._consumed = None
+
+    def _grammar_for(self, row: int) -> BboxJsonGrammar:
+        max_boxes = self.max_boxes[row] if isinstance(self.max_boxes, (list, tuple)) else self.max_boxes
+        if max_boxes not in self._grammars:
+            self._grammars[max_boxes] = BboxJsonGrammar(
+                max_boxes=max_boxes, max_label_chars=self.max_label_chars, geometry=self.geometry
+            )
+        return self._grammars[max_boxes]
+
+    def _allowed_mask(self, grammar: BboxJsonGrammar, state) -> torch.Tensor:
+        key = (grammar.max_boxes, grammar.memo_key(state))
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+
+        vocab = self.vocabulary
+        mask = torch.zeros(vocab.vocab_size, dtype=torch.bool)
+        phase = state[0]
+        if phase == _PHASE_STRING:
+            remaining = grammar.max_label_chars - state[2]
+            mask |= vocab.plain_string_mask & (vocab.lengths <= remaining)
+            candidates = vocab.quote_ids
+        elif phase == _PHASE_DONE:
+            candidates = []
+            mask[self.eos_token_ids] = True
+        else:
+            candidates = set()
+            for option in grammar.continuations(state):
+                if option == _DIGITS:
+                    for digit in _DIGITS:
+                        candidates.update(vocab.starting_with(digit))
+                else:
+                    candidates.update(vocab.prefixes_of(option))
+                    candidates.update(vocab.starting_with(option))
+
+        for token_id in candidates:
+            if grammar.consume(state, vocab.texts[token_id]) is not None:
+                mask[token_id] = True
+
+        self._masks[key] = mask
+        return mask
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        batch_size, cur_len = input_ids.shape
+        if self.states is None:
+            # 第一次调用时输入只包含提示部分
+            self.states = [self._grammar_for(row).initial_state() for row in range(batch_size)]
+            self._consumed = [cur_len] * batch_size
+
+        allowed = torch.zeros(scores.shape, dtype=torch.bool)
+        for row in range(batch_size):
+            grammar = self._grammar_for(row)
+            state = self.states[row]
+            for token_id in input_ids[row, self._consumed[row]:cur_len].tolist():
+                text = self.vocabulary.texts[token_id] if token_id < self.vocabulary.vocab_size else None
+                # EOS / padding 等特殊 token 不改变语法状态
+                if text is not None and state is not None:
+                    state = grammar.consume(state, text)
+            self._consumed[row] = cur_len
+            self.states[row] = state
+
+            if state is None:
+                # 理论上不会发生：所有生成的 token 都经过了约束。兜底只允许结束。
+                allowed[row, self.eos_token_ids] = True
+            else:
+                mask = self._allowed_mask(grammar, state)
+                allowed[row, :mask.shape[0]] = mask
+
+        return scores.masked_fill(~allowed.to(scores.device), float("-inf"))
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """
+    记录首 token 延迟 (TTFT) 的 logits 处理器，不修改 scores。
+
+    `generate` 在预填充完成、得到第一个位置的 logits 后第一次调用 logits 处理器，
+    因此第一次调用的时刻减去开始时刻即为首 token 延迟。
+
+    Args:
+        start (float): 请求开始的 `time.perf_counter()` 时刻。
+    """
+
+    def __init__(self, start: float):
+        self.start = start
+        self.ttft_ms = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.perf_counter() - self.start) * 1000
+        return scores
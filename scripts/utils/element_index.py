@@ -0,0 +1,389 @@
+"""
+本模块实现屏幕元素索引，用于"解析一次、多次查找"的定位。
+
+在阶段三的计算器任务中，按钮布局从头到尾都不变，但每一步都要让模型从零开始定位一个按钮。
+元素索引把这些重复工作合并成一次：
+1. 枚举：对整张截图做一次全屏推理，让模型列出所有 UI 元素的边界框与可见文字。
+2. 建索引：规范化后的标签 -> 元素的映射，以及按网格划分的空间索引（按坐标或区域查询元素）。
+3. 查找：从指令中提取目标（例如 "点击按钮 '3'" 中的 "3"），按标签查找元素，取其中心点作为点击坐标。
+4. 校验：每个元素在建索引时保存一张所在区域的小缩略图；查找时与当前截图的同一区域比较，
+   区域内容发生变化（或截图尺寸改变）即视为屏幕已变化，回退到模型定位。
+
+查找不到、标签有歧义或区域已变化时返回 None，由调用方回退到逐步调用模型。
+配合 `frame_diff` 使用时，`invalidate` 移除变化区域中的元素，`refresh` 只对这些区域重新枚举，不必重做整张截图。
+"""
+
+import logging
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from PIL import ImageChops
+
+from . import telemetry
+from .boxes import BoxSet
+from .frames import as_frame
+from .grounding_utils import inference
+
+logger = logging.getLogger(__name__)
+
+ENUMERATE_SYSTEM_PROMPT = (
+    "You are a helpful assistant. Detect every UI element in the screenshot "
+    "and provide their bounding boxes in JSON format."
+)
+ENUMERATE_PROMPT = (
+    "List every button, input field, icon and text label in the screenshot. "
+    "Use the element's visible text as its label, or a short name if it has no text: "
+    "[{\"bbox_2d\": [x1, y1, x2, y2], \"label\": \"text\"}, ...]"
+)
+
+# 区域缩略图的边长，以及判定区域未变化的最大灰度差（0-255）。
+# 取最大值而不是平均值：大按钮里只变了几个字符时，平均差会被大片不变的背景稀释。
+_THUMB_SIZE = (16, 16)
+DEFAULT_TOLERANCE = 16
+
+# 指令中被引号括起来的目标文字，例如 "点击按钮 '3'"
+_QUOTED = re.compile(r"['\"“”‘’「」『』`]([^'\"“”‘’「」『』`]+)['\"“”‘’「」『』`]")
+# 标签与指令中不区分元素的通用词
+_FILLER = re.compile(
+    r"(点击|单击|双击|定位|找到|按下|按钮|按键|图标|的|"
+    r"\bclick\b|\blocate\b|\bpress\b|\bthe\b|\bbutton\b|\bicon\b|\bkey\b)"
+)
+
+
+def normalize_label(text: str) -> str:
+    """
+    标签规范化：全角转半角 (NFKC)、忽略大小写、去掉通用词与空白。
+    只剩下符号的标签（如 "+"、"="）保持原样。
+    """
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    stripped = _FILLER.sub(" ", text)
+    stripped = "".join(stripped.split()).strip("'\"`")
+    return stripped or "".join(text.split())
+
+
+def instruction_target(instruction: str) -> str:
+    """从指令中提取要查找的标签：优先取引号内的文字，否则取去掉通用词后的整条指令。"""
+    match = _QUOTED.search(unicodedata.normalize("NFKC", instruction))
+    if match:
+        return normalize_label(match.group(1))
+    return normalize_label(instruction)
+
+
+def _merge_boxes(boxes) -> list:
+    """把相交的矩形合并为外接矩形，直到两两不相交。"""
+    merged = []
+    for box in boxes:
+        box = tuple(box)
+        changed = True
+        while changed:
+            changed = False
+            for other in merged:
+                if other[0] < box[2] and box[0] < other[2] and other[1] < box[3] and box[1] < other[3]:
+                    merged.remove(other)
+                    box = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    changed = True
+                    break
+        merged.append(box)
+    return merged
+
+
+class IndexedElement:
+    """索引中的一个元素。`bbox` 位于模型输入坐标系（与模型输出一致）。"""
+    __slots__ = ("label", "key", "bbox", "thumbnail")
+
+    def __init__(self, label, key, bbox, thumbnail):
+        self.label = label
+        self.key = key
+        self.bbox = bbox
+        self.thumbnail = thumbnail
+
+    @property
+    def center(self) -> tuple:
+        x1, y1, x2, y2 = self.bbox
+        return (x1 + x2) / 2, (y1 + y2) / 2
+
+
+class ElementIndex:
+    """
+    一张截图上所有 UI 元素的标签索引与空间索引。
+
+    Args:
+        elements (BoxSet | list[dict]): 模型输出的边界框（`BoxSet`，或每项包含 "bbox_2d" 与 "label" 的元素列表）。
+        input_height (int): 模型处理图像时使用的高度（边界框所在的坐标系）。
+        input_width (int): 模型处理图像时使用的宽度。
+        frame (Frame | str | Image.Image): 建索引所用的截图，用于保存各元素区域的缩略图。
+        cell_size (int): 空间索引网格的边长（模型输入坐标系下的像素）。
+        tolerance (int): 区域校验时缩略图逐像素允许的最大灰度差。
+    """
+
+    def __init__(self, elements, input_height: int, input_width: int, frame, cell_size: int = 64,
+                 tolerance: int = DEFAULT_TOLERANCE):
+        frame = as_frame(frame)
+        self.input_height = input_height
+        self.input_width = input_width
+        self.image_size = frame.size
+        self.cell_size = cell_size
+        self.tolerance = tolerance
+
+        self.elements = []        # 被移除的元素留下 None，保持其余元素的下标不变
+        self._by_label = {}
+        self._grid = {}
+        self.pending_regions = []  # 已失效、等待重新枚举的区域（原图像素坐标系）
+        # 多个工作流步骤可能并发查找；局部更新期间（含模型调用）其他查找等待更新完成
+        self._lock = threading.RLock()
+        if not isinstance(elements, BoxSet):
+            elements = BoxSet.from_elements(elements, (input_height, input_width))
+        self._add_elements(elements, frame)
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @classmethod
+    def from_response(cls, response: str, input_height: int, input_width: int, frame, **kwargs) -> "ElementIndex":
+        """由全屏枚举的模型输出建立索引。"""
+        return cls(BoxSet.from_response(response, input_height, input_width, frame), input_height, input_width, frame,
+                   **kwargs)
+
+    def __len__(self):
+        return sum(1 for item in self.elements if item is not None)
+
+    def boxes(self) -> BoxSet:
+        """索引中现存的所有元素（模型输入坐标系）。"""
+        with self._lock:
+            items = [item for item in self.elements if item is not None]
+        return BoxSet([item.bbox for item in items], [item.label for item in items],
+                      input_size=(self.input_height, self.input_width))
+
+    # --- 建索引 ---
+
+    def _add_elements(self, boxes: BoxSet, frame, within=None) -> int:
+        """
+        把模型输入坐标系下的边界框加入索引，返回加入的数量。
+
+        Args:
+            within (tuple, optional): 只加入中心点落在该区域（索引坐标系）内的元素。
+        """
+        if within is not None:
+            boxes = boxes.centered_in(within)
+        rects = self._pixel_rects(boxes.coords)
+        for bbox, rect, label in zip(boxes.coords.tolist(), rects.tolist(), boxes.labels):
+            self._add(IndexedElement(label, normalize_label(label), tuple(bbox), self._thumbnail(frame, rect)))
+        return len(boxes)
+
+    def _remove(self, index: int):
+        item = self.elements[index]
+        self.elements[index] = None
+        if item.key:
+            indices = self._by_label[item.key]
+            indices.remove(index)
+            if not indices:
+                del self._by_label[item.key]
+        for cell in self._cells(item.bbox):
+            self._grid[cell].remove(index)
+
+    def _add(self, item: IndexedElement):
+        index = len(self.elements)
+        self.elements.append(item)
+        if item.key:
+            self._by_label.setdefault(item.key, []).append(index)
+        for cell in self._cells(item.bbox):
+            self._grid.setdefault(cell, []).append(index)
+
+    def _cells(self, bbox):
+        x1, y1, x2, y2 = bbox
+        size = self.cell_size
+        for cx in range(int(x1 // size), int(x2 // size) + 1):
+            for cy in range(int(y1 // size), int(y2 // size) + 1):
+                yield cx, cy
+
+    def _pixel_rects(self, coords) -> np.ndarray:
+        """
+        模型输入坐标系 -> 原图像素坐标系的整数矩形（形如 (N, 4)），裁剪到图像范围内且宽高至少为 1，
+        可直接用于 `Image.crop`。
+        """
+        width, height = self.image_size
+        scaled = np.asarray(coords, dtype=np.float64).reshape(-1, 4) * [
+            width / self.input_width, height / self.input_height, width / self.input_width, height / self.input_height
+        ]
+        top_left = np.trunc(scaled[:, :2])
+        bottom_right = np.minimum(np.maximum(top_left + 1, np.rint(scaled[:, 2:])), [width, height])
+        return np.concatenate([np.maximum(top_left, 0), bottom_right], axis=1).astype(np.int64)
+
+    def _to_original(self, bbox):
+        """模型输入坐标系 -> 原图像素坐标系。"""
+        return tuple(self._pixel_rects(bbox)[0].tolist())
+
+    def _from_original(self, box):
+        """原图像素坐标系 -> 模型输入坐标系。"""
+        scale_x = self.input_width / self.image_size[0]
+        scale_y = self.input_height / self.image_size[1]
+        x1, y1, x2, y2 = box
+        return x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y
+
+    def _thumbnail(self, frame, rect):
+        """原图像素矩形 `rect` 区域的灰度缩略图。"""
+        return frame.image.crop(rect).convert("L").resize(_THUMB_SIZE)
+
+    # --- 查询 ---
+
+    def elements_at(self, x: float, y: float) -> list:
+        """返回包含点 (x, y)（模型输入坐标系）的所有元素。"""
+        cell = (int(x // self.cell_size), int(y // self.cell_size))
+        found = []
+        for i in self._grid.get(cell, ()):
+            x1, y1, x2, y2 = self.elements[i].bbox
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                found.append(self.elements[i])
+        return found
+
+    def _indices_in(self, box) -> list:
+        bx1, by1, bx2, by2 = box
+        seen = set()
+        found = []
+        for cell in self._cells(box):
+            for i in self._grid.get(cell, ()):
+                if i in seen:
+                    continue
+                seen.add(i)
+                x1, y1, x2, y2 = self.elements[i].bbox
+                if x1 <= bx2 and bx1 <= x2 and y1 <= by2 and by1 <= y2:
+                    found.append(i)
+        return found
+
+    def elements_in(self, box) -> list:
+        """返回与区域 `box`（模型输入坐标系的 [x1, y1, x2, y2]）相交的所有元素。"""
+        return [self.elements[i] for i in self._indices_in(box)]
+
+    def find(self, label: str) -> list:
+        """按标签查找元素（标签先经过 `normalize_label` 规范化）。"""
+        return [self.elements[i] for i in self._by_label.get(normalize_label(label), ())]
+
+    def is_unchanged(self, element: IndexedElement, frame) -> bool:
+        """比较元素所在区域在建索引时与当前截图中的缩略图，判断该区域是否未变化。"""
+        frame = as_frame(frame)
+        if frame.size != self.image_size:
+            return False
+        diff = ImageChops.difference(self._thumbnail(frame, self._to_original(element.bbox)), element.thumbnail)
+        return diff.getextrema()[1] <= self.tolerance
+
+    def _match(self, frame, instruction: str):
+        """返回 (元素, 未命中原因)；命中时原因为 None。"""
+        candidates = [self.elements[i] for i in self._by_label.get(instruction_target(instruction), ())]
+        if not candidates:
+            return None, "missing"
+        if len(candidates) > 1:
+            logger.debug("元素索引中有 %d 个元素匹配 '%s'，回退到模型定位。", len(candidates), instruction)
+            return None, "ambiguous"
+        if not self.is_unchanged(candidates[0], frame):
+            logger.debug("元素 '%s' 所在区域已变化，回退到模型定位。", candidates[0].label)
+            return None, "stale"
+        return candidates[0], None
+
+    def match(self, frame, instruction: str):
+        """与 `locate` 相同，但不计入命中统计；用于预先判断哪些步骤需要模型。"""
+        with self._lock:
+            return self._match(frame, instruction)[0]
+
+    def locate(self, frame, instruction: str):
+        """
+        按指令在当前截图上查找元素。
+
+        Returns:
+            IndexedElement | None: 找到且所在区域未变化的唯一元素；查找不到、标签有歧义或区域已变化时为 None。
+        """
+        with self._lock:
+            element, reason = self._match(frame, instruction)
+            if reason == "stale":
+                self.stale += 1
+            elif reason is not None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        telemetry.cache_lookup("element_index", element is not None)
+        return element
+
+    # --- 局部更新 ---
+
+    def invalidate(self, regions) -> int:
+        """
+        移除与变化区域（原图像素坐标系的 (x1, y1, x2, y2)，例如 `frame_diff.dirty_regions` 的结果）相交的元素，
+        并把这些区域记为待重新枚举。返回移除的元素数。
+        """
+        removed = 0
+        with self._lock:
+            for region in regions:
+                for i in self._indices_in(self._from_original(region)):
+                    self._remove(i)
+                    removed += 1
+                self.pending_regions.append(tuple(region))
+            self.pending_regions = _merge_boxes(self.pending_regions)
+        return removed
+
+    def refresh(self, frame, enumerate_fn, margin: int = 32) -> float:
+        """
+        只对待重新枚举的区域调用模型，把识别到的元素加回索引。
+
+        Args:
+            frame (Frame | str | Image.Image): 当前截图。
+            enumerate_fn (callable): `enumerate_fn(crop) -> (模型输出, 输入高度, 输入宽度)`，
+                通常为 `lambda crop: enumerate_elements(model, processor, crop)`。
+            margin (int): 裁剪时每边外扩的像素数，使区域边缘的元素完整可见。
+
+        Returns:
+            float: 模型处理的像素占整帧的比例；没有待枚举的区域时为 0。
+        """
+        frame = as_frame(frame)
+        with self._lock:
+            return self._refresh(frame, enumerate_fn, margin)
+
+    def _refresh(self, frame, enumerate_fn, margin: int) -> float:
+        width, height = self.image_size
+        processed = 0
+        for region in self.pending_regions:
+            left, top = max(0, region[0] - margin), max(0, region[1] - margin)
+            right, bottom = min(width, region[2] + margin), min(height, region[3] + margin)
+            response, input_height, input_width = enumerate_fn(frame.image.crop((left, top, right, bottom)))
+            # 裁剪图的模型输入坐标 -> 原图像素坐标 -> 索引的模型输入坐标
+            boxes = BoxSet.from_response(response, input_height, input_width).to_pixels(
+                size=(right - left, bottom - top), offset=(left, top)
+            ).to_input(self.input_height, self.input_width, size=self.image_size)
+
+            # 外扩边距内的元素仍在索引中，只加入中心点落在变化区域内的元素，避免重复
+            self._add_elements(boxes, frame, within=self._from_original(region))
+            processed += (right - left) * (bottom - top)
+        self.pending_regions = []
+        return min(1.0, processed / (width * height))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.stale
+        return {
+            "elements": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+@telemetry.traced("enumerate_elements")
+def enumerate_elements(model, processor, image, max_new_tokens: int = 2048, **kwargs) -> tuple[str, int, int]:
+    """
+    对整张截图做一次全屏推理，列出所有 UI 元素。
+
+    Args:
+        model: 已加载的VLLM模型（或推理服务客户端）。
+        processor: 对应的处理器。
+        image (str | Frame | Image.Image): 截图。
+        max_new_tokens (int): 生成的最大 token 数；元素较多的界面需要更大的值。
+        **kwargs: 透传给 `grounding_utils.inference` 的其他参数（如 `max_pixels`）。
+
+    Returns:
+        tuple[str, int, int]: (模型输出, 模型输入高度, 模型输入宽度)，可直接传给 `ElementIndex.from_response`。
+    """
+    return inference(
+        model, processor, image, ENUMERATE_PROMPT, ENUMERATE_SYSTEM_PROMPT,
+        max_new_tokens=max_new_tokens, **kwargs
+    )
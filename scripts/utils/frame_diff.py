@@ -0,0 +1,289 @@
+"""
+本模块实现相邻截图之间的差分检测，用于减少重复定位。
+
+阶段三中相邻的截图（`data/calc_0*.png`）只有计算器的显示区域不同，但智能体把每一帧都当作全新的画面。
+差分检测在两帧之间找出发生变化的矩形区域 ("dirty rectangles")：
+1. 逐像素比较（NumPy 向量化）：任一颜色通道的差值超过 `threshold` 即视为该像素已变化。
+2. 按 `block_size` 划分网格，变化像素数不少于 `min_changed_pixels` 的块标记为脏块，过滤掉零星的压缩噪声。
+3. 相邻（间隔不超过 `merge_gap` 个块）的脏块合并为一个矩形：在块网格上做连通区域标记（同样向量化，见 `_label_components`）。
+
+`FrameDiffTracker` 在此基础上记住之前的定位结果及其所在区域：当前帧在该区域与结果所在的帧相同时直接复用结果，
+完全跳过模型；元素索引（见 `element_index.py`）也可以只对脏区域重新枚举，而不是整张截图。
+"""
+
+import logging
+import math
+import threading
+
+import numpy as np
+
+from .frames import as_frame
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 24
+DEFAULT_BLOCK_SIZE = 16
+DEFAULT_MIN_CHANGED_PIXELS = 8
+
+
+def _pixels(frame) -> np.ndarray:
+    return np.asarray(as_frame(frame).image.convert("RGB"), dtype=np.int16)
+
+
+def dirty_block_mask(prev, curr, threshold: int = DEFAULT_THRESHOLD, block_size: int = DEFAULT_BLOCK_SIZE,
+                     min_changed_pixels: int = DEFAULT_MIN_CHANGED_PIXELS) -> np.ndarray:
+    """
+    比较两帧，返回按 `block_size` 划分的脏块掩码（形状为 [行块数, 列块数] 的布尔数组）。
+    两帧尺寸必须相同。
+    """
+    a, b = _pixels(prev), _pixels(curr)
+    if a.shape != b.shape:
+        raise ValueError(f"两帧尺寸不同: {a.shape[1::-1]} vs {b.shape[1::-1]}")
+    changed = (np.abs(a - b).max(axis=2) > threshold)
+
+    # 补齐到块大小的整数倍，再按块统计变化像素数
+    height, width = changed.shape
+    rows, cols = math.ceil(height / block_size), math.ceil(width / block_size)
+    padded = np.zeros((rows * block_size, cols * block_size), dtype=bool)
+    padded[:height, :width] = changed
+    counts = padded.reshape(rows, block_size, cols, block_size).sum(axis=(1, 3))
+    return counts >= min_changed_pixels
+
+
+def _dilate(mask: np.ndarray, steps: int) -> np.ndarray:
+    """把掩码向 8 邻域扩张 `steps` 个块，使间隔较小的脏块连成一片。"""
+    for _ in range(steps):
+        grown = mask.copy()
+        grown[1:, :] |= mask[:-1, :]
+        grown[:-1, :] |= mask[1:, :]
+        grown[:, 1:] |= mask[:, :-1]
+        grown[:, :-1] |= mask[:, 1:]
+        grown[1:, 1:] |= mask[:-1, :-1]
+        grown[:-1, :-1] |= mask[1:, 1:]
+        grown[1:, :-1] |= mask[:-1, 1:]
+        grown[:-1, 1:] |= mask[1:, :-1]
+        mask = grown
+    return mask
+
+
+def _label_components(mask: np.ndarray) -> np.ndarray:
+    """
+    标记掩码的 8 邻域连通区域，返回与掩码同形的标号数组（背景为 0）。
+    每个块先以自身的序号为标号，再反复取 3x3 邻域内的最大标号，直到不再变化；
+    迭代次数与最大区域的直径成正比，每次迭代都是整个网格上的数组运算。
+    """
+    rows, cols = mask.shape
+    labels = np.where(mask, np.arange(1, mask.size + 1).reshape(rows, cols), 0)
+    while True:
+        padded = np.pad(labels, 1)
+        neighbours = labels.copy()
+        for dr in range(3):
+            for dc in range(3):
+                np.maximum(neighbours, padded[dr:dr + rows, dc:dc + cols], out=neighbours)
+        grown = np.where(mask, neighbours, 0)
+        if np.array_equal(grown, labels):
+            return labels
+        labels = grown
+
+
+def dirty_regions(prev, curr, threshold: int = DEFAULT_THRESHOLD, block_size: int = DEFAULT_BLOCK_SIZE,
+                  min_changed_pixels: int = DEFAULT_MIN_CHANGED_PIXELS, merge_gap: int = 1) -> list:
+    """
+    计算两帧之间发生变化的矩形区域。
+
+    Args:
+        prev, curr (Frame | str | Image.Image | np.ndarray): 前后两帧。
+        threshold (int): 像素差阈值（0-255），任一通道差值超过该值即视为已变化。
+        block_size (int): 网格块的边长（像素）。
+        min_changed_pixels (int): 一个块内至少有多少个像素变化才算脏块。
+        merge_gap (int): 间隔不超过该块数的脏块合并为同一个矩形。
+
+    Returns:
+        list[tuple[int, int, int, int]]: 原图像素坐标系下的 (x1, y1, x2, y2)；两帧尺寸不同时返回整帧。
+    """
+    prev, curr = as_frame(prev), as_frame(curr)
+    width, height = curr.size
+    if prev.size != curr.size:
+        return [(0, 0, width, height)]
+
+    dirty = dirty_block_mask(prev, curr, threshold, block_size, min_changed_pixels)
+    if not dirty.any():
+        return []
+    grouped = _dilate(dirty, merge_gap) if merge_gap > 0 else dirty
+
+    # 在（扩张后的）块网格上求连通区域，每个区域取其中原始脏块的外接矩形
+    labels = _label_components(grouped)
+    dirty_rows, dirty_cols = np.nonzero(dirty)
+    ids, group = np.unique(labels[dirty_rows, dirty_cols], return_inverse=True)
+    count = len(ids)
+    top, left = np.full(count, dirty.shape[0]), np.full(count, dirty.shape[1])
+    bottom, right, first = np.full(count, -1), np.full(count, -1), np.full(count, dirty_rows.size)
+    np.minimum.at(top, group, dirty_rows)
+    np.minimum.at(left, group, dirty_cols)
+    np.maximum.at(bottom, group, dirty_rows)
+    np.maximum.at(right, group, dirty_cols)
+    # 区域按其第一个脏块的行优先顺序排列
+    np.minimum.at(first, group, np.arange(dirty_rows.size))
+
+    regions = []
+    for i in np.argsort(first):
+        regions.append((
+            int(left[i] * block_size), int(top[i] * block_size),
+            int(min((right[i] + 1) * block_size, width)), int(min((bottom[i] + 1) * block_size, height)),
+        ))
+    return regions
+
+
+def region_area(regions) -> int:
+    """矩形列表的总面积（不去重，矩形之间按互不重叠处理）。"""
+    return sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+
+
+def intersects(box, regions) -> bool:
+    """`box` 是否与任一矩形相交。"""
+    bx1, by1, bx2, by2 = box
+    return any(x1 < bx2 and bx1 < x2 and y1 < by2 and by1 < y2 for x1, y1, x2, y2 in regions)
+
+
+class FrameDiffTracker:
+    """
+    跟踪连续截图之间的变化，复用未受影响区域上的定位结果。
+
+    每一步先调用 `observe(frame)` 得到相对上一帧的脏矩形；之前通过 `remember` 记下的结果，
+    只要当前帧在其所在区域与记下结果时的帧相同，`recall` 就直接返回该结果。每一步的跳过情况由 `note` 记录，
+    `report()` 汇总各步骤中模型实际处理的像素比例。
+
+    工作流中的步骤可能并发执行，"上一帧"不能取最近一次 `observe` 的帧：调用 `observe` 时传入步骤 ID
+    与其依赖的步骤，脏矩形相对依赖步骤观察到的帧计算，各分支互不干扰。`recall` 直接比较结果所在区域，
+    与各步骤观察的先后顺序无关。
+
+    Args:
+        threshold, block_size, min_changed_pixels, merge_gap: 见 `dirty_regions`。
+    """
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD, block_size: int = DEFAULT_BLOCK_SIZE,
+                 min_changed_pixels: int = DEFAULT_MIN_CHANGED_PIXELS, merge_gap: int = 1):
+        self.threshold = threshold
+        self.block_size = block_size
+        self.min_changed_pixels = min_changed_pixels
+        self.merge_gap = merge_gap
+
+        self._previous = None     # 未指定步骤时的上一帧；`prime` 设置的基准帧
+        self._observed = {}       # 步骤 ID -> 该步骤观察到的帧
+        self._remembered = {}     # 键 -> (原图像素坐标系下的区域, 结果, 记下结果时的帧)
+        self._lock = threading.Lock()
+        self._local = threading.local()  # 各线程当前步骤的记录，供 `note` 使用
+        self.steps = []
+
+    def prime(self, frame):
+        """把 `frame` 设为比较基准（例如建立元素索引所用的帧），不产生步骤记录。"""
+        with self._lock:
+            self._previous = as_frame(frame)
+
+    def observe(self, frame, step=None, after=()) -> list:
+        """
+        处理新的一帧，返回相对上一帧的脏矩形；没有可比较的帧时返回整帧。
+        可在多个线程中调用，各线程随后的 `note` 记入各自的步骤。
+
+        Args:
+            frame: 本步骤的截图。
+            step (str, optional): 步骤 ID。为 None 时按调用顺序与上一次 `observe` 的帧比较（单线程顺序执行）。
+            after (tuple[str]): 本步骤依赖的步骤 ID；与其中最后一个已观察过的步骤的帧比较，
+                都未观察过（例如已续跑跳过）时与 `prime` 设置的基准帧比较。
+        """
+        frame = as_frame(frame)
+        width, height = frame.size
+        with self._lock:
+            if step is None:
+                previous = self._previous
+                self._previous = frame
+            else:
+                observed = [self._observed[s] for s in after if s in self._observed]
+                previous = observed[-1] if observed else self._previous
+                self._observed[step] = frame
+        # 差分计算不持锁，并发步骤互不阻塞
+        if previous is None:
+            regions = [(0, 0, width, height)]
+        else:
+            regions = dirty_regions(
+                previous, frame, self.threshold, self.block_size, self.min_changed_pixels, self.merge_gap
+            )
+
+        with self._lock:
+            record = {
+                "baseline": previous is None,
+                "dirty_regions": regions,
+                "dirty_fraction": min(1.0, region_area(regions) / (width * height)),
+                "source": None,
+                "model_fraction": None,
+            }
+            self.steps.append(record)
+        self._local.record = record
+        return regions
+
+    def remember(self, key, region, value, frame):
+        """记下在 `frame` 上得到的定位结果及其所在区域（原图像素坐标系的 (x1, y1, x2, y2)）。"""
+        with self._lock:
+            self._remembered[key] = (tuple(region), value, as_frame(frame))
+
+    def recall(self, key, frame):
+        """
+        返回在 `frame` 上仍然有效的结果：`frame` 在结果所在区域与记下结果时的帧相同。
+        没有记下的结果或区域已变化时返回 None（已变化的结果随即丢弃）。
+        """
+        frame = as_frame(frame)
+        with self._lock:
+            item = self._remembered.get(key)
+        if item is None:
+            return None
+        box, value, source = item
+        if source is frame or self._region_unchanged(source, frame, box):
+            return value
+        with self._lock:
+            if self._remembered.get(key) is item:
+                del self._remembered[key]
+        return None
+
+    def _region_unchanged(self, source, frame, box) -> bool:
+        """只比较 `box` 内的像素，代价与区域面积成正比。"""
+        if source.size != frame.size:
+            return False
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        if x2 <= x1 or y2 <= y1:
+            return True
+        return not dirty_regions(source.image.crop((x1, y1, x2, y2)), frame.image.crop((x1, y1, x2, y2)),
+                                 self.threshold, self.block_size, self.min_changed_pixels, self.merge_gap)
+
+    def current(self) -> dict:
+        """当前线程最近一次 `observe` 产生的步骤记录。"""
+        return getattr(self._local, "record", None)
+
+    def note(self, source: str, model_fraction: float):
+        """
+        记录当前步骤的定位来源与模型实际处理的像素比例。
+
+        Args:
+            source (str): 例如 "reused"（复用结果）、"index"（元素索引）、"regions"（只重新定位脏区域）、"model"（整帧推理）。
+            model_fraction (float): 模型处理的像素占整帧的比例；完全跳过模型时为 0。
+        """
+        record = self.current()
+        if record is not None:
+            record["source"] = source
+            record["model_fraction"] = model_fraction
+
+    def report(self) -> dict:
+        """
+        汇总所有步骤：完全跳过模型的步骤数，以及模型处理的像素占"每步整帧推理"的比例。
+        平均变化比例不计没有可比较帧的步骤（它们的脏矩形总是整帧）。
+        """
+        noted = [s for s in self.steps if s["model_fraction"] is not None]
+        compared = [s for s in self.steps if not s["baseline"]]
+        model_pixels = sum(s["model_fraction"] for s in noted)
+        return {
+            "steps": len(self.steps),
+            "skipped_steps": sum(1 for s in noted if s["model_fraction"] == 0),
+            "model_pixel_fraction": model_pixels / len(noted) if noted else 0.0,
+            "mean_dirty_fraction": (
+                sum(s["dirty_fraction"] for s in compared) / len(compared) if compared else 0.0
+            ),
+        }
@@ -0,0 +1,152 @@
+"""
+本模块定义在推理与可视化之间流转的屏幕帧 `Frame`。
+
+过去 `inference`、`draw_click_on_image`、`plot_bounding_boxes`、`get_vlm_response` 都只接受文件路径，
+各自重新打开并解码 PNG；阶段三的每一步里同一张截图至少被解码两次（计算缓存键一次、推理一次、可视化再一次）。
+
+`Frame` 包装一个图像来源，并在所有使用者之间共享解码结果：
+- 来源可以是文件路径、Pillow 图像、NumPy 数组 (H, W, 3) 或屏幕采集得到的原始 RGB 缓冲区。
+- 解码是惰性的：只读取尺寸时不解码像素；第一次访问 `image` 时才解码，之后复用同一个对象。
+- 内容哈希 `digest` 与来源哈希 `source_digest` 只计算一次。
+- NumPy 数组与原始像素缓冲区在构造时直接转换为 Pillow 图像，之后不再重复转换。Pillow 内部以每像素 4 字节存储 RGB，
+  因此 RGB 数据会被复制一次；只有连续的 4 通道 (RGBA) uint8 数据由 Pillow 直接引用其内存，不复制像素。
+"""
+
+import hashlib
+import sys
+
+from PIL import Image
+
+
+def image_digest(image: Image.Image) -> str:
+    """
+    计算图像内容的哈希值，用作各类缓存的键。
+
+    哈希基于解码后的像素数据（以及模式和尺寸），因此与文件名、PNG压缩参数无关。
+    """
+    hasher = hashlib.sha1()
+    hasher.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """哈希文件的原始字节，无需解码图像。"""
+    hasher = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _is_ndarray(value) -> bool:
+    """不导入 numpy 判断是否为 NumPy 数组：调用方传入数组时 numpy 必然已被导入。"""
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(value, np.ndarray)
+
+
+class Frame:
+    """
+    一帧屏幕图像，解码结果与哈希值在所有使用者之间共享。
+
+    Args:
+        source (str | Image.Image | np.ndarray): 图像文件路径、Pillow 图像，或形如 (H, W, 3) / (H, W, 4)
+            的 uint8 数组。
+    """
+
+    __slots__ = ("path", "_image", "_size", "_digest", "_source_digest")
+
+    def __init__(self, source):
+        self.path = None
+        self._image = None
+        self._size = None
+        self._digest = None
+        self._source_digest = None
+
+        if isinstance(source, str):
+            self.path = source
+        elif isinstance(source, Image.Image):
+            self._image = source
+        elif _is_ndarray(source):
+            # 转换为 Pillow 图像：RGB 数组会复制一次，连续的 RGBA uint8 数组由 Pillow 直接引用其内存
+            np = sys.modules["numpy"]
+            self._image = Image.fromarray(np.ascontiguousarray(source, dtype=np.uint8))
+        else:
+            raise TypeError(f"不支持的图像来源类型: {type(source).__name__}")
+
+    @classmethod
+    def from_rgb_buffer(cls, buffer, width: int, height: int, mode: str = "RGB") -> "Frame":
+        """
+        从屏幕采集得到的原始像素缓冲区（如 mss 的 `.rgb`、bytes、memoryview）构造帧。
+        "RGBA" 缓冲区由 Pillow 直接引用，不复制像素；"RGB" 与 "BGRA" 缓冲区会在构造时复制（并转换）一次。
+
+        Args:
+            buffer: 按行排列、无行填充的像素缓冲区。
+            width (int): 宽度。
+            height (int): 高度。
+            mode (str): 像素格式，"RGB" 或 "RGBA"（BGRA 缓冲区可传入 "BGRA" 以在解码时转换）。
+        """
+        if mode == "BGRA":
+            image = Image.frombuffer("RGB", (width, height), buffer, "raw", "BGRX", 0, 1)
+        else:
+            image = Image.frombuffer(mode, (width, height), buffer, "raw", mode, 0, 1)
+        return cls(image)
+
+    def __repr__(self):
+        source = self.path if self.path is not None else "memory"
+        return f"Frame({source!r}, size={self.size})"
+
+    @property
+    def image(self) -> Image.Image:
+        """解码后的 Pillow 图像。第一次访问时解码，之后返回同一个对象；使用者不应就地修改它。"""
+        if self._image is None:
+            image = Image.open(self.path)
+            image.load()
+            self._image = image
+        return self._image
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """(宽, 高)。对尚未解码的文件只读取文件头。"""
+        if self._image is not None:
+            return self._image.size
+        if self._size is None:
+            with Image.open(self.path) as image:
+                self._size = image.size
+        return self._size
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def digest(self) -> str:
+        """像素内容哈希（见 `image_digest`），只计算一次。"""
+        if self._digest is None:
+            self._digest = image_digest(self.image)
+        return self._digest
+
+    @property
+    def source_digest(self) -> str:
+        """
+        来源内容哈希：文件来源哈希原始字节（无需解码），内存来源哈希像素数据。
+        用作预处理缓存的键。
+        """
+        if self._source_digest is None:
+            if self.path is not None:
+                # 无论是否已经解码，文件来源都按文件字节哈希，保证键一致
+                self._source_digest = "file:" + file_digest(self.path)
+            else:
+                self._source_digest = "pixels:" + self.digest
+        return self._source_digest
+
+
+def as_frame(source) -> Frame:
+    """把路径、Pillow 图像、NumPy 数组或已有的 `Frame` 统一为 `Frame`。"""
+    if isinstance(source, Frame):
+        return source
+    return Frame(source)
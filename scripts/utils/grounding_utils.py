@@ -5,29 +5,80 @@ Qwen-2.5-VL 官方 Cookbook spatial_understanding.ipynb 重写而来
 主要功能包括：
 1. `inference`: 调用模型进行推理，获取模型对图像和文本提示的响应。
 2. `plot_bounding_boxes`: 解析模型输出的JSON格式边界框，并在图像上绘制出来。
-3. `plot_points`: 解析模型输出的XML格式坐标点，并在图像上标记出来。
+3. `plot_points`: 解析模型输出的XML格式坐标点，并在图像上标记出来（配合 `POINT_PROMPT_TEMPLATE` 的点定位模式）。
 4. 辅助函数: 用于解析和清理模型原始输出的特定格式（JSON, XML）。
+5. `inference_batch`: 将多个图文任务合并到一次 `generate` 调用中批量推理。
+6. `chat` / `chat_batch`: 通用图文问答（阶段一的图像描述与视觉问答）。
+7. `inference_tiled`: 把高分辨率截图切分为重叠图块批量定位，并用 NMS 合并重复结果。
+
+定位结果的坐标换算、NMS 等数组运算由 `boxes.BoxSet` / `boxes.PointSet` 完成。
 """
 
+import functools
 import json
-import ast
 import io
-import os
+import logging
+import math
+import time
 import xml.etree.ElementTree as ET
-from PIL import Image, ImageDraw, ImageFont, ImageColor
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+from . import telemetry
+from .frames import Frame, as_frame, image_digest
+from .model_client import is_remote_model
+from .render import BoxMarker, ClickMarker, PointMarker, compose, render
+from .stream_parser import parse_grounding_output
+
+# torch / transformers / numpy 只在推理与 NMS 等真正需要它们的函数内部导入：
+# 只做解析或可视化的代码（如后处理已保存的模型输出）导入本模块时不会加载 torch。
+# `boxes` 模块依赖 numpy，同样在用到时才导入。
+if TYPE_CHECKING:
+    from .boxes import BoxSet, PointSet
+    from .prefix_cache import PrefixCache
+    from .render import AnnotationRenderer
+    from .preprocess_cache import PreprocessCache
+
+logger = logging.getLogger(__name__)
 
 # --- 全局常量 ---
 
 # 定义一个丰富的颜色列表，用于在图像上绘制不同的对象。
-# 首先包含一组常用颜色，然后从PIL的ImageColor模块中添加更多颜色，以确保多样性。
-_COLORS = [
+# 首先包含一组常用颜色，第一次绘制时再从PIL的ImageColor模块中添加更多颜色，以确保多样性。
+_BASE_COLORS = [
     'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 'brown', 'gray',
     'beige', 'turquoise', 'cyan', 'magenta', 'lime', 'navy', 'maroon', 'teal',
     'olive', 'coral', 'lavender', 'violet', 'gold', 'silver'
-] + list(ImageColor.colormap.keys())
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _all_colors() -> tuple:
+    from PIL import ImageColor
+    return tuple(_BASE_COLORS + list(ImageColor.colormap.keys()))
+
+
+def _color(index: int) -> str:
+    """按序号循环选取绘制颜色。"""
+    colors = _all_colors()
+    return colors[index % len(colors)]
+
+# 点定位模式的提示词。相比输出完整的边界框再计算中心点，只输出一个坐标点所需的 token 更少。
+POINT_SYSTEM_PROMPT = "You are a helpful assistant. Locate the object in the image based on the instruction and point to it."
+POINT_PROMPT_TEMPLATE = (
+    "Instruction: \"{instruction}\". Point to the center of the target element. "
+    "Answer only with <points x1=\"x\" y1=\"y\" alt=\"label\">label</points>"
+)
+# 点定位模式的 JSON 形式，与约束解码（`constrained="point"`）的语法一致
+POINT_JSON_PROMPT_TEMPLATE = (
+    "Instruction: \"{instruction}\". Point to the center of the target element. "
+    "Answer only with JSON: [{{\"point_2d\": [x, y], \"label\": \"label\"}}]"
+)
 
 # --- 解析函数 ---
 
+@telemetry.traced("parse_json_from_string")
 def parse_json_from_string(text: str) -> str:
     """
     从可能包含Markdown代码块的字符串中提取纯净的JSON内容。
@@ -35,6 +86,9 @@ def parse_json_from_string(text: str) -> str:
     模型有时会用 "```json\n{...}\n```" 这样的格式包裹其JSON输出，
     此函数旨在移除这些包裹，以便后续解析。
 
+    注意：绘图与定位流程已改用 `stream_parser.parse_grounding_output` 单遍解析，
+    此函数仅为兼容旧代码保留。
+
     Args:
         text (str): 包含JSON的模型原始输出字符串。
 
@@ -55,170 +109,489 @@ def parse_json_from_string(text: str) -> str:
     # 如果没有找到 "```json" 标记，则假定整个文本就是JSON内容
     return text
 
-# --- 可视化函数 ---
+@telemetry.traced("parse_points")
+def parse_points(text: str) -> list:
+    """
+    从模型输出中解析所有坐标点。
+
+    支持 XML 形式 `<points x1="..." y1="..." alt="...">...</points>`（一个元素可包含多个点）
+    以及 JSON 形式 `{"point_2d": [x, y], "label": "..."}`。
+
+    Returns:
+        list[dict]: 每个点为 {"point_2d": [x, y], "label": str}，坐标位于模型输入的坐标系中。
+    """
+    return [element for element in parse_grounding_output(text) if "point_2d" in element]
 
-def plot_bounding_boxes(im: Image.Image, json_str: str, input_width: int, input_height: int, output_path: str = None):
+# --- 可视化函数 ---
+# 绘制与保存由 `render` 模块完成：一帧上的所有标注一次合成，传入 `renderer` 时在后台编码与保存。
+
+def _output(image, markers, output_path, renderer):
+    """把标注绘制到图像副本上并保存（或显示）。传入 `renderer` 时返回后台任务的 `Future`。"""
+    if not output_path:
+        compose(image, markers).show()
+        return None
+    if renderer is not None:
+        return renderer.submit(image, markers, output_path)
+    render(image, markers, output_path)
+    logger.info("🖼️  可视化结果已保存至: %s", output_path)
+    return None
+
+
+@telemetry.traced("plot_bounding_boxes")
+def plot_bounding_boxes(im, json_str, input_width: int, input_height: int, output_path: str = None,
+                        renderer: "AnnotationRenderer" = None):
     """
     在图像上绘制边界框和标签。
     该函数会解析JSON字符串，将归一化的坐标转换为绝对坐标，并用不同颜色绘制。
 
     Args:
-        im (Image.Image): Pillow图像对象。
-        json_str (str): 包含边界框信息的JSON格式字符串。
+        im (Image.Image | Frame | str): Pillow图像对象，也可以是 `Frame`、NumPy 数组或图像路径。
+            总是在副本上绘制，不影响传入的图像或共享的帧。
+        json_str (str | BoxSet): 包含边界框信息的JSON格式字符串，也可以是已解析的 `BoxSet`
+            （位于原图像素坐标系的 `BoxSet` 不再做坐标换算）。
         input_width (int): 模型处理图像时所见的宽度（用于坐标归一化）。
         input_height (int): 模型处理图像时所见的高度（用于坐标归一化）。
         output_path (str, optional): 如果提供，则将绘制后的图像保存到此路径。否则，直接显示图像。
+        renderer (AnnotationRenderer, optional): 后台渲染器。提供时立即返回保存任务的 `Future`，不阻塞调用方。
     """
-    original_width, original_height = im.size
-    draw = ImageDraw.Draw(im)
-    font = ImageFont.load_default()
-
-    # 步骤1: 清理并解析JSON字符串
-    clean_json_str = parse_json_from_string(json_str)
-    
-    try:
-        # 使用ast.literal_eval安全地评估字符串为Python对象（列表、字典等）
-        # 它比json.loads更容忍一些轻微的语法错误，但仍比eval安全得多。
-        bounding_boxes = ast.literal_eval(clean_json_str)
-    except Exception as e:
-        print(f"[-] 使用 ast.literal_eval 解析JSON失败。错误: {e}")
-        # 容错处理：大语言模型有时会因输出截断导致JSON不完整。
-        # 这里尝试一种常见的修复方法：找到最后一个有效的 '}' 并补全 ']'
-        try:
-            # 找到最后一个 `"}` 出现的位置，并截取到其后
-            end_idx = clean_json_str.rfind('"}') + len('"}')
-            # 假设原始结构是 `[{"key": "value"}, ...]`，尝试在末尾补上 `]`
-            truncated_text = clean_json_str[:end_idx] + "]"
-            bounding_boxes = ast.literal_eval(truncated_text)
-            print("[+] 容错解析成功！")
-        except Exception as e2:
-            print(f"[-] 容错解析同样失败。错误: {e2}")
-            # 如果所有解析都失败，则放弃绘制，直接保存或显示原图以便调试。
-            if output_path:
-                im.save(output_path)
-                print(f"[!] 因解析失败，已将原始图像保存至 {output_path}")
-            else:
-                im.show()
-            return # 提前退出函数
-
-    # 步骤2: 遍历每个边界框并绘制
-    for i, box_data in enumerate(bounding_boxes):
-        # 从颜色列表中循环选择颜色
-        color = _COLORS[i % len(_COLORS)]
-
-        # 步骤3: 坐标转换
-        # 模型输出的bbox_2d是归一化坐标 [x1, y1, x2, y2]，范围在[0, input_width/input_height]
-        # 需要将其转换为原始图像上的绝对像素坐标。
-        y1_norm, x1_norm, y2_norm, x2_norm = box_data["bbox_2d"][1], box_data["bbox_2d"][0], box_data["bbox_2d"][3], box_data["bbox_2d"][2]
-
-        abs_y1 = int(y1_norm / input_height * original_height)
-        abs_x1 = int(x1_norm / input_width * original_width)
-        abs_y2 = int(y2_norm / input_height * original_height)
-        abs_x2 = int(x2_norm / input_width * original_width)
-        
-        # 确保(x1, y1)是左上角, (x2, y2)是右下角
-        if abs_x1 > abs_x2: abs_x1, abs_x2 = abs_x2, abs_x1
-        if abs_y1 > abs_y2: abs_y1, abs_y2 = abs_y2, abs_y1
-
-        # 步骤4: 绘制矩形框
-        draw.rectangle(
-            ((abs_x1, abs_y1), (abs_x2, abs_y2)), 
-            outline=color, 
-            width=4
-        )
+    from .boxes import BoxSet
 
-        # 步骤5: 绘制标签文本
-        if "label" in box_data:
-            label = box_data["label"]
-            # 在框的左上角内侧绘制标签文本
-            draw.text((abs_x1 + 8, abs_y1 + 6), label, fill=color, font=font)
+    frame = as_frame(im)
 
-    # 步骤6: 保存或显示结果
-    if output_path:
-        im.save(output_path)
-        print(f"[+] 带有边界框的图像已保存至: {output_path}")
+    # 步骤1: 单遍增量解析模型输出。
+    # 解析器会跳过 Markdown 代码块标记和说明文字，兼容单引号，并补全被截断的最后一个对象。
+    if isinstance(json_str, BoxSet):
+        bounding_boxes = json_str
     else:
-        im.show()
+        bounding_boxes = BoxSet.from_response(json_str, input_height, input_width)
+    if not len(bounding_boxes):
+        logger.warning("[-] 未能从模型输出中解析出任何边界框。")
+        # 如果解析失败，则放弃绘制，直接保存或显示原图以便调试。
+        return _output(frame, [], output_path, renderer)
+
+    # 步骤2: 坐标转换
+    # 模型输出的bbox_2d是归一化坐标 [x1, y1, x2, y2]，范围在[0, input_width/input_height]，
+    # 整组一次换算为原始图像上的绝对像素坐标；BoxSet 构造时已保证 (x1, y1) 是左上角、(x2, y2) 是右下角。
+    # 只读取尺寸，截图在真正绘制时才解码。
+    pixel_boxes = bounding_boxes.to_pixels(frame.size).coords.astype(int).tolist()
+
+    # 步骤3: 每个边界框一个标注，从颜色列表中循环选择颜色，标签绘制在框的左上角内侧
+    markers = [
+        BoxMarker(*box, label=label, color=_color(i))
+        for i, (box, label) in enumerate(zip(pixel_boxes, bounding_boxes.labels))
+    ]
+
+    # 步骤4: 保存或显示结果
+    return _output(frame, markers, output_path, renderer)
+
+@telemetry.traced("plot_points")
+def plot_points(im, text, input_width: int, input_height: int, output_path: str = None,
+                renderer: "AnnotationRenderer" = None):
+    """
+    在图像上标记模型输出的坐标点及其标签。
+
+    Args:
+        im (Image.Image | Frame | str): Pillow图像对象，也可以是 `Frame`、NumPy 数组或图像路径。
+        text (str | PointSet): 包含 `<points>` 元素（或 point_2d JSON）的模型输出，也可以是已解析的 `PointSet`。
+        input_width (int): 模型处理图像时所见的宽度（用于坐标归一化）。
+        input_height (int): 模型处理图像时所见的高度（用于坐标归一化）。
+        output_path (str, optional): 如果提供，则将绘制后的图像保存到此路径。否则，直接显示图像。
+        renderer (AnnotationRenderer, optional): 后台渲染器（见 `plot_bounding_boxes`）。
+    """
+    from .boxes import PointSet
+
+    frame = as_frame(im)
+    points = text if isinstance(text, PointSet) else PointSet.from_elements(parse_points(text), (input_height, input_width))
+    if not len(points):
+        logger.warning("[-] 未能从模型输出中解析出任何坐标点。")
+
+    # 将模型输入坐标系中的点整组映射回原图
+    markers = [
+        PointMarker(x, y, label=label, color=_color(i))
+        for i, ((x, y), label) in enumerate(zip(points.to_pixels(frame.size).coords.tolist(), points.labels))
+    ]
+    return _output(frame, markers, output_path, renderer)
 
 # --- 可视化点函数 ---
-def draw_click_on_image(image_path, normalized_coords, input_width: int, input_height: int, output_path):
+@telemetry.traced("draw_click_on_image")
+def draw_click_on_image(image_path, normalized_coords, input_width: int, input_height: int, output_path,
+                        renderer: "AnnotationRenderer" = None):
     """
     在指定图片上绘制一个模拟点击的点，并保存结果。
 
+    半透明的点击标记只在其外接矩形内做 alpha 合成（见 `render.ClickMarker`），不再转换和合成整张截图。
+
     Args:
-        image_path (str): 原始图片的路径。
+        image_path (str | Frame): 原始图片的路径，也可以是已解码的 `Frame`、Pillow 图像或 NumPy 数组。
+            传入阶段三循环中共享的 `Frame` 时不会再次解码截图。
         normalized_coords (tuple): (x, y) 格式的归一化坐标 (范围 0-1000)。
         output_path (str): 保存绘制后图片的路径。
+        renderer (AnnotationRenderer, optional): 后台渲染器。提供时立即返回保存任务的 `Future`，不阻塞调用方。
     """
     try:
-        image = Image.open(image_path).convert('RGBA')
+        # 只读取尺寸；截图在绘制时才解码（已解码的帧直接复用）
+        frame = as_frame(image_path)
+        original_width, original_height = frame.size
     except FileNotFoundError:
-        print(f"[错误] 找不到图片: {image_path}")
-        return
+        logger.error("[错误] 找不到图片: %s", image_path)
+        return None
 
-    original_width, original_height = image.size
-    
-    # 1. 坐标转换：将归一化坐标 (0-1000) 转换为绝对像素坐标
+    # 坐标转换：将归一化坐标 (0-1000) 转换为绝对像素坐标。
+    # 绘制效果借鉴官方Cookbook：半透明的红色大圆表示点击区域，绿色实心小圆表示精确的点击中心。
     norm_x, norm_y = normalized_coords
-    abs_x = norm_x / input_width * original_width
-    abs_y = norm_y / input_height * original_height
-    
-    point = (abs_x, abs_y)
-    color = (255, 0, 0, 128) # 红色，半透明 (RGBA)
-
-    # 2. 创建一个透明的叠加层用于绘制，避免直接修改原图
-    overlay = Image.new('RGBA', image.size, (255, 255, 255, 0))
-    overlay_draw = ImageDraw.Draw(overlay)
-
-    # 3. 绘制效果 (借鉴官方Cookbook)
-    # 绘制一个较大的半透明圆圈表示点击区域
-    radius = min(image.size) * 0.02 # 调整半径大小，使其更适合UI元素
-    overlay_draw.ellipse(
-        [(point[0] - radius, point[1] - radius), (point[0] + radius, point[1] + radius)],
-        fill=color
+    marker = ClickMarker(norm_x / input_width * original_width, norm_y / input_height * original_height)
+    return _output(frame, [marker], output_path, renderer)
+
+
+# --- 模型推理函数 ---
+
+def smart_resize_dims(height: int, width: int, min_pixels: int = None, max_pixels: int = None, factor: int = 28) -> tuple[int, int]:
+    """
+    计算按像素预算缩放后的 (高, 宽)，规则与 Qwen2.5-VL 处理器的 smart_resize 一致：
+    宽高取 `factor`(patch_size * merge_size = 28) 的整数倍，总像素数落在 [min_pixels, max_pixels] 内。
+
+    只做算术运算，不需要解码或缩放图像，可用于提前估算视觉 token 数。
+    """
+    resized_height = max(factor, round(height / factor) * factor)
+    resized_width = max(factor, round(width / factor) * factor)
+    if max_pixels is not None and resized_height * resized_width > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        resized_height = max(factor, math.floor(height / beta / factor) * factor)
+        resized_width = max(factor, math.floor(width / beta / factor) * factor)
+    elif min_pixels is not None and resized_height * resized_width < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        resized_height = math.ceil(height * beta / factor) * factor
+        resized_width = math.ceil(width * beta / factor) * factor
+    return resized_height, resized_width
+
+
+def resize_to_pixel_budget(image: Image.Image, min_pixels: int = None, max_pixels: int = None, factor: int = 28) -> Image.Image:
+    """
+    按像素预算缩放图像，规则见 `smart_resize_dims`。
+
+    视觉 token 数约为 像素数 / 28^2，因此像素预算直接决定了预填充的开销。
+    预先缩放后，处理器不会再做二次缩放。
+
+    Args:
+        image (Image.Image): 原始图像。
+        min_pixels (int, optional): 像素数下限。
+        max_pixels (int, optional): 像素数上限。
+        factor (int, optional): 宽高对齐的倍数。
+
+    Returns:
+        Image.Image: 缩放后的图像；尺寸无需改变时返回原对象。
+    """
+    width, height = image.size
+    resized_height, resized_width = smart_resize_dims(height, width, min_pixels, max_pixels, factor)
+    if (resized_width, resized_height) == image.size:
+        return image
+    return image.resize((resized_width, resized_height), Image.BICUBIC)
+
+
+def visual_token_count(input_height: int, input_width: int, factor: int = 28) -> int:
+    """
+    根据模型输入尺寸计算视觉 token 数：每 factor x factor 像素对应一个 token，
+    factor = patch_size * merge_size（Qwen2.5-VL 为 2x2 个 14 像素的 patch 合并，即 28）。
+    """
+    return (input_height // factor) * (input_width // factor)
+
+
+def _load_image(image) -> Image.Image:
+    """
+    接受图像路径、Pillow 图像、NumPy 数组或 `Frame`，返回解码后的 Pillow 图像。
+    传入 `Frame` 时复用其已解码的图像，不会重复解码。
+    """
+    return as_frame(image).image
+
+
+def _cached_processor_inputs(processor, sources, prompt_texts, min_pixels, max_pixels, preprocess_cache):
+    """
+    与 `processor(text=..., images=..., padding=True)` 等价，但图像预处理结果取自 `preprocess_cache`。
+
+    命中时不打开、不解码图像，`pixel_values` 直接由内存映射数组零拷贝构造；未命中时才执行完整的
+    缩放/归一化流程并写入缓存。文本部分按处理器的规则把每个 `<|image_pad|>` 展开为
+    T*H*W / merge_size^2 个视觉 token 后再分词。
+    """
+    import torch
+    from transformers import BatchFeature
+    from .preprocess_cache import make_preprocess_key
+
+    image_processor = processor.image_processor
+    pixel_chunks = []
+    grids = []
+    for source in sources:
+        key = make_preprocess_key(as_frame(source).source_digest, image_processor, min_pixels, max_pixels)
+        cached = preprocess_cache.get(key)
+        if cached is None:
+            image = _load_image(source)
+            if min_pixels is not None or max_pixels is not None:
+                image = resize_to_pixel_budget(image, min_pixels, max_pixels)
+            processed = image_processor(images=[image], return_tensors="np")
+            pixel_values, grid_thw = processed["pixel_values"], processed["image_grid_thw"][0].tolist()
+            preprocess_cache.put(key, pixel_values, grid_thw)
+        else:
+            pixel_values, grid_thw = cached
+        pixel_chunks.append(torch.from_numpy(pixel_values))
+        grids.append(grid_thw)
+
+    image_token = getattr(processor, "image_token", "<|image_pad|>")
+    merge_length = image_processor.merge_size ** 2
+    texts = [
+        text.replace(image_token, image_token * (t * h * w // merge_length), 1)
+        for text, (t, h, w) in zip(prompt_texts, grids)
+    ]
+    text_inputs = processor.tokenizer(texts, padding=True, return_tensors="pt")
+    pixel_values = pixel_chunks[0] if len(pixel_chunks) == 1 else torch.cat(pixel_chunks)
+    return BatchFeature(data={
+        **text_inputs,
+        "pixel_values": pixel_values,
+        "image_grid_thw": torch.tensor(grids, dtype=torch.long),
+    })
+
+
+def _build_messages(image: Image.Image, prompt: str, system_prompt: str) -> list:
+    """
+    构建符合模型聊天模板的输入消息格式。
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image", "image": image}
+            ]
+        }
+    ]
+
+
+def _generation_controls(model, tokenizer, max_new_tokens, expected_boxes, constrained):
+    """
+    构建 `model.generate` 的早停准则与约束解码参数。
+
+    Returns:
+        tuple: (JsonCompletionStoppingCriteria 或 None, 传给 generate 的额外参数字典)
+    """
+    from transformers import LogitsProcessorList, StoppingCriteriaList
+    from .decoding_utils import BboxJsonLogitsProcessor, JsonCompletionStoppingCriteria
+
+    generate_kwargs = {}
+    stopping_criteria = None
+    if expected_boxes is not None:
+        stopping_criteria = JsonCompletionStoppingCriteria(tokenizer, expected_boxes, max_new_tokens)
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([stopping_criteria])
+    if constrained:
+        eos_token_ids = model.generation_config.eos_token_id
+        if eos_token_ids is None:
+            eos_token_ids = tokenizer.eos_token_id
+        geometry = constrained if isinstance(constrained, str) else "box"
+        generate_kwargs["logits_processor"] = LogitsProcessorList([
+            BboxJsonLogitsProcessor(tokenizer, eos_token_ids, max_boxes=expected_boxes, geometry=geometry)
+        ])
+    return stopping_criteria, generate_kwargs
+
+
+def _attach_first_token_timer(generate_kwargs: dict, started: float):
+    """向 `generate` 的 logits 处理器中追加首 token 计时器，并重置峰值显存统计（仅在遥测开启时调用）。"""
+    from transformers import LogitsProcessorList
+    from .decoding_utils import FirstTokenTimer
+
+    timer = FirstTokenTimer(started)
+    generate_kwargs["logits_processor"] = LogitsProcessorList([*generate_kwargs.get("logits_processor", []), timer])
+    telemetry.reset_peak_memory()
+    return timer
+
+
+def _record_generation(span, processor, inputs, generated_ids, first_token_timer):
+    """把一次 generate 的 token 数、首 token 延迟和峰值内存记录到 span 上。"""
+    merge_length = processor.image_processor.merge_size ** 2
+    pad_token_id = processor.tokenizer.pad_token_id
+    span.set(
+        prompt_tokens=int(inputs["attention_mask"].sum()),
+        visual_tokens=int(inputs["image_grid_thw"].prod(dim=-1).sum()) // merge_length,
+        generated_tokens=sum(int((ids != pad_token_id).sum()) for ids in generated_ids),
+        **telemetry.peak_memory(),
     )
-    
-    # 绘制一个小的实心点表示精确的点击中心
-    center_radius = radius * 0.2
-    overlay_draw.ellipse(
-        [(point[0] - center_radius, point[1] - center_radius), 
-         (point[0] + center_radius, point[1] + center_radius)],
-        fill=(0, 255, 0, 255) # 绿色实心点
+    if first_token_timer.ttft_ms is not None:
+        span.set(ttft_ms=first_token_timer.ttft_ms)
+
+
+def _apply_early_stopping(output_texts, stopping_criteria):
+    """为早停的输出补全闭合括号，使下游解析结果与完整解码时一致，并报告最多节省的 token 数。"""
+    if stopping_criteria is None:
+        return output_texts
+    completed = []
+    for i, text in enumerate(output_texts):
+        completed.append(text + stopping_criteria.closing_suffix(i))
+        if stopping_criteria.early_stopped(i):
+            logger.info("[早停] 任务 %d 已输出完整结果，最多节省 %d 个 token。", i, stopping_criteria.max_tokens_saved(i))
+    return completed
+
+
+@telemetry.traced("inference_batch")
+def inference_batch(
+    model,
+    processor,
+    jobs: list,
+    max_new_tokens: int = 1024,
+    expected_boxes=None,
+    stats: list = None,
+    constrained: bool = False,
+    min_pixels: int = None,
+    max_pixels: int = None,
+    preprocess_cache: "PreprocessCache" = None
+) -> list[tuple[str, int, int]]:
+    """
+    将多个 (图像, 提示) 任务填充(padding)到同一次 `model.generate` 调用中批量推理，
+    再把结果按任务拆分返回。
+
+    批大小为 1 时，其行为与 `inference` 完全一致（`inference` 本身即调用本函数）。
+
+    Args:
+        model: 已加载的VLLM模型。
+        processor: 对应的处理器，用于文本和图像的预处理。
+        jobs (list): 任务列表，每个元素为 (image_path, prompt, system_prompt) 三元组。
+            image_path 也可以是已加载的 Pillow 图像（例如截图中裁剪出的区域）。
+        max_new_tokens (int, optional): 模型生成新文本的最大长度。
+        expected_boxes (int | list, optional): 期望的边界框数量（可按任务分别指定）。
+            提供时启用早停：输出中出现该数量的完整 `bbox_2d` 对象后立即停止解码，并补全 JSON 的闭合括号。
+        stats (list, optional): 若提供，会为每个任务追加一条
+            {"generated_tokens", "max_tokens_saved", "early_stopped"} 统计信息。
+            `max_tokens_saved` 是相对于解码到 `max_new_tokens` 的上界，见 `JsonCompletionStoppingCriteria.max_tokens_saved`。
+        constrained (bool | str, optional): 是否启用定位 JSON 的约束解码。为 True 或 "box" 时输出必然是
+            `[{"bbox_2d": [x1, y1, x2, y2], "label": "..."}]` 格式的合法 JSON，为 "point" 时必然是
+            `[{"point_2d": [x, y], "label": "..."}]`（配合 `POINT_JSON_PROMPT_TEMPLATE`），坐标均为整数。
+        min_pixels (int, optional): 图像像素数下限，见 `resize_to_pixel_budget`。
+        max_pixels (int, optional): 图像像素数上限。设置较小的值可以显著减少视觉 token 数。
+        preprocess_cache (PreprocessCache, optional): 图像预处理结果的磁盘缓存。命中时跳过 PNG 解码与
+            缩放/归一化，直接以内存映射方式加载 `pixel_values`。
+
+    Returns:
+        list[tuple[str, int, int]]: 与 `jobs` 一一对应，每项为
+            (模型生成的文本输出, 模型内部处理时使用的图像高度, 模型内部处理时使用的图像宽度)。
+    """
+    if not jobs:
+        return []
+
+    if is_remote_model(model):
+        # 模型常驻在推理服务中：整批任务转发给服务端执行
+        return model.inference_batch(
+            jobs, stats=stats, max_new_tokens=max_new_tokens, expected_boxes=expected_boxes,
+            constrained=constrained, min_pixels=min_pixels, max_pixels=max_pixels
+        )
+
+    started = time.perf_counter()
+    span = telemetry.current_span()
+    span.set(batch_size=len(jobs))
+
+    # 1. 加载图像并构建每个任务的聊天模板文本。
+    #    使用预处理缓存时先不加载图像：聊天模板只需要知道这里有一张图像。
+    images = []
+    prompt_texts = []
+    for image_path, prompt, system_prompt in jobs:
+        if preprocess_cache is not None:
+            image = image_path
+        else:
+            image = _load_image(image_path)
+            if min_pixels is not None or max_pixels is not None:
+                image = resize_to_pixel_budget(image, min_pixels, max_pixels)
+        messages = _build_messages(image, prompt, system_prompt)
+        prompt_text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        logger.debug("--- 模型输入文本 ---\n%s", prompt_text)
+        images.append(image)
+        prompt_texts.append(prompt_text)
+
+    # 2. 批量预处理。decoder-only 模型批量生成时必须左侧填充，
+    #    否则较短序列的新 token 会接在 padding 之后，导致输出错乱。
+    tokenizer = processor.tokenizer
+    original_padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        with telemetry.span("preprocess", cached=preprocess_cache is not None):
+            if preprocess_cache is not None:
+                inputs = _cached_processor_inputs(
+                    processor, images, prompt_texts, min_pixels, max_pixels, preprocess_cache
+                ).to(model.device)
+            else:
+                inputs = processor(text=prompt_texts, images=images, padding=True, return_tensors="pt").to(model.device)
+    finally:
+        tokenizer.padding_side = original_padding_side
+
+    # 3. 一次 generate 调用完成整批推理
+    stopping_criteria, generate_kwargs = _generation_controls(
+        model, tokenizer, max_new_tokens, expected_boxes, constrained
     )
+    first_token_timer = _attach_first_token_timer(generate_kwargs, started) if telemetry.enabled() else None
+    with telemetry.span("generate"):
+        output_ids = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, **generate_kwargs)
 
-    # 4. 合并原图和叠加层
-    combined = Image.alpha_composite(image, overlay)
-    
-    # 5. 保存为RGB格式的图片
-    rgb_image = combined.convert('RGB')
-    
-    # 确保输出目录存在
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    rgb_image.save(output_path)
-    
-    print(f"🖼️  可视化结果已保存至: {output_path}")
+    # 4. 从输出中分离出新生成的部分（左填充后每行输入长度相同）
+    generated_ids = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, output_ids)
+    ]
+    output_texts = processor.batch_decode(generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
 
+    output_texts = _apply_early_stopping(output_texts, stopping_criteria)
+    if first_token_timer is not None:
+        _record_generation(span, processor, inputs, generated_ids, first_token_timer)
+    if stats is not None:
+        pad_token_id = tokenizer.pad_token_id
+        for i, ids in enumerate(generated_ids):
+            stats.append({
+                "generated_tokens": int((ids != pad_token_id).sum()),
+                "max_tokens_saved": stopping_criteria.max_tokens_saved(i) if stopping_criteria else 0,
+                "early_stopped": bool(stopping_criteria and stopping_criteria.early_stopped(i)),
+            })
 
-# --- 模型推理函数 ---
+    # 5. 按任务拆分结果。`image_grid_thw` 的第 i 行对应第 i 张图像的网格 [T, H, W]，
+    #    乘以处理器的 patch_size 即为模型输入尺寸（见 `boxes.input_sizes`）。
+    from .boxes import input_sizes
+
+    results = []
+    for output_text, (input_height, input_width) in zip(output_texts, input_sizes(inputs['image_grid_thw'], processor).tolist()):
+        logger.debug("--- 模型原始输出 ---\n%s", output_text)
+        results.append((output_text, input_height, input_width))
+
+    return results
 
+
+@telemetry.traced("inference")
 def inference(
     model, 
     processor, 
     image_path: str, 
     prompt: str, 
     system_prompt: str = "You are a helpful assistant.", 
-    max_new_tokens: int = 1024
+    max_new_tokens: int = 1024,
+    prefix_cache: "PrefixCache" = None,
+    expected_boxes: int = None,
+    stats: list = None,
+    constrained: bool = False,
+    min_pixels: int = None,
+    max_pixels: int = None,
+    preprocess_cache: "PreprocessCache" = None
 ) -> tuple[str, int, int]:
     """
     使用指定的VLLM模型和处理器执行端到端的推理。
 
+    传入 `prefix_cache` 时启用前缀复用模式：同一张图像上的 "system + 图像" 前缀只预填充一次，
+    之后的指令只需预填充各自的文本。该模式下用户消息中图像位于文本之前。
+
     Args:
         model: 已加载的VLLM模型。
         processor: 对应的处理器，用于文本和图像的预处理。
-        image_path (str): 本地图像文件的路径。
+        image_path (str): 本地图像文件的路径，也可以是已加载的 Pillow 图像。
         prompt (str): 向模型提出的文本问题或指令。
         system_prompt (str, optional): 系统提示，用于设定模型的角色或行为。
         max_new_tokens (int, optional): 模型生成新文本的最大长度。
+        prefix_cache (PrefixCache, optional): 前缀 KV 缓存。为 None 时不启用复用。
+        expected_boxes (int, optional): 期望的边界框数量，提供时启用 JSON 完整即停止的早停。
+        stats (list, optional): 若提供，会追加一条生成统计信息（见 `inference_batch`）。
+        constrained (bool | str, optional): 是否启用定位 JSON 的约束解码（见 `inference_batch`）。
+        min_pixels (int, optional): 图像像素数下限（见 `resize_to_pixel_budget`）。
+        max_pixels (int, optional): 图像像素数上限，用于控制视觉 token 数。
+        preprocess_cache (PreprocessCache, optional): 图像预处理结果的磁盘缓存（见 `inference_batch`）；
+            前缀复用模式下用于前缀未命中时的预填充。
 
     Returns:
         tuple[str, int, int]:
@@ -226,45 +599,265 @@ def inference(
             - int: 模型内部处理时使用的图像高度。
             - int: 模型内部处理时使用的图像宽度。
     """
-    # 1. 加载图像
-    image = Image.open(image_path)
+    if prefix_cache is not None and is_remote_model(model):
+        # 前缀缓存中的 KV 张量位于服务进程内，由服务端常驻的前缀缓存负责复用
+        return model.inference_batch(
+            [(image_path, prompt, system_prompt)], stats=stats, prefix_cache=True,
+            max_new_tokens=max_new_tokens, expected_boxes=expected_boxes,
+            constrained=constrained, min_pixels=min_pixels, max_pixels=max_pixels
+        )[0]
+
+    if prefix_cache is not None:
+        started = time.perf_counter()
+        frame = as_frame(image_path)
+        image = frame.image
+        if min_pixels is not None or max_pixels is not None:
+            image = resize_to_pixel_budget(image, min_pixels, max_pixels)
+        stopping_criteria, generate_kwargs = _generation_controls(
+            model, processor.tokenizer, max_new_tokens, expected_boxes, constrained
+        )
+        first_token_timer = _attach_first_token_timer(generate_kwargs, started) if telemetry.enabled() else None
+        prefix_inputs = None
+        if preprocess_cache is not None:
+            # 前缀未命中时，图像部分取自预处理缓存（例如后台预取的结果），不在这里重新预处理
+            def prefix_inputs(prefix_text):
+                return _cached_processor_inputs(
+                    processor, [frame], [prefix_text], min_pixels, max_pixels, preprocess_cache
+                )
+        from .prefix_cache import generate_with_prefix_cache
+        output_text, grid_thw, generated_ids = generate_with_prefix_cache(
+            model, processor, image, prompt, system_prompt,
+            cache=prefix_cache,
+            image_key=frame.digest if image is frame.image else image_digest(image),
+            max_new_tokens=max_new_tokens,
+            generate_kwargs=generate_kwargs,
+            prefix_inputs=prefix_inputs
+        )
+        output_text = _apply_early_stopping([output_text], stopping_criteria)[0]
+        if first_token_timer is not None:
+            span = telemetry.current_span()
+            span.set(prefix_cache=True, **telemetry.peak_memory())
+            if first_token_timer.ttft_ms is not None:
+                span.set(ttft_ms=first_token_timer.ttft_ms)
+        if stats is not None:
+            stats.append({
+                "generated_tokens": int((generated_ids != processor.tokenizer.pad_token_id).sum()),
+                "max_tokens_saved": stopping_criteria.max_tokens_saved(0) if stopping_criteria else 0,
+                "early_stopped": bool(stopping_criteria and stopping_criteria.early_stopped(0)),
+            })
+        from .boxes import input_sizes
+        input_height, input_width = input_sizes(grid_thw, processor)[0].tolist()
+        return output_text, input_height, input_width
+
+    # 单任务推理即批大小为 1 的批量推理
+    return inference_batch(
+        model,
+        processor,
+        [(image_path, prompt, system_prompt)],
+        max_new_tokens=max_new_tokens,
+        expected_boxes=expected_boxes,
+        stats=stats,
+        constrained=constrained,
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
+        preprocess_cache=preprocess_cache
+    )[0]
+
+
+@telemetry.traced("chat_batch")
+def chat_batch(model, processor, items: list, max_new_tokens: int = 1024) -> list[str]:
+    """
+    批量通用图文问答：不带系统提示，图像位于文本之前，贪心解码。
 
-    # 2. 构建符合模型聊天模板的输入消息格式
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image", "image": image}
-            ]
-        }
+    Args:
+        model: 已加载的VLLM模型，或推理服务客户端。
+        processor: 对应的处理器（使用推理服务时可为 None）。
+        items (list): (image, prompt) 二元组列表，image 为图像路径或已加载的图像。
+        max_new_tokens (int, optional): 生成文本的最大长度。
+
+    Returns:
+        list[str]: 与 `items` 一一对应的文本回答。
+    """
+    if not items:
+        return []
+    if is_remote_model(model):
+        return [model.chat(image, prompt, max_new_tokens=max_new_tokens) for image, prompt in items]
+
+    started = time.perf_counter()
+    images = []
+    prompt_texts = []
+    for image, prompt in items:
+        image = _load_image(image)
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "image": image},
+                    {"type": "text", "text": prompt},
+                ],
+            }
+        ]
+        prompt_texts.append(processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+        images.append(image)
+
+    tokenizer = processor.tokenizer
+    original_padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        inputs = processor(text=prompt_texts, images=images, padding=True, return_tensors="pt").to(model.device)
+    finally:
+        tokenizer.padding_side = original_padding_side
+
+    generate_kwargs = {}
+    first_token_timer = _attach_first_token_timer(generate_kwargs, started) if telemetry.enabled() else None
+    with telemetry.span("generate"):
+        generated_ids = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, **generate_kwargs)
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
     ]
+    if first_token_timer is not None:
+        _record_generation(telemetry.current_span(), processor, inputs, generated_ids_trimmed, first_token_timer)
+    return processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
 
-    # 3. 应用聊天模板，生成模型可以直接处理的文本输入
-    prompt_text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    print("--- 模型输入文本 ---\n", prompt_text)
 
-    # 4. 使用处理器对文本和图像进行预处理，转换为模型所需的张量格式
-    inputs = processor(text=[prompt_text], images=[image], padding=True, return_tensors="pt").to(model.device)
+def chat(model, processor, image, prompt: str, max_new_tokens: int = 1024) -> str:
+    """
+    通用图文问答：不带系统提示，图像位于文本之前，贪心解码。
 
-    # 5. 执行模型生成（推理）
-    output_ids = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
-    
-    # 6. 从输出中分离出新生成的部分
-    generated_ids = [
-        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, output_ids)
+    Args:
+        model: 已加载的VLLM模型，或推理服务客户端。
+        processor: 对应的处理器（使用推理服务时可为 None）。
+        image (str | Image.Image): 图像路径或已加载的图像。
+        prompt (str): 用户的文本提问。
+        max_new_tokens (int, optional): 生成文本的最大长度。
+
+    Returns:
+        str: 模型生成的文本回答。
+    """
+    if is_remote_model(model):
+        return model.chat(image, prompt, max_new_tokens=max_new_tokens)
+    return chat_batch(model, processor, [(image, prompt)], max_new_tokens=max_new_tokens)[0]
+
+
+# --- 分块推理 ---
+
+def split_into_tiles(width: int, height: int, tile_size: int = 896, overlap: int = 128) -> list[tuple[int, int, int, int]]:
+    """
+    把 width x height 的画面切分为相互重叠的方形图块。
+
+    相邻图块重叠 `overlap` 像素，保证落在切分线上的元素至少在一个图块中是完整的。
+    最后一行/列的图块贴齐画面边缘，因此所有图块（画面本身更小时除外）尺寸相同。
+
+    Args:
+        width (int): 画面宽度。
+        height (int): 画面高度。
+        tile_size (int, optional): 图块边长（像素）。
+        overlap (int, optional): 相邻图块的重叠宽度（像素），必须小于 `tile_size`。
+
+    Returns:
+        list[tuple[int, int, int, int]]: 每个图块的 (left, top, right, bottom)。
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"overlap 必须在 [0, tile_size) 内: overlap={overlap}, tile_size={tile_size}")
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        count = math.ceil((length - overlap) / stride)
+        positions = [i * stride for i in range(count)]
+        positions[-1] = length - tile_size
+        return positions
+
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height)
+        for left in starts(width)
     ]
-    
-    # 7. 将生成的token IDs解码为可读的文本
-    output_text = processor.batch_decode(generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-    print("\n--- 模型原始输出 ---\n", output_text[0])
-
-    # 8. 获取模型处理图像时内部使用的网格尺寸，并计算出归一化坐标系的基准宽高。
-    # `image_grid_thw` 包含了图像被切分成网格的信息 [T, H, W]。
-    # 这里的 `14` 很可能是模型使用的patch_size(图像块大小)，这是一个与模型架构相关的硬编码值。
-    # 不同的模型可能有不同的patch_size。
-    input_height = inputs['image_grid_thw'][0][1] * 14
-    input_width = inputs['image_grid_thw'][0][2] * 14
-
-    return output_text[0], input_height, input_width
\ No newline at end of file
+
+
+def nms_boxes(boxes, scores, iou_threshold: float = 0.5) -> list[int]:
+    """
+    向量化的非极大值抑制 (NMS)，见 `boxes.nms`。
+
+    Args:
+        boxes: 形如 (N, 4) 的 [x1, y1, x2, y2] 坐标。
+        scores: 长度为 N 的得分，得分高者优先保留。
+        iou_threshold (float, optional): IoU 超过该值的框视为重复。
+
+    Returns:
+        list[int]: 保留下来的框的下标，按得分从高到低排列。
+    """
+    from .boxes import nms
+    return nms(boxes, scores, iou_threshold)
+
+
+@telemetry.traced("inference_tiled")
+def inference_tiled(
+    model,
+    processor,
+    image,
+    prompt: str,
+    system_prompt: str = "You are a helpful assistant.",
+    tile_size: int = 896,
+    overlap: int = 128,
+    batch_size: int = 4,
+    iou_threshold: float = 0.5,
+    max_new_tokens: int = 1024
+) -> "BoxSet":
+    """
+    分块推理：把高分辨率截图切分为重叠图块，批量定位后映射回全局坐标并用 NMS 合并重复结果。
+
+    每个图块的像素数不超过 tile_size^2，每次 `generate` 最多处理 `batch_size` 个图块，
+    因此单次调用的预填充显存与画面大小无关；小图标也不会因为整图缩放而丢失。
+
+    Args:
+        model: 已加载的VLLM模型。
+        processor: 对应的处理器。
+        image (str | Image.Image): 截图路径或已加载的图像。
+        prompt (str): 定位提示（要求输出 bbox_2d JSON）。
+        system_prompt (str, optional): 系统提示。
+        tile_size (int, optional): 图块边长（像素）。
+        overlap (int, optional): 相邻图块的重叠宽度（像素）。
+        batch_size (int, optional): 每次 `generate` 调用处理的图块数。
+        iou_threshold (float, optional): NMS 的 IoU 阈值。
+        max_new_tokens (int, optional): 每个图块生成的最大 token 数。
+
+    Returns:
+        BoxSet: 合并后的边界框，位于原图像素坐标系，得分为框中心到所在图块中心的接近程度。
+            `to_json()` 后以原图尺寸作为输入尺寸即可交给 `plot_bounding_boxes` 绘制。
+    """
+    import numpy as np
+    from .boxes import BoxSet
+
+    frame = as_frame(image)
+    image = frame.image.convert("RGB")
+    tiles = split_into_tiles(image.width, image.height, tile_size, overlap)
+    logger.info("[分块推理] 画面 %dx%d 切分为 %d 个图块 (边长 %d, 重叠 %d)", image.width, image.height, len(tiles), tile_size, overlap)
+
+    # 1. 按 batch_size 分批推理，每个图块的像素数不超过 tile_size^2
+    outputs = []
+    for start in range(0, len(tiles), batch_size):
+        jobs = [(image.crop(region), prompt, system_prompt) for region in tiles[start:start + batch_size]]
+        outputs.extend(inference_batch(
+            model, processor, jobs, max_new_tokens=max_new_tokens, max_pixels=tile_size * tile_size
+        ))
+
+    # 2. 图块坐标 -> 全局坐标。得分取框中心到图块中心的接近程度：
+    #    重叠区内同一元素的多个检测结果中，离图块边缘最远（最不可能被截断）的那个优先保留。
+    tile_boxes = []
+    for (left, top, right, bottom), (text, input_height, input_width) in zip(tiles, outputs):
+        boxes = BoxSet.from_response(text, input_height, input_width).to_pixels(
+            size=(right - left, bottom - top), offset=(left, top)
+        )
+        offsets = np.abs(boxes.centers - [(left + right) / 2, (top + bottom) / 2]) / [right - left, bottom - top]
+        boxes.scores = 1.0 - offsets.max(axis=1)
+        tile_boxes.append(boxes)
+    candidates = BoxSet.concat(tile_boxes, frame=frame)
+
+    # 3. 合并重叠区中的重复检测
+    merged = candidates.nms(iou_threshold)
+    logger.info("[分块推理] 共检测到 %d 个框，NMS 合并后保留 %d 个", len(candidates), len(merged))
+    return merged
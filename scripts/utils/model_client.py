@@ -0,0 +1,166 @@
+"""
+本模块提供常驻推理服务（见 `model_server.py`）的轻量客户端。
+
+客户端只依赖标准库和 Pillow，不导入 torch/transformers，也不加载模型：
+脚本启动时只需一次本地 HTTP 健康检查（毫秒级），即可把推理请求转发给已经加载好模型的服务进程。
+
+`ModelClient` 可以直接代替本地模型传给 `grounding_utils.inference`、`inference_batch`、`chat` 等函数，
+这些函数检测到远程模型后会透明地通过 HTTP 转发请求，调用方代码无需改动。
+"""
+
+import base64
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+
+from PIL import Image
+
+from . import telemetry
+from .frames import Frame, as_frame
+
+# 服务默认只监听本机回环地址
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 可通过环境变量指定服务地址，设置为空字符串可禁用服务探测
+SERVER_URL_ENV = "VLM_SERVER_URL"
+
+
+def default_server_url() -> str:
+    return os.environ.get(SERVER_URL_ENV, f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+
+
+def encode_image(image) -> dict:
+    """
+    把图像编码为可 JSON 序列化的描述。
+
+    服务与客户端运行在同一台机器上，图像路径直接传路径，由服务端读取；
+    内存中的图像（Pillow 图像、NumPy 数组、内存来源的 `Frame`，例如裁剪出的区域）编码为无损 PNG 后以 base64 传输。
+    """
+    if isinstance(image, Frame) and image.path is not None:
+        image = image.path
+    if isinstance(image, str):
+        return {"path": os.path.abspath(image)}
+    buffer = io.BytesIO()
+    as_frame(image).image.save(buffer, format="PNG")
+    return {"png": base64.b64encode(buffer.getvalue()).decode("ascii")}
+
+
+def decode_image(payload: dict) -> Image.Image:
+    """`encode_image` 的逆过程（服务端使用）。"""
+    if "path" in payload:
+        return Image.open(payload["path"])
+    return Image.open(io.BytesIO(base64.b64decode(payload["png"])))
+
+
+class ModelServerError(RuntimeError):
+    """推理服务返回错误或无法连接。"""
+
+
+class ModelClient:
+    """
+    常驻推理服务的客户端。
+
+    Args:
+        url (str, optional): 服务地址，默认取环境变量 `VLM_SERVER_URL` 或 http://127.0.0.1:8765。
+        timeout (float): 推理请求的超时时间（秒）。
+    """
+
+    # 供 grounding_utils 识别远程模型
+    is_remote = True
+
+    def __init__(self, url: str = None, timeout: float = 600.0):
+        self.url = (url or default_server_url()).rstrip("/")
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"ModelClient({self.url!r})"
+
+    # --- 底层请求 ---
+
+    def _request(self, path: str, payload: dict = None, timeout: float = None) -> dict:
+        data = None
+        headers = {}
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                body = json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode("utf-8")).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            raise ModelServerError(f"推理服务返回错误 ({e.code}): {message}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ModelServerError(f"无法连接推理服务 {self.url}: {e}") from e
+        return body
+
+    # --- 公共接口 ---
+
+    def health(self, timeout: float = 1.0) -> dict:
+        """查询服务健康状态。"""
+        return self._request("/health", timeout=timeout)
+
+    def stats(self) -> dict:
+        """查询服务的请求统计信息。"""
+        return self._request("/stats", timeout=5.0)
+
+    @telemetry.traced("remote_inference")
+    def inference_batch(self, jobs: list, stats: list = None, prefix_cache: bool = False, **options) -> list:
+        """
+        远程执行 `grounding_utils.inference_batch`。
+
+        Args:
+            jobs (list): (image, prompt, system_prompt) 三元组列表，image 为路径或 Pillow 图像。
+            stats (list, optional): 若提供，追加服务端返回的每个任务的生成统计
+                （仅前缀缓存模式；与其他请求合批执行时服务端不返回逐任务统计）。
+            prefix_cache (bool): 是否使用服务端常驻的前缀 KV 缓存（仅单任务请求）。
+            **options: 透传给 `inference_batch` 的参数，如 max_new_tokens、expected_boxes、max_pixels。
+
+        Returns:
+            list[tuple[str, int, int]]: 与本地 `inference_batch` 相同。
+        """
+        payload = {
+            "jobs": [
+                {"image": encode_image(image), "prompt": prompt, "system_prompt": system_prompt}
+                for image, prompt, system_prompt in jobs
+            ],
+            "options": options,
+            "prefix_cache": prefix_cache,
+        }
+        body = self._request("/inference", payload)
+        if stats is not None:
+            stats.extend(body.get("stats", []))
+        return [(r["text"], r["input_height"], r["input_width"]) for r in body["results"]]
+
+    def chat(self, image, prompt: str, max_new_tokens: int = 1024) -> str:
+        """远程执行 `grounding_utils.chat`（通用图文问答）。"""
+        payload = {"image": encode_image(image), "prompt": prompt, "max_new_tokens": max_new_tokens}
+        return self._request("/chat", payload)["text"]
+
+
+def is_remote_model(model) -> bool:
+    """判断传入的"模型"是否为推理服务客户端。"""
+    return getattr(model, "is_remote", False)
+
+
+def connect_model_server(url: str = None, timeout: float = 0.5):
+    """
+    探测本地推理服务。
+
+    Returns:
+        ModelClient | None: 服务可用时返回客户端，否则返回 None。
+    """
+    url = default_server_url() if url is None else url
+    if not url:
+        return None
+    client = ModelClient(url)
+    try:
+        health = client.health(timeout=timeout)
+    except ModelServerError:
+        return None
+    return client if health.get("status") == "ok" else None
@@ -4,66 +4,247 @@
 功能：
 1. 从 ModelScope 下载指定版本的 Qwen-VL 模型文件。
 2. 使用 Transformers 加载量化后的模型和对应的处理器。
-3. 实现单例模式（Singleton-like），确保在整个应用生命周期中模型只被加载一次，
-   避免重复占用显存和加载时间。
+3. 通过模块级的 `ModelRegistry`（见 `model_registry.py`）缓存已加载的模型：同一模型只加载一次，
+   不同模型 ID / 精度 / 设备可以共存，按 LRU、空闲超时和显存预算自动释放。
+4. `get_model_and_processor`: 优先连接常驻推理服务（见 `model_server.py`），跨进程复用已加载的模型。
+5. `preload_model_and_processor`: 在后台线程中提前加载，与入口脚本的其他准备工作重叠。
+
+torch、transformers、modelscope 只在真正加载模型时才导入，导入本模块本身几乎没有开销。
 """
 
-import torch
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
-from modelscope import snapshot_download
+import logging
 import os
+import threading
+from concurrent.futures import Future
+
+from . import telemetry
+from .model_client import connect_model_server
+from .model_registry import ModelRegistry, default_memory_budget
 
-# 在模块级别定义变量，用于缓存已加载的模型和处理器
-_model = None
-_processor = None
+logger = logging.getLogger(__name__)
+
+# 已连接的常驻推理服务客户端
+_client = None
+# 后台预加载：模型 ID -> Future
+_preloads = {}
+_preload_lock = threading.Lock()
 
 # 指定模型ID
 MODEL_ID = 'unsloth/Qwen2.5-VL-3B-Instruct-unsloth-bnb-4bit' # 原脚本使用的bnb-4bit版本
 
-def load_model_and_processor():
+# 检查点中的权重文件
+_WEIGHT_SUFFIXES = (".safetensors", ".bin")
+# 非量化检查点按目标精度换算占用：权重文件通常以 float32 / bfloat16 存储
+_DTYPE_BYTES = {"float32": 4, "float16": 2, "bfloat16": 2}
+
+
+def _load_pretrained(model_id: str, dtype: str, device: str):
+    """下载并加载一个模型及其处理器（注册表的加载函数）。"""
+    import torch
+    from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
+    from modelscope import snapshot_download
+
+    # --- 下载模型 ---
+    logger.info("正在从 ModelScope 下载模型: %s...", model_id)
+    model_dir = snapshot_download(model_id)
+    logger.info("模型已下载至: %s", model_dir)
+
+    # --- 加载模型 ---
+    logger.info("正在加载模型到设备...")
+    model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+        model_dir,
+        torch_dtype=getattr(torch, dtype),
+        device_map=device,
+        # attn_implementation="flash_attention_2",
+        trust_remote_code=True
+    )
+    logger.info("模型加载完成。")
+
+    # --- 加载处理器 ---
+    logger.info("正在加载处理器...")
+    processor = AutoProcessor.from_pretrained(model_dir, trust_remote_code=True)
+    logger.info("处理器加载完成。")
+    return model, processor
+
+
+def _quantized_bytes_per_param(model_id: str):
+    """bnb 量化检查点每个参数的字节数；非量化检查点返回 None。"""
+    name = model_id.lower()
+    if "4bit" in name:
+        return 0.5
+    if "8bit" in name:
+        return 1
+    return None
+
+
+def _weight_bytes(model_dir: str) -> int:
+    total = 0
+    for root, _, files in os.walk(model_dir):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files if name.endswith(_WEIGHT_SUFFIXES))
+    return total
+
+
+def _count_parameters(config: dict) -> int:
+    """按 Qwen2.5-VL 的 config.json 估算参数量（语言模型 + 视觉编码器，忽略偏置与归一化层）。"""
+    hidden = config["hidden_size"]
+    heads = config.get("num_attention_heads", 1)
+    kv_hidden = hidden * config.get("num_key_value_heads", heads) // heads
+    layer = 2 * hidden * hidden + 2 * hidden * kv_hidden + 3 * hidden * config["intermediate_size"]
+    embeddings = config["vocab_size"] * hidden * (1 if config.get("tie_word_embeddings") else 2)
+    total = config["num_hidden_layers"] * layer + embeddings
+
+    vision = config.get("vision_config") or {}
+    if vision.get("hidden_size"):
+        v_hidden = vision["hidden_size"]
+        v_inter = vision.get("intermediate_size", 4 * v_hidden)
+        total += vision.get("depth", 0) * (4 * v_hidden * v_hidden + 3 * v_hidden * v_inter)
+        merged = v_hidden * vision.get("spatial_merge_size", 2) ** 2
+        total += merged * merged + merged * vision.get("out_hidden_size", hidden)
+    return total
+
+
+def _estimate_checkpoint_bytes(model_id: str, dtype: str, device: str):
+    """
+    估算模型加载后的占用，不为估算而下载权重：
+    1. 检查点已在本地缓存中时，按权重文件的大小估算。量化检查点（如 bnb-4bit）按原样加载，文件大小即为占用；
+       其余检查点按目标精度与 bfloat16 的比例换算。
+    2. 否则只下载 config.json 与权重索引：索引中有权重总大小时按其估算，没有时按参数量 x 每参数字节数估算。
+    3. 元数据也无法获取（如离线）时返回 None，注册表只按条目数淘汰。
+    """
+    import json
+    from modelscope import snapshot_download
+
+    quantized = _quantized_bytes_per_param(model_id)
+    dtype_bytes = _DTYPE_BYTES.get(dtype, 2)
+
+    def scale(stored_bytes):
+        # 无法得知文件中的存储精度时，保守地假定为 bfloat16，目标精度更高时按比例放大
+        return stored_bytes if quantized else stored_bytes * dtype_bytes // 2
+
+    try:
+        model_dir = snapshot_download(model_id, local_files_only=True)
+    except Exception:
+        model_dir = None
+    if model_dir:
+        total = _weight_bytes(model_dir)
+        if total:
+            return scale(total)
+
+    try:
+        meta_dir = snapshot_download(model_id, allow_patterns=["config.json", "*.index.json"])
+        for name in os.listdir(meta_dir):
+            if name.endswith(".index.json"):
+                with open(os.path.join(meta_dir, name), "r", encoding="utf-8") as f:
+                    total = json.load(f).get("metadata", {}).get("total_size")
+                if total:
+                    return scale(int(total))
+        with open(os.path.join(meta_dir, "config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return int(_count_parameters(config) * (quantized or dtype_bytes))
+    except Exception as e:
+        logger.debug("无法估算模型 %s 的占用: %s", model_id, e)
+        return None
+
+
+# 进程内的模型注册表：默认最多同时驻留 2 个模型，空闲 10 分钟释放，显存预算为 GPU 总显存的 90%
+registry = ModelRegistry(
+    _load_pretrained,
+    estimate_bytes=_estimate_checkpoint_bytes,
+    max_models=2,
+    idle_timeout=600.0,
+    memory_budget_bytes=default_memory_budget,
+)
+
+
+@telemetry.traced("load_model_and_processor")
+def load_model_and_processor(model_id: str = MODEL_ID, dtype: str = "bfloat16", device: str = "auto"):
     """
     加载并返回Qwen-VL模型和处理器。
 
-    如果模型和处理器已经加载，则直接从缓存中返回，否则执行下载和加载过程。
+    如果模型和处理器已经加载，则直接从注册表中返回，否则执行下载和加载过程；
+    加载前若显存预算或驻留模型数不足，会先释放最久未使用的模型。
+
+    Args:
+        model_id (str): ModelScope 上的模型 ID，默认为 `MODEL_ID`。
+        dtype (str): 加载精度，如 "bfloat16"、"float16"。
+        device (str): 传给 `device_map` 的设备，如 "auto"、"cuda:0"、"cpu"。
 
     Returns:
         tuple: (model, processor)
                - model: 加载好的 Qwen2_5_VLForConditionalGeneration 模型实例。
                - processor: 加载好的 AutoProcessor 处理器实例。
     """
-    global _model, _processor
+    cached = registry.is_loaded(model_id, dtype, device)
+    if cached:
+        logger.debug("模型和处理器已加载，直接从缓存返回。")
+    model, processor = registry.get(model_id, dtype, device)
+    telemetry.current_span().set(model_id=model_id, cached=cached, **telemetry.peak_memory())
+    return model, processor
 
-    # 检查是否已经加载过，如果加载过则直接返回
-    if _model is not None and _processor is not None:
-        print("模型和处理器已加载，直接从缓存返回。")
-        return _model, _processor
+def get_model_and_processor(use_server: bool = True, model_id: str = MODEL_ID):
+    """
+    获取用于推理的模型和处理器。
 
-    # --- 下载模型 ---
-    print(f"正在从 ModelScope 下载模型: {MODEL_ID}...")
-    # 使用 atexit 确保在脚本退出时能看到下载进度条的完整输出
-    model_dir = snapshot_download(MODEL_ID)
-    print(f"模型已下载至: {model_dir}")
+    常驻推理服务正在运行时，返回其客户端 `(ModelClient, None)`，脚本无需加载模型即可推理；
+    否则回退到在当前进程内加载（`load_model_and_processor`）。
+    `grounding_utils` 中的推理函数对两种返回值的用法完全相同。
 
-    # --- 加载模型 ---
-    print("正在加载模型到设备...")
-    _model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-        model_dir,
-        torch_dtype=torch.bfloat16,
-        device_map="auto",
-        # attn_implementation="flash_attention_2",
-        trust_remote_code=True
-    )
-    print("模型加载完成。")
+    Args:
+        use_server (bool): 是否探测推理服务。推理服务只提供默认的 `MODEL_ID`，其他模型总是在本进程内加载。
+        model_id (str): 模型 ID。
+
+    Returns:
+        tuple: (model, processor)，使用推理服务时 processor 为 None。
+    """
+    with _preload_lock:
+        future = _preloads.pop(model_id, None)
+    if future is not None:
+        # 已在后台预加载：等待其完成（不再持有 Future，模型的生命周期交给注册表管理）
+        return future.result()
+    return _connect_or_load(use_server, model_id)
+
+
+def _connect_or_load(use_server: bool, model_id: str):
+    global _client
+
+    if use_server and model_id == MODEL_ID and not registry.is_loaded(model_id):
+        if _client is None:
+            _client = connect_model_server()
+            if _client is not None:
+                logger.info("已连接常驻推理服务: %s", _client.url)
+        if _client is not None:
+            return _client, None
+    return load_model_and_processor(model_id)
+
+
+def _run_preload(future: Future, model_id: str, use_server: bool):
+    try:
+        future.set_result(_connect_or_load(use_server, model_id))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+def preload_model_and_processor(model_id: str = MODEL_ID, use_server: bool = True) -> Future:
+    """
+    在后台线程中执行 `get_model_and_processor`，立即返回 Future。
+
+    入口脚本可以先调用本函数，再去解码截图、计算缓存键等；之后第一次调用 `get_model_and_processor`
+    时直接取用预加载的结果（尚未完成则等待），模型加载与这些准备工作得以重叠。
+    后台线程是守护线程，脚本最终没有用到模型时不会阻止进程退出。
+    """
+    with _preload_lock:
+        future = _preloads.get(model_id)
+        if future is None:
+            future = _preloads[model_id] = Future()
+            threading.Thread(
+                target=_run_preload, args=(future, model_id, use_server), name="model-preload", daemon=True
+            ).start()
+    return future
 
-    # --- 加载处理器 ---
-    print("正在加载处理器...")
-    _processor = AutoProcessor.from_pretrained(model_dir, trust_remote_code=True)
-    print("处理器加载完成。")
-    
-    return _model, _processor
 
 if __name__ == '__main__':
-    # 这个部分用于直接运行此文件时进行测试，确保加载功能正常
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # 加载功能自检。本模块使用相对导入，须以包的形式运行：在 scripts/ 目录下执行 `python -m utils.model_loader`
     print("正在测试模型加载功能...")
     model, processor = load_model_and_processor()
     
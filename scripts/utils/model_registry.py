@@ -0,0 +1,335 @@
+"""
+本模块实现多模型注册表 `ModelRegistry`：按需加载、按 LRU 与空闲超时淘汰，并遵守显存水位线。
+
+`model_loader` 过去只缓存一个固定 `MODEL_ID` 的模型，加载后永不释放。在同一个进程中交替使用
+3B 4-bit 模型与更大的检查点时，要么重复加载，要么几个模型同时常驻直至显存耗尽。注册表：
+1. 以 (模型 ID, 精度/量化方式, 设备) 为键缓存模型与处理器。
+2. 惰性加载且线程安全：同一个键并发请求时只加载一次，其余线程等待加载结果；已加载模型的获取不会被其他模型的加载阻塞。
+3. 超过 `max_models` 时淘汰最久未使用的模型；超过 `idle_timeout` 未被使用的模型由后台线程释放。
+4. 加载前估算新模型的占用，若 已驻留 + 新模型 会超过 `memory_budget_bytes`，先按 LRU 释放旧模型。
+
+被淘汰的模型只是从注册表中移除；仍在其他线程中执行推理的调用持有自己的引用，推理结束后内存才真正释放。
+长期持有模型的调用方（如常驻推理服务）应通过 `acquire` / `release`（或 `lease`）租用模型：
+被租用的模型不会被 LRU、空闲超时或显存预算淘汰，避免注册表"遗忘"仍在显存中的模型后再加载出第二份。
+"""
+
+import gc
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from . import telemetry
+
+
+class ModelKey(NamedTuple):
+    """模型在注册表中的键。"""
+    model_id: str
+    dtype: str
+    device: str
+
+
+class _Entry:
+    __slots__ = ("key", "model", "processor", "footprint_bytes", "last_used", "loaded_at", "leases")
+
+    def __init__(self, key, model, processor, footprint_bytes, leases: int = 0):
+        self.key = key
+        self.model = model
+        self.processor = processor
+        self.footprint_bytes = footprint_bytes
+        self.leases = leases
+        self.last_used = time.monotonic()
+        self.loaded_at = self.last_used
+
+
+def _release_memory():
+    """回收被释放模型的内存（torch 未导入时只做垃圾回收）。"""
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def default_memory_budget(fraction: float = 0.9):
+    """默认的显存预算：第一块 GPU 总显存的 `fraction`；没有 GPU 时返回 None（不限制）。"""
+    import torch
+    if not torch.cuda.is_available():
+        return None
+    return int(torch.cuda.get_device_properties(0).total_memory * fraction)
+
+
+class ModelRegistry:
+    """
+    多模型注册表。
+
+    Args:
+        loader (callable): `loader(model_id, dtype, device) -> (model, processor)`，执行实际加载。
+        estimate_bytes (callable, optional): `estimate_bytes(model_id, dtype, device) -> int`，
+            加载前估算模型占用；为 None 或返回 None 时按 0 处理（只按条目数淘汰）。
+            同一个键加载过一次后，改用实测的占用。
+        max_models (int): 同时驻留的模型数上限。
+        idle_timeout (float, optional): 模型超过该秒数未被使用即释放；为 None 时不按空闲时间淘汰。
+        memory_budget_bytes (int | callable, optional): 所有驻留模型的总占用上限；为 None 时不限制。
+            传入无参函数时在第一次加载前才求值（例如 `default_memory_budget`），避免导入时初始化 CUDA。
+    """
+
+    def __init__(self, loader, estimate_bytes=None, max_models: int = 2, idle_timeout: float = 600.0,
+                 memory_budget_bytes: int = None):
+        if max_models < 1:
+            raise ValueError("max_models 必须 >= 1")
+        self.loader = loader
+        self.estimate_bytes = estimate_bytes
+        self.max_models = max_models
+        self.idle_timeout = idle_timeout
+        self._memory_budget = memory_budget_bytes
+
+        self._entries = OrderedDict()
+        self._loading = set()     # 正在加载的键
+        self._reserved = {}       # 正在加载的键 -> 预留的字节数
+        self._footprints = {}     # 各键实测的占用，用于下次加载前的估算
+        self._lock = threading.Condition()
+        self._janitor = None
+        self._closed = threading.Event()
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = {"lru": 0, "idle": 0, "memory": 0, "manual": 0}
+
+    @property
+    def memory_budget_bytes(self):
+        if callable(self._memory_budget):
+            self._memory_budget = self._memory_budget()
+        return self._memory_budget
+
+    # --- 获取与加载 ---
+
+    def get(self, model_id: str, dtype: str = "bfloat16", device: str = "auto"):
+        """
+        获取模型与处理器，未加载时加载。
+
+        Returns:
+            tuple: (model, processor)
+        """
+        return self._get(ModelKey(model_id, dtype, device), lease=False)
+
+    def acquire(self, model_id: str, dtype: str = "bfloat16", device: str = "auto"):
+        """
+        获取模型并租用：`release` 之前该模型不会被自动淘汰。可多次租用，每次 `acquire` 对应一次 `release`。
+
+        Returns:
+            tuple: (model, processor)
+        """
+        return self._get(ModelKey(model_id, dtype, device), lease=True)
+
+    def release(self, model_id: str, dtype: str = "bfloat16", device: str = "auto"):
+        """归还一次 `acquire` 的租用；租用全部归还后，模型重新参与 LRU 与空闲超时淘汰。"""
+        key = ModelKey(model_id, dtype, device)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.leases > 0:
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+
+    @contextmanager
+    def lease(self, model_id: str, dtype: str = "bfloat16", device: str = "auto"):
+        """在 with 块内租用模型：`with registry.lease(model_id) as (model, processor): ...`"""
+        model, processor = self.acquire(model_id, dtype, device)
+        try:
+            yield model, processor
+        finally:
+            self.release(model_id, dtype, device)
+
+    def _get(self, key: ModelKey, lease: bool):
+        model_id, dtype, device = key
+        with self._lock:
+            while True:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.last_used = time.monotonic()
+                    entry.leases += int(lease)
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    telemetry.cache_lookup("model", True)
+                    return entry.model, entry.processor
+                if key not in self._loading:
+                    break
+                # 其他线程正在加载同一个模型：等待其完成后重新检查（加载失败时由本线程重试）
+                self._lock.wait()
+            telemetry.cache_lookup("model", False)
+            self._loading.add(key)
+
+        try:
+            estimate = self._estimate(key)
+            with self._lock:
+                self._make_room(estimate)
+                self._reserved[key] = estimate
+            with telemetry.span("model_registry_load", model_id=model_id, dtype=dtype, device=device):
+                model, processor = self.loader(model_id, dtype, device)
+            footprint = self._measure(model, estimate)
+        except BaseException:
+            with self._lock:
+                self._loading.discard(key)
+                self._reserved.pop(key, None)
+                self._lock.notify_all()
+            raise
+
+        with self._lock:
+            self._loading.discard(key)
+            self._reserved.pop(key, None)
+            self._footprints[key] = footprint
+            self._entries[key] = _Entry(key, model, processor, footprint, leases=int(lease))
+            self.loads += 1
+            self._evict_lru(keep=key)
+            self._lock.notify_all()
+        self._ensure_janitor()
+        return model, processor
+
+    def is_loaded(self, model_id: str, dtype: str = "bfloat16", device: str = "auto") -> bool:
+        with self._lock:
+            return ModelKey(model_id, dtype, device) in self._entries
+
+    def _estimate(self, key: ModelKey) -> int:
+        if key in self._footprints:
+            return self._footprints[key]
+        if self.estimate_bytes is None:
+            return 0
+        return self.estimate_bytes(*key) or 0
+
+    @staticmethod
+    def _measure(model, estimate: int) -> int:
+        get_footprint = getattr(model, "get_memory_footprint", None)
+        if get_footprint is None:
+            return estimate
+        try:
+            return int(get_footprint())
+        except Exception:
+            return estimate
+
+    # --- 淘汰 ---
+
+    def _resident_bytes(self) -> int:
+        return sum(e.footprint_bytes for e in self._entries.values()) + sum(self._reserved.values())
+
+    def _pop(self, key, reason: str) -> _Entry:
+        entry = self._entries.pop(key)
+        self.evictions[reason] += 1
+        telemetry.count("model_evictions", reason=reason, model_id=key.model_id)
+        return entry
+
+    def _lru_candidate(self, keep=None):
+        """（持有锁时调用）最久未使用、且未被租用的模型（`keep` 除外）；没有可淘汰的模型时返回 None。"""
+        return next((key for key, e in self._entries.items() if e.leases == 0 and key != keep), None)
+
+    def _make_room(self, incoming_bytes: int):
+        """
+        （持有锁时调用）按 LRU 释放模型，直到新模型能放进显存预算、且条目数留出空位。
+        被租用的模型不会释放；只剩被租用的模型时停止，新模型照常加载。
+        """
+        evicted = []
+        while len(self._entries) + len(self._reserved) >= self.max_models:
+            key = self._lru_candidate()
+            if key is None:
+                break
+            evicted.append(self._pop(key, "lru"))
+        if self.memory_budget_bytes is not None:
+            while self._resident_bytes() + incoming_bytes > self.memory_budget_bytes:
+                key = self._lru_candidate()
+                if key is None:
+                    break
+                evicted.append(self._pop(key, "memory"))
+        if evicted:
+            del evicted
+            _release_memory()
+
+    def _evict_lru(self, keep=None):
+        """（持有锁时调用）条目数超过上限时淘汰最久未使用、且未被租用的模型；刚加载的 `keep` 不淘汰。"""
+        evicted = False
+        while len(self._entries) > self.max_models:
+            key = self._lru_candidate(keep)
+            if key is None:
+                break
+            self._pop(key, "lru")
+            evicted = True
+        if evicted:
+            _release_memory()
+
+    def evict_idle(self) -> int:
+        """释放超过 `idle_timeout` 未被使用、且未被租用的模型，返回释放的数量。"""
+        if self.idle_timeout is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key for key, e in self._entries.items()
+                if e.leases == 0 and now - e.last_used > self.idle_timeout
+            ]
+            for key in idle:
+                self._pop(key, "idle")
+        if idle:
+            _release_memory()
+        return len(idle)
+
+    def unload(self, model_id: str, dtype: str = "bfloat16", device: str = "auto") -> bool:
+        """手动释放一个模型，返回它是否在注册表中。"""
+        key = ModelKey(model_id, dtype, device)
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._pop(key, "manual")
+        _release_memory()
+        return True
+
+    def clear(self):
+        """释放所有模型。"""
+        with self._lock:
+            for key in list(self._entries):
+                self._pop(key, "manual")
+        _release_memory()
+
+    # --- 后台空闲检查 ---
+
+    def _ensure_janitor(self):
+        if self.idle_timeout is None or self._janitor is not None:
+            return
+        with self._lock:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._janitor_loop, name="model-registry-janitor", daemon=True)
+                self._janitor.start()
+
+    def _janitor_loop(self):
+        interval = min(max(self.idle_timeout / 2, 1.0), 60.0)
+        while not self._closed.wait(interval):
+            self.evict_idle()
+
+    def close(self):
+        """停止后台线程并释放所有模型。"""
+        self._closed.set()
+        self.clear()
+
+    # --- 统计 ---
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            total = self.hits + self.loads
+            return {
+                "models": [
+                    {
+                        "model_id": e.key.model_id,
+                        "dtype": e.key.dtype,
+                        "device": e.key.device,
+                        "footprint_bytes": e.footprint_bytes,
+                        "idle_seconds": round(now - e.last_used, 1),
+                        "leases": e.leases,
+                    }
+                    for e in self._entries.values()
+                ],
+                "resident_bytes": self._resident_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loads": self.loads,
+                "hits": self.hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": dict(self.evictions),
+            }
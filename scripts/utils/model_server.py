@@ -0,0 +1,271 @@
+"""
+本模块实现常驻的本地推理服务。
+
+每个入口脚本单独运行时都要冷启动 torch/transformers 并调用 `from_pretrained`，模型加载往往比推理本身还慢。
+推理服务只加载一次模型并常驻显存，通过本机 HTTP 接口对外提供推理：
+
+- GET  /health     健康检查，返回 {"status": "ok", "model_id": ...}
+- GET  /stats      请求统计：各接口的请求数、错误数、平均延迟、并发数、前缀缓存命中、微批调度的批大小与 p50/p99 延迟等
+- GET  /metrics    Prometheus 文本格式的遥测指标：各环节耗时、token 数、首 token 延迟、缓存命中、峰值显存（见 `telemetry.py`）
+- POST /inference  定位推理，请求体见 `model_client.ModelClient.inference_batch`
+- POST /chat       通用图文问答，请求体见 `model_client.ModelClient.chat`
+
+服务基于 `ThreadingHTTPServer`，每个连接一个线程，健康检查和统计查询不会被推理阻塞。
+多个客户端并发提交的推理请求由 `BatchScheduler` 动态合并为微批，再交给 GPU 执行；
+所有 `generate` 调用由同一把锁串行化。
+
+启动方式（在项目根目录下执行）：
+    python scripts/serve_model.py --port 8765
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import telemetry
+from .grounding_utils import inference
+from .model_client import DEFAULT_HOST, DEFAULT_PORT, decode_image
+from .model_loader import MODEL_ID, registry
+from .prefix_cache import PrefixCache
+from .preprocess_cache import PreprocessCache
+from .scheduler import BatchScheduler
+
+# 可以按任务分别指定（以列表传入）的推理选项
+_PER_JOB_OPTIONS = ("expected_boxes",)
+
+
+def _job_options(options: dict, index: int) -> dict:
+    """取出第 `index` 个任务的推理选项：按任务分别指定的列表选项拆为该任务自己的值。"""
+    return {
+        key: value[index] if key in _PER_JOB_OPTIONS and isinstance(value, (list, tuple)) else value
+        for key, value in options.items()
+    }
+
+
+class _EndpointStats:
+    """单个接口的累计统计。"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        completed = max(self.requests, 1)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.total_seconds / completed * 1000, 2),
+        }
+
+
+class ModelService:
+    """
+    持有常驻模型的推理服务状态。
+
+    服务在整个生命周期内持有模型的引用，因此模型应当从注册表租用（`registry.acquire`，见 `serve`），
+    否则注册表按空闲超时淘汰后显存并不会释放，之后的加载还会再占一份。
+
+    Args:
+        model: 已加载的模型。
+        processor: 对应的处理器。
+        load_seconds (float): 模型加载耗时，用于统计展示。
+        prefix_cache_entries (int): 服务端常驻前缀缓存的条目数上限。
+        max_batch_size (int): 微批的最大请求数（见 `BatchScheduler`）。
+        max_queue_delay (float): 请求凑批的最长等待时间（秒）。
+        metrics (telemetry.PrometheusExporter, optional): 已注册的 Prometheus 导出器，由 /metrics 接口提供。
+    """
+
+    def __init__(self, model, processor, load_seconds: float = 0.0, prefix_cache_entries: int = 4,
+                 max_batch_size: int = 8, max_queue_delay: float = 0.02, metrics=None):
+        self.model = model
+        self.metrics = metrics
+        self.processor = processor
+        self.load_seconds = load_seconds
+        self.prefix_cache = PrefixCache(max_entries=prefix_cache_entries)
+        # 客户端反复提交的截图只做一次预处理
+        self.preprocess_cache = PreprocessCache()
+        self.started_at = time.time()
+
+        # generate 调用串行执行；统计信息由单独的锁保护
+        self._model_lock = threading.Lock()
+        self.scheduler = BatchScheduler(
+            model, processor, max_batch_size=max_batch_size, max_queue_delay=max_queue_delay,
+            model_lock=self._model_lock, preprocess_cache=self.preprocess_cache
+        )
+        self._stats_lock = threading.Lock()
+        self._endpoints = {}
+        self._in_flight = 0
+
+    # --- 请求处理 ---
+
+    def handle_inference(self, payload: dict) -> dict:
+        jobs = [
+            (decode_image(job["image"]), job["prompt"], job.get("system_prompt", "You are a helpful assistant."))
+            for job in payload["jobs"]
+        ]
+        options = payload.get("options", {})
+        stats = []
+        if payload.get("prefix_cache") and len(jobs) == 1:
+            # 前缀缓存复用需要独占模型，不参与合批
+            image, prompt, system_prompt = jobs[0]
+            with self._model_lock:
+                results = [inference(
+                    self.model, self.processor, image, prompt, system_prompt,
+                    prefix_cache=self.prefix_cache, stats=stats, **_job_options(options, 0)
+                )]
+        else:
+            # 每个任务单独进入调度队列，与其他客户端的并发请求一起合批；调度器按微批重建逐行的选项
+            futures = [
+                self.scheduler.submit_grounding(*job, **_job_options(options, index))
+                for index, job in enumerate(jobs)
+            ]
+            results = [future.result() for future in futures]
+        return {
+            "results": [
+                {"text": text, "input_height": input_height, "input_width": input_width}
+                for text, input_height, input_width in results
+            ],
+            "stats": stats,
+        }
+
+    def handle_chat(self, payload: dict) -> dict:
+        future = self.scheduler.submit_chat(
+            decode_image(payload["image"]), payload["prompt"], max_new_tokens=payload.get("max_new_tokens", 1024)
+        )
+        return {"text": future.result()}
+
+    def run(self, endpoint: str, handler, payload: dict) -> dict:
+        """执行一次推理请求，并记录总延迟。"""
+        received = time.perf_counter()
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            result = handler(payload)
+        except Exception:
+            self._record(endpoint, received, error=True)
+            raise
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+        self._record(endpoint, received)
+        return result
+
+    def _record(self, endpoint: str, received: float, error: bool = False):
+        with self._stats_lock:
+            stats = self._endpoints.setdefault(endpoint, _EndpointStats())
+            if error:
+                stats.errors += 1
+                return
+            stats.requests += 1
+            stats.total_seconds += time.perf_counter() - received
+
+    # --- 状态查询 ---
+
+    def health(self) -> dict:
+        return {"status": "ok", "model_id": MODEL_ID, "device": str(self.model.device)}
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "model_id": MODEL_ID,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "model_load_seconds": round(self.load_seconds, 1),
+                "in_flight": self._in_flight,
+                "endpoints": {name: s.as_dict() for name, s in self._endpoints.items()},
+                "prefix_cache": self.prefix_cache.stats(),
+                "preprocess_cache": self.preprocess_cache.stats(),
+                "scheduler": self.scheduler.stats(),
+                "model_registry": registry.stats(),
+            }
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """把 HTTP 请求分派到 `ModelService`。"""
+
+    service: ModelService = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.service.health())
+        elif self.path == "/stats":
+            self._send_json(200, self.service.stats())
+        elif self.path == "/metrics" and self.service.metrics is not None:
+            data = self.service.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": f"未知的接口: {self.path}"})
+
+    def do_POST(self):
+        handlers = {"/inference": self.service.handle_inference, "/chat": self.service.handle_chat}
+        handler = handlers.get(self.path)
+        if handler is None:
+            self._send_json(404, {"error": f"未知的接口: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            self._send_json(400, {"error": f"请求体不是合法的 JSON: {e}"})
+            return
+        try:
+            self._send_json(200, self.service.run(self.path, handler, payload))
+        except (KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"请求参数错误: {e!r}"})
+        except Exception as e:
+            self._send_json(500, {"error": repr(e)})
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 只打印推理请求，健康检查的轮询不刷屏
+        if "/health" not in self.requestline and "/metrics" not in self.requestline:
+            super().log_message(format, *args)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, prefix_cache_entries: int = 4,
+          max_batch_size: int = 8, max_queue_delay: float = 0.02):
+    """
+    加载模型并启动推理服务，阻塞直到进程被中断。
+
+    Args:
+        host (str): 监听地址。默认只监听本机回环地址，不对外暴露。
+        port (int): 监听端口。
+        prefix_cache_entries (int): 服务端前缀缓存的条目数上限。
+        max_batch_size (int): 微批的最大请求数。
+        max_queue_delay (float): 请求凑批的最长等待时间（秒）。
+    """
+    # 服务始终开启遥测：相对于 GPU 推理，记录开销可以忽略
+    metrics = telemetry.add_exporter(telemetry.PrometheusExporter())
+    start = time.perf_counter()
+    # 租用模型：服务常驻期间不会被注册表的空闲超时或 LRU 淘汰
+    model, processor = registry.acquire(MODEL_ID)
+    service = ModelService(
+        model, processor, time.perf_counter() - start, prefix_cache_entries,
+        max_batch_size=max_batch_size, max_queue_delay=max_queue_delay, metrics=metrics
+    )
+
+    handler = type("RequestHandler", (_RequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"推理服务已启动: http://{host}:{port} (模型加载耗时 {service.load_seconds:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n推理服务正在退出...")
+    finally:
+        server.server_close()
+        service.scheduler.close(wait=False)
+        registry.release(MODEL_ID)
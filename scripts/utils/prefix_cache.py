@@ -0,0 +1,263 @@
+"""
+本模块实现"系统提示 + 图像"公共前缀的 KV 缓存复用。
+
+背景：
+同一张截图上的多次定位（如阶段二对登录页的三次查询、阶段三中的重复查询），
+每次都要重新经过视觉编码器并对数千个图像 token 做预填充(prefill)。
+而这些请求的 "system prompt + 图像 token" 部分完全相同，只有最后的指令文本不同。
+
+做法：
+1. 缓存模式下，用户消息中图像放在文本之前，使 "system + 图像" 成为序列的公共前缀。
+2. 首次遇到某张图像时，对前缀做一次预填充，缓存其 KV(past_key_values) 与 mRoPE 的 rope_deltas。
+3. 之后同一图像上的新指令只需预填充各自的文本后缀。
+4. 缓存以图像内容哈希为键，按 LRU 策略限制条目数量，避免显存无限增长。
+5. 生成时直接复用缓存的 KV，结束后截回前缀长度，不复制整份缓存（见 `generate_with_prefix_cache`）。
+
+缓存可以在多个线程之间共享（如推理服务的请求线程）：条目表由缓存自身的锁保护；
+mRoPE 偏移量 `rope_deltas` 保存在模型对象上，"设置 rope_deltas + 生成 + 截回 KV" 按模型串行执行。
+"""
+
+import copy
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Qwen2.5-VL 聊天模板中图像占位区域的结束标记，其后即为指令文本
+VISION_END_TOKEN = "<|vision_end|>"
+
+# 模型 -> 该模型上前缀复用生成的锁
+_model_locks = weakref.WeakKeyDictionary()
+_model_locks_guard = threading.Lock()
+
+
+def _model_lock(model) -> threading.Lock:
+    """
+    返回模型对应的锁。生成前要把 `rope_deltas` 写到模型上，生成期间缓存条目的 KV 会临时追加后缀，
+    同一模型上的前缀复用生成（包括前缀预填充）必须串行，不同条目之间也不例外。
+    """
+    with _model_locks_guard:
+        lock = _model_locks.get(model)
+        if lock is None:
+            lock = _model_locks[model] = threading.Lock()
+        return lock
+
+
+class PrefixCacheEntry:
+    """
+    一条缓存的前缀：前缀 token、对应的 KV 缓存、rope_deltas 以及图像网格信息。
+    生成期间 KV 缓存会临时追加后缀，只能在持有模型锁（见 `_model_lock`）时使用。
+    """
+
+    def __init__(self, input_ids, past_key_values, rope_deltas, image_grid_thw):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.rope_deltas = rope_deltas
+        self.image_grid_thw = image_grid_thw
+
+    @property
+    def prefix_length(self) -> int:
+        return self.input_ids.shape[1]
+
+
+class PrefixCache:
+    """
+    有界 LRU 前缀缓存。
+
+    Args:
+        max_entries (int): 最多缓存的前缀条数。每条前缀的 KV 缓存大小与图像 token 数成正比，
+            应根据显存大小设置。
+    """
+
+    def __init__(self, max_entries: int = 4):
+        if max_entries < 1:
+            raise ValueError("max_entries 必须 >= 1")
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """查找前缀，命中时将其移到最近使用的位置。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        telemetry.cache_lookup("prefix", entry is not None)
+        return entry
+
+    def put(self, key, entry: PrefixCacheEntry):
+        """写入前缀，超出容量时淘汰最久未使用的条目。"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _set_rope_deltas(model, rope_deltas):
+    """
+    设置模型的 mRoPE 偏移量。
+
+    Qwen2.5-VL 只在预填充阶段根据图像网格计算 position_ids 并记录 `rope_deltas`，
+    之后的 token 位置 = cache_position + rope_deltas。跳过前缀预填充时必须手动恢复它。
+    """
+    for module in (model, getattr(model, "model", None)):
+        if module is not None and hasattr(module, "rope_deltas"):
+            module.rope_deltas = rope_deltas
+
+
+def _prefill_prefix(model, processor, image, prefix_text, prefix_inputs=None) -> PrefixCacheEntry:
+    """
+    对 "system + 图像" 前缀做一次预填充，返回可复用的缓存条目。
+    `prefix_inputs` 见 `generate_with_prefix_cache`。
+    """
+    if prefix_inputs is not None:
+        inputs = prefix_inputs(prefix_text)
+    else:
+        inputs = processor(text=[prefix_text], images=[image], return_tensors="pt")
+    inputs = inputs.to(model.device)
+    prefix_length = inputs.input_ids.shape[1]
+
+    # 只生成 1 个 token 即可得到前缀的完整 KV；生成的 token 本身未被前向，不在缓存中。
+    with telemetry.span("generate", prefill=True):
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=1,
+            do_sample=False,
+            return_dict_in_generate=True,
+        )
+    past_key_values = outputs.past_key_values
+    if hasattr(past_key_values, "crop"):
+        past_key_values.crop(prefix_length)
+
+    rope_deltas = getattr(model, "rope_deltas", None)
+    if rope_deltas is None:
+        rope_deltas = getattr(getattr(model, "model", None), "rope_deltas", None)
+
+    return PrefixCacheEntry(
+        input_ids=inputs.input_ids,
+        past_key_values=past_key_values,
+        rope_deltas=rope_deltas,
+        image_grid_thw=inputs["image_grid_thw"],
+    )
+
+
+def generate_with_prefix_cache(
+    model,
+    processor,
+    image,
+    prompt: str,
+    system_prompt: str,
+    cache: PrefixCache,
+    image_key: str,
+    max_new_tokens: int = 1024,
+    generate_kwargs: dict = None,
+    prefix_inputs=None
+):
+    """
+    复用缓存的 "system + 图像" 前缀执行一次生成，只对指令文本后缀做预填充。
+
+    Args:
+        model: 已加载的VLLM模型。
+        processor: 对应的处理器。
+        image (Image.Image): 已加载的图像。
+        prompt (str): 指令文本。
+        system_prompt (str): 系统提示。
+        cache (PrefixCache): 前缀缓存。
+        image_key (str): 图像内容哈希，作为缓存键的一部分。
+        max_new_tokens (int, optional): 模型生成新文本的最大长度。
+        generate_kwargs (dict, optional): 透传给 `model.generate` 的额外参数（停止准则、logits 处理器等）。
+        prefix_inputs (callable, optional): `prefix_inputs(prefix_text) -> BatchFeature`，前缀未命中时代替
+            `processor(text=..., images=...)` 构造模型输入，例如从预取的图像预处理结果中构造。
+
+    Returns:
+        tuple[str, torch.Tensor, torch.Tensor]: (模型生成的文本, 该图像的 image_grid_thw, 新生成的 token id)。
+    """
+    import torch
+
+    # 1. 图像在前、文本在后，使 "system + 图像" 成为可共享的前缀
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image", "image": image},
+                {"type": "text", "text": prompt}
+            ]
+        }
+    ]
+    full_text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    logger.debug("--- 模型输入文本 ---\n%s", full_text)
+
+    split = full_text.index(VISION_END_TOKEN) + len(VISION_END_TOKEN)
+    prefix_text, suffix_text = full_text[:split], full_text[split:]
+
+    # 2. 查找或建立前缀缓存。前缀文本中包含系统提示，不同系统提示不会互相命中。
+    #    预填充同样会改写模型上的 rope_deltas，因此从查找到生成结束都持有模型锁：
+    #    同一模型上不同条目的生成不会互相覆盖 rope_deltas，也不会有两个线程同时预填充同一前缀。
+    key = (image_key, prefix_text)
+    with _model_lock(model):
+        entry = cache.get(key)
+        if entry is None:
+            entry = _prefill_prefix(model, processor, image, prefix_text, prefix_inputs)
+            cache.put(key, entry)
+
+        # 3. 前缀以特殊 token 结尾，单独对后缀分词与整体分词结果一致
+        suffix_ids = processor.tokenizer(
+            suffix_text, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(entry.input_ids.device)
+        input_ids = torch.cat([entry.input_ids, suffix_ids], dim=1)
+        attention_mask = torch.ones_like(input_ids)
+
+        # 4. generate 会向传入的 KV 缓存追加后缀与新生成的 token。DynamicCache 每次追加都拼接出新的张量，
+        #    前缀部分不会被原地修改，因此直接复用缓存、结束后截回前缀长度即可，无需复制整份缓存；
+        #    不支持 crop 的缓存类型才退回到深拷贝。
+        past_key_values = entry.past_key_values
+        reuse = hasattr(past_key_values, "crop")
+        _set_rope_deltas(model, entry.rope_deltas)
+        try:
+            with telemetry.span("generate"):
+                output_ids = model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values if reuse else copy.deepcopy(past_key_values),
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    **(generate_kwargs or {}),
+                )
+        finally:
+            if reuse:
+                past_key_values.crop(entry.prefix_length)
+
+    generated_ids = output_ids[:, input_ids.shape[1]:]
+    output_text = processor.batch_decode(generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)[0]
+    logger.debug("--- 模型原始输出 ---\n%s", output_text)
+
+    return output_text, entry.image_grid_thw[0], generated_ids[0]
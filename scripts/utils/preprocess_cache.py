@@ -0,0 +1,286 @@
+"""
+本模块实现图像预处理结果（`pixel_values` 与 `image_grid_thw`）的磁盘缓存。
+
+每次推理都要经历 PNG 解码 -> 缩放 -> 归一化 -> 切分 patch 的完整预处理流程，
+即使同一张截图几秒前刚处理过。预处理缓存把处理器的输出按以下内容的哈希保存到磁盘：
+1. 图像来源的内容哈希（图像文件的原始字节，或内存图像的像素数据）。
+2. 请求指定的像素预算（min_pixels / max_pixels）。
+3. 处理器的像素相关配置（patch 大小、合并尺寸、像素范围、归一化参数等）。
+
+`pixel_values` 以 `.npy` 格式存储，读取时使用内存映射 (mmap)：
+后续调用以及其他进程无需解码 PNG，也无需把整个数组读入内存，直接以零拷贝方式构造张量。
+磁盘总大小有上限，超出时按最近使用时间淘汰。缓存可以在多个线程之间共享（例如推理服务的各个请求线程）。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import telemetry
+
+# 默认的磁盘缓存目录：项目根目录下的 .cache/preprocess
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '.cache', 'preprocess')
+
+# 影响 pixel_values 的处理器配置项
+_PROCESSOR_SETTINGS = (
+    "min_pixels", "max_pixels", "patch_size", "merge_size", "temporal_patch_size",
+    "do_resize", "resample", "do_rescale", "rescale_factor", "do_normalize", "image_mean", "image_std",
+    "do_convert_rgb",
+)
+
+
+def processor_fingerprint(image_processor) -> str:
+    """把处理器中影响像素输出的配置序列化为稳定的字符串。"""
+    settings = {name: getattr(image_processor, name, None) for name in _PROCESSOR_SETTINGS}
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def make_preprocess_key(source_hash: str, image_processor, min_pixels: int = None, max_pixels: int = None) -> str:
+    """
+    根据图像来源哈希、像素预算和处理器配置生成缓存键。
+    """
+    hasher = hashlib.sha256()
+    for part in (source_hash, f"{min_pixels}:{max_pixels}", processor_fingerprint(image_processor)):
+        encoded = part.encode("utf-8")
+        hasher.update(f"{len(encoded)}:".encode())
+        hasher.update(encoded)
+    return hasher.hexdigest()
+
+
+class PreprocessCache:
+    """
+    以内存映射数组存储的预处理结果磁盘缓存。
+
+    Args:
+        cache_dir (str): 缓存目录。
+        max_disk_bytes (int): 磁盘层的总大小上限（字节）。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_disk_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        # 保护命中统计与磁盘占用；文件读写本身不持锁（临时文件名按线程区分，替换是原子操作）
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+
+    # --- 公共接口 ---
+
+    def get(self, key: str):
+        """
+        读取缓存条目。
+
+        Returns:
+            tuple[np.ndarray, list[int]] | None: (以写时复制方式内存映射的 pixel_values, [T, H, W] 网格)，
+            未命中时返回 None。
+        """
+        pixel_path, meta_path = self._paths_for(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # mmap_mode="c"：写时复制，数组可写但修改不会落盘，可直接交给 torch.from_numpy 共享内存
+            pixel_values = np.load(pixel_path, mmap_mode="c")
+        except (FileNotFoundError, json.JSONDecodeError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            telemetry.cache_lookup("preprocess", False)
+            return None
+        # 更新修改时间，作为 LRU 淘汰的依据
+        try:
+            os.utime(pixel_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        telemetry.cache_lookup("preprocess", True)
+        return pixel_values, meta["grid_thw"]
+
+    def put(self, key: str, pixel_values: np.ndarray, grid_thw: list):
+        """
+        写入缓存条目。`pixel_values` 为单张图像的 (patch 数, patch 维度) 数组，`grid_thw` 为 [T, H, W]。
+        """
+        pixel_path, meta_path = self._paths_for(key)
+        os.makedirs(os.path.dirname(pixel_path), exist_ok=True)
+
+        # 元数据先于像素数组写入：像素文件存在即代表条目完整。两者都先写临时文件再原子替换；
+        # 临时文件名包含进程号与线程号，同一进程中并发写入同一条目的线程互不覆盖
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({"grid_thw": [int(v) for v in grid_thw], "created": time.time()}, f)
+        os.replace(meta_path + suffix, meta_path)
+        with open(pixel_path + suffix, "wb") as f:
+            np.save(f, np.ascontiguousarray(pixel_values))
+
+        with self._lock:
+            old_size = os.path.getsize(pixel_path) if os.path.exists(pixel_path) else 0
+            os.replace(pixel_path + suffix, pixel_path)
+            self._disk_bytes += os.path.getsize(pixel_path) - old_size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def clear(self):
+        """清空磁盘缓存。"""
+        with self._lock:
+            for path, _, _ in self._scan_disk():
+                self._remove_entry(path)
+            self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    # --- 磁盘层 ---
+
+    def _paths_for(self, key: str) -> tuple[str, str]:
+        # 以键的前两位作为子目录，避免单个目录下文件过多
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return f"{base}.npy", f"{base}.json"
+
+    # 以下方法修改 `_disk_bytes`，均在持有 `_lock` 时调用
+
+    def _remove_entry(self, pixel_path: str):
+        try:
+            size = os.path.getsize(pixel_path)
+            os.remove(pixel_path)
+            self._disk_bytes -= size
+        except OSError:
+            pass
+        try:
+            os.remove(pixel_path[:-len(".npy")] + ".json")
+        except OSError:
+            pass
+
+    def _scan_disk(self):
+        """返回所有条目的 (像素文件路径, 大小, 修改时间)。"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """按最近使用时间从旧到新删除条目，直到总大小低于上限。"""
+        entries = self._scan_disk()
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        entries.sort(key=lambda entry: entry[2])
+        for path, _, _ in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_entry(path)
+
+
+class PrefetchBuffer:
+    """
+    内存中的预取结果：后台线程提前完成的图像预处理，供 `inference_batch(..., preprocess_cache=buffer)` 使用。
+
+    接口与 `PreprocessCache` 相同（`get`/`put`），但只存在于内存中。同一张截图可能对应多条记录，
+    每条记录预取时 `acquire` 一次、推理结束后 `release` 一次，最后一条记录完成时才释放该截图的预处理结果。
+    同一截图的多条记录同时预取时，只有第一条执行预处理，其余等待其完成。
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._refs = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key: str, pixel_values, grid_thw):
+        with self._lock:
+            self._entries[key] = (pixel_values, list(grid_thw))
+            loading = self._loading.pop(key, None)
+        if loading is not None:
+            loading.set()
+
+    def acquire(self, key: str) -> bool:
+        """
+        登记一条使用 `key` 的记录。
+
+        Returns:
+            bool: 该键的预处理结果已存在（或已由其他线程完成）时为 True；为 False 时调用方负责预处理并 `put`，
+                  失败时须调用 `cancel`。
+        """
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + 1
+            if key in self._entries:
+                return True
+            loading = self._loading.get(key)
+            if loading is None:
+                self._loading[key] = threading.Event()
+                return False
+        loading.wait()
+        return True
+
+    def cancel(self, key: str):
+        """预处理失败：唤醒等待该键的线程（它们的记录在推理时按缓存未命中处理），并释放本条记录的引用。"""
+        with self._lock:
+            loading = self._loading.pop(key, None)
+        if loading is not None:
+            loading.set()
+        self.release([key])
+
+    def release(self, keys):
+        """每个键对应一条已完成的记录；引用计数归零的预处理结果被释放。"""
+        with self._lock:
+            for key in keys:
+                refs = self._refs.get(key, 0) - 1
+                if refs > 0:
+                    self._refs[key] = refs
+                else:
+                    self._refs.pop(key, None)
+                    self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def prepare(self, frame, image_processor, min_pixels: int = None, max_pixels: int = None) -> str:
+        """
+        为一条记录登记并（必要时）完成 `frame` 的图像预处理，返回其键。调用方用完后须 `release` 该键。
+
+        与 `grounding_utils._cached_processor_inputs` 未命中时的处理相同：先按像素预算缩放，再交给处理器。
+        """
+        from .grounding_utils import resize_to_pixel_budget
+
+        key = make_preprocess_key(frame.source_digest, image_processor, min_pixels, max_pixels)
+        if not self.acquire(key):
+            try:
+                image = frame.image
+                if min_pixels is not None or max_pixels is not None:
+                    image = resize_to_pixel_budget(image, min_pixels, max_pixels)
+                processed = image_processor(images=[image], return_tensors="np")
+            except Exception:
+                self.cancel(key)
+                raise
+            self.put(key, processed["pixel_values"], processed["image_grid_thw"][0].tolist())
+        return key
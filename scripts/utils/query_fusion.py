@@ -0,0 +1,161 @@
+"""
+本模块实现定位请求的查询融合 (query fusion)。
+
+阶段二的测试案例 4 表明，模型可以在一次回答中给出多个元素的边界框；而测试案例 1~3 在同一张登录页上
+分别发起三次完整的推理，图像被预填充了三次。查询融合把针对同一帧的多条定位指令合并为一个多目标提示：
+1. 按图像内容哈希分组，同一帧上的 N 条指令合并为一个提示，只需一次预填充、一次解码。
+2. 模型返回的边界框列表按标签分发回各条指令：先比较规范化后的标签（见 `element_index.normalize_label`），
+   再允许包含关系；标签都对不上、但框的数量与目标数一致时，按目标在提示中的顺序分配。
+3. 回答中缺失的目标回退为单独查询（所有回退查询合并为一次批量推理）。
+
+每条指令得到的结果与单独查询的格式相同：只含一个元素的 JSON 列表，以及模型输入尺寸，
+可直接交给 `plot_bounding_boxes` 或写入结果缓存。
+"""
+
+import logging
+import re
+
+from . import telemetry
+from .boxes import BoxSet
+from .element_index import normalize_label
+from .frames import as_frame
+from .grounding_utils import inference_batch
+
+logger = logging.getLogger(__name__)
+
+FUSED_PROMPT_TEMPLATE = """
+Locate each of the following elements in the image:
+{targets}
+Please provide a JSON list with exactly one bounding box per element, in the same order as above, and use the element's description above as its "label". The format should be:
+[
+  {{"bbox_2d": [x1, y1, x2, y2], "label": "element description"}}
+]
+"""
+
+# 指令开头表示"定位/点击"的动词，合并提示中只保留要找的元素本身
+_LEADING_VERB = re.compile(
+    r"^\s*(请|帮我)*\s*(定位|点击|单击|找到|找出|查找|选中|locate|find|click(\s+on)?|point\s+to)\s*(the\s+)?",
+    re.IGNORECASE,
+)
+
+
+def target_phrase(instruction: str) -> str:
+    """从定位指令中取出要找的元素，例如 "定位登录按钮" -> "登录按钮"。"""
+    phrase = _LEADING_VERB.sub("", instruction).strip().rstrip("。.!！")
+    return phrase or instruction.strip()
+
+
+def demultiplex(targets: list, labels: list) -> list:
+    """
+    把模型返回的边界框分配给各个目标。
+
+    Args:
+        targets (list[str]): 合并提示中各目标的描述，顺序与提示一致。
+        labels (list[str]): 模型返回的各边界框的标签（如 `BoxSet.labels`）。
+
+    Returns:
+        list[int | None]: 与 `targets` 一一对应的边界框下标，未能分配到边界框的目标为 None。
+    """
+    assigned = [None] * len(targets)
+    used = set()
+    target_keys = [normalize_label(t) for t in targets]
+    box_keys = [normalize_label(label) for label in labels]
+
+    # 1. 规范化后完全相同；2. 一方包含另一方
+    for exact in (True, False):
+        for i, target_key in enumerate(target_keys):
+            if assigned[i] is not None or not target_key:
+                continue
+            for j, box_key in enumerate(box_keys):
+                if j in used or not box_key:
+                    continue
+                if box_key == target_key if exact else (target_key in box_key or box_key in target_key):
+                    assigned[i] = j
+                    used.add(j)
+                    break
+
+    # 3. 模型给出的框数与目标数一致时，剩下的按顺序分配（模型被要求按提示中的顺序输出）
+    if len(labels) == len(targets):
+        for i in range(len(targets)):
+            if assigned[i] is None and i not in used:
+                assigned[i] = i
+                used.add(i)
+    return assigned
+
+
+@telemetry.traced("fused_grounding")
+def fused_grounding(model, processor, requests: list, prompt_template: str, system_prompt: str,
+                    max_new_tokens: int = 1024, stats: dict = None, **kwargs) -> list[tuple[str, int, int]]:
+    """
+    以查询融合的方式执行一组定位请求。
+
+    Args:
+        model: 已加载的VLLM模型（或推理服务客户端）。
+        processor: 对应的处理器。
+        requests (list): 每个元素为 (image, instruction)；image 可以是路径、Pillow 图像或 `Frame`。
+        prompt_template (str): 单条指令的提示模板（含 `{instruction}`），用于回退的单独查询。
+        system_prompt (str): 系统提示，融合查询与单独查询共用。
+        max_new_tokens (int): 单独查询生成的最大 token 数；融合查询按目标数放大。
+        stats (dict, optional): 若提供，会写入 {"requests", "fused_calls", "fused_targets", "fallbacks"}。
+        **kwargs: 透传给 `inference_batch` 的其他参数（如 `max_pixels`、`preprocess_cache`）。
+
+    Returns:
+        list[tuple[str, int, int]]: 与 `requests` 一一对应的 (模型输出, 输入高度, 输入宽度)。
+    """
+    # 同一张图像只解码、哈希一次
+    frames = {}
+    request_frames = []
+    groups = {}
+    for i, (image, _) in enumerate(requests):
+        frame = as_frame(image)
+        frame = frames.setdefault(frame.digest, frame)
+        request_frames.append(frame)
+        groups.setdefault(frame.digest, []).append(i)
+
+    results = [None] * len(requests)
+    fallback = [i for indices in groups.values() if len(indices) == 1 for i in indices]
+
+    # 1. 每一帧上的多条指令合并为一个提示；不同帧的融合提示放在同一次批量推理中
+    fused_groups = [indices for indices in groups.values() if len(indices) > 1]
+    if fused_groups:
+        jobs, group_targets = [], []
+        for indices in fused_groups:
+            targets = [target_phrase(requests[i][1]) for i in indices]
+            lines = "\n".join(f"{n}. {target}" for n, target in enumerate(targets, 1))
+            jobs.append((request_frames[indices[0]], FUSED_PROMPT_TEMPLATE.format(targets=lines), system_prompt))
+            group_targets.append(targets)
+        outputs = inference_batch(
+            model, processor, jobs, max_new_tokens=max_new_tokens * max(len(t) for t in group_targets),
+            expected_boxes=[len(t) for t in group_targets], **kwargs
+        )
+        for indices, targets, (response, input_height, input_width) in zip(fused_groups, group_targets, outputs):
+            boxes = BoxSet.from_response(response, input_height, input_width)
+            for i, j in zip(indices, demultiplex(targets, boxes.labels)):
+                if j is None:
+                    fallback.append(i)
+                else:
+                    # 与单独查询的结果格式相同：只含一个元素的 JSON 列表
+                    results[i] = boxes[j].to_json(), input_height, input_width
+
+    # 2. 单独的指令与融合回答中缺失的目标：逐条查询，合并为一次批量推理
+    missing = len(fallback) - sum(1 for indices in groups.values() if len(indices) == 1)
+    if missing:
+        logger.info("[查询融合] %d 个目标未出现在融合回答中，回退为单独查询。", missing)
+    if fallback:
+        fallback.sort()
+        jobs = [
+            (request_frames[i], prompt_template.format(instruction=requests[i][1]), system_prompt)
+            for i in fallback
+        ]
+        for i, output in zip(fallback, inference_batch(
+            model, processor, jobs, max_new_tokens=max_new_tokens, expected_boxes=1, **kwargs
+        )):
+            results[i] = output
+
+    fused_targets = sum(len(indices) for indices in fused_groups) - missing
+    telemetry.count("query_fusion_targets", value=fused_targets, result="fused")
+    telemetry.count("query_fusion_targets", value=len(fallback), result="individual")
+    if stats is not None:
+        stats.update(requests=len(requests), fused_calls=len(fused_groups), fused_targets=fused_targets,
+                     fallbacks=len(fallback))
+    return results
@@ -0,0 +1,283 @@
+"""
+本模块实现定位结果的标注渲染：只在标注所在的区域合成，编码与保存交给后台线程（或进程）池。
+
+过去每一步可视化都是同步的整帧操作：`draw_click_on_image` 把整张截图转换为 RGBA，分配一张同样大小的透明叠加层，
+对整帧做 alpha 合成再转换回 RGB，只为了画两个小圆；`plot_bounding_boxes` 在推理循环中同步编码并保存整张 PNG。
+渲染子系统把这些开销降到与标注大小相关：
+1. 标注 (`ClickMarker` / `BoxMarker` / `PointMarker`) 以原图像素坐标描述，一帧上的所有标注在一次 `compose` 中完成。
+2. 不透明的框与点直接绘制在 RGB 副本上；半透明的点击标记只裁剪出其外接矩形做 alpha 合成，再贴回原位，
+   结果与整帧合成逐像素一致。
+3. `AnnotationRenderer` 在后台执行合成、编码与保存，调用方立即得到一个 `Future`，智能体循环不再被阻塞。
+   输出格式与压缩级别可配置：PNG 默认使用较低的压缩级别，编码耗时远小于默认的级别 6。
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from . import telemetry
+from .frames import as_frame
+
+logger = logging.getLogger(__name__)
+
+# PNG 的 zlib 压缩级别 (0-9)。级别 1 的文件略大，但编码速度是默认级别 6 的数倍。
+DEFAULT_COMPRESS_LEVEL = 1
+DEFAULT_QUALITY = 90
+
+# 输出格式 -> 可接受的扩展名（第一个为替换时使用的扩展名）
+_FORMAT_EXTENSIONS = {"PNG": (".png",), "JPEG": (".jpg", ".jpeg"), "WEBP": (".webp",)}
+
+
+class ClickMarker(NamedTuple):
+    """模拟点击的位置：半透明的大圆表示点击区域，实心小圆表示点击中心。`radius` 为 None 时取画面短边的 2%。"""
+    x: float
+    y: float
+    radius: float = None
+    color: tuple = (255, 0, 0, 128)
+    center_color: tuple = (0, 255, 0, 255)
+
+
+class BoxMarker(NamedTuple):
+    """边界框及其标签，坐标为原图像素坐标系的 [x1, y1, x2, y2]。"""
+    x1: float
+    y1: float
+    x2: float
+    y2: float
+    label: str = ""
+    color: str = "red"
+    width: int = 4
+
+
+class PointMarker(NamedTuple):
+    """坐标点及其标签。`radius` 为 None 时取画面短边的 1%（至少 3 像素）。"""
+    x: float
+    y: float
+    label: str = ""
+    color: str = "red"
+    radius: float = None
+
+
+def _composite_click(canvas: Image.Image, marker: ClickMarker):
+    """只在点击标记的外接矩形内做 alpha 合成，并把结果贴回 `canvas` 的同一位置。"""
+    radius = marker.radius if marker.radius is not None else min(canvas.size) * 0.02
+    left, top = max(0, math.floor(marker.x - radius)), max(0, math.floor(marker.y - radius))
+    right = min(canvas.width, math.ceil(marker.x + radius) + 1)
+    bottom = min(canvas.height, math.ceil(marker.y + radius) + 1)
+    if left >= right or top >= bottom:
+        return
+
+    region = canvas.crop((left, top, right, bottom)).convert("RGBA")
+    overlay = Image.new("RGBA", region.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    # 在区域坐标系中绘制：整数平移不改变光栅化结果
+    x, y = marker.x - left, marker.y - top
+    draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill=marker.color)
+    center_radius = radius * 0.2
+    draw.ellipse([(x - center_radius, y - center_radius), (x + center_radius, y + center_radius)],
+                 fill=marker.center_color)
+    canvas.paste(Image.alpha_composite(region, overlay).convert(canvas.mode), (left, top))
+
+
+@telemetry.traced("compose_annotations")
+def compose(image, markers) -> Image.Image:
+    """
+    在图像的 RGB 副本上一次绘制所有标注，不修改传入的图像。
+
+    Args:
+        image (Image.Image | Frame | str): 原图。
+        markers (Iterable): `ClickMarker` / `BoxMarker` / `PointMarker` 列表。
+
+    Returns:
+        Image.Image: 绘制好的 RGB 图像。
+    """
+    image = as_frame(image).image
+    canvas = image.copy() if image.mode == "RGB" else image.convert("RGB")
+    draw = ImageDraw.Draw(canvas)
+    font = None
+    for marker in markers:
+        if isinstance(marker, ClickMarker):
+            _composite_click(canvas, marker)
+            continue
+        font = font or ImageFont.load_default()
+        if isinstance(marker, BoxMarker):
+            draw.rectangle(((marker.x1, marker.y1), (marker.x2, marker.y2)), outline=marker.color, width=marker.width)
+            if marker.label:
+                # 在框的左上角内侧绘制标签文本
+                draw.text((marker.x1 + 8, marker.y1 + 6), marker.label, fill=marker.color, font=font)
+        elif isinstance(marker, PointMarker):
+            radius = marker.radius if marker.radius is not None else max(3, int(min(canvas.size) * 0.01))
+            draw.ellipse([(marker.x - radius, marker.y - radius), (marker.x + radius, marker.y + radius)],
+                         fill=marker.color)
+            if marker.label:
+                draw.text((marker.x + 2 * radius, marker.y - radius), marker.label, fill=marker.color, font=font)
+        else:
+            raise TypeError(f"不支持的标注类型: {type(marker).__name__}")
+    return canvas
+
+
+def output_path_for(path: str, format: str = None) -> str:
+    """指定了输出格式时，把路径的扩展名替换为该格式的扩展名。"""
+    if format is None:
+        return path
+    extensions = _FORMAT_EXTENSIONS.get(format.upper())
+    if extensions is None:
+        raise ValueError(f"不支持的输出格式: {format}（可选 {', '.join(_FORMAT_EXTENSIONS)}）")
+    root, current = os.path.splitext(path)
+    return path if current.lower() in extensions else root + extensions[0]
+
+
+@telemetry.traced("save_image")
+def save_image(image: Image.Image, path: str, format: str = None, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+               quality: int = DEFAULT_QUALITY) -> str:
+    """
+    编码并保存图像，返回实际写入的路径。
+
+    Args:
+        image (Image.Image): 要保存的图像。
+        path (str): 输出路径；目录不存在时自动创建。
+        format (str, optional): "PNG"、"JPEG" 或 "WEBP"；为 None 时按扩展名推断。
+        compress_level (int): PNG 的压缩级别 (0-9)。
+        quality (int): JPEG / WEBP 的质量 (1-100)。
+    """
+    path = output_path_for(path, format)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    format = (format or Image.registered_extensions().get(os.path.splitext(path)[1].lower(), "PNG")).upper()
+    if format == "PNG":
+        image.save(path, format=format, compress_level=compress_level)
+    else:
+        image.save(path, format=format, quality=quality)
+    return path
+
+
+def render(image, markers, output_path: str, format: str = None, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+           quality: int = DEFAULT_QUALITY) -> str:
+    """同步地合成一帧上的所有标注并保存，返回实际写入的路径。参数见 `compose` 与 `save_image`。"""
+    return save_image(compose(image, markers), output_path, format, compress_level, quality)
+
+
+def _render_job(image, markers, output_path, format, compress_level, quality):
+    """后台任务（可在子进程中执行）：返回 (写入的路径, 耗时毫秒)。"""
+    started = time.perf_counter()
+    path = render(image, markers, output_path, format, compress_level, quality)
+    return path, (time.perf_counter() - started) * 1000
+
+
+class AnnotationRenderer:
+    """
+    后台标注渲染器。`submit` 立即返回，合成、编码与保存在线程池（或进程池）中完成。
+
+    Args:
+        max_workers (int): 后台工作线程（进程）数。
+        format (str, optional): 输出格式，见 `save_image`；为 None 时按输出路径的扩展名推断。
+        compress_level (int): PNG 压缩级别。
+        quality (int): JPEG / WEBP 质量。
+        processes (bool): 为 True 时使用进程池；截图需要序列化后传给子进程，只在编码成为瓶颈时才值得使用。
+        max_pending (int, optional): 排队与执行中的任务数上限。达到上限时 `submit` 等待，
+            渲染跟不上时由此向智能体循环施加背压，避免排队的截图无限占用内存；为 None 时不限制。
+    """
+
+    def __init__(self, max_workers: int = 2, format: str = None, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+                 quality: int = DEFAULT_QUALITY, processes: bool = False, max_pending: int = None):
+        self.format = format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.processes = processes
+        if processes:
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.render_ms = 0.0
+
+    def submit(self, image, markers, output_path: str) -> Future:
+        """
+        提交一帧的渲染任务。设置了 `max_pending` 且已达上限时，先等待有任务完成。
+
+        Args:
+            image (Image.Image | Frame | str): 原图。帧在后台才解码（若尚未解码），且不会被修改。
+            markers (Iterable): 该帧上的所有标注。
+            output_path (str): 输出路径（指定了 `format` 时扩展名会被替换）。
+
+        Returns:
+            Future: 结果为实际写入的路径；渲染失败时为对应的异常。
+        """
+        frame = as_frame(image)
+        if self._slots is not None:
+            self._slots.acquire()
+        # 子进程拿不到父进程中的帧缓存，直接传递解码后的图像
+        source = frame.image if self.processes else frame
+        result = Future()
+        with self._lock:
+            self.submitted += 1
+            self._pending.add(result)
+        future = self._executor.submit(
+            _render_job, source, list(markers), output_path, self.format, self.compress_level, self.quality
+        )
+        future.add_done_callback(lambda done: self._finish(done, result))
+        return result
+
+    def _finish(self, done: Future, result: Future):
+        # 先移出待完成集合再设置结果：`wait` 看到结果时，该任务已不在集合中
+        with self._lock:
+            self._pending.discard(result)
+            error = done.exception()
+            if error is None:
+                path, elapsed_ms = done.result()
+                self.completed += 1
+                self.render_ms += elapsed_ms
+            else:
+                self.failed += 1
+        if self._slots is not None:
+            self._slots.release()
+        if error is None:
+            telemetry.count("annotations_rendered", result="ok")
+            logger.info("🖼️  可视化结果已保存至: %s", path)
+            result.set_result(path)
+        else:
+            telemetry.count("annotations_rendered", result="error")
+            logger.error("[错误] 可视化结果保存失败: %s", error)
+            result.set_exception(error)
+
+    def wait(self):
+        """等待所有已提交的任务完成。"""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            for future in pending:
+                future.exception()
+
+    def close(self):
+        """等待所有任务完成并关闭后台线程（进程）池。"""
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "pending": len(self._pending),
+                "mean_render_ms": self.render_ms / self.completed if self.completed else 0.0,
+            }
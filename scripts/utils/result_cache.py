@@ -0,0 +1,311 @@
+"""
+本模块实现以内容寻址的定位结果缓存。
+
+缓存键由以下内容的哈希构成：
+1. 图像内容哈希（与文件名无关，内容相同的截图会命中同一条目）。
+2. 用户指令。
+3. 系统提示与 Prompt 模板。
+4. 模型 ID。
+
+缓存分为两级：
+- 内存层：进程内的 LRU 字典，按条目数限制大小。
+- 磁盘层：每个条目一个 JSON 文件，进程重启后依然有效，按总字节数和存活时间淘汰。
+
+重复运行阶段二、阶段三脚本时，所有结果都可以直接从缓存返回，无需调用模型。
+
+缓存可以在多个线程之间共享（例如工作流中并发执行的步骤）：所有读写与统计由一把锁保护，
+`get_or_compute` 对同一个键只计算一次，其他线程等待同一个结果。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import telemetry
+
+# 默认的磁盘缓存目录：项目根目录下的 .cache/grounding
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '.cache', 'grounding')
+
+# 磁盘条目开头的 created 字段（见 `_write_disk`），淘汰时无需解析整个文件
+_CREATED_PATTERN = re.compile(r'\{"created":\s*([0-9.eE+-]+)')
+
+
+def make_cache_key(image_hash: str, instruction: str, prompt_template: str, model_id: str, system_prompt: str = "") -> str:
+    """
+    根据图像内容哈希、指令、Prompt 模板和模型 ID 生成缓存键。
+    """
+    hasher = hashlib.sha256()
+    for part in (image_hash, instruction, prompt_template, system_prompt, model_id):
+        # 以长度作前缀，避免不同字段拼接后产生歧义
+        encoded = part.encode("utf-8")
+        hasher.update(f"{len(encoded)}:".encode())
+        hasher.update(encoded)
+    return hasher.hexdigest()
+
+
+class GroundingCache:
+    """
+    两级（内存 + 磁盘）定位结果缓存。
+
+    Args:
+        cache_dir (str, optional): 磁盘缓存目录。为 None 时只使用内存层。
+        max_memory_entries (int): 内存层最多保留的条目数。
+        max_disk_bytes (int): 磁盘层的总大小上限（字节）。
+        max_age_seconds (float): 条目的最长存活时间（秒），过期条目视为未命中并被删除。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_memory_entries: int = 256,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 3600
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self._memory = OrderedDict()
+        self._pending = {}   # 正在计算的键 -> Future
+        self._lock = threading.RLock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+
+    # --- 公共接口 ---
+
+    def get(self, key: str):
+        """
+        查找缓存条目，依次检查内存层和磁盘层。
+
+        Returns:
+            缓存的值；未命中或已过期时返回 None。
+        """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str):
+        now = time.time()
+
+        item = self._memory.get(key)
+        if item is not None:
+            created, value = item
+            if now - created <= self.max_age_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                telemetry.count("cache_lookups", cache="result", result="memory_hit")
+                return value
+            del self._memory[key]
+
+        if self.cache_dir:
+            record = self._read_disk(key)
+            if record is not None:
+                if now - record["created"] <= self.max_age_seconds:
+                    # 提升到内存层
+                    self._put_memory(key, record["created"], record["value"])
+                    self.disk_hits += 1
+                    telemetry.count("cache_lookups", cache="result", result="disk_hit")
+                    return record["value"]
+                self._remove_disk(self._path_for(key))
+
+        self.misses += 1
+        telemetry.cache_lookup("result", False)
+        return None
+
+    def contains(self, key: str) -> bool:
+        """
+        判断缓存中是否有未过期的条目；不计入命中统计，也不改变 LRU 顺序。
+        用于在真正查询前判断是否需要提前加载模型。
+        """
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+        if item is not None and now - item[0] <= self.max_age_seconds:
+            return True
+        if self.cache_dir:
+            path = self._path_for(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError, OSError):
+                return False
+            return now - record["created"] <= self.max_age_seconds
+        return False
+
+    def put(self, key: str, value):
+        """
+        写入缓存条目。`value` 必须可被 JSON 序列化。
+        """
+        created = time.time()
+        with self._lock:
+            self._put_memory(key, created, value)
+            if self.cache_dir:
+                self._write_disk(key, {"created": created, "value": value})
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+
+    def get_or_compute(self, key: str, compute):
+        """
+        命中时直接返回缓存值，否则调用 `compute()` 计算、写入缓存后返回。
+        多个线程同时计算同一个键时只有第一个线程调用 `compute()`，其余线程等待并返回它的结果（或异常）。
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = Future()
+        if not owner:
+            return pending.result()
+
+        try:
+            value = compute()
+            self.put(key, value)
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(value)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        return value
+
+    def clear(self):
+        """清空内存层与磁盘层。"""
+        with self._lock:
+            self._memory.clear()
+            if self.cache_dir:
+                for path, _, _ in self._scan_disk():
+                    self._remove_disk(path)
+                self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+    # --- 内存层 ---
+
+    # 以下私有方法均在持有 `_lock` 时调用
+
+    def _put_memory(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # --- 磁盘层 ---
+
+    def _path_for(self, key: str) -> str:
+        # 以键的前两位作为子目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str):
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return None
+        # 更新修改时间，作为磁盘层 LRU 淘汰的依据；过期只看记录中的 created，与修改时间无关
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return record
+
+    def _write_disk(self, key: str, record: dict):
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # 先写临时文件再原子替换，避免并发读取到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._disk_bytes += os.path.getsize(path) - old_size
+
+    def _remove_disk(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_bytes -= size
+        except OSError:
+            pass
+
+    def _scan_disk(self):
+        """返回磁盘层所有条目的 (路径, 大小, 修改时间)。"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    @staticmethod
+    def _created_at(path: str):
+        """
+        读取条目写入时记录的 created 时间戳；文件无法读取或已损坏时返回 None。
+        `_write_disk` 总是把 created 写在最前面，通常只需读取文件开头。
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                match = _CREATED_PATTERN.match(f.read(64))
+                if match:
+                    return float(match.group(1))
+                f.seek(0)
+                return float(json.load(f)["created"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _evict_disk(self):
+        """
+        先删除过期条目，再按最近使用时间从旧到新删除，直到总大小低于上限。
+        过期与 `_get` 一致，按条目的 created 判断；修改时间（每次命中时刷新）只决定 LRU 顺序。
+        """
+        now = time.time()
+        entries = self._scan_disk()
+        self._disk_bytes = sum(size for _, size, _ in entries)
+
+        live = []
+        for path, size, mtime in entries:
+            created = self._created_at(path)
+            if created is None or now - created > self.max_age_seconds:
+                self._remove_disk(path)
+            else:
+                live.append((path, size, mtime))
+
+        live.sort(key=lambda entry: entry[2])
+        for path, _, _ in live:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_disk(path)
@@ -0,0 +1,312 @@
+"""
+本模块实现模型前端的动态微批调度器 (dynamic micro-batching)。
+
+多个桌面智能体共用一块 GPU 时，如果各自直接调用 `grounding_utils.inference`，
+请求只能逐个进入 `model.generate`，GPU 大部分时间都在处理批大小为 1 的解码。
+`BatchScheduler` 把并发到达的请求排队，在最长等待时间内凑成微批，再一次性交给
+`inference_batch` / `chat_batch`：
+
+1. 调用方通过 `submit_grounding` / `submit_chat` 提交请求，立即得到一个 `Future`。
+2. 只有生成参数完全相同、且视觉 token 数落在同一个分桶内的请求才会合批，
+   避免一张大截图和一张小裁剪图拼在一起时，小图被大量 padding 填充。
+3. 队首请求等待超过 `max_queue_delay` 或凑满 `max_batch_size` 时立即执行。
+
+视觉 token 数按处理器的 smart_resize 规则由图像尺寸直接算出，与 `image_grid_thw`
+给出的网格一致（每个 token 对应 merge_size x merge_size 个 patch，patch 边长取自处理器），无需先跑一遍预处理。
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from . import telemetry
+from .boxes import merge_size, patch_size
+from .frames import as_frame
+from .grounding_utils import chat_batch, inference_batch, smart_resize_dims, visual_token_count
+from .model_loader import get_model_and_processor
+
+# Qwen2.5-VL 图像处理器的默认像素范围（处理器未提供时使用）
+_DEFAULT_MIN_PIXELS = 56 * 56
+_DEFAULT_MAX_PIXELS = 28 * 28 * 16384
+
+# 按请求分别指定、不影响合批的选项：不参与 batch_key，执行微批时重建为逐行的列表
+_PER_REQUEST_OPTIONS = ("expected_boxes",)
+
+
+def estimate_visual_tokens(image, processor=None, min_pixels: int = None, max_pixels: int = None) -> int:
+    """
+    估算图像经过处理器后的视觉 token 数，等于 `image_grid_thw` 中 T*H*W / (merge_size^2)。
+
+    Args:
+        image (str | Image.Image | Frame): 图像路径、已加载的图像或帧（未解码的文件只读取文件头）。
+        processor: 处理器，用于读取其默认的 min_pixels/max_pixels；为 None 时使用默认值。
+        min_pixels (int, optional): 请求指定的像素数下限。
+        max_pixels (int, optional): 请求指定的像素数上限。
+    """
+    image_processor = getattr(processor, "image_processor", None)
+    default_min = getattr(image_processor, "min_pixels", None) or _DEFAULT_MIN_PIXELS
+    default_max = getattr(image_processor, "max_pixels", None) or _DEFAULT_MAX_PIXELS
+    factor = patch_size(processor) * merge_size(processor)
+    width, height = as_frame(image).size
+    if min_pixels is not None or max_pixels is not None:
+        height, width = smart_resize_dims(height, width, min_pixels, max_pixels, factor)
+    height, width = smart_resize_dims(height, width, default_min, default_max, factor)
+    return visual_token_count(height, width, factor)
+
+
+def _percentile(values: list, q: float) -> float:
+    """最近秩法计算分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class _Request:
+    """队列中的一个请求。"""
+
+    __slots__ = ("kind", "payload", "options", "visual_tokens", "batch_key", "future", "submitted")
+
+    def __init__(self, kind, payload, options, visual_tokens, batch_key):
+        self.kind = kind
+        self.payload = payload
+        self.options = options
+        self.visual_tokens = visual_tokens
+        self.batch_key = batch_key
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    动态微批调度器。
+
+    Args:
+        model: 已加载的模型；为 None 时通过 `model_loader.get_model_and_processor` 获取。
+        processor: 对应的处理器。
+        max_batch_size (int): 单个微批的最大请求数。
+        max_queue_delay (float): 队首请求最长的排队等待时间（秒），超时后即使未凑满也立即执行。
+        bucket_ratio (float): 视觉 token 分桶的几何比例。同一桶内最大与最小 token 数之比不超过该值，
+            即批内 padding 浪费有上界。设为 None 时不分桶。
+        max_queue_size (int, optional): 队列长度上限，超过时 `submit_*` 抛出 RuntimeError（背压）。
+        model_lock (threading.Lock, optional): 与其他直接调用模型的代码共享的锁，执行微批时持有。
+        preprocess_cache (PreprocessCache, optional): 定位请求使用的图像预处理缓存。
+        stats_window (int): 计算延迟分位数时保留的最近请求数；更早的请求只计入累计计数。
+    """
+
+    def __init__(
+        self,
+        model=None,
+        processor=None,
+        max_batch_size: int = 8,
+        max_queue_delay: float = 0.02,
+        bucket_ratio: float = 1.5,
+        max_queue_size: int = None,
+        model_lock: threading.Lock = None,
+        preprocess_cache=None,
+        stats_window: int = 1024
+    ):
+        if model is None:
+            model, processor = get_model_and_processor()
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay
+        self.bucket_ratio = bucket_ratio
+        self.max_queue_size = max_queue_size
+        self._model_lock = model_lock
+        self.preprocess_cache = preprocess_cache
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        # 统计信息：分位数只看最近 stats_window 个请求，总数用计数器累计，常驻服务的内存不随请求数增长
+        self._latencies = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+        self._batches = 0
+        self._batched_requests = 0
+        self._padded_tokens = 0
+        self._useful_tokens = 0
+        self._completed = 0
+        self._failed = 0
+        self._started_at = time.perf_counter()
+
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    # --- 提交请求 ---
+
+    def submit_grounding(
+        self,
+        image,
+        prompt: str,
+        system_prompt: str = "You are a helpful assistant.",
+        max_new_tokens: int = 1024,
+        expected_boxes: int = None,
+        constrained: bool = False,
+        min_pixels: int = None,
+        max_pixels: int = None
+    ) -> Future:
+        """
+        提交一个定位请求，参数含义同 `grounding_utils.inference`。
+
+        Returns:
+            Future: 结果为 (模型输出文本, 输入高度, 输入宽度)。
+        """
+        options = {
+            "max_new_tokens": max_new_tokens,
+            "expected_boxes": expected_boxes,
+            "constrained": constrained,
+            "min_pixels": min_pixels,
+            "max_pixels": max_pixels,
+        }
+        tokens = estimate_visual_tokens(image, self.processor, min_pixels, max_pixels)
+        return self._submit("grounding", (image, prompt, system_prompt), options, tokens)
+
+    def submit_chat(self, image, prompt: str, max_new_tokens: int = 1024) -> Future:
+        """
+        提交一个通用图文问答 (VQA) 请求，参数含义同 `grounding_utils.chat`。
+
+        Returns:
+            Future: 结果为模型的文本回答。
+        """
+        tokens = estimate_visual_tokens(image, self.processor)
+        return self._submit("chat", (image, prompt), {"max_new_tokens": max_new_tokens}, tokens)
+
+    def _bucket(self, visual_tokens: int) -> int:
+        if not self.bucket_ratio:
+            return 0
+        return int(math.log(max(visual_tokens, 1)) / math.log(self.bucket_ratio))
+
+    def _submit(self, kind, payload, options, visual_tokens) -> Future:
+        shared = {k: v for k, v in options.items() if k not in _PER_REQUEST_OPTIONS}
+        batch_key = (kind, tuple(sorted(shared.items())), self._bucket(visual_tokens))
+        request = _Request(kind, payload, options, visual_tokens, batch_key)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("调度器已关闭")
+            if self.max_queue_size is not None and len(self._queue) >= self.max_queue_size:
+                raise RuntimeError(f"调度队列已满 ({self.max_queue_size})")
+            self._queue.append(request)
+            self._condition.notify()
+        return request.future
+
+    # --- 调度循环 ---
+
+    def _take_batch(self) -> list:
+        """
+        等待并取出一个微批：以队首请求为锚点，收集与其 batch_key 相同的请求，
+        凑满 `max_batch_size` 或队首等待超过 `max_queue_delay` 时返回。
+        """
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if not self._queue:
+                return []
+
+            anchor = self._queue[0]
+            deadline = anchor.submitted + self.max_queue_delay
+            while True:
+                compatible = [r for r in self._queue if r.batch_key == anchor.batch_key]
+                remaining = deadline - time.perf_counter()
+                if len(compatible) >= self.max_batch_size or remaining <= 0 or self._closed:
+                    break
+                self._condition.wait(remaining)
+
+            batch = compatible[:self.max_batch_size]
+            for request in batch:
+                self._queue.remove(request)
+            return batch
+
+    def _execute(self, batch: list) -> list:
+        kind = batch[0].kind
+        options = {k: v for k, v in batch[0].options.items() if k not in _PER_REQUEST_OPTIONS}
+        if kind == "grounding":
+            # 批内各行的期望框数可以不同，按行传给早停条件
+            expected = [r.options.get("expected_boxes") for r in batch]
+            options["expected_boxes"] = expected if any(e is not None for e in expected) else None
+            return inference_batch(
+                self.model, self.processor, [r.payload for r in batch],
+                preprocess_cache=self.preprocess_cache, **options
+            )
+        return chat_batch(self.model, self.processor, [r.payload for r in batch], **options)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            started = time.perf_counter()
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                with telemetry.span("scheduler_batch", kind=batch[0].kind, batch_size=len(batch),
+                                    queue_wait_ms=(started - batch[0].submitted) * 1000):
+                    if self._model_lock is not None:
+                        with self._model_lock:
+                            results = self._execute(batch)
+                    else:
+                        results = self._execute(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                with self._condition:
+                    self._failed += len(batch)
+                continue
+
+            finished = time.perf_counter()
+            largest = max(r.visual_tokens for r in batch)
+            with self._condition:
+                self._batches += 1
+                self._batched_requests += len(batch)
+                self._padded_tokens += largest * len(batch)
+                self._useful_tokens += sum(r.visual_tokens for r in batch)
+                self._completed += len(batch)
+                for request in batch:
+                    self._latencies.append(finished - request.submitted)
+                    self._queue_waits.append(started - request.submitted)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    # --- 生命周期与统计 ---
+
+    def close(self, wait: bool = True):
+        """停止接收新请求；已排队的请求仍会执行完毕。"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def stats(self) -> dict:
+        """
+        返回调度统计：完成数、吞吐量、端到端延迟与排队时间的 p50/p99（最近 `stats_window` 个请求）、
+        平均批大小，以及批内视觉 token 的 padding 浪费比例。
+        """
+        with self._condition:
+            elapsed = time.perf_counter() - self._started_at
+            batches = self._batches
+            return {
+                "completed": self._completed,
+                "failed": self._failed,
+                "queued": len(self._queue),
+                "throughput_rps": self._completed / elapsed if elapsed > 0 else 0.0,
+                "latency_p50_ms": _percentile(self._latencies, 50) * 1000,
+                "latency_p99_ms": _percentile(self._latencies, 99) * 1000,
+                "queue_p50_ms": _percentile(self._queue_waits, 50) * 1000,
+                "queue_p99_ms": _percentile(self._queue_waits, 99) * 1000,
+                "batches": batches,
+                "avg_batch_size": self._batched_requests / batches if batches else 0.0,
+                "padding_waste": 1 - self._useful_tokens / self._padded_tokens if self._padded_tokens else 0.0,
+            }
@@ -0,0 +1,216 @@
+"""
+本模块提供定位结果的增量流式解析器。
+
+模型的原始输出常见以下几种"变形"：
+1. 被 Markdown 代码块包裹：```json\n[...]\n```
+2. 前后夹杂说明文字：Sure! Here is the bounding box: [...]
+3. 因 `max_new_tokens` 或早停而被截断：[{"bbox_2d": [1, 2, 3, 4], "label": "lo
+4. 使用 Python 风格的单引号。
+5. 坐标点以 XML 形式给出：<points x1="12" y1="34" alt="按钮">按钮</points>
+
+`GroundingStreamParser` 逐块消费文本（例如来自 `TextIteratorStreamer` 的片段），
+只扫描一遍，每当一个边界框对象或 `<points>` 元素闭合时立即产出结果，
+无需先拼接全文、按行切分、再整体解析和截断重试。
+"""
+
+import ast
+import json
+import re
+
+from . import telemetry
+
+_POINTS_OPEN = "<points"
+_POINTS_CLOSE = "</points>"
+_ATTR_PATTERN = re.compile(r'(\w+)\s*=\s*"([^"]*)"')
+_OPENERS = {"{": "}", "[": "]"}
+
+
+def _parse_object(text: str):
+    """将捕获到的对象文本解析为 dict；先按 JSON 解析，失败时再按 Python 字面量解析。"""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, SyntaxError, TypeError, RecursionError, MemoryError):
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def _parse_points_element(text: str) -> list:
+    """
+    解析一个完整的 `<points ...>文本</points>` 元素。
+    一个元素可以包含多个点：x1/y1, x2/y2, ...，每个点产出一个 {"point_2d", "label"}。
+    """
+    head_end = text.find(">")
+    attrs = dict(_ATTR_PATTERN.findall(text[:head_end]))
+    inner = text[head_end + 1:len(text) - len(_POINTS_CLOSE)].strip()
+    label = attrs.get("alt") or inner
+
+    points = []
+    i = 1
+    while f"x{i}" in attrs and f"y{i}" in attrs:
+        try:
+            points.append({"point_2d": [float(attrs[f"x{i}"]), float(attrs[f"y{i}"])], "label": label})
+        except ValueError:
+            pass
+        i += 1
+    # 兼容 <points x="..." y="..."> 形式
+    if not points and "x" in attrs and "y" in attrs:
+        try:
+            points.append({"point_2d": [float(attrs["x"]), float(attrs["y"])], "label": label})
+        except ValueError:
+            pass
+    return points
+
+
+def _is_grounding_element(value) -> bool:
+    return isinstance(value, dict) and ("bbox_2d" in value or "point_2d" in value)
+
+
+def _has_complete_coords(value) -> bool:
+    """边界框需要 4 个坐标，坐标点需要 2 个坐标。"""
+    if not _is_grounding_element(value):
+        return False
+    key, size = ("bbox_2d", 4) if "bbox_2d" in value else ("point_2d", 2)
+    coords = value[key]
+    return isinstance(coords, list) and len(coords) == size
+
+
+class GroundingStreamParser:
+    """
+    定位结果的增量解析器。
+
+    用法：
+        parser = GroundingStreamParser()
+        for chunk in streamer:
+            for element in parser.feed(chunk):
+                ...  # 每个元素闭合时立即可用
+        tail = parser.close()  # 处理被截断的最后一个元素
+
+    产出的元素为 dict：边界框包含 "bbox_2d"，坐标点包含 "point_2d"，二者通常都带有 "label"。
+    """
+
+    def __init__(self):
+        self.elements = []
+        # 对象捕获状态
+        self._buffer = []
+        self._stack = []
+        self._quote = None
+        self._escape = False
+        # <points> 元素捕获状态
+        self._tag_buffer = None
+        self._pending_tag = ""
+
+    @property
+    def capturing(self) -> bool:
+        return bool(self._stack)
+
+    def feed(self, chunk: str) -> list:
+        """消费一段文本，返回其中新闭合的元素。"""
+        produced = []
+        for ch in chunk:
+            if self._stack:
+                self._feed_object_char(ch, produced)
+            elif self._tag_buffer is not None:
+                self._feed_tag_char(ch, produced)
+            elif ch == "{":
+                self._buffer = [ch]
+                self._stack = ["{"]
+                self._quote = None
+                self._escape = False
+            elif ch == "<" or self._pending_tag:
+                self._match_tag_start(ch)
+        self.elements.extend(produced)
+        return produced
+
+    def close(self) -> list:
+        """
+        输入结束时调用：尝试补全被截断的最后一个对象。
+        只有坐标已经完整的对象才会被保留（label 可能不完整）。
+        """
+        produced = []
+        if self._stack:
+            text = "".join(self._buffer)
+            if self._quote is not None:
+                text += self._quote
+            text += "".join(_OPENERS[opener] for opener in reversed(self._stack))
+            value = _parse_object(text)
+            if _has_complete_coords(value):
+                produced.append(value)
+        self._stack = []
+        self._buffer = []
+        self._tag_buffer = None
+        self._pending_tag = ""
+        self.elements.extend(produced)
+        return produced
+
+    # --- 对象捕获 ---
+
+    def _feed_object_char(self, ch: str, produced: list):
+        self._buffer.append(ch)
+        if self._quote is not None:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == self._quote:
+                self._quote = None
+            return
+
+        if ch in ('"', "'"):
+            self._quote = ch
+        elif ch in _OPENERS:
+            self._stack.append(ch)
+        elif ch in ("}", "]"):
+            if _OPENERS[self._stack[-1]] != ch:
+                # 括号不匹配：放弃当前捕获，继续扫描后续文本
+                self._stack = []
+                self._buffer = []
+                return
+            self._stack.pop()
+            if not self._stack:
+                value = _parse_object("".join(self._buffer))
+                self._buffer = []
+                if _is_grounding_element(value):
+                    produced.append(value)
+
+    # --- <points> 元素捕获 ---
+
+    def _match_tag_start(self, ch: str):
+        candidate = self._pending_tag + ch
+        if _POINTS_OPEN.startswith(candidate):
+            if candidate == _POINTS_OPEN:
+                self._tag_buffer = [candidate]
+                self._pending_tag = ""
+            else:
+                self._pending_tag = candidate
+        else:
+            self._pending_tag = "<" if ch == "<" else ""
+
+    def _feed_tag_char(self, ch: str, produced: list):
+        self._tag_buffer.append(ch)
+        if ch == ">" and "".join(self._tag_buffer[-len(_POINTS_CLOSE):]) == _POINTS_CLOSE:
+            produced.extend(_parse_points_element("".join(self._tag_buffer)))
+            self._tag_buffer = None
+
+
+@telemetry.traced("parse_grounding_output")
+def parse_grounding_output(text: str) -> list:
+    """
+    一次性解析完整的模型输出，返回其中所有的边界框与坐标点元素。
+    """
+    parser = GroundingStreamParser()
+    elements = parser.feed(text)
+    elements.extend(parser.close())
+    return elements
+
+
+def iter_grounding_elements(chunks):
+    """
+    包装一个文本片段迭代器（如 `TextIteratorStreamer`），在每个元素闭合时立即产出。
+    """
+    parser = GroundingStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
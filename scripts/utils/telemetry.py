@@ -0,0 +1,477 @@
+"""
+本模块为推理热路径提供可插拔的结构化遥测 (telemetry)。
+
+`model_loader`、`inference`、解析器和绘制函数通过 `traced` 装饰器或 `span` 上下文管理器记录：
+1. 各环节的耗时（span，可嵌套，记录父子关系）。
+2. 提示/视觉/生成 token 数、首 token 延迟 (TTFT)、峰值内存等 span 属性。
+3. 各类缓存的命中与未命中次数（计数器 `cache_lookups`，标签 cache/result）。
+
+记录通过导出器 (exporter) 输出，可同时注册多个：
+- `CallbackExporter`: 把每条记录交给回调函数。
+- `JsonlExporter`: 逐行追加写入 JSONL 追踪文件。
+- `ChromeTraceExporter`: 写出 Chrome 追踪事件格式的时间线，可在 Perfetto / chrome://tracing 中按线程查看各环节的重叠情况。
+- `PrometheusExporter`: 聚合为 Prometheus 文本格式的指标，可单独监听端口，也可由推理服务的 /metrics 接口提供。
+
+没有注册任何导出器时遥测处于关闭状态：`span` 返回共享的空对象，`traced` 只多一次列表判断，
+不计时、不读取内存、不计算 token 数，开销可以忽略。
+
+调试输出（完整的提示文本、模型原始输出等）统一使用 `logging`，由日志级别控制，
+入口脚本通过 `configure` 设置日志级别与追踪文件（也可用环境变量 `VLM_LOG_LEVEL`、`VLM_TRACE_FILE`）。
+"""
+
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块
+    resource = None
+
+LOG_LEVEL_ENV = "VLM_LOG_LEVEL"
+TRACE_FILE_ENV = "VLM_TRACE_FILE"
+
+_exporters = []
+_exporters_lock = threading.Lock()
+_local = threading.local()
+_span_ids = itertools.count(1)
+
+
+# --- 注册与配置 ---
+
+def enabled() -> bool:
+    """是否注册了至少一个导出器。"""
+    return bool(_exporters)
+
+
+def add_exporter(exporter):
+    """注册导出器并返回它。"""
+    with _exporters_lock:
+        _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter):
+    """注销导出器；导出器有 `close` 方法时一并调用。"""
+    with _exporters_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+    close = getattr(exporter, "close", None)
+    if close is not None:
+        close()
+
+
+def configure(log_level: str = None, trace_file: str = None):
+    """
+    入口脚本使用的一站式配置。
+
+    Args:
+        log_level (str, optional): 日志级别，默认取环境变量 `VLM_LOG_LEVEL`，未设置时为 INFO。
+            设为 DEBUG 可查看每次推理的完整提示文本与模型原始输出。
+        trace_file (str, optional): JSONL 追踪文件路径，默认取环境变量 `VLM_TRACE_FILE`；为空时不记录追踪。
+    """
+    level = (log_level or os.environ.get(LOG_LEVEL_ENV) or "INFO").upper()
+    logging.basicConfig(level=level, format="%(message)s")
+    trace_file = trace_file or os.environ.get(TRACE_FILE_ENV)
+    if trace_file:
+        add_exporter(JsonlExporter(trace_file))
+
+
+def _export(record: dict):
+    for exporter in list(_exporters):
+        try:
+            exporter.export(record)
+        except Exception:
+            logging.getLogger(__name__).exception("遥测导出失败: %r", exporter)
+
+
+# --- Span ---
+
+class Span:
+    """
+    一段计时区间。通过 `span()` 创建，作为上下文管理器使用；退出时导出一条 "span" 记录。
+    """
+
+    __slots__ = ("name", "attributes", "span_id", "parent_id", "start_time", "_start", "duration_ms")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(_span_ids)
+        self.parent_id = None
+        self.start_time = None
+        self._start = None
+        self.duration_ms = None
+
+    def set(self, **attributes):
+        """设置 span 属性（token 数、缓存命中、峰值内存等）。"""
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self) -> float:
+        """从 span 开始到现在经过的毫秒数，可用于记录 TTFT 等区间内的时间点。"""
+        return (time.perf_counter() - self._start) * 1000
+
+    def __enter__(self):
+        stack = _span_stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        stack = _span_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _export(self.to_record())
+        return False
+
+    def to_record(self) -> dict:
+        return {
+            "type": "span",
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "thread": threading.current_thread().name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """遥测关闭时使用的空 span。"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _span_stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def span(name: str, **attributes):
+    """
+    创建一个 span。遥测关闭时返回共享的空对象。
+
+    用法:
+        with telemetry.span("preprocess", batch_size=4) as s:
+            ...
+            s.set(visual_tokens=1024)
+    """
+    if not _exporters:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def current_span():
+    """当前线程中最内层的活动 span；没有时返回空对象，调用方无需判断。"""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else _NOOP_SPAN
+
+
+def traced(name: str):
+    """把整个函数调用记录为一个 span 的装饰器。函数内部可通过 `current_span()` 设置属性。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _exporters:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels):
+    """累加一个计数器，例如 `count("cache_lookups", cache="prefix", result="hit")`。"""
+    if not _exporters:
+        return
+    _export({"type": "counter", "name": name, "value": value, "labels": labels})
+
+
+def cache_lookup(cache: str, hit: bool):
+    """记录一次缓存查找的结果。"""
+    if _exporters:
+        count("cache_lookups", cache=cache, result="hit" if hit else "miss")
+
+
+# --- 内存 ---
+
+def reset_peak_memory():
+    """重置 GPU 的峰值显存统计（torch 未导入或没有 GPU 时什么都不做）。"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def peak_memory() -> dict:
+    """
+    返回进程的峰值常驻内存与 GPU 峰值显存（字节）。
+    不主动导入 torch：只有已经加载了 torch 的进程才读取显存。
+    """
+    result = {}
+    if resource is not None:
+        # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_bytes"] = rss if sys.platform == "darwin" else rss * 1024
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        result["peak_gpu_bytes"] = torch.cuda.max_memory_allocated()
+    return result
+
+
+# --- 导出器 ---
+
+class CallbackExporter:
+    """把每条记录（dict）交给 `callback`。"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def export(self, record: dict):
+        self.callback(record)
+
+
+class JsonlExporter:
+    """
+    把记录逐行写入 JSONL 追踪文件（追加模式，多线程安全）。
+
+    Args:
+        path (str): 追踪文件路径。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ChromeTraceExporter:
+    """
+    把 span 记录写成 Chrome 追踪事件格式 (Trace Event Format) 的 JSON 文件。
+
+    每个线程是时间线上的一行，每个 span 是一个区间（嵌套的 span 叠放在父 span 之下），属性显示在详情中。
+    用 https://ui.perfetto.dev 或 chrome://tracing 打开，可以直观地看到预取、推理、渲染等线程是否相互重叠。
+    文件在 `close`（或 `remove_exporter`）时一次写出。
+
+    Args:
+        path (str): 输出的 JSON 文件路径。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        if record["type"] != "span":
+            return
+        with self._lock:
+            tid = self._threads.setdefault(record["thread"], len(self._threads) + 1)
+            self._events.append({
+                "name": record["name"], "cat": "span", "ph": "X", "pid": os.getpid(), "tid": tid,
+                "ts": record["start_time"] * 1e6, "dur": record["duration_ms"] * 1e3,
+                "args": record["attributes"],
+            })
+
+    def close(self):
+        with self._lock:
+            pid = os.getpid()
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for name, tid in self._threads.items()
+            ]
+            events = metadata + sorted(self._events, key=lambda event: event["ts"])
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+
+# span 属性中按 token 类型累加的计数
+_TOKEN_ATTRIBUTES = {"prompt_tokens": "prompt", "visual_tokens": "visual", "generated_tokens": "generated"}
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+class PrometheusExporter:
+    """
+    把记录聚合为 Prometheus 指标：
+    - `<prefix>_span_duration_seconds`: 各 span 耗时的直方图（标签 span）。
+    - `<prefix>_time_to_first_token_seconds`: 首 token 延迟的直方图（span 属性 ttft_ms）。
+    - `<prefix>_tokens_total`: 提示/视觉/生成 token 累计数（标签 span、kind）。
+    - `<prefix>_peak_memory_bytes`: 观察到的峰值内存（标签 kind 为 rss/gpu）。
+    - `<prefix>_<name>_total`: `count()` 记录的计数器，如 `cache_lookups_total{cache, result}`。
+
+    Args:
+        prefix (str): 指标名前缀。
+        buckets (tuple): 直方图的桶边界（秒）。
+    """
+
+    def __init__(self, prefix: str = "vlm", buckets: tuple = _DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._ttft = _Histogram(buckets)
+        self._tokens = {}
+        self._peak_memory = {}
+        self._counters = {}
+        self._server = None
+
+    def export(self, record: dict):
+        with self._lock:
+            if record["type"] == "counter":
+                key = (record["name"], tuple(sorted(record["labels"].items())))
+                self._counters[key] = self._counters.get(key, 0) + record["value"]
+                return
+
+            name, attributes = record["name"], record["attributes"]
+            histogram = self._durations.get(name)
+            if histogram is None:
+                histogram = self._durations[name] = _Histogram(self.buckets)
+            histogram.observe(record["duration_ms"] / 1000)
+            if "ttft_ms" in attributes:
+                self._ttft.observe(attributes["ttft_ms"] / 1000)
+            for attribute, kind in _TOKEN_ATTRIBUTES.items():
+                if attribute in attributes:
+                    key = (name, kind)
+                    self._tokens[key] = self._tokens.get(key, 0) + attributes[attribute]
+            for attribute, kind in (("peak_rss_bytes", "rss"), ("peak_gpu_bytes", "gpu")):
+                if attribute in attributes:
+                    self._peak_memory[kind] = max(self._peak_memory.get(kind, 0), attributes[attribute])
+
+    def render(self) -> str:
+        """生成 Prometheus 文本格式 (text/plain; version=0.0.4) 的指标。"""
+        p = self.prefix
+        lines = []
+
+        def histogram_lines(metric, histogram, labels):
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': bound})} {bucket_count}")
+            lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+        with self._lock:
+            lines.append(f"# HELP {p}_span_duration_seconds 各环节耗时")
+            lines.append(f"# TYPE {p}_span_duration_seconds histogram")
+            for name, histogram in sorted(self._durations.items()):
+                histogram_lines(f"{p}_span_duration_seconds", histogram, {"span": name})
+
+            lines.append(f"# HELP {p}_time_to_first_token_seconds 首 token 延迟")
+            lines.append(f"# TYPE {p}_time_to_first_token_seconds histogram")
+            histogram_lines(f"{p}_time_to_first_token_seconds", self._ttft, {})
+
+            lines.append(f"# HELP {p}_tokens_total 处理的 token 数")
+            lines.append(f"# TYPE {p}_tokens_total counter")
+            for (name, kind), value in sorted(self._tokens.items()):
+                lines.append(f"{p}_tokens_total{_format_labels({'span': name, 'kind': kind})} {value}")
+
+            lines.append(f"# HELP {p}_peak_memory_bytes 观察到的峰值内存")
+            lines.append(f"# TYPE {p}_peak_memory_bytes gauge")
+            for kind, value in sorted(self._peak_memory.items()):
+                lines.append(f"{p}_peak_memory_bytes{_format_labels({'kind': kind})} {value}")
+
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = f"{p}_{name}_total"
+                if metric not in declared:
+                    lines.append(f"# TYPE {metric} counter")
+                    declared.add(metric)
+                lines.append(f"{metric}{_format_labels(dict(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9464):
+        """在后台线程中监听 `host:port`，通过 GET /metrics 提供指标。"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        exporter = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,79 @@
+"""
+本模块构建一个随机初始化的"迷你" Qwen2.5-VL 模型，用于在没有 GPU 的机器上测试推理流程。
+
+迷你模型与真实模型共享同一套处理器（分词器、聊天模板、图像预处理）和特殊 token ID，
+只是把视觉编码器和语言模型缩小到几层、几十维。它的输出没有意义，
+但能在 CPU 上几秒内走完 预处理 -> 预填充 -> 解码 的完整路径，适合验证约束解码、
+早停、批量推理等与模型权重无关的逻辑，以及在 CI 中做性能回归。
+
+只下载配置和分词器文件（几 MB），不下载模型权重。
+"""
+
+import torch
+from transformers import AutoConfig, AutoProcessor, Qwen2_5_VLConfig, Qwen2_5_VLForConditionalGeneration
+from modelscope import snapshot_download
+
+from .model_loader import MODEL_ID
+
+# 只需要配置、分词器和预处理相关的文件
+_CONFIG_PATTERNS = ["*.json", "*.txt", "*.jinja"]
+
+
+def build_tiny_config(base_config) -> Qwen2_5_VLConfig:
+    """
+    以真实模型的配置为基础，构建一个结构相同但尺寸极小的配置。
+    特殊 token ID、patch 大小、合并尺寸等与处理器相关的参数保持不变。
+    """
+    vision = base_config.vision_config
+    return Qwen2_5_VLConfig(
+        vocab_size=base_config.vocab_size,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=base_config.max_position_embeddings,
+        rope_theta=base_config.rope_theta,
+        # 头维度为 16，mrope_section 之和必须等于头维度的一半
+        rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]},
+        image_token_id=base_config.image_token_id,
+        video_token_id=base_config.video_token_id,
+        vision_start_token_id=base_config.vision_start_token_id,
+        vision_end_token_id=base_config.vision_end_token_id,
+        bos_token_id=base_config.bos_token_id,
+        eos_token_id=base_config.eos_token_id,
+        vision_config={
+            "depth": 2,
+            "hidden_size": 32,
+            "intermediate_size": 64,
+            "num_heads": 2,
+            "out_hidden_size": 64,
+            "patch_size": vision.patch_size,
+            "spatial_merge_size": vision.spatial_merge_size,
+            "temporal_patch_size": vision.temporal_patch_size,
+            "window_size": vision.window_size,
+            "fullatt_block_indexes": [1],
+            "tokens_per_second": getattr(vision, "tokens_per_second", 2),
+        },
+    )
+
+
+def load_tiny_model_and_processor(model_id: str = MODEL_ID, seed: int = 0):
+    """
+    加载真实模型的处理器，并构建随机初始化的迷你模型（float32，CPU）。
+
+    Args:
+        model_id (str): 提供配置和分词器的模型 ID。
+        seed (int): 随机初始化的种子，保证每次构建的模型相同。
+
+    Returns:
+        tuple: (model, processor)
+    """
+    model_dir = snapshot_download(model_id, allow_patterns=_CONFIG_PATTERNS)
+    processor = AutoProcessor.from_pretrained(model_dir, trust_remote_code=True)
+    base_config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+
+    torch.manual_seed(seed)
+    model = Qwen2_5_VLForConditionalGeneration(build_tiny_config(base_config))
+    model.eval()
+    return model, processor
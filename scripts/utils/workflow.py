@@ -0,0 +1,387 @@
+"""
+本模块实现可断点续跑的声明式工作流引擎。
+
+阶段三的 `run_calculator_task` 原本是一个写死在代码里、逐个执行的步骤列表：第 6 步失败时，
+重新运行要从头开始，模型加载和前面每一步都要重做。工作流引擎：
+1. 从 YAML 或 JSON 文件加载任务步骤（见 `scripts/workflows/`）。
+2. 每一步的输入、输入哈希、输出、耗时与错误追加写入日志文件 (JSONL)，日志只追加、不改写。
+3. 续跑：日志中已成功完成、且输入哈希相同的步骤直接复用上次的输出，不再执行。
+   输入哈希包含依赖步骤的输出哈希，上游输出变化时下游步骤会重新执行。
+4. 每一步有独立的重试策略（次数与指数退避的初始间隔）。
+5. 步骤之间的依赖通过 `depends_on` 声明，互不依赖的步骤（例如同一帧上的多个查找）在线程池中并发执行。
+
+工作流文件格式：
+
+    name: calculator
+    defaults:            # 所有步骤的默认参数，可被步骤覆盖
+      mode: point
+      retries: 2
+      retry_delay: 1.0
+    steps:
+      - id: press_1
+        instruction: "定位按钮 '1'"
+        screenshot: data/calc_01_initial.png
+      - id: press_2       # 未声明 depends_on 时依赖上一步，即默认按顺序执行
+        ...
+      - id: lookup_a
+        depends_on: []    # 不依赖任何步骤，可与其他步骤并发
+
+除 `id`、`depends_on`、`retries`、`retry_delay` 之外的字段都作为步骤参数原样交给执行函数。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+_RESERVED_KEYS = ("id", "depends_on", "retries", "retry_delay")
+
+
+class WorkflowStep(NamedTuple):
+    """工作流中的一个步骤。"""
+    id: str
+    params: dict
+    depends_on: tuple
+    retries: int = 0
+    retry_delay: float = 1.0
+
+
+class StepResult(NamedTuple):
+    """
+    一个步骤的执行结果。
+
+    `status` 取值：
+    - "completed": 本次运行中执行成功。
+    - "resumed": 日志中已有相同输入的成功记录，直接复用输出。
+    - "failed": 重试次数用尽后仍然失败。
+    - "blocked": 依赖的步骤失败，未执行。
+    """
+    status: str
+    output: object = None
+    attempts: int = 0
+    elapsed_ms: float = 0.0
+    error: str = None
+
+
+def _stable_hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def load_workflow(path: str) -> tuple[str, list]:
+    """
+    从 YAML（.yaml/.yml）或 JSON 文件加载工作流。
+
+    Returns:
+        tuple[str, list[WorkflowStep]]: (工作流名称, 步骤列表)。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    name = spec.get("name") or os.path.splitext(os.path.basename(path))[0]
+    return name, parse_steps(spec.get("steps", []), spec.get("defaults"))
+
+
+def parse_steps(raw_steps: list, defaults: dict = None) -> list:
+    """把工作流文件中的步骤列表解析为 `WorkflowStep`，并检查 ID 重复、未知依赖与循环依赖。"""
+    defaults = dict(defaults or {})
+    steps = []
+    previous = None
+    for i, raw in enumerate(raw_steps):
+        merged = {**defaults, **raw}
+        step_id = str(merged.get("id") or f"step_{i + 1:02d}")
+        depends_on = merged.get("depends_on")
+        if depends_on is None:
+            depends_on = [previous] if previous is not None else []
+        elif isinstance(depends_on, str):
+            depends_on = [depends_on]
+        steps.append(WorkflowStep(
+            id=step_id,
+            params={k: v for k, v in merged.items() if k not in _RESERVED_KEYS},
+            depends_on=tuple(str(d) for d in depends_on),
+            retries=int(merged.get("retries", 0)),
+            retry_delay=float(merged.get("retry_delay", 1.0)),
+        ))
+        previous = step_id
+
+    ids = [step.id for step in steps]
+    duplicates = {i for i in ids if ids.count(i) > 1}
+    if duplicates:
+        raise ValueError(f"步骤 ID 重复: {sorted(duplicates)}")
+    known = set(ids)
+    for step in steps:
+        unknown = [d for d in step.depends_on if d not in known]
+        if unknown:
+            raise ValueError(f"步骤 {step.id} 依赖了不存在的步骤: {unknown}")
+
+    # 拓扑排序检查循环依赖
+    remaining = {step.id: set(step.depends_on) for step in steps}
+    while remaining:
+        ready = [step_id for step_id, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"步骤之间存在循环依赖: {sorted(remaining)}")
+        for step_id in ready:
+            del remaining[step_id]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return steps
+
+
+class StepJournal:
+    """
+    只追加的步骤日志 (JSONL)。每条记录一次尝试的结果：
+
+        {"workflow", "step", "status", "attempt", "input_hash", "inputs", "output", "output_hash",
+         "started_at", "elapsed_ms", "error"}
+
+    续跑时只读取 `status` 为 "completed" 的记录；同一步骤有多条成功记录时以最后一条为准。
+
+    `background` 为 True 时，写入与 fsync 交给后台线程，`append` 只把记录放入有界队列（队列满时等待），
+    步骤不再为落盘等待；后台线程把排队的多条记录合并为一次写入。`flush` 等待已提交的记录全部落盘。
+    进程在落盘前被强行终止时，最后几条记录可能丢失，续跑时这些步骤会重新执行。
+
+    Args:
+        path (str): 日志文件路径，不存在时自动创建。
+        background (bool): 是否在后台线程中写入。
+        max_pending (int): 后台模式下排队等待写入的记录数上限。
+    """
+
+    def __init__(self, path: str, background: bool = False, max_pending: int = 64):
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed = {}
+        self._queue = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 进程在写入过程中被中断时，最后一行可能不完整
+                        continue
+                    if record.get("status") == "completed":
+                        self._completed[(record.get("workflow"), record["step"])] = record
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if background:
+            self._queue = queue.Queue(maxsize=max_pending)
+            self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+            self._writer.start()
+
+    def lookup(self, workflow: str, step_id: str, input_hash: str):
+        """返回该步骤输入哈希相同的最近一次成功记录；没有时返回 None。"""
+        record = self._completed.get((workflow, step_id))
+        if record is not None and record.get("input_hash") == input_hash:
+            return record
+        return None
+
+    def append(self, record: dict):
+        """追加一条记录。同步模式下立即刷新到磁盘，进程随后崩溃也不会丢失；后台模式见类说明。"""
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if record.get("status") == "completed":
+                self._completed[(record.get("workflow"), record["step"])] = record
+            if self._queue is None:
+                self._write([line])
+                return
+        self._queue.put(line)
+
+    def _write(self, lines: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_loop(self):
+        while True:
+            lines = [self._queue.get()]
+            # 合并已排队的记录，一次写入、一次 fsync
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [line for line in lines if line is not None]
+            try:
+                if records:
+                    with telemetry.span("journal_write", records=len(records)):
+                        self._write(records)
+            except Exception:
+                logger.exception("步骤日志写入失败: %s", self.path)
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+            if len(records) < len(lines):
+                return
+
+    def flush(self):
+        """等待已提交的记录全部写入磁盘（同步模式下什么都不做）。"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """写完所有记录并结束后台线程。"""
+        if self._queue is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._queue = None
+
+
+class WorkflowEngine:
+    """
+    按依赖关系执行工作流步骤。
+
+    Args:
+        name (str): 工作流名称，用于区分同一日志文件中不同工作流的记录。
+        steps (list[WorkflowStep]): 步骤列表（见 `load_workflow`）。
+        run_step (callable): `run_step(step) -> output`，执行一个步骤并返回可 JSON 序列化的输出；
+            抛出异常表示本次尝试失败。
+        journal (StepJournal, optional): 步骤日志；为 None 时不记录，也不能续跑。
+        fingerprint (callable, optional): `fingerprint(step) -> str`，返回步骤参数之外的输入指纹
+            （例如截图文件的内容哈希、模型 ID），参与输入哈希的计算。
+        max_workers (int): 并发执行互不依赖的步骤时的最大线程数。
+        resume (bool): 是否复用日志中已完成步骤的输出。
+    """
+
+    def __init__(self, name: str, steps: list, run_step, journal: StepJournal = None, fingerprint=None,
+                 max_workers: int = 4, resume: bool = True):
+        self.name = name
+        self.steps = {step.id: step for step in steps}
+        self.order = [step.id for step in steps]
+        self.run_step = run_step
+        self.journal = journal
+        self.fingerprint = fingerprint
+        self.max_workers = max_workers
+        self.resume = resume
+
+    def input_hash(self, step: WorkflowStep, output_hashes: dict) -> str:
+        """步骤参数、外部输入指纹与依赖步骤输出哈希的组合哈希。"""
+        return _stable_hash({
+            "params": step.params,
+            "fingerprint": self.fingerprint(step) if self.fingerprint else None,
+            "depends_on": {d: output_hashes.get(d) for d in step.depends_on},
+        })
+
+    def resumable(self) -> set:
+        """
+        不执行任何步骤，只根据日志推算本次运行中会被直接复用的步骤 ID。
+        入口脚本据此判断是否需要加载模型等准备工作。
+        """
+        if not self.resume or self.journal is None:
+            return set()
+        output_hashes = {}
+        resolved = set()
+        changed = True
+        while changed:
+            changed = False
+            for step_id in self.order:
+                step = self.steps[step_id]
+                if step_id in resolved or not all(d in output_hashes for d in step.depends_on):
+                    continue
+                resolved.add(step_id)
+                changed = True
+                record = self.journal.lookup(self.name, step_id, self.input_hash(step, output_hashes))
+                if record is not None:
+                    output_hashes[step_id] = record.get("output_hash")
+        return set(output_hashes)
+
+    def _attempt(self, step: WorkflowStep, input_hash: str) -> StepResult:
+        """执行一个步骤，失败时按重试策略重试；每次尝试都写入日志。"""
+        delay = step.retry_delay
+        started = time.perf_counter()
+        error = None
+        for attempt in range(1, step.retries + 2):
+            attempt_started = time.perf_counter()
+            record = {
+                "workflow": self.name, "step": step.id, "attempt": attempt,
+                "input_hash": input_hash, "inputs": step.params, "started_at": time.time(),
+            }
+            try:
+                with telemetry.span("workflow_step", step=step.id, attempt=attempt):
+                    output = self.run_step(step)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                record.update(status="failed", error=error,
+                              elapsed_ms=round((time.perf_counter() - attempt_started) * 1000, 2))
+                if self.journal is not None:
+                    self.journal.append(record)
+                if attempt <= step.retries:
+                    logger.warning("步骤 %s 第 %d 次尝试失败: %s；%.1f 秒后重试。", step.id, attempt, error, delay)
+                    time.sleep(delay)
+                    delay *= 2
+                continue
+            record.update(status="completed", output=output, output_hash=_stable_hash(output),
+                          elapsed_ms=round((time.perf_counter() - attempt_started) * 1000, 2))
+            if self.journal is not None:
+                self.journal.append(record)
+            return StepResult("completed", output, attempt, (time.perf_counter() - started) * 1000)
+        return StepResult("failed", None, step.retries + 1, (time.perf_counter() - started) * 1000, error)
+
+    def run(self) -> dict:
+        """
+        执行工作流。
+
+        Returns:
+            dict[str, StepResult]: 按工作流文件中的顺序排列的各步骤结果。
+        """
+        results = {}
+        output_hashes = {}
+        pending = list(self.order)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="workflow") as pool:
+            while pending or running:
+                # 1. 依赖失败的步骤标记为 blocked；依赖全部完成的步骤续跑或提交执行
+                for step_id in list(pending):
+                    step = self.steps[step_id]
+                    statuses = [results[d].status if d in results else None for d in step.depends_on]
+                    if any(s in ("failed", "blocked") for s in statuses):
+                        results[step_id] = StepResult("blocked", error="依赖的步骤失败")
+                        pending.remove(step_id)
+                        continue
+                    if not all(s in ("completed", "resumed") for s in statuses):
+                        continue
+                    pending.remove(step_id)
+                    input_hash = self.input_hash(step, output_hashes)
+                    record = self.journal.lookup(self.name, step_id, input_hash) \
+                        if self.resume and self.journal is not None else None
+                    if record is not None:
+                        results[step_id] = StepResult("resumed", record.get("output"))
+                        output_hashes[step_id] = record.get("output_hash")
+                        telemetry.count("workflow_steps_resumed", workflow=self.name)
+                        logger.info("步骤 %s 已在之前的运行中完成，跳过。", step_id)
+                        continue
+                    running[pool.submit(self._attempt, step, input_hash)] = step_id
+
+                if not running:
+                    # 本轮只产生了续跑/阻塞的结果，可能让更多步骤就绪
+                    if pending and not any(
+                        all(d in results for d in self.steps[s].depends_on) for s in pending
+                    ):
+                        break
+                    continue
+
+                # 2. 等待任一正在执行的步骤结束
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step_id = running.pop(future)
+                    result = future.result()
+                    results[step_id] = result
+                    if result.status == "completed":
+                        output_hashes[step_id] = _stable_hash(result.output)
+
+        if self.journal is not None:
+            # 日志在后台写入时，返回前确保所有记录都已落盘
+            self.journal.flush()
+        return {step_id: results[step_id] for step_id in self.order if step_id in results}
@@ -0,0 +1,133 @@
+"""
+本模块实现"由粗到细"的两阶段区域放大定位 (coarse-to-fine ROI zoom)。
+
+默认情况下，每张截图都以处理器的默认分辨率送入模型，目标再小也要付出数千个视觉 token 的预填充开销。
+两阶段定位把像素预算花在真正需要的地方：
+1. 粗定位：以很低的像素预算处理整张截图，只求找到目标所在的大致区域。
+2. 精定位：把该区域（适当外扩）从原图中裁剪出来，以较高的像素预算再定位一次。
+3. 把第二阶段在裁剪图上的坐标映射回原图坐标系。
+
+对于大尺寸桌面截图，两次推理的视觉 token 总数通常远小于一次全分辨率推理，
+而小目标在第二阶段中占据的像素反而更多，定位精度得以保持甚至提升。
+"""
+
+import logging
+
+from . import telemetry
+from .boxes import BoxSet
+from .grounding_utils import _load_image, inference, visual_token_count
+
+logger = logging.getLogger(__name__)
+
+# 默认像素预算：粗定位约 256 个视觉 token，精定位约 1280 个视觉 token
+DEFAULT_COARSE_MAX_PIXELS = 256 * 28 * 28
+DEFAULT_FINE_MAX_PIXELS = 1280 * 28 * 28
+
+
+def _first_box(text: str, input_height: int, input_width: int, size, offset=(0, 0)) -> BoxSet:
+    """取模型输出中的第一个完整边界框，换算到原图坐标系；`size`/`offset` 为推理所用图像在原图中的尺寸与位置。"""
+    return BoxSet.from_response(text, input_height, input_width)[:1].to_pixels(size, offset)
+
+
+def _expand_region(box, image_size, margin: float, min_size: int):
+    """
+    以边界框为中心外扩出裁剪区域：每边外扩 `margin` 倍的框宽/框高，且区域边长不小于 `min_size`，
+    最后裁剪到图像范围内。
+    """
+    width, height = image_size
+    x1, y1, x2, y2 = box
+    box_w, box_h = x2 - x1, y2 - y1
+    region_w = max(box_w * (1 + 2 * margin), min(min_size, width))
+    region_h = max(box_h * (1 + 2 * margin), min(min_size, height))
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+
+    left = int(max(0, min(cx - region_w / 2, width - region_w)))
+    top = int(max(0, min(cy - region_h / 2, height - region_h)))
+    right = int(min(width, left + region_w))
+    bottom = int(min(height, top + region_h))
+    return left, top, right, bottom
+
+
+@telemetry.traced("zoom_grounding")
+def zoom_grounding(
+    model,
+    processor,
+    image,
+    prompt: str,
+    system_prompt: str,
+    coarse_max_pixels: int = DEFAULT_COARSE_MAX_PIXELS,
+    fine_max_pixels: int = DEFAULT_FINE_MAX_PIXELS,
+    margin: float = 1.0,
+    min_region_size: int = 224,
+    max_new_tokens: int = 256
+) -> dict:
+    """
+    两阶段区域放大定位。
+
+    Args:
+        model: 已加载的VLLM模型。
+        processor: 对应的处理器。
+        image (str | Image.Image): 截图路径或已加载的图像。
+        prompt (str): 已填入指令的定位提示（要求输出 bbox_2d JSON）。
+        system_prompt (str): 系统提示。
+        coarse_max_pixels (int): 第一阶段（整图）的像素预算。
+        fine_max_pixels (int): 第二阶段（裁剪区域）的像素预算。
+        margin (float): 裁剪区域相对粗定位框每边外扩的比例。
+        min_region_size (int): 裁剪区域的最小边长（原图像素）。
+        max_new_tokens (int): 每个阶段生成的最大 token 数。
+
+    Returns:
+        dict: {
+            "bbox": 原图像素坐标系下的 [x1, y1, x2, y2]，两阶段都失败时为 None,
+            "label": 模型给出的标签,
+            "passes": 每个阶段的统计，包括输入尺寸、视觉 token 数与裁剪区域,
+        }
+    """
+    image = _load_image(image)
+    original_width, original_height = image.size
+    passes = []
+
+    # 1. 粗定位：整张截图，低像素预算
+    coarse_text, input_height, input_width = inference(
+        model, processor, image, prompt, system_prompt,
+        max_new_tokens=max_new_tokens, expected_boxes=1, max_pixels=coarse_max_pixels
+    )
+    passes.append({
+        "name": "coarse",
+        "region": [0, 0, original_width, original_height],
+        "input_size": [input_width, input_height],
+        "visual_tokens": visual_token_count(input_height, input_width),
+    })
+    # 粗定位框映射回原图坐标系
+    coarse = _first_box(coarse_text, input_height, input_width, image.size)
+    if not len(coarse):
+        return {"bbox": None, "label": None, "passes": passes}
+
+    # 2. 精定位：在原图上裁剪外扩后的区域，以高像素预算再定位一次
+    region = _expand_region(coarse.coords[0], image.size, margin, min_region_size)
+    crop = image.crop(region)
+    fine_text, input_height, input_width = inference(
+        model, processor, crop, prompt, system_prompt,
+        max_new_tokens=max_new_tokens, expected_boxes=1, max_pixels=fine_max_pixels
+    )
+    passes.append({
+        "name": "fine",
+        "region": list(region),
+        "input_size": [input_width, input_height],
+        "visual_tokens": visual_token_count(input_height, input_width),
+    })
+    # 3. 裁剪图坐标 -> 原图坐标
+    left, top, right, bottom = region
+    fine = _first_box(fine_text, input_height, input_width, (right - left, bottom - top), (left, top))
+    if not len(fine):
+        # 精定位失败时退回粗定位结果
+        logger.warning("[!] 精定位未能给出边界框，使用粗定位结果。")
+        bbox, label = coarse.coords[0], coarse.labels[0]
+    else:
+        bbox, label = fine.coords[0], fine.labels[0] or coarse.labels[0]
+
+    total_tokens = sum(p["visual_tokens"] for p in passes)
+    logger.info("[缩放定位] 视觉 token: %s = %d",
+                " + ".join(f"{p['name']} {p['visual_tokens']}" for p in passes), total_tokens)
+    telemetry.current_span().set(visual_tokens=total_tokens)
+    return {"bbox": [int(round(v)) for v in bbox.tolist()], "label": label, "passes": passes}
@@ -0,0 +1,29 @@
+"""
+测试的公共配置。
+
+测试只覆盖与模型权重无关的逻辑，在没有 GPU、未安装 torch 的机器上即可运行：
+    python -m pytest -q
+
+需要 torch 的测试在 torch 不可用时自动跳过；用到 `tiny_model` 的测试还需要联网下载模型的配置与分词器（几 MB）。
+"""
+
+import os
+import sys
+
+import pytest
+
+# 与 scripts/ 下的入口脚本一致，以 `from utils... import ...` 导入工具模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+
+@pytest.fixture(scope="session")
+def tiny_model():
+    """随机初始化的迷你 Qwen2.5-VL 模型与真实处理器（见 `utils.tiny_model`）。"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    pytest.importorskip("modelscope")
+    load_tiny_model_and_processor = pytest.importorskip("utils.tiny_model").load_tiny_model_and_processor
+    try:
+        return load_tiny_model_and_processor()
+    except OSError as e:
+        pytest.skip(f"无法获取模型配置与分词器: {e}")
@@ -0,0 +1,87 @@
+"""`agent_pipeline.FramePrefetcher`：预取窗口、逐步骤释放预处理结果，以及关闭时的清理。"""
+
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from utils.agent_pipeline import FramePrefetcher
+from utils.frames import as_frame
+
+TIMEOUT = 5
+
+
+class _ImageProcessor(SimpleNamespace):
+    def __call__(self, images, return_tensors):
+        self.calls.append(images[0].size)
+        return {"pixel_values": np.zeros((4, 1176), np.float32), "image_grid_thw": np.array([[1, 2, 2]])}
+
+
+def _processor():
+    image_processor = _ImageProcessor(min_pixels=3136, max_pixels=12845056, patch_size=14, merge_size=2, calls=[])
+    return SimpleNamespace(image_processor=image_processor)
+
+
+def _frames(count):
+    return [as_frame(Image.new("RGB", (64, 64), (n, 0, 0))) for n in range(count)]
+
+
+def _ready(prefetcher, frame, timeout=TIMEOUT):
+    return prefetcher._slots[id(frame)].ready.wait(timeout)
+
+
+def test_shared_frame_is_released_after_its_last_step():
+    frame, other = _frames(2)
+    prefetcher = FramePrefetcher([("a", frame, True), ("b", frame, True), ("c", other, False)], _processor())
+    try:
+        assert prefetcher.wait(frame) is prefetcher.buffer
+        assert prefetcher.wait(other) is None          # 只解码的帧没有预处理结果
+        assert len(prefetcher.buffer) == 1
+
+        prefetcher.release(frame, "a")
+        prefetcher.release(frame, "a")                 # 重复释放与未知的帧都被忽略
+        prefetcher.release(_frames(1)[0], "a")
+        assert len(prefetcher.buffer) == 1
+        prefetcher.release(frame, "b")
+        assert len(prefetcher.buffer) == 0
+    finally:
+        prefetcher.close()
+
+
+def test_prefetch_stays_within_lookahead():
+    frames = _frames(3)
+    prefetcher = FramePrefetcher([(f"s{n}", f, True) for n, f in enumerate(frames)], _processor(), lookahead=2)
+    try:
+        assert _ready(prefetcher, frames[0]) and _ready(prefetcher, frames[1])
+        assert not _ready(prefetcher, frames[2], timeout=0.1)
+        # 第一帧的步骤结束后腾出位置，第三帧才开始预取
+        prefetcher.release(frames[0], "s0")
+        assert _ready(prefetcher, frames[2])
+    finally:
+        prefetcher.close()
+
+
+def test_step_ahead_of_prefetch_prepares_in_place():
+    frames = _frames(3)
+    processor = _processor()
+    prefetcher = FramePrefetcher([(f"s{n}", f, True) for n, f in enumerate(frames)], processor, lookahead=1)
+    try:
+        assert _ready(prefetcher, frames[0])
+        # 第三帧还没轮到预取线程：步骤线程就地准备，不等待预取窗口
+        assert prefetcher.wait(frames[2]) is prefetcher.buffer
+        assert len(processor.image_processor.calls) == 2
+    finally:
+        prefetcher.close()
+
+
+def test_close_stops_prefetch_and_drops_results():
+    frames = _frames(4)
+    processor = _processor()
+    prefetcher = FramePrefetcher([(f"s{n}", f, True) for n, f in enumerate(frames)], processor, lookahead=2)
+    assert _ready(prefetcher, frames[1])
+    prefetcher.close()                                 # 预取线程正阻塞在预取窗口上
+
+    assert not prefetcher._thread.is_alive()
+    assert len(prefetcher.buffer) == 0
+    assert not prefetcher._slots[id(frames[3])].started
+    assert len(processor.image_processor.calls) == 2
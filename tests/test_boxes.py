@@ -0,0 +1,90 @@
+"""`boxes`：BoxSet / PointSet 的解析、坐标系换算与向量化的几何查询。"""
+
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.boxes import BoxSet, PointSet, box_iou, input_sizes, nms
+
+RESPONSE = '```json\n[{"bbox_2d": [100, 50, 20, 10], "label": "a"}, {"bbox_2d": [1, 2], "label": "bad"}, ' \
+           '{"bbox_2d": [0, 0, "x", 4], "label": "bad"}, {"bbox_2d": [200, 100, 280, 140], "label": "b"}]\n```'
+
+
+def test_input_sizes_use_processor_patch_size():
+    assert input_sizes([[1, 36, 52], [1, 8, 8]]).tolist() == [[504, 728], [112, 112]]
+
+    class Processor:
+        image_processor = type("ImageProcessor", (), {"patch_size": 16})()
+
+    assert input_sizes(np.array([1, 4, 6]), Processor()).tolist() == [[64, 96]]
+
+
+def test_from_response_skips_invalid_and_normalizes_corners():
+    boxes = BoxSet.from_response(RESPONSE, 280, 560)
+    assert len(boxes) == 2
+    assert boxes.labels == ["a", "b"]
+    assert boxes.coords.tolist() == [[20, 10, 100, 50], [200, 100, 280, 140]]
+    assert boxes.input_size == (280, 560)
+
+
+def test_pixel_and_input_round_trip():
+    frame = Image.new("RGB", (1120, 560))
+    boxes = BoxSet.from_response(RESPONSE, 280, 560, frame)
+    pixels = boxes.to_pixels()
+    assert pixels.input_size is None
+    assert pixels.coords.tolist() == [[40, 20, 200, 100], [400, 200, 560, 280]]
+    assert pixels.to_pixels() is pixels
+    np.testing.assert_allclose(pixels.to_input(280, 560).coords, boxes.coords)
+
+    # 来自裁剪区域的结果：按裁剪区域尺寸缩放，再平移到整张原图
+    crop = boxes.to_pixels(size=(280, 140), offset=(500, 300))
+    assert crop.coords[0].tolist() == [510, 305, 550, 325]
+    with pytest.raises(ValueError):
+        BoxSet.from_response(RESPONSE, 280, 560).to_pixels()
+
+
+def test_to_json_matches_model_format():
+    boxes = BoxSet([[1.4, 2.6, 3.5, 4.4]], ["ok"])
+    assert json.loads(boxes.to_json()) == [{"bbox_2d": [1, 3, 4, 4], "label": "ok"}]
+    assert BoxSet.from_response(boxes.to_json(), 10, 10).labels == ["ok"]
+    with pytest.raises(ValueError):
+        BoxSet([[0, 0, 1, 1]], ["a", "b"])
+
+
+def test_iou_and_nms():
+    coords = [[0, 0, 10, 10], [1, 1, 11, 11], [20, 20, 30, 30]]
+    iou = box_iou(coords, coords)
+    assert np.allclose(np.diag(iou), 1)
+    assert iou[0, 1] == pytest.approx(81 / 119)
+    assert iou[0, 2] == 0
+    assert nms(coords, [0.5, 0.9, 0.1]) == [1, 2]
+    assert nms([], []) == []
+
+    boxes = BoxSet(coords, ["a", "b", "c"], [0.5, 0.9, 0.1])
+    assert boxes.nms().labels == ["b", "c"]
+    assert boxes.nms(iou_threshold=0.9).labels == ["b", "a", "c"]
+
+
+def test_geometric_queries():
+    boxes = BoxSet([[0, 0, 10, 10], [5, 5, 20, 20], [30, 30, 40, 40]], ["a", "b", "c"])
+    assert boxes.centers.tolist() == [[5, 5], [12.5, 12.5], [35, 35]]
+    assert boxes.areas.tolist() == [100, 225, 100]
+    assert boxes.containing(7, 7).labels == ["a", "b"]
+    assert boxes.intersecting([10, 10, 29, 29]).labels == ["a", "b"]
+    assert boxes.centered_in([0, 0, 20, 20]).labels == ["a", "b"]
+    assert boxes[[2, 0]].labels == ["c", "a"]
+    assert boxes[np.array([True, False, True])].labels == ["a", "c"]
+
+    points = PointSet([[1, 1], [25, 25], [35, 31]])
+    assert boxes.contains(points).tolist() == [[True, False, False], [False, False, False], [False, False, True]]
+    assert points.inside(boxes).tolist() == [True, False, True]
+    assert boxes.center_points().coords.tolist() == boxes.centers.tolist()
+
+
+def test_concat_keeps_labels_and_scores():
+    merged = BoxSet.concat([BoxSet([[0, 0, 1, 1]], ["a"], [0.3]), BoxSet([[2, 2, 3, 3]], ["b"])])
+    assert merged.labels == ["a", "b"]
+    assert merged.scores.tolist() == [0.3, 1.0]
+    assert len(BoxSet.concat([])) == 0
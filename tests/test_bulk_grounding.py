@@ -0,0 +1,144 @@
+"""`bulk_grounding`：清单读取、按 id 分片、输出文件的断点续跑，以及端到端的批量流水线。"""
+
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import utils.bulk_grounding as bulk
+from utils.bulk_grounding import (
+    completed_ids, load_manifest, manifest_from_directory, run_bulk_grounding, shard_output_path, shard_records,
+)
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return str(path)
+
+
+def test_load_manifest_formats(tmp_path):
+    jsonl = _write(tmp_path / "m.jsonl",
+                   '{"image": "a.png", "instruction": "login", "expected_boxes": 1}\n\n'
+                   '{"image": "/abs/b.png", "instruction": "cancel", "id": "r2"}\n')
+    records = load_manifest(jsonl, image_root="shots")
+    assert [(r.id, r.image, r.expected_boxes) for r in records] == [
+        ("a.png\tlogin", os.path.join("shots", "a.png"), 1),
+        ("r2", "/abs/b.png", None),
+    ]
+    # 缺省 id 与 image_root 无关，更换根目录后续跑结果不变
+    assert load_manifest(jsonl)[0].id == records[0].id
+
+    csv_path = _write(tmp_path / "m.csv", "image,instruction,expected_boxes\na.png,login,\nb.png,ok,2\n")
+    tsv_path = _write(tmp_path / "m.tsv", "id\timage\tinstruction\nx\ta.png\tlogin\n")
+    assert [r.expected_boxes for r in load_manifest(csv_path)] == [None, 2]
+    assert load_manifest(tsv_path)[0].id == "x"
+
+    with pytest.raises(ValueError, match="第 1 条"):
+        load_manifest(_write(tmp_path / "bad.jsonl", '{"image": "a.png"}\n'))
+
+
+def test_manifest_from_directory(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("b.png", "a.jpg", "sub/c.png", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+    records = manifest_from_directory(str(tmp_path), ["ok", "cancel"])
+    assert [os.path.relpath(r.image, tmp_path) for r in records[::2]] == ["a.jpg", "b.png", os.path.join("sub", "c.png")]
+    assert [r.instruction for r in records[:2]] == ["ok", "cancel"]
+
+
+def test_shards_partition_records_stably():
+    records = [bulk.BulkRecord(f"id{i}", f"{i}.png", "x") for i in range(200)]
+    shards = [shard_records(records, i, 4) for i in range(4)]
+    assert sorted(r.id for shard in shards for r in shard) == sorted(r.id for r in records)
+    assert all(shards)
+    # 与记录顺序无关
+    assert {r.id for r in shard_records(records[::-1], 1, 4)} == {r.id for r in shards[1]}
+    assert shard_records(records, 0, 1) == records
+    with pytest.raises(ValueError):
+        shard_records(records, 4, 4)
+
+
+def test_shard_output_path():
+    assert shard_output_path("out/results.jsonl") == "out/results.jsonl"
+    assert shard_output_path("out/results.jsonl", 1, 4) == "out/results.shard01-of-04.jsonl"
+    assert shard_output_path("results", 0, 2) == "results.shard00-of-02.jsonl"
+
+
+def test_completed_ids_truncates_partial_line_and_retries_errors(tmp_path):
+    path = tmp_path / "results.jsonl"
+    assert completed_ids(str(path)) == set()
+    lines = [
+        {"id": "a", "boxes": []},
+        {"id": "b", "error": "OSError"},
+        {"id": "c", "error": "OSError"},
+        {"id": "c", "boxes": []},
+        {"id": "a", "error": "RuntimeError"},
+        {"id": "d", "boxes": []},
+    ]
+    complete = "".join(json.dumps(line) + "\n" for line in lines)
+    path.write_text(complete + '{"id": "e", "box', encoding="utf-8")
+
+    assert completed_ids(str(path)) == {"c", "d"}
+    assert path.read_text(encoding="utf-8") == complete
+
+
+@pytest.fixture
+def remote_run(monkeypatch, tmp_path):
+    """把推理替换为假的推理服务：每条记录返回一个覆盖左上角的边界框。"""
+    calls = []
+
+    def fake_inference_batch(model, processor, jobs, expected_boxes=None, preprocess_cache=None, **kwargs):
+        calls.append({"size": len(jobs), "expected_boxes": expected_boxes, "cache": preprocess_cache})
+        return [('[{"bbox_2d": [0, 0, 50, 50], "label": "%s"}]' % prompt, 100, 100) for _, prompt, _ in jobs]
+
+    monkeypatch.setattr(bulk, "inference_batch", fake_inference_batch)
+    images = []
+    for i in range(5):
+        path = tmp_path / f"shot{i}.png"
+        Image.new("RGB", (200, 100), (i * 40, 0, 0)).save(path)
+        images.append(str(path))
+    records = [bulk._record(image, "ok", expected_boxes=1 if i == 0 else None) for i, image in enumerate(images)]
+    records.append(bulk._record(str(tmp_path / "missing.png"), "ok"))
+
+    def run(**kwargs):
+        return run_bulk_grounding(
+            SimpleNamespace(is_remote=True), None, records, str(tmp_path / "out.jsonl"),
+            "{instruction}", "system", batch_size=2, workers=2, **kwargs
+        )
+
+    return run, calls, records, tmp_path / "out.jsonl"
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_writes_every_record_and_resumes(remote_run):
+    run, calls, records, output = remote_run
+    stats = run()
+    assert (stats["total"], stats["completed"], stats["failed"], stats["skipped"]) == (6, 5, 1, 0)
+    assert [c["size"] for c in calls] == [2, 2, 1]
+    assert calls[0]["expected_boxes"] == [1, None] and calls[1]["expected_boxes"] is None
+    assert all(c["cache"] is None for c in calls)
+
+    results = {r["id"]: r for r in _read(output)}
+    assert set(results) == {r.id for r in records}
+    first = results[records[0].id]
+    assert first["image_size"] == [200, 100]
+    assert first["boxes"] == [{"bbox_2d": [0, 0, 100, 50], "label": "ok"}]
+    assert "error" in results[records[-1].id]
+
+    # 续跑只重试失败的记录
+    calls.clear()
+    stats = run()
+    assert (stats["skipped"], stats["completed"], stats["failed"]) == (5, 0, 1)
+    assert calls == []
+
+    # resume=False 时清空输出文件重新执行
+    stats = run(resume=False)
+    assert stats["completed"] == 5
+    assert len(_read(output)) == 6
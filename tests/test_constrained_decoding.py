@@ -0,0 +1,97 @@
+"""约束解码：边界框 JSON 的字符级语法，以及迷你模型上的端到端约束生成。"""
+
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from utils.decoding_utils import _PHASE_DONE, BboxJsonGrammar  # noqa: E402
+
+CANONICAL = '[{"bbox_2d": [1, 22, 333, 4444], "label": "ok"}]'
+
+
+def _accepts(grammar, text) -> bool:
+    state = grammar.consume(grammar.initial_state(), text)
+    return state is not None and state[0] == _PHASE_DONE
+
+
+def test_accepts_canonical_json():
+    grammar = BboxJsonGrammar()
+    assert _accepts(grammar, CANONICAL)
+    two = CANONICAL[:-1] + ', {"bbox_2d": [5, 6, 7, 8], "label": "b"}]'
+    assert _accepts(grammar, two)
+    assert json.loads(two)
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n' + CANONICAL,                                  # 代码块
+    '[{"bbox_2d": [1.5, 2, 3, 4], "label": "x"}]',            # 非整数坐标
+    '[{"bbox_2d": [1, 2, 3], "label": "x"}]',                 # 坐标数量不足
+    '[{"bbox_2d": [1, 2, 3, 4], "label": "a\\"b"}]',          # 转义字符
+    '[{"label": "x", "bbox_2d": [1, 2, 3, 4]}]',              # 键顺序不规范
+])
+def test_rejects_non_canonical_output(text):
+    grammar = BboxJsonGrammar()
+    assert grammar.consume(grammar.initial_state(), text) is None
+
+
+def test_max_boxes_forces_array_to_close():
+    grammar = BboxJsonGrammar(max_boxes=1)
+    state = grammar.consume(grammar.initial_state(), CANONICAL[:-1])
+    assert grammar.continuations(state) == ["]"]
+    assert grammar.advance(state, ",") is None
+
+
+def test_limits_digits_and_label_length():
+    grammar = BboxJsonGrammar(max_digits=2, max_label_chars=3)
+    assert grammar.consume(grammar.initial_state(), '[{"bbox_2d": [123') is None
+    assert grammar.consume(grammar.initial_state(), '[{"bbox_2d": [1, 2, 3, 4], "label": "abcd') is None
+    assert _accepts(grammar, '[{"bbox_2d": [1, 2, 3, 4], "label": "abc"}]')
+
+
+def test_tiny_model_output_is_always_valid(tiny_model):
+    from PIL import Image
+    from utils.grounding_utils import inference
+
+    model, processor = tiny_model
+    image = Image.new("RGB", (224, 224), (40, 120, 200))
+    for expected in (1, 3):
+        output, _, _ = inference(
+            model, processor, image, 'Provide the JSON: [{"bbox_2d": [x1, y1, x2, y2], "label": "element"}]',
+            max_new_tokens=96, expected_boxes=expected, constrained=True
+        )
+        boxes = json.loads(output)
+        assert 1 <= len(boxes) <= expected
+        for box in boxes:
+            assert set(box) == {"bbox_2d", "label"}
+            assert len(box["bbox_2d"]) == 4 and all(isinstance(v, int) for v in box["bbox_2d"])
+
+
+def test_point_geometry():
+    grammar = BboxJsonGrammar(geometry="point", max_boxes=1)
+    assert _accepts(grammar, '[{"point_2d": [12, 345], "label": "3"}]')
+    assert grammar.consume(grammar.initial_state(), '[{"point_2d": [1, 2, 3') is None
+    assert grammar.consume(grammar.initial_state(), '[{"bbox_2d": [') is None
+    assert grammar.continuations(grammar.consume(grammar.initial_state(), '[{"point_2d": [1')) == ["0123456789", ", "]
+    assert grammar.continuations(grammar.consume(grammar.initial_state(), '[{"point_2d": [1, 2')) == [
+        "0123456789", '], "label": "'
+    ]
+    with pytest.raises(ValueError):
+        BboxJsonGrammar(geometry="polygon")
+
+
+def test_tiny_model_point_output_parses_as_points(tiny_model):
+    from PIL import Image
+    from utils.grounding_utils import POINT_JSON_PROMPT_TEMPLATE, inference, parse_points
+
+    model, processor = tiny_model
+    image = Image.new("RGB", (224, 224), (40, 120, 200))
+    output, _, _ = inference(
+        model, processor, image, POINT_JSON_PROMPT_TEMPLATE.format(instruction="button '3'"),
+        max_new_tokens=64, expected_boxes=1, constrained="point"
+    )
+    points = parse_points(output)
+    assert len(points) == 1
+    assert all(isinstance(v, int) for v in json.loads(output)[0]["point_2d"])
@@ -0,0 +1,99 @@
+"""`decoding_utils`：JSON 结构跟踪与"JSON 完整即停止"的早停准则。"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from utils.decoding_utils import JsonCompletionStoppingCriteria, JsonStateTracker  # noqa: E402
+
+BOX = '{"bbox_2d": [10, 20, 30, 40], "label": "ok"}'
+
+
+class _CharTokenizer:
+    """每个字符一个 token，token ID 即字符的码位。"""
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids.tolist())
+
+
+def _feed(text: str) -> JsonStateTracker:
+    tracker = JsonStateTracker()
+    tracker.feed(text)
+    return tracker
+
+
+def test_counts_completed_boxes_and_finishes_on_outer_close():
+    tracker = _feed(f"[{BOX}, {BOX}]")
+    assert tracker.finished
+    assert tracker.completed_boxes == 2
+
+
+def test_ignores_markdown_fence_and_leading_prose():
+    tracker = _feed(f"Here you go:\n```json\n[{BOX}]\n```")
+    assert tracker.finished and tracker.completed_boxes == 1
+
+
+def test_brackets_in_prose_do_not_finish():
+    tracker = _feed("Step [1]: look at the {top} bar. ")
+    assert not tracker.finished
+    tracker.feed(f"[{BOX}]")
+    assert tracker.finished and tracker.completed_boxes == 1
+
+
+def test_point_objects_count_as_location_objects():
+    tracker = _feed('[{"point_2d": [5, 6], "label": "p"}]')
+    assert tracker.finished and tracker.completed_boxes == 1
+
+
+def test_brackets_inside_strings_are_ignored():
+    tracker = _feed('[{"bbox_2d": [1, 2, 3, 4], "label": "a]}["}')
+    assert not tracker.finished
+    assert tracker.closing_suffix() == "]"
+
+
+def test_closing_suffix_completes_open_structures():
+    tracker = _feed(f'[{BOX}, {{"bbox_2d": [1, 2, 3, 4]')
+    assert tracker.completed_boxes == 1
+    assert tracker.closing_suffix() == "}]"
+
+
+def _run(criteria, texts, prompt="<prompt>"):
+    """按步把每一行的文本追加到输入中调用准则，直到所有行停止或文本耗尽。"""
+    rows = [list(map(ord, prompt)) for _ in texts]
+    steps = max(len(t) for t in texts)
+    done = None
+    for step in range(steps):
+        for row, text in zip(rows, texts):
+            row.append(ord(text[step]) if step < len(text) else ord(" "))
+        done = criteria(torch.tensor(rows), None)
+        if bool(done.all()):
+            break
+    return done
+
+
+def test_stops_after_expected_boxes_per_row():
+    criteria = JsonCompletionStoppingCriteria(_CharTokenizer(), [1, 2], max_new_tokens=256)
+    text = f"[{BOX}, {BOX}, {BOX}]"
+    done = _run(criteria, [text, text])
+    assert done.tolist() == [True, True]
+    first, second = criteria.stopped_at
+    assert first == len(f"[{BOX}")
+    assert second == len(f"[{BOX}, {BOX}")
+    assert criteria.closing_suffix(0) == "]"
+    assert criteria.early_stopped(0)
+    assert criteria.max_tokens_saved(0) == 256 - first
+
+
+def test_rows_without_expectation_stop_when_json_closes():
+    criteria = JsonCompletionStoppingCriteria(_CharTokenizer(), [None], max_new_tokens=256)
+    _run(criteria, [f"[{BOX}, {BOX}] trailing text"])
+    assert criteria.stopped_at == [len(f"[{BOX}, {BOX}]")]
+    assert criteria.closing_suffix(0) == ""
+
+
+def test_not_stopped_rows_report_no_savings():
+    criteria = JsonCompletionStoppingCriteria(_CharTokenizer(), 1, max_new_tokens=8)
+    _run(criteria, ["no json"])
+    assert not criteria.early_stopped(0)
+    assert criteria.max_tokens_saved(0) == 0
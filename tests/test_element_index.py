@@ -0,0 +1,104 @@
+"""`element_index`：标签规范化、按指令查找、区域校验，以及失效区域的局部重新枚举。"""
+
+import json
+
+import pytest
+from PIL import Image, ImageDraw
+
+from utils.element_index import ElementIndex, instruction_target, normalize_label
+
+WIDTH, HEIGHT = 400, 200
+ELEMENTS = [
+    {"bbox_2d": [10, 10, 90, 60], "label": "3"},
+    {"bbox_2d": [110, 10, 190, 60], "label": "+"},
+    {"bbox_2d": [210, 10, 290, 60], "label": "OK"},
+    {"bbox_2d": [10, 110, 90, 160], "label": "ok"},
+    {"bbox_2d": [310, 110, 390, 160], "label": "Cancel"},
+]
+
+
+def _screen(changed=()):
+    image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    for i, element in enumerate(ELEMENTS):
+        draw.rectangle(element["bbox_2d"], fill=(30 * i, 100, 200))
+    for box in changed:
+        draw.rectangle(box, fill="black")
+    return image
+
+
+@pytest.fixture
+def index():
+    # 模型输入尺寸与截图相同，两个坐标系重合
+    return ElementIndex(ELEMENTS, HEIGHT, WIDTH, _screen())
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("点击按钮 '３'", "3"),
+    ("Click the 'Cancel' button", "cancel"),
+    ("Click the OK button", "ok"),
+    ("点击 “+” 按钮", "+"),
+    ("+", "+"),
+])
+def test_instruction_target(text, expected):
+    assert instruction_target(text) == expected
+
+
+def test_normalize_label_keeps_symbols():
+    assert normalize_label("  ＝ ") == "="
+    assert normalize_label("按钮") == "按钮"
+
+
+def test_locate_hits_unique_unchanged_elements(index):
+    element = index.locate(_screen(), "点击按钮 '3'")
+    assert element is not None and element.label == "3"
+    assert element.center == (50, 35)
+    assert index.locate(_screen(), "Click 'Cancel'").label == "Cancel"
+    assert index.stats()["hits"] == 2
+
+
+def test_locate_misses_on_missing_ambiguous_or_stale(index):
+    assert index.locate(_screen(), "Click '7'") is None          # 查找不到
+    assert index.locate(_screen(), "Click 'ok'") is None         # 两个元素都规范化为 "ok"
+    assert index.locate(_screen(changed=[(20, 20, 40, 40)]), "Click '3'") is None
+    resized = _screen().resize((WIDTH // 2, HEIGHT // 2))
+    assert index.locate(resized, "Click '+'") is None
+    stats = index.stats()
+    assert (stats["hits"], stats["misses"], stats["stale"]) == (0, 2, 2)
+    # 区域之外的变化不影响查找
+    assert index.locate(_screen(changed=[(300, 10, 305, 15)]), "Click '3'") is not None
+
+
+def test_spatial_queries(index):
+    assert [e.label for e in index.elements_at(50, 35)] == ["3"]
+    assert index.elements_at(100, 100) == []
+    assert sorted(e.label for e in index.elements_in([80, 0, 220, 70])) == ["+", "3", "OK"]
+
+
+def test_invalidate_and_refresh_only_reenumerates_dirty_regions(index):
+    removed = index.invalidate([(100, 0, 200, 70), (180, 20, 220, 50)])
+    assert removed == 2
+    assert index.pending_regions == [(100, 0, 220, 70)]
+    assert len(index) == 3
+    assert index.locate(_screen(), "Click '+'") is None
+
+    crops = []
+
+    def enumerate_fn(crop):
+        crops.append(crop.size)
+        # 裁剪图的坐标系：原图中的 (110, 10) 在裁剪图中为 (110 - 68, 10 - 0)
+        response = json.dumps([
+            {"bbox_2d": [42, 10, 122, 60], "label": "-"},
+            {"bbox_2d": [0, 10, 22, 60], "label": "3"},   # 中心落在变化区域之外，已在索引中
+        ])
+        return response, crop.size[1], crop.size[0]
+
+    new_screen = _screen()
+    fraction = index.refresh(new_screen, enumerate_fn)
+    assert crops == [(184, 102)]
+    assert fraction == pytest.approx(184 * 102 / (WIDTH * HEIGHT))
+    assert index.pending_regions == []
+    assert len(index) == 4
+    assert [e.label for e in index.find("-")] == ["-"]
+    assert len(index.find("3")) == 1
+    assert index.refresh(new_screen, enumerate_fn) == 0
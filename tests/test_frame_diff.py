@@ -0,0 +1,167 @@
+"""`frame_diff`：脏矩形检测，以及 `FrameDiffTracker` 的分支基准与结果复用。"""
+
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from utils.frame_diff import (
+    FrameDiffTracker, _label_components, dirty_block_mask, dirty_regions, intersects, region_area,
+)
+
+WIDTH, HEIGHT = 320, 240
+
+
+def _frame(*boxes, color="black"):
+    image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    for box in boxes:
+        draw.rectangle(box, fill=color)
+    return image
+
+
+def test_identical_frames_have_no_dirty_regions():
+    assert dirty_regions(_frame(), _frame()) == []
+    assert not dirty_block_mask(_frame(), _frame()).any()
+
+
+def test_regions_are_block_aligned_and_cover_the_change():
+    regions = dirty_regions(_frame(), _frame((40, 20, 70, 50)))
+    assert regions == [(32, 16, 80, 64)]
+    assert region_area(regions) == 48 * 48
+
+
+def test_distant_changes_stay_separate_and_near_changes_merge():
+    far = dirty_regions(_frame(), _frame((0, 0, 20, 20), (200, 150, 220, 170)))
+    assert len(far) == 2
+    near = dirty_regions(_frame(), _frame((0, 0, 15, 15), (32, 0, 47, 15)))
+    assert near == [(0, 0, 48, 16)]
+    assert len(dirty_regions(_frame(), _frame((0, 0, 15, 15), (32, 0, 47, 15)), merge_gap=0)) == 2
+
+
+def test_winding_change_is_one_region():
+    # U 形的变化：两条竖边只通过底边相连，标号需要沿整条路径传播
+    regions = dirty_regions(_frame(), _frame((0, 0, 15, 200), (0, 192, 300, 207), (288, 0, 303, 200)), merge_gap=0)
+    assert regions == [(0, 0, 304, 208)]
+
+
+def _reference_components(mask):
+    """逐块广度优先搜索的 8 邻域连通区域，作为对照。"""
+    rows, cols = mask.shape
+    seen, components = np.zeros_like(mask), []
+    for r0, c0 in zip(*np.nonzero(mask)):
+        if seen[r0, c0]:
+            continue
+        seen[r0, c0] = True
+        queue, component = [(r0, c0)], set()
+        while queue:
+            r, c = queue.pop()
+            component.add((r, c))
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if mask[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        queue.append((nr, nc))
+        components.append(frozenset(component))
+    return set(components)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_label_components_matches_breadth_first_search(seed):
+    mask = np.random.default_rng(seed).random((20, 30)) < 0.35
+    labels = _label_components(mask)
+    assert (labels[~mask] == 0).all()
+    components = {frozenset(zip(*np.nonzero(labels == label))) for label in np.unique(labels[mask])}
+    assert components == _reference_components(mask)
+
+
+def test_small_or_faint_changes_are_ignored():
+    noisy = np.asarray(_frame()).copy()
+    noisy[10, 10] = 0                     # 单个像素的噪声
+    noisy[100:140, 100:140] = 240         # 低于阈值的色差
+    assert dirty_regions(_frame(), Image.fromarray(noisy)) == []
+
+
+def test_size_change_marks_whole_frame():
+    assert dirty_regions(_frame(), Image.new("RGB", (100, 100), "white")) == [(0, 0, 100, 100)]
+    with pytest.raises(ValueError):
+        dirty_block_mask(_frame(), Image.new("RGB", (100, 100), "white"))
+
+
+def test_intersects():
+    assert intersects((10, 10, 20, 20), [(15, 15, 30, 30)])
+    assert not intersects((10, 10, 20, 20), [(20, 0, 30, 30)])
+
+
+def test_observe_without_steps_compares_consecutive_frames():
+    tracker = FrameDiffTracker()
+    assert tracker.observe(_frame()) == [(0, 0, WIDTH, HEIGHT)]
+    assert tracker.observe(_frame()) == []
+    assert tracker.observe(_frame((40, 20, 70, 50))) == [(32, 16, 80, 64)]
+    assert len(tracker.steps) == 3
+
+
+def test_mean_dirty_fraction_skips_only_steps_without_baseline():
+    tracker = FrameDiffTracker()
+    tracker.observe(_frame())                      # 没有可比较的帧，整帧
+    tracker.observe(_frame((0, 0, 20, 20)))
+    assert tracker.report()["mean_dirty_fraction"] == pytest.approx(32 * 32 / (WIDTH * HEIGHT))
+
+    # 先 `prime` 时第一步已有基准帧，计入平均
+    primed = FrameDiffTracker()
+    primed.prime(_frame())
+    primed.observe(_frame((0, 0, 20, 20)))
+    primed.observe(_frame((0, 0, 20, 20)))
+    assert primed.report()["mean_dirty_fraction"] == pytest.approx(32 * 32 / (WIDTH * HEIGHT) / 2)
+
+
+def test_parallel_branches_diff_against_their_dependencies():
+    tracker = FrameDiffTracker()
+    tracker.prime(_frame())
+    assert tracker.observe(_frame((0, 0, 20, 20)), step="a") == [(0, 0, 32, 32)]
+    # 与 a 并行的分支 b 不依赖 a，相对基准帧比较，不会把 a 的变化算进来
+    assert tracker.observe(_frame((200, 150, 220, 170)), step="b") == [(192, 144, 224, 176)]
+    # c 依赖 a：相对 a 观察到的帧比较
+    assert tracker.observe(_frame((0, 0, 20, 20)), step="c", after=("a",)) == []
+    # 依赖的步骤都未观察过（例如续跑时已跳过）时回到基准帧
+    assert tracker.observe(_frame(), step="d", after=("missing",)) == []
+
+
+def test_recall_checks_the_remembered_region():
+    tracker = FrameDiffTracker()
+    source = _frame()
+    tracker.remember("login", (100, 100, 150, 140), {"x": 125, "y": 120}, source)
+
+    assert tracker.recall("login", source) == {"x": 125, "y": 120}
+    assert tracker.recall("login", _frame((0, 0, 30, 30))) == {"x": 125, "y": 120}
+    assert tracker.recall("missing", source) is None
+    # 区域内发生变化：结果失效并被丢弃
+    assert tracker.recall("login", _frame((110, 110, 130, 130))) is None
+    assert tracker.recall("login", source) is None
+
+
+def test_notes_are_recorded_per_thread_and_reported():
+    tracker = FrameDiffTracker()
+    tracker.prime(_frame())
+
+    def step(name, frame, source, fraction):
+        tracker.observe(frame, step=name)
+        tracker.note(source, fraction)
+
+    threads = [
+        threading.Thread(target=step, args=("a", _frame(), "reused", 0.0)),
+        threading.Thread(target=step, args=("b", _frame((0, 0, 20, 20)), "model", 1.0)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    by_source = {record["source"]: record for record in tracker.steps}
+    assert by_source["reused"]["dirty_regions"] == []
+    assert by_source["model"]["dirty_regions"] == [(0, 0, 32, 32)]
+    report = tracker.report()
+    assert report["steps"] == 2
+    assert report["skipped_steps"] == 1
+    assert report["model_pixel_fraction"] == pytest.approx(0.5)
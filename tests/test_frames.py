@@ -0,0 +1,69 @@
+"""`frames.Frame`：惰性解码，以及 `digest`（像素）与 `source_digest`（来源）在各种来源之间的一致性。"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.frames import Frame, as_frame, image_digest
+
+
+def _pixels():
+    data = np.zeros((40, 60, 3), dtype=np.uint8)
+    data[10:30, 20:50] = (200, 40, 90)
+    return data
+
+
+@pytest.fixture
+def png_paths(tmp_path):
+    """同一像素内容、不同压缩参数的两个 PNG 文件。"""
+    image = Image.fromarray(_pixels())
+    paths = [str(tmp_path / "fast.png"), str(tmp_path / "small.png")]
+    image.save(paths[0], compress_level=0)
+    image.save(paths[1], compress_level=9)
+    return paths
+
+
+def test_digest_depends_only_on_pixels(png_paths):
+    digests = {
+        Frame(png_paths[0]).digest,
+        Frame(png_paths[1]).digest,
+        Frame(Image.fromarray(_pixels())).digest,
+        Frame(_pixels()).digest,
+        Frame.from_rgb_buffer(_pixels().tobytes(), 60, 40).digest,
+    }
+    assert digests == {image_digest(Image.fromarray(_pixels()))}
+
+
+def test_bgra_buffer_matches_rgb_pixels():
+    bgra = np.concatenate([_pixels()[..., ::-1], np.full((40, 60, 1), 255, np.uint8)], axis=2)
+    assert Frame.from_rgb_buffer(bgra.tobytes(), 60, 40, mode="BGRA").digest == Frame(_pixels()).digest
+
+
+def test_source_digest_is_stable_across_decoding(png_paths):
+    frame = Frame(png_paths[0])
+    before = frame.source_digest
+    frame.image
+    assert before == frame.source_digest == Frame(png_paths[0]).source_digest
+    assert before.startswith("file:")
+    # 像素相同但文件字节不同：像素哈希相同，来源哈希不同
+    assert Frame(png_paths[1]).source_digest != before
+
+
+def test_memory_source_digest_is_the_pixel_digest():
+    frame = Frame(_pixels())
+    assert frame.source_digest == "pixels:" + frame.digest
+
+
+def test_size_does_not_decode(png_paths):
+    frame = Frame(png_paths[0])
+    assert frame.size == (60, 40)
+    assert frame._image is None
+    image = frame.image
+    assert frame.image is image
+
+
+def test_as_frame_reuses_frames():
+    frame = Frame(_pixels())
+    assert as_frame(frame) is frame
+    with pytest.raises(TypeError):
+        Frame(42)
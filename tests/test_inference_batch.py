@@ -0,0 +1,68 @@
+"""`grounding_utils.inference_batch`：批量推理的结果与任务一一对应。"""
+
+import pytest
+from PIL import Image
+
+from utils.grounding_utils import inference, inference_batch, smart_resize_dims
+
+
+def _image(width, height, color=(40, 120, 200)):
+    return Image.new("RGB", (width, height), color)
+
+
+def test_empty_batch_needs_no_model():
+    assert inference_batch(None, None, []) == []
+
+
+def test_results_follow_job_order_and_input_sizes(tiny_model):
+    model, processor = tiny_model
+    sizes = [(224, 224), (336, 168), (168, 280)]
+    jobs = [(_image(w, h), "Locate the button.", "You are a helpful assistant.") for w, h in sizes]
+
+    results = inference_batch(model, processor, jobs, max_new_tokens=4)
+
+    assert len(results) == len(jobs)
+    for (width, height), (text, input_height, input_width) in zip(sizes, results):
+        assert isinstance(text, str)
+        assert (input_height, input_width) == smart_resize_dims(height, width)
+
+
+def test_single_job_batch_matches_inference(tiny_model):
+    model, processor = tiny_model
+    image = _image(224, 224)
+    single = inference(model, processor, image, "Locate the button.", max_new_tokens=4)
+    batched = inference_batch(model, processor, [(image, "Locate the button.", "You are a helpful assistant.")],
+                              max_new_tokens=4)
+    assert batched == [single]
+
+
+def test_stats_have_one_entry_per_job(tiny_model):
+    model, processor = tiny_model
+    jobs = [(_image(224, 224), "Locate the button.", "You are a helpful assistant.")] * 2
+    stats = []
+    inference_batch(model, processor, jobs, max_new_tokens=4, stats=stats)
+    assert len(stats) == 2
+    assert all({"generated_tokens", "max_tokens_saved", "early_stopped"} <= set(s) for s in stats)
+
+
+@pytest.mark.parametrize("max_pixels", [224 * 224, 112 * 112])
+def test_pixel_budget_limits_input_size(tiny_model, max_pixels):
+    model, processor = tiny_model
+    [(_, input_height, input_width)] = inference_batch(
+        model, processor, [(_image(896, 896), "Locate the button.", "You are a helpful assistant.")],
+        max_new_tokens=2, max_pixels=max_pixels
+    )
+    assert input_height * input_width <= max_pixels
+
+
+def test_prefix_cache_stats_match_batched_path(tiny_model):
+    from utils.prefix_cache import PrefixCache
+
+    model, processor = tiny_model
+    image = _image(224, 224)
+    cached_stats, batched_stats = [], []
+    inference(model, processor, image, "Locate the button.", max_new_tokens=4,
+              prefix_cache=PrefixCache(), stats=cached_stats)
+    inference(model, processor, image, "Locate the button.", max_new_tokens=4, stats=batched_stats)
+    assert set(cached_stats[0]) == set(batched_stats[0])
+    assert 0 < cached_stats[0]["generated_tokens"] <= 4
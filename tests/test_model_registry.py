@@ -0,0 +1,116 @@
+"""`model_registry`：按键惰性加载、LRU / 显存预算 / 空闲超时淘汰，以及租用期间不被淘汰。"""
+
+import threading
+import time
+
+import pytest
+
+from utils.model_registry import ModelRegistry
+
+GB = 1024 ** 3
+
+
+class FakeLoader:
+    """记录加载次数的加载函数；`delay` 模拟耗时的加载。"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.loads = []
+        self._lock = threading.Lock()
+
+    def __call__(self, model_id, dtype, device):
+        time.sleep(self.delay)
+        with self._lock:
+            self.loads.append(model_id)
+        return f"model:{model_id}", f"processor:{model_id}"
+
+
+def _registry(loader, **kwargs):
+    kwargs.setdefault("idle_timeout", None)
+    return ModelRegistry(loader, estimate_bytes=lambda model_id, dtype, device: 2 * GB, **kwargs)
+
+
+def test_concurrent_gets_load_once():
+    loader = FakeLoader(delay=0.05)
+    registry = _registry(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("a"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.loads == ["a"]
+    assert results == [("model:a", "processor:a")] * 8
+    stats = registry.stats()
+    assert (stats["loads"], stats["hits"]) == (1, 7)
+    assert registry.get("a", dtype="4bit") and loader.loads == ["a", "a"]
+
+
+def test_failed_load_is_retried_by_the_next_caller():
+    attempts = []
+
+    def flaky(model_id, dtype, device):
+        attempts.append(model_id)
+        if len(attempts) == 1:
+            raise OSError("download failed")
+        return "model", "processor"
+
+    registry = _registry(flaky)
+    with pytest.raises(OSError):
+        registry.get("a")
+    assert registry.get("a") == ("model", "processor")
+    assert not registry.is_loaded("b")
+
+
+def test_lru_and_memory_budget_evictions():
+    loader = FakeLoader()
+    registry = _registry(loader, max_models=2, memory_budget_bytes=5 * GB)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")              # 超过 max_models：淘汰最久未使用的 b
+    assert [registry.is_loaded(m) for m in "abc"] == [True, False, True]
+    assert registry.stats()["evictions"]["lru"] == 1
+
+    registry.max_models = 3
+    registry.get("d")              # 2GB x 3 超过 5GB 预算：淘汰 a
+    assert [registry.is_loaded(m) for m in "acd"] == [False, True, True]
+    assert registry.stats()["evictions"]["memory"] == 1
+    assert registry.stats()["resident_bytes"] == 4 * GB
+
+
+def test_leased_models_are_never_evicted():
+    registry = _registry(FakeLoader(), max_models=1, idle_timeout=0.0)
+    registry.acquire("server")
+    registry.get("other")          # 唯一的另一个条目被租用：新模型照常加载，不淘汰刚加载的模型
+    assert registry.is_loaded("server") and registry.is_loaded("other")
+    registry.get("third")
+    assert registry.is_loaded("server") and not registry.is_loaded("other")
+
+    time.sleep(0.01)
+    assert registry.evict_idle() == 1
+    assert registry.is_loaded("server")
+    assert registry.stats()["models"][0]["leases"] == 1
+
+    registry.release("server")
+    time.sleep(0.01)
+    assert registry.evict_idle() == 1
+    assert not registry.is_loaded("server")
+
+
+def test_lease_context_manager_and_unload():
+    registry = _registry(FakeLoader(), idle_timeout=0.0)
+    with registry.lease("a") as (model, processor):
+        assert model == "model:a"
+        time.sleep(0.01)
+        assert registry.evict_idle() == 0
+    time.sleep(0.01)
+    assert registry.evict_idle() == 1
+
+    registry.get("b")
+    assert registry.unload("b") is True
+    assert registry.unload("b") is False
+    registry.get("c")
+    registry.close()
+    assert registry.stats()["models"] == []
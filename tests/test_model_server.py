@@ -0,0 +1,64 @@
+"""`model_server`：按任务拆分的推理选项，以及合批与前缀缓存两条路径收到的参数。"""
+
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+
+import utils.model_server as model_server
+from utils.model_client import encode_image
+from utils.model_server import ModelService, _job_options
+
+
+def test_job_options_split_only_per_job_lists():
+    options = {"expected_boxes": [1, 3], "max_new_tokens": 64, "constrained": "point"}
+    assert _job_options(options, 0) == {"expected_boxes": 1, "max_new_tokens": 64, "constrained": "point"}
+    assert _job_options(options, 1) == {"expected_boxes": 3, "max_new_tokens": 64, "constrained": "point"}
+    # 标量的按任务选项对所有任务相同；其他列表选项原样透传
+    assert _job_options({"expected_boxes": 2}, 5) == {"expected_boxes": 2}
+    assert _job_options({"stop": ["a", "b"]}, 1) == {"stop": ["a", "b"]}
+
+
+@pytest.fixture
+def service():
+    service = ModelService(object(), None)
+    yield service
+    service.scheduler.close()
+
+
+def _payload(count, **extra):
+    job = {"image": encode_image(Image.new("RGB", (32, 32))), "prompt": "定位按钮"}
+    return {"jobs": [dict(job, prompt=f"p{i}") for i in range(count)], **extra}
+
+
+def test_batched_jobs_get_their_own_options(service, monkeypatch):
+    submitted = []
+
+    def submit_grounding(image, prompt, system_prompt, **options):
+        submitted.append((prompt, options))
+        future = Future()
+        future.set_result((prompt, 28, 28))
+        return future
+
+    monkeypatch.setattr(service.scheduler, "submit_grounding", submit_grounding)
+    response = service.handle_inference(_payload(2, options={"expected_boxes": [1, 2], "max_new_tokens": 8}))
+
+    assert submitted == [("p0", {"expected_boxes": 1, "max_new_tokens": 8}),
+                         ("p1", {"expected_boxes": 2, "max_new_tokens": 8})]
+    assert [r["text"] for r in response["results"]] == ["p0", "p1"]
+
+
+def test_prefix_cache_request_uses_first_job_options(service, monkeypatch):
+    received = {}
+
+    def fake_inference(model, processor, image, prompt, system_prompt, prefix_cache=None, stats=None, **options):
+        received.update(options, prefix_cache=prefix_cache)
+        stats.append({"generated_tokens": 3})
+        return prompt, 28, 28
+
+    monkeypatch.setattr(model_server, "inference", fake_inference)
+    response = service.handle_inference(_payload(1, prefix_cache=True, options={"expected_boxes": [4]}))
+
+    assert received == {"expected_boxes": 4, "prefix_cache": service.prefix_cache}
+    assert response == {"results": [{"text": "p0", "input_height": 28, "input_width": 28}],
+                        "stats": [{"generated_tokens": 3}]}
@@ -0,0 +1,188 @@
+"""`prefix_cache`：LRU 与并发访问、生成后截回 KV、同一模型上按模型串行的 rope_deltas。"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils.prefix_cache import PrefixCache, PrefixCacheEntry, _model_lock, generate_with_prefix_cache
+
+
+def _entry(n=0):
+    return PrefixCacheEntry(input_ids=SimpleNamespace(shape=(1, n)), past_key_values=None,
+                            rope_deltas=None, image_grid_thw=None)
+
+
+def test_lru_eviction_and_stats():
+    cache = PrefixCache(max_entries=2)
+    cache.put("a", _entry())
+    cache.put("b", _entry())
+    assert cache.get("a") is not None
+    cache.put("c", _entry())
+    assert cache.get("b") is None
+    assert len(cache) == 2
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_concurrent_get_put_keeps_cache_consistent():
+    cache = PrefixCache(max_entries=3)
+
+    def worker(offset):
+        for n in range(200):
+            key = (offset + n) % 7
+            if cache.get(key) is None:
+                cache.put(key, _entry())
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert len(cache) == 3
+    assert stats["hits"] + stats["misses"] == 8 * 200
+
+
+def test_model_lock_is_per_model():
+    class Model:
+        pass
+
+    a, b = Model(), Model()
+    assert _model_lock(a) is _model_lock(a)
+    assert _model_lock(a) is not _model_lock(b)
+
+
+# --- generate_with_prefix_cache：用假模型记录 KV 长度与 rope_deltas ---
+
+class _Inputs(dict):
+    __getattr__ = dict.__getitem__
+
+    def to(self, device):
+        return self
+
+
+class _FakeKV:
+    """只记录序列长度的 KV 缓存，支持 crop。"""
+
+    def __init__(self, length):
+        self.length = length
+
+    def crop(self, length):
+        self.length = length
+
+
+class _FakeModel:
+    """
+    预填充时把图像编号记为 rope_deltas；生成时检查 rope_deltas 在整个生成期间未被其他线程改写，
+    并把它作为唯一生成的 token 输出，调用方据此核对用的是哪个前缀。
+    """
+    device = "cpu"
+
+    def __init__(self):
+        self.rope_deltas = None
+        self.seen_lengths = []
+
+    def generate(self, input_ids, max_new_tokens, past_key_values=None, return_dict_in_generate=False, **kwargs):
+        import torch
+
+        if return_dict_in_generate:
+            self.rope_deltas = int(input_ids[0, 0])
+            return SimpleNamespace(past_key_values=_FakeKV(input_ids.shape[1] + 1))
+
+        rope_deltas = self.rope_deltas
+        self.seen_lengths.append(past_key_values.length)
+        time.sleep(0.005)
+        assert self.rope_deltas == rope_deltas, "生成期间 rope_deltas 被其他线程改写"
+        past_key_values.length = input_ids.shape[1] + 1
+        return torch.cat([input_ids, torch.tensor([[rope_deltas]])], dim=1)
+
+
+class _FakeProcessor:
+    def __init__(self):
+        self.tokenizer = lambda text, **kwargs: SimpleNamespace(input_ids=_tensor([[7] * len(text)]))
+
+    @staticmethod
+    def apply_chat_template(messages, **kwargs):
+        image, prompt = (part.get("image", part.get("text")) for part in messages[1]["content"])
+        return f"{messages[0]['content']}|{image}<|vision_end|>{prompt}"
+
+    @staticmethod
+    def batch_decode(ids, **kwargs):
+        return [str(int(ids[0, -1]))]
+
+
+def _tensor(data):
+    import torch
+    return torch.tensor(data)
+
+
+def _prefix_inputs(prefix_text):
+    image = int(prefix_text.split("|")[1].split("<")[0])
+    return _Inputs(input_ids=_tensor([[image] * 3]), image_grid_thw=_tensor([[1, 2, 2]]))
+
+
+def _generate(model, cache, image, prompt="locate"):
+    text, _, generated_ids = generate_with_prefix_cache(model, _FakeProcessor(), image, prompt, "sys", cache,
+                                                        image_key=str(image), max_new_tokens=1,
+                                                        prefix_inputs=_prefix_inputs)
+    assert generated_ids.tolist() == [image]
+    return text
+
+
+def test_kv_is_cropped_back_to_prefix_after_generate():
+    pytest.importorskip("torch")
+    model, cache = _FakeModel(), PrefixCache()
+
+    assert _generate(model, cache, 5) == "5"
+    entry = cache.get(("5", "sys|5<|vision_end|>"))
+    assert entry.past_key_values.length == entry.prefix_length == 3
+
+    # 另一张图像的预填充改写了 rope_deltas，命中旧前缀时须恢复
+    assert _generate(model, cache, 6, "another") == "6"
+    assert _generate(model, cache, 5, "another") == "5"
+    assert model.seen_lengths == [3, 3, 3]
+    assert entry.past_key_values.length == 3
+    assert cache.stats()["hits"] == 2  # 测试中的 get + 第三次生成
+
+
+def test_concurrent_generations_do_not_clobber_rope_deltas():
+    pytest.importorskip("torch")
+    model, cache = _FakeModel(), PrefixCache(max_entries=8)
+    errors, results = [], {}
+
+    def worker(image):
+        try:
+            for _ in range(5):
+                results.setdefault(image, set()).add(_generate(model, cache, image))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(image,)) for image in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == {image: {str(image)} for image in range(1, 5)}
+    assert set(model.seen_lengths) == {3}
+
+
+def test_repeated_query_on_tiny_model_is_stable(tiny_model):
+    from PIL import Image
+
+    model, processor = tiny_model
+    cache = PrefixCache()
+    image = Image.new("RGB", (224, 224), (40, 120, 200))
+
+    def run():
+        text, _, _ = generate_with_prefix_cache(model, processor, image, "Locate the button.",
+                                                "You are a helpful assistant.", cache, image_key="img", max_new_tokens=4)
+        return text
+
+    first = run()
+    assert run() == first
+    (entry,) = cache._entries.values()
+    assert entry.past_key_values.get_seq_length() == entry.prefix_length
@@ -0,0 +1,161 @@
+"""`preprocess_cache`：预处理结果的磁盘缓存（mmap 读取、LRU 淘汰、并发写入）与内存预取缓冲。"""
+
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.frames import as_frame
+from utils.preprocess_cache import PrefetchBuffer, PreprocessCache, make_preprocess_key
+
+PROCESSOR = SimpleNamespace(min_pixels=3136, max_pixels=12845056, patch_size=14, merge_size=2)
+
+
+def _pixels(seed: int, patches: int = 16) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((patches, 1176)).astype(np.float32)
+
+
+def test_key_depends_on_source_budget_and_processor():
+    key = make_preprocess_key("abc", PROCESSOR)
+    assert key == make_preprocess_key("abc", SimpleNamespace(**vars(PROCESSOR)))
+    assert key != make_preprocess_key("abd", PROCESSOR)
+    assert key != make_preprocess_key("abc", PROCESSOR, max_pixels=1024 * 28 * 28)
+    assert key != make_preprocess_key("abc", SimpleNamespace(**{**vars(PROCESSOR), "patch_size": 16}))
+
+
+def test_roundtrip_is_memory_mapped(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+    assert cache.get("k1") is None
+    pixels = _pixels(0)
+    cache.put("k1", pixels, np.array([1, 4, 4]))
+
+    loaded, grid = cache.get("k1")
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, pixels)
+    assert grid == [1, 4, 4]
+    # 写时复制：修改读到的数组不会改动磁盘上的条目
+    loaded[0, 0] = 123.0
+    np.testing.assert_array_equal(cache.get("k1")[0], pixels)
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_survive_restart_and_clear(tmp_path):
+    PreprocessCache(str(tmp_path)).put("k1", _pixels(0), [1, 4, 4])
+    cache = PreprocessCache(str(tmp_path))
+    assert cache.stats()["disk_bytes"] > 0
+    assert cache.get("k1") is not None
+    cache.clear()
+    assert cache.get("k1") is None
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+    cache.put("aa1", _pixels(0), [1, 4, 4])
+    entry_bytes = cache.stats()["disk_bytes"]
+    cache.max_disk_bytes = 2 * entry_bytes
+    cache.put("bb2", _pixels(1), [1, 4, 4])
+    os.utime(cache._paths_for("aa1")[0], (1, 1))
+    os.utime(cache._paths_for("bb2")[0], (2, 2))
+    cache.get("aa1")  # 读取刷新修改时间
+
+    cache.put("cc3", _pixels(2), [1, 4, 4])
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") is not None and cache.get("cc3") is not None
+    assert cache.stats()["disk_bytes"] == 2 * entry_bytes
+
+
+def test_concurrent_puts_keep_disk_accounting_exact(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+
+    def worker(index):
+        for i in range(10):
+            cache.put(f"k{(index + i) % 5}", _pixels(i), [1, 4, 4])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    on_disk = sum(size for _, size, _ in cache._scan_disk())
+    assert cache.stats()["disk_bytes"] == on_disk
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+
+def test_prefetch_buffer_releases_after_last_reference():
+    buffer = PrefetchBuffer()
+    assert buffer.acquire("k") is False
+    buffer.put("k", "pixels", (1, 2, 2))
+    assert buffer.acquire("k") is True
+    assert buffer.get("k") == ("pixels", [1, 2, 2])
+
+    buffer.release(["k"])
+    assert len(buffer) == 1
+    buffer.release(["k"])
+    assert len(buffer) == 0
+    assert buffer.get("k") is None
+
+
+def test_prefetch_buffer_waiters_share_one_preparation():
+    buffer = PrefetchBuffer()
+    assert buffer.acquire("k") is False
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(buffer.acquire("k"))) for _ in range(4)]
+    for thread in waiters:
+        thread.start()
+    buffer.put("k", "pixels", [1, 2, 2])
+    for thread in waiters:
+        thread.join(10)
+    assert results == [True] * 4
+
+    buffer.release(["k"] * 5)
+    assert len(buffer) == 0
+
+
+def test_prefetch_buffer_cancel_wakes_waiters():
+    buffer = PrefetchBuffer()
+    assert buffer.acquire("k") is False
+    waiter = threading.Thread(target=buffer.acquire, args=("k",))
+    waiter.start()
+    while buffer._refs.get("k") != 2:  # 等待方已登记并开始等待
+        time.sleep(0.001)
+    buffer.cancel("k")
+    waiter.join(10)
+    assert not waiter.is_alive()
+    assert buffer.get("k") is None
+    # 等待方的记录仍持有引用；归还后下一次登记重新负责预处理
+    buffer.release(["k"])
+    assert buffer.acquire("k") is False
+
+
+def test_prepare_runs_the_processor_once_per_frame():
+    calls = []
+
+    class FakeImageProcessor(SimpleNamespace):
+        def __call__(self, images, return_tensors):
+            calls.append(images[0].size)
+            return {"pixel_values": _pixels(0, patches=4), "image_grid_thw": np.array([[1, 2, 2]])}
+
+    image_processor = FakeImageProcessor(**vars(PROCESSOR))
+    frame = as_frame(Image.new("RGB", (64, 64), (10, 20, 30)))
+    buffer = PrefetchBuffer()
+
+    keys = [buffer.prepare(frame, image_processor) for _ in range(3)]
+    assert len(set(keys)) == 1 and len(calls) == 1
+    assert buffer.get(keys[0])[1] == [1, 2, 2]
+
+    class FailingImageProcessor(FakeImageProcessor):
+        def __call__(self, images, return_tensors):
+            raise ValueError("bad image")
+
+    other = as_frame(Image.new("RGB", (64, 64), (1, 2, 3)))
+    with pytest.raises(ValueError):
+        buffer.prepare(other, FailingImageProcessor(**vars(PROCESSOR)))
+    buffer.release(keys)
+    assert len(buffer) == 0
@@ -0,0 +1,61 @@
+"""`query_fusion`：融合回答按标签分发回各条指令，分发不了的目标回退为单独查询。"""
+
+import json
+
+from PIL import Image
+
+import utils.query_fusion as query_fusion
+from utils.query_fusion import demultiplex, fused_grounding, target_phrase
+
+
+def test_target_phrase_strips_leading_verbs():
+    assert target_phrase("定位登录按钮。") == "登录按钮"
+    assert target_phrase("Click on the Submit button") == "Submit button"
+    assert target_phrase("定位") == "定位"
+
+
+def test_exact_labels_win_over_containment():
+    # "save" 包含于 "save as"，但两者都有完全相同的标签，先按完全相同分配
+    assert demultiplex(["Save", "Save As"], ["save as", "save"]) == [1, 0]
+    assert demultiplex(["用户名输入框"], ["用户名输入框 (顶部)"]) == [0]
+
+
+def test_positional_fallback_only_when_counts_match():
+    # 标签都对不上，但框数与目标数一致：按提示中的顺序分配
+    assert demultiplex(["登录按钮", "密码框"], ["a", "b"]) == [0, 1]
+    # 一个按标签分配，另一个按顺序取剩下的同位置框
+    assert demultiplex(["登录按钮", "密码框"], ["x", "登录按钮"]) == [1, None]
+    assert demultiplex(["登录按钮", "密码框"], ["密码框", "x"]) == [None, 0]
+    # 框数不一致时不猜
+    assert demultiplex(["登录按钮", "密码框"], ["a"]) == [None, None]
+    assert demultiplex(["登录按钮"], []) == [None]
+
+
+def _response(*labels):
+    return json.dumps([{"bbox_2d": [10 * n, 10, 10 * n + 5, 15], "label": label} for n, label in enumerate(labels)],
+                      ensure_ascii=False)
+
+
+def test_missing_targets_fall_back_to_single_queries(monkeypatch):
+    calls = []
+
+    def fake_inference_batch(model, processor, jobs, expected_boxes=None, **kwargs):
+        calls.append((len(jobs), expected_boxes))
+        if len(calls) == 1:
+            # 融合回答只给出了三个目标中的两个
+            return [(_response("登录按钮", "用户名输入框"), 100, 100)]
+        return [(f"single:{prompt}", 100, 100) for _, prompt, _ in jobs]
+
+    monkeypatch.setattr(query_fusion, "inference_batch", fake_inference_batch)
+    login, other = Image.new("RGB", (100, 100), "white"), Image.new("RGB", (100, 100), "black")
+    requests = [(login, "定位登录按钮"), (login, "定位用户名输入框"), (other, "定位菜单"), (login, "定位密码框")]
+    stats = {}
+
+    results = fused_grounding(None, None, requests, "{instruction}", "sys", stats=stats)
+
+    assert calls == [(1, [3]), (2, 1)]
+    assert json.loads(results[0][0])[0]["label"] == "登录按钮"
+    assert json.loads(results[1][0])[0]["bbox_2d"] == [10, 10, 15, 15]
+    assert results[2][0] == "single:定位菜单"
+    assert results[3][0] == "single:定位密码框"
+    assert stats == {"requests": 4, "fused_calls": 1, "fused_targets": 2, "fallbacks": 2}
@@ -0,0 +1,61 @@
+"""`render`：点击标记只在其外接矩形内合成，结果与整帧合成逐像素一致，越界部分被裁掉。"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from utils.render import ClickMarker, _composite_click, compose
+
+SIZE = (200, 120)
+
+
+def _background():
+    data = np.random.default_rng(0).integers(0, 256, (SIZE[1], SIZE[0], 3), dtype=np.uint8)
+    return Image.fromarray(data)
+
+
+def _full_frame_reference(image, marker):
+    """改动前的做法：整帧 RGBA 叠加层与整帧 alpha 合成。"""
+    radius = marker.radius if marker.radius is not None else min(image.size) * 0.02
+    overlay = Image.new("RGBA", image.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    x, y = marker.x, marker.y
+    draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill=marker.color)
+    center = radius * 0.2
+    draw.ellipse([(x - center, y - center), (x + center, y + center)], fill=marker.center_color)
+    return Image.alpha_composite(image.convert("RGBA"), overlay).convert("RGB")
+
+
+@pytest.mark.parametrize("marker", [
+    ClickMarker(100, 60, radius=10),
+    ClickMarker(100.5, 60.25),                 # 默认半径、非整数坐标
+    ClickMarker(3, 2, radius=12),              # 部分超出左上角
+    ClickMarker(197, 118, radius=12),          # 部分超出右下角
+])
+def test_matches_full_frame_composite(marker):
+    canvas = _background()
+    _composite_click(canvas, marker)
+    assert np.array_equal(np.asarray(canvas), np.asarray(_full_frame_reference(_background(), marker)))
+
+
+def test_changes_stay_inside_the_marker_bounds():
+    canvas = _background()
+    _composite_click(canvas, ClickMarker(50, 40, radius=8))
+    changed = np.argwhere((np.asarray(canvas) != np.asarray(_background())).any(axis=2))
+    assert changed.size
+    (top, left), (bottom, right) = changed.min(axis=0), changed.max(axis=0)
+    assert left >= 42 and top >= 32 and right <= 58 and bottom <= 48
+
+
+def test_marker_outside_the_canvas_is_ignored():
+    canvas = _background()
+    _composite_click(canvas, ClickMarker(-50, -50, radius=10))
+    _composite_click(canvas, ClickMarker(SIZE[0] + 50, 10, radius=10))
+    assert np.array_equal(np.asarray(canvas), np.asarray(_background()))
+
+
+def test_compose_does_not_modify_the_source():
+    source = _background()
+    result = compose(source, [ClickMarker(100, 60, radius=10)])
+    assert np.array_equal(np.asarray(source), np.asarray(_background()))
+    assert result.mode == "RGB" and result.size == SIZE
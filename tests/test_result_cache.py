@@ -0,0 +1,153 @@
+"""`result_cache.GroundingCache`：两级缓存、过期、淘汰与并发下的单次计算。"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from utils.result_cache import GroundingCache, make_cache_key
+
+
+def _key(n: int) -> str:
+    return make_cache_key(f"image-{n}", "定位登录按钮", "template", "model")
+
+
+def test_cache_key_depends_on_every_field():
+    base = make_cache_key("img", "inst", "tpl", "model", "sys")
+    assert base == make_cache_key("img", "inst", "tpl", "model", "sys")
+    assert base != make_cache_key("img", "inst", "tpl", "model", "other")
+    assert base != make_cache_key("img", "inst2", "tpl", "model", "sys")
+    # 字段以长度作前缀，拼接后相同的不同字段不会冲突
+    assert make_cache_key("ab", "c", "", "") != make_cache_key("a", "bc", "", "")
+
+
+def test_memory_only_roundtrip_and_stats():
+    cache = GroundingCache(cache_dir=None)
+    assert cache.get(_key(1)) is None
+    cache.put(_key(1), {"response": "[]"})
+    assert cache.get(_key(1)) == {"response": "[]"}
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_memory_lru_evicts_oldest():
+    cache = GroundingCache(cache_dir=None, max_memory_entries=2)
+    cache.put(_key(1), 1)
+    cache.put(_key(2), 2)
+    cache.get(_key(1))
+    cache.put(_key(3), 3)
+    assert cache.get(_key(2)) is None
+    assert cache.get(_key(1)) == 1 and cache.get(_key(3)) == 3
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    GroundingCache(cache_dir=str(tmp_path)).put(_key(1), {"response": "x"})
+    cache = GroundingCache(cache_dir=str(tmp_path))
+    assert cache.contains(_key(1))
+    assert cache.get(_key(1)) == {"response": "x"}
+    assert cache.stats()["disk_hits"] == 1
+    # 已提升到内存层
+    assert cache.get(_key(1)) == {"response": "x"}
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = GroundingCache(cache_dir=str(tmp_path), max_age_seconds=0.01)
+    cache.put(_key(1), 1)
+    time.sleep(0.05)
+    assert not cache.contains(_key(1))
+    assert cache.get(_key(1)) is None
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_disk_size_limit_evicts_least_recently_used(tmp_path):
+    value = "x" * 1000
+    cache = GroundingCache(cache_dir=str(tmp_path), max_memory_entries=1, max_disk_bytes=2500)
+    for n in range(4):
+        cache.put(_key(n), value)
+        os.utime(cache._path_for(_key(n)), (n, n))  # 固定最近使用时间的先后
+    assert cache.stats()["disk_bytes"] <= 2500
+    assert cache.get(_key(0)) is None
+    assert cache.get(_key(3)) == value
+
+
+def test_disk_expiry_uses_created_not_last_access(tmp_path):
+    value = "x" * 1000
+    cache = GroundingCache(cache_dir=str(tmp_path), max_memory_entries=1, max_age_seconds=100)
+    cache.put(_key(0), value)
+    cache.put(_key(1), value)
+    # 能容纳两个条目、容纳不下三个（created 的位数不同，文件大小会差几个字节）
+    cache.max_disk_bytes = cache.stats()["disk_bytes"] + 100
+    # 条目 0 写入已久但刚被访问过：修改时间是新的，仍应按 created 过期
+    path = cache._path_for(_key(0))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.time() - 1000, "value": value}, f)
+    # 条目 1 刚写入但很久没被访问：只影响 LRU 顺序，不算过期
+    os.utime(cache._path_for(_key(1)), (1, 1))
+
+    cache.put(_key(2), value)
+    assert not os.path.exists(path)
+    assert os.path.exists(cache._path_for(_key(1)))
+    assert cache.get(_key(1)) == value
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    cache = GroundingCache(cache_dir=str(tmp_path))
+    cache.put(_key(1), 1)
+    cache.clear()
+    assert cache.get(_key(1)) is None
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_get_or_compute_computes_each_key_once_across_threads(tmp_path):
+    cache = GroundingCache(cache_dir=str(tmp_path))
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return {"response": "computed"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(_key(1), compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"response": "computed"}] * 8
+    assert cache.get_or_compute(_key(1), compute) == {"response": "computed"}
+    assert len(calls) == 1
+
+
+def test_get_or_compute_propagates_errors_and_allows_retry():
+    cache = GroundingCache(cache_dir=None)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        cache.get_or_compute(_key(1), fail)
+    assert cache.get_or_compute(_key(1), lambda: 42) == 42
+
+
+def test_concurrent_puts_keep_disk_accounting_consistent(tmp_path):
+    cache = GroundingCache(cache_dir=str(tmp_path))
+
+    def worker(offset):
+        for n in range(20):
+            cache.put(_key(n % 5), {"n": n, "offset": offset})
+            cache.get(_key(n % 5))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()["disk_bytes"] == sum(size for _, size, _ in cache._scan_disk())
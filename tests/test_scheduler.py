@@ -0,0 +1,125 @@
+"""`scheduler`：视觉 token 估算、按参数与分桶合批、逐行的期望框数以及有界的统计窗口。"""
+
+import threading
+
+import pytest
+from PIL import Image
+
+import utils.scheduler as scheduler
+from utils.grounding_utils import smart_resize_dims, visual_token_count
+from utils.scheduler import BatchScheduler, estimate_visual_tokens
+
+
+def _image(width, height):
+    return Image.new("RGB", (width, height), (40, 120, 200))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """用假的批量推理替换模型调用，记录每个微批的大小与参数。"""
+    recorded = []
+
+    def fake_inference_batch(model, processor, jobs, preprocess_cache=None, **options):
+        recorded.append(("grounding", len(jobs), options))
+        return [(prompt, 1, 1) for _, prompt, _ in jobs]
+
+    def fake_chat_batch(model, processor, jobs, **options):
+        recorded.append(("chat", len(jobs), options))
+        return [prompt for _, prompt in jobs]
+
+    monkeypatch.setattr(scheduler, "inference_batch", fake_inference_batch)
+    monkeypatch.setattr(scheduler, "chat_batch", fake_chat_batch)
+    return recorded
+
+
+def test_estimate_visual_tokens_follows_smart_resize():
+    height, width = smart_resize_dims(1080, 1920, 56 * 56, 28 * 28 * 16384)
+    assert estimate_visual_tokens(_image(1920, 1080)) == visual_token_count(height, width)
+    assert estimate_visual_tokens(_image(1920, 1080), max_pixels=256 * 28 * 28) <= 256
+    assert estimate_visual_tokens(_image(10, 10)) >= 1
+
+
+def test_bucket_bounds_the_token_ratio():
+    sched = BatchScheduler(model=object(), processor=None, bucket_ratio=1.5)
+    try:
+        assert sched._bucket(1000) == sched._bucket(1400)
+        assert sched._bucket(1000) != sched._bucket(1600)
+        sched.bucket_ratio = None
+        assert sched._bucket(10) == sched._bucket(100000) == 0
+    finally:
+        sched.close()
+
+
+def test_requests_with_different_expected_boxes_share_a_batch(calls):
+    with BatchScheduler(model=object(), processor=None, max_batch_size=4, max_queue_delay=5.0) as sched:
+        image = _image(224, 224)
+        futures = [sched.submit_grounding(image, f"p{i}", expected_boxes=e) for i, e in enumerate((1, 2, None, 3))]
+        results = [f.result(timeout=10) for f in futures]
+
+    assert results == [(f"p{i}", 1, 1) for i in range(4)]
+    assert len(calls) == 1
+    kind, size, options = calls[0]
+    assert (kind, size) == ("grounding", 4)
+    assert options["expected_boxes"] == [1, 2, None, 3]
+
+
+def test_incompatible_requests_are_not_batched(calls):
+    with BatchScheduler(model=object(), processor=None, max_batch_size=8, max_queue_delay=0.05) as sched:
+        futures = [
+            sched.submit_grounding(_image(224, 224), "small"),
+            sched.submit_grounding(_image(1920, 1080), "large"),
+            sched.submit_grounding(_image(224, 224), "tokens", max_new_tokens=16),
+            sched.submit_chat(_image(224, 224), "chat"),
+        ]
+        assert [f.result(timeout=10) for f in futures] == [("small", 1, 1), ("large", 1, 1), ("tokens", 1, 1), "chat"]
+
+    assert sorted(size for _, size, _ in calls) == [1, 1, 1, 1]
+    assert all(options.get("expected_boxes") is None for kind, _, options in calls if kind == "grounding")
+
+
+def test_failures_propagate_and_are_counted(monkeypatch):
+    def failing(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(scheduler, "inference_batch", failing)
+    with BatchScheduler(model=object(), processor=None, max_queue_delay=0.01) as sched:
+        future = sched.submit_grounding(_image(224, 224), "p")
+        with pytest.raises(RuntimeError, match="boom"):
+            future.result(timeout=10)
+    assert sched.stats()["failed"] == 1
+
+
+def test_stats_window_is_bounded(calls):
+    with BatchScheduler(model=object(), processor=None, max_batch_size=2, max_queue_delay=0.01,
+                        stats_window=3) as sched:
+        for i in range(5):
+            sched.submit_grounding(_image(224, 224), f"p{i}").result(timeout=10)
+    stats = sched.stats()
+    assert stats["completed"] == 5
+    assert stats["batches"] == 5
+    assert stats["avg_batch_size"] == 1.0
+    assert len(sched._latencies) == len(sched._queue_waits) == 3
+
+
+def test_backpressure_and_closed_scheduler(monkeypatch):
+    started, gate = threading.Event(), threading.Event()
+
+    def blocking(model, processor, jobs, preprocess_cache=None, **options):
+        started.set()
+        gate.wait(10)
+        return [("ok", 1, 1)] * len(jobs)
+
+    monkeypatch.setattr(scheduler, "inference_batch", blocking)
+    sched = BatchScheduler(model=object(), processor=None, max_batch_size=1, max_queue_delay=0.0, max_queue_size=1)
+    try:
+        first = sched.submit_grounding(_image(224, 224), "running")
+        assert started.wait(10)
+        second = sched.submit_grounding(_image(224, 224), "queued")
+        with pytest.raises(RuntimeError):
+            sched.submit_grounding(_image(224, 224), "rejected")
+    finally:
+        gate.set()
+        sched.close()
+    assert first.result(timeout=10) == second.result(timeout=10) == ("ok", 1, 1)
+    with pytest.raises(RuntimeError):
+        sched.submit_grounding(_image(224, 224), "late")
@@ -0,0 +1,67 @@
+"""`stream_parser`：各种"变形"输出的解析，以及分块喂入时的增量产出。"""
+
+import pytest
+
+from utils.stream_parser import GroundingStreamParser, iter_grounding_elements, parse_grounding_output
+
+BOXES = '[{"bbox_2d": [1, 2, 3, 4], "label": "login"}, {"bbox_2d": [5, 6, 7, 8], "label": "cancel"}]'
+EXPECTED = [
+    {"bbox_2d": [1, 2, 3, 4], "label": "login"},
+    {"bbox_2d": [5, 6, 7, 8], "label": "cancel"},
+]
+
+
+@pytest.mark.parametrize("text", [
+    BOXES,
+    "```json\n" + BOXES + "\n```",
+    "Sure! Here is the bounding box: " + BOXES + " Hope it helps.",
+    BOXES.replace('"', "'"),
+])
+def test_parses_wrapped_and_python_style_output(text):
+    assert parse_grounding_output(text) == EXPECTED
+
+
+def test_truncated_object_is_kept_only_with_complete_coords():
+    assert parse_grounding_output(BOXES[:BOXES.index('cancel') + 3]) == [
+        EXPECTED[0],
+        {"bbox_2d": [5, 6, 7, 8], "label": "can"},
+    ]
+    assert parse_grounding_output('[{"bbox_2d": [1, 2, 3, 4]}, {"bbox_2d": [5, 6') == [{"bbox_2d": [1, 2, 3, 4]}]
+
+
+def test_ignores_non_grounding_and_mismatched_objects():
+    text = '{"note": "hi"} {"bbox_2d": [1, 2, 3, 4]] {"bbox_2d": [9, 9, 9, 9], "label": "x"}'
+    assert parse_grounding_output(text) == [{"bbox_2d": [9, 9, 9, 9], "label": "x"}]
+
+
+def test_braces_inside_strings_do_not_close_objects():
+    text = '[{"bbox_2d": [1, 2, 3, 4], "label": "a } b \\" {"}]'
+    assert parse_grounding_output(text) == [{"bbox_2d": [1, 2, 3, 4], "label": 'a } b " {'}]
+
+
+def test_points_elements():
+    text = 'Points: <points x1="12" y1="34" x2="56.5" y2="78" alt="按钮">按钮</points> and <points x="1" y="2">确定</points>'
+    assert parse_grounding_output(text) == [
+        {"point_2d": [12.0, 34.0], "label": "按钮"},
+        {"point_2d": [56.5, 78.0], "label": "按钮"},
+        {"point_2d": [1.0, 2.0], "label": "确定"},
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_chunked_feed_matches_whole_text(size):
+    text = "```json\n" + BOXES + '\n``` <points x="1" y="2">ok</points>'
+    chunks = [text[i:i + size] for i in range(0, len(text), size)]
+    assert list(iter_grounding_elements(chunks)) == parse_grounding_output(text)
+
+
+def test_elements_are_produced_as_soon_as_they_close():
+    parser = GroundingStreamParser()
+    closing = BOXES.index("}") + 1
+    assert parser.feed(BOXES[:closing - 1]) == []
+    assert parser.capturing
+    assert parser.feed(BOXES[closing - 1:closing]) == [EXPECTED[0]]
+    assert not parser.capturing
+    assert parser.feed(BOXES[closing:]) == [EXPECTED[1]]
+    assert parser.close() == []
+    assert parser.elements == EXPECTED
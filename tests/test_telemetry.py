@@ -0,0 +1,86 @@
+"""`telemetry`：关闭时不记录任何内容；开启后 span 的嵌套、计数器与导出器的聚合。"""
+
+import pytest
+
+from utils import telemetry
+
+
+@pytest.fixture
+def records():
+    """注册一个收集记录的导出器，测试结束后注销。"""
+    collected = []
+    exporter = telemetry.add_exporter(telemetry.CallbackExporter(collected.append))
+    yield collected
+    telemetry.remove_exporter(exporter)
+
+
+def test_disabled_telemetry_is_a_noop(monkeypatch):
+    assert not telemetry.enabled()
+    exported = []
+    monkeypatch.setattr(telemetry, "_export", exported.append)
+
+    @telemetry.traced("work")
+    def work():
+        # 关闭时不建立 span，函数内部拿到的是共享的空对象
+        assert telemetry.current_span() is telemetry._NOOP_SPAN
+        telemetry.current_span().set(tokens=3)
+        return 42
+
+    assert work() == 42
+    with telemetry.span("outer", size=1) as s:
+        assert s is telemetry._NOOP_SPAN
+        s.set(visual_tokens=10)
+        assert s.elapsed_ms() == 0.0
+    telemetry.count("cache_lookups", cache="result")
+    telemetry.cache_lookup("prefix", True)
+    assert exported == []
+    assert telemetry._span_stack() == []
+
+
+def test_spans_nest_and_record_errors(records):
+    @telemetry.traced("inner")
+    def inner():
+        telemetry.current_span().set(generated_tokens=5)
+        raise RuntimeError("boom")
+
+    with telemetry.span("outer") as outer:
+        with pytest.raises(RuntimeError):
+            inner()
+
+    spans = {r["name"]: r for r in records if r["type"] == "span"}
+    assert spans["inner"]["parent_id"] == outer.span_id
+    assert spans["inner"]["attributes"] == {"generated_tokens": 5, "error": "RuntimeError"}
+    assert spans["outer"]["parent_id"] is None
+    assert telemetry.current_span() is telemetry._NOOP_SPAN
+
+
+def test_failing_exporter_does_not_break_callers(records):
+    def fail(record):
+        raise ValueError("exporter down")
+
+    broken = telemetry.add_exporter(telemetry.CallbackExporter(fail))
+    try:
+        with telemetry.span("step"):
+            pass
+    finally:
+        telemetry.remove_exporter(broken)
+    assert [r["name"] for r in records] == ["step"]
+
+
+def test_prometheus_aggregates_counters_and_tokens():
+    exporter = telemetry.add_exporter(telemetry.PrometheusExporter(prefix="t"))
+    try:
+        telemetry.cache_lookup("result", True)
+        telemetry.cache_lookup("result", True)
+        telemetry.cache_lookup("result", False)
+        with telemetry.span("generate") as s:
+            s.set(generated_tokens=7, ttft_ms=20)
+    finally:
+        telemetry.remove_exporter(exporter)
+
+    text = exporter.render()
+    assert 't_cache_lookups_total{cache="result",result="hit"} 2' in text
+    assert 't_cache_lookups_total{cache="result",result="miss"} 1' in text
+    assert 't_tokens_total{kind="generated",span="generate"} 7' in text
+    assert "t_time_to_first_token_seconds_count 1" in text
+    assert not telemetry.enabled()
@@ -0,0 +1,43 @@
+"""`inference_tiled`：图块切分、图块坐标到全局坐标的平移，以及重叠区重复检测的 NMS 合并。"""
+
+import json
+
+import pytest
+from PIL import Image
+
+import utils.grounding_utils as grounding_utils
+from utils.grounding_utils import inference_tiled, split_into_tiles
+
+
+def test_tiles_overlap_and_end_flush_with_the_frame():
+    assert split_into_tiles(1500, 800, tile_size=896, overlap=128) == [(0, 0, 896, 800), (604, 0, 1500, 800)]
+    assert split_into_tiles(500, 400) == [(0, 0, 500, 400)]
+    with pytest.raises(ValueError):
+        split_into_tiles(1000, 1000, tile_size=100, overlap=100)
+
+
+def _box(x1, y1, x2, y2, label):
+    return {"bbox_2d": [x1, y1, x2, y2], "label": label}
+
+
+def test_tile_boxes_are_offset_and_duplicates_merged(monkeypatch):
+    # 每个图块内的坐标；模型输入尺寸与图块相同，换算只有平移
+    per_tile = [
+        [_box(700, 300, 740, 340, "shared")],
+        [_box(98, 300, 138, 340, "shared"), _box(700, 100, 740, 140, "right")],
+    ]
+    batches = []
+
+    def fake_inference_batch(model, processor, jobs, max_pixels=None, **kwargs):
+        batches.append(len(jobs))
+        return [(json.dumps(per_tile[len(batches) - 1]), crop.height, crop.width) for crop, _, _ in jobs]
+
+    monkeypatch.setattr(grounding_utils, "inference_batch", fake_inference_batch)
+    boxes = inference_tiled(None, None, Image.new("RGB", (1500, 800)), "p", tile_size=896, overlap=128, batch_size=1)
+
+    assert batches == [1, 1]
+    by_label = dict(zip(boxes.labels, boxes.coords.tolist()))
+    assert len(boxes) == 2
+    # 重叠区中的同一元素只保留离图块中心更近（更不可能被截断）的一个：来自第一个图块
+    assert by_label["shared"] == [700, 300, 740, 340]
+    assert by_label["right"] == [1304, 100, 1344, 140]
@@ -0,0 +1,149 @@
+"""`workflow`：步骤解析与依赖检查、只追加的步骤日志，以及工作流引擎的重试、阻塞与断点续跑。"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from utils.workflow import StepJournal, WorkflowEngine, load_workflow, parse_steps
+
+WORKFLOW_DIR = os.path.join(os.path.dirname(__file__), "..", "scripts", "workflows")
+
+
+def test_parse_steps_defaults_and_dependencies():
+    steps = parse_steps(
+        [
+            {"id": "a", "instruction": "x"},
+            {"instruction": "y", "retries": 0},
+            {"id": "c", "depends_on": []},
+            {"id": "d", "depends_on": "a"},
+        ],
+        defaults={"mode": "point", "retries": 2, "retry_delay": 0.5},
+    )
+    assert [s.id for s in steps] == ["a", "step_02", "c", "d"]
+    assert [s.depends_on for s in steps] == [(), ("a",), (), ("a",)]
+    assert steps[0].params == {"mode": "point", "instruction": "x"}
+    assert [s.retries for s in steps] == [2, 0, 2, 2]
+    assert steps[0].retry_delay == 0.5
+
+
+@pytest.mark.parametrize("raw, message", [
+    ([{"id": "a"}, {"id": "a"}], "重复"),
+    ([{"id": "a", "depends_on": ["b"]}], "不存在"),
+    ([{"id": "a", "depends_on": ["b"]}, {"id": "b", "depends_on": ["a"]}], "循环"),
+])
+def test_parse_steps_rejects_invalid_graphs(raw, message):
+    with pytest.raises(ValueError, match=message):
+        parse_steps(raw)
+
+
+def test_bundled_workflows_load():
+    name, steps = load_workflow(os.path.join(WORKFLOW_DIR, "calculator.yaml"))
+    assert name == "calculator_123_plus_456"
+    assert all(step.depends_on == (prev.id,) for prev, step in zip(steps, steps[1:]))
+    name, steps = load_workflow(os.path.join(WORKFLOW_DIR, "login_lookups.json"))
+    assert name == "login_page_lookups"
+    assert [s.depends_on for s in steps] == [(), (), ()]
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_journal_reloads_completed_records(tmp_path, background):
+    path = str(tmp_path / "journal.jsonl")
+    journal = StepJournal(path, background=background)
+    journal.append({"workflow": "w", "step": "a", "status": "failed", "input_hash": "h1"})
+    journal.append({"workflow": "w", "step": "a", "status": "completed", "input_hash": "h1", "output": 1})
+    journal.append({"workflow": "w", "step": "b", "status": "completed", "input_hash": "h2", "output": 2})
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"workflow": "w", "step": "c", "sta')  # 写入中途被中断的最后一行
+
+    reloaded = StepJournal(path)
+    assert reloaded.lookup("w", "a", "h1")["output"] == 1
+    assert reloaded.lookup("w", "a", "other") is None
+    assert reloaded.lookup("w", "c", "h3") is None
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 4
+
+
+class Runner:
+    """记录执行次数的步骤函数；`failures` 指定各步骤前几次尝试失败。"""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, step):
+        with self._lock:
+            self.calls.append(step.id)
+            if self.failures.get(step.id, 0) > 0:
+                self.failures[step.id] -= 1
+                raise RuntimeError(f"{step.id} failed")
+        return {"step": step.id, "value": step.params.get("value")}
+
+
+def _steps(**overrides):
+    raw = [
+        {"id": "a", "value": 1},
+        {"id": "b", "value": 2},
+        {"id": "c", "value": 3, "depends_on": []},
+    ]
+    for step in raw:
+        step.update(overrides.get(step["id"], {}))
+    return parse_steps(raw, {"retry_delay": 0})
+
+
+def test_dependencies_run_in_order_with_retries():
+    runner = Runner(failures={"a": 1})
+    results = WorkflowEngine("w", _steps(a={"retries": 1}), runner).run()
+
+    assert {k: r.status for k, r in results.items()} == {"a": "completed", "b": "completed", "c": "completed"}
+    assert results["a"].attempts == 2
+    assert runner.calls.index("b") > runner.calls.index("a", 1)
+
+
+def test_failed_steps_block_their_dependents(tmp_path):
+    journal = StepJournal(str(tmp_path / "journal.jsonl"))
+    runner = Runner(failures={"a": 5})
+    results = WorkflowEngine("w", _steps(a={"retries": 1}), runner, journal=journal).run()
+
+    assert results["a"].status == "failed"
+    assert results["a"].attempts == 2 and "RuntimeError" in results["a"].error
+    assert results["b"].status == "blocked"
+    assert results["c"].status == "completed"
+    assert runner.calls.count("a") == 2 and "b" not in runner.calls
+    with open(journal.path, encoding="utf-8") as f:
+        statuses = [(r["step"], r["status"]) for r in map(json.loads, f)]
+    assert statuses.count(("a", "failed")) == 2
+
+
+def test_resume_skips_completed_steps_and_reruns_changed_ones(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    first = Runner(failures={"b": 1})
+    results = WorkflowEngine("w", _steps(), first, journal=StepJournal(path)).run()
+    assert results["b"].status == "failed"
+
+    # 续跑：a、c 复用上次的输出，只执行失败的 b
+    engine = WorkflowEngine("w", _steps(), Runner(), journal=StepJournal(path))
+    assert engine.resumable() == {"a", "c"}
+    results = engine.run()
+    assert {k: r.status for k, r in results.items()} == {"a": "resumed", "b": "completed", "c": "resumed"}
+    assert results["a"].output == {"step": "a", "value": 1}
+    assert engine.run_step.calls == ["b"]
+
+    # a 的参数变化：a 与依赖它的 b 重新执行，c 不受影响
+    engine = WorkflowEngine("w", _steps(a={"value": 10}), Runner(), journal=StepJournal(path))
+    assert engine.resumable() == {"c"}
+    results = engine.run()
+    assert sorted(engine.run_step.calls) == ["a", "b"]
+    assert results["c"].status == "resumed"
+
+    # 外部输入指纹变化（例如截图内容）同样使步骤重新执行；resume=False 时全部重新执行
+    engine = WorkflowEngine("w", _steps(a={"value": 10}), Runner(), journal=StepJournal(path),
+                            fingerprint=lambda step: "new screenshot" if step.id == "c" else None)
+    engine.run()
+    assert engine.run_step.calls == ["c"]
+    engine = WorkflowEngine("w", _steps(a={"value": 10}), Runner(), journal=StepJournal(path), resume=False)
+    engine.run()
+    assert sorted(engine.run_step.calls) == ["a", "b", "c"]
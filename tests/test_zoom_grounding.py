@@ -0,0 +1,63 @@
+"""`zoom_grounding`：裁剪区域的外扩与裁剪、两阶段坐标换算与精定位失败时的回退。"""
+
+import pytest
+from PIL import Image
+
+import utils.zoom_grounding as zoom
+from utils.zoom_grounding import _expand_region, zoom_grounding
+
+SIZE = (1000, 800)
+
+
+@pytest.mark.parametrize("box, image_size, expected", [
+    ((400, 300, 420, 320), SIZE, (298, 198, 522, 422)),       # 以框为中心，边长取 min_size
+    ((0, 0, 10, 10), SIZE, (0, 0, 224, 224)),                 # 贴近左上角：平移回图像内，边长不变
+    ((990, 790, 1000, 800), SIZE, (776, 576, 1000, 800)),     # 贴近右下角
+    ((10, 10, 20, 20), (100, 80), (0, 0, 100, 80)),           # 图像比 min_size 小：取整张图
+    ((100, 100, 600, 500), SIZE, (0, 0, 1000, 800)),          # 外扩后超出图像：裁剪到图像范围
+])
+def test_expand_region_is_clamped_to_the_image(box, image_size, expected):
+    assert _expand_region(box, image_size, margin=1.0, min_size=224) == expected
+
+
+def _fake_inference(responses, calls):
+    def inference(model, processor, image, prompt, system_prompt, max_pixels=None, **kwargs):
+        calls.append((image.size, max_pixels))
+        return responses[len(calls) - 1]
+    return inference
+
+
+def _box(x1, y1, x2, y2, label="button"):
+    return f'[{{"bbox_2d": [{x1}, {y1}, {x2}, {y2}], "label": "{label}"}}]'
+
+
+def test_fine_box_is_mapped_back_through_the_crop(monkeypatch):
+    calls = []
+    monkeypatch.setattr(zoom, "inference", _fake_inference([
+        (_box(100, 100, 110, 110), 400, 500),     # 粗定位：输入为原图的一半 -> (200, 200, 220, 220)
+        (_box(100, 100, 124, 124, ""), 224, 224),  # 精定位：裁剪区域 (98, 98, 322, 322) 与输入同尺寸
+    ], calls))
+
+    result = zoom_grounding(None, None, Image.new("RGB", SIZE), "p", "s", coarse_max_pixels=1, fine_max_pixels=2)
+
+    assert calls == [(SIZE, 1), ((224, 224), 2)]
+    assert result["bbox"] == [198, 198, 222, 222]
+    assert result["label"] == "button"        # 精定位没有标签时沿用粗定位的标签
+    assert [p["region"] for p in result["passes"]] == [[0, 0, 1000, 800], [98, 98, 322, 322]]
+
+
+def test_falls_back_to_coarse_box_when_fine_pass_fails(monkeypatch):
+    monkeypatch.setattr(zoom, "inference", _fake_inference([
+        (_box(100, 100, 110, 110), 400, 500),
+        ("没有找到", 224, 224),
+    ], []))
+    result = zoom_grounding(None, None, Image.new("RGB", SIZE), "p", "s")
+    assert result["bbox"] == [200, 200, 220, 220]
+    assert len(result["passes"]) == 2
+
+
+def test_no_coarse_box_skips_the_fine_pass(monkeypatch):
+    calls = []
+    monkeypatch.setattr(zoom, "inference", _fake_inference([("[]", 400, 500)], calls))
+    result = zoom_grounding(None, None, Image.new("RGB", SIZE), "p", "s")
+    assert result["bbox"] is None and len(calls) == 1